@@ -21,6 +21,11 @@ export interface Transaction {
     epoch: number;
     fees: number;
     order: Order;
+    // Consecutive holds are one transaction at the last hold, with the
+    // number of holds and the epoch and exchange rate of the first
+    count?: number;
+    first_epoch?: number;
+    first_exchange_rate?: number;
 }
 
 // TODO: rename this to ExchangeRateSample
@@ -38,6 +43,28 @@ export interface SlidingWindow {
     maximum_size: number;
 }
 
+// Risk and performance metrics the server keeps up to date as a record trades
+export interface PerformanceAnalytics {
+    marks: number;
+    equity: number;
+    peak_equity: number;
+    equity_sum: number;
+    drawdown: number;
+    max_drawdown: number;
+    returns_sum: number;
+    returns_sum_of_squares: number;
+    maximum_returns: number;
+    volatility: number;
+    sharpe_ratio: number;
+    wins: number;
+    losses: number;
+    realized_gains: number;
+    win_rate: number;
+    win_loss_ratio: number;
+    traded_volume: number;
+    turnover: number;
+}
+
 export interface TradingRecord {
     name: string;
     description: string;
@@ -51,6 +78,7 @@ export interface TradingRecord {
     fees_paid: number;
     pending_sales: Transaction[];
     transaction_window: Transaction[];
+    analytics: PerformanceAnalytics;
 }
 
 export type TradingRecordRegistry = ObservableMap<TradingRecord>;
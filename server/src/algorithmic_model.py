@@ -4,13 +4,15 @@ A model that predicts trading decisions using handbuilt algorithms
 from functools import partial
 from typing import Tuple
 
-import maybe
-import trading_record
+from feature_engine import Features
 from logger import logger
 from pyrsistent import PRecord, field, pvector, pvector_field
 from trading_record import TradingAction, TradingRecord
 
 
+FEATURES = ['exchange_rate', 'rate_of_change_100', 'moving_average_100']
+
+
 class PendingTrade(PRecord):
     buyers_price = field(type=float)
 
@@ -34,11 +36,12 @@ def construct(
 
 def predict(
     record: TradingRecord,
+    features: Features,
     model: AlgorithmicModel
 ) -> Tuple[TradingAction, AlgorithmicModel]:
-    exchange_rate = maybe.with_default(0.0, trading_record.get_exchange_rate(record))
-    rate_of_change = maybe.with_default(0.0, trading_record.get_rate_of_change(record))
-    moving_average = maybe.with_default(0.0, trading_record.get_moving_average(record))
+    exchange_rate = features['exchange_rate']
+    rate_of_change = features['rate_of_change_100']
+    moving_average = features['moving_average_100']
 
     should_sell_partial = partial(
         should_sell,
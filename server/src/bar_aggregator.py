@@ -0,0 +1,187 @@
+'''
+Aggregates matches into OHLCV bars at several resolutions at once.
+
+Every resolution keeps its bars in a fixed size numpy ring, so a tick updates
+each resolution in O(1) and long histories (1000 one hour bars is six weeks) can
+be read without holding or scanning every tick.
+
+Time bars start at multiples of their resolution in epoch seconds, and
+intervals without matches have no bar.  Volume and dollar bars close on the
+first match that brings their volume (or notional value) to the threshold;
+matches aren't split between bars.  The newest bar of every resolution is the
+bar still being built.
+
+Only the trading thread reads the rings.  Other threads read the PublishedBars
+that publish takes between ticks: a read-only copy of the closed bars, copied
+again only after a bar closes, and the bar still being built.
+'''
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+COLUMNS = ['start', 'end', 'open', 'high', 'low', 'close', 'volume', 'notional', 'trades']
+START, END, OPEN, HIGH, LOW, CLOSE, VOLUME, NOTIONAL, TRADES = range(len(COLUMNS))
+
+# Seconds per bar
+TIME_RESOLUTIONS = {'1s': 1.0, '1m': 60.0, '5m': 300.0, '1h': 3600.0}
+
+
+class Bars:
+    def __init__(
+        self,
+        capacity: int,
+        resolution: float = 0.0,
+        threshold_column: int = VOLUME,
+        threshold: float = 0.0
+    ):
+        self.capacity = capacity
+        # Seconds per bar for time bars, 0.0 for volume and dollar bars
+        self.resolution = resolution
+        self.threshold_column = threshold_column
+        self.threshold = threshold
+        self.bars = np.zeros((capacity, len(COLUMNS)))
+        # The newest bar is built in a list of floats, which is much cheaper to
+        # update than a numpy row, and is stored in the ring once it's closed
+        self.current = [0.0] * len(COLUMNS)
+        # Index of the newest bar
+        self.head = -1
+        self.count = 0
+        self.closed = True
+        # Read-only copy of the closed bars, oldest first, None after a bar closes
+        self.published: Optional[np.ndarray] = None
+
+
+# The closed bars and the bar still being built, None before the first match
+PublishedBars = Tuple[np.ndarray, Optional[Tuple[float, ...]]]
+
+
+class BarAggregator:
+    def __init__(self, bars: Dict[str, Bars]):
+        self.bars = bars
+
+
+def construct(
+    capacity: int = 1000,
+    time_resolutions: Dict[str, float] = TIME_RESOLUTIONS,
+    volume_threshold: float = 10.0,
+    dollar_threshold: float = 100000.0
+) -> BarAggregator:
+    ''' Constructs time bars for every resolution, volume bars of (volume_threshold)
+    cryptocurrency and dollar bars of (dollar_threshold) usd
+    '''
+    bars = {
+        name: Bars(capacity, resolution=resolution)
+        for name, resolution in time_resolutions.items()
+    }
+    bars['volume'] = Bars(capacity, threshold_column=VOLUME, threshold=volume_threshold)
+    bars['dollar'] = Bars(capacity, threshold_column=NOTIONAL, threshold=dollar_threshold)
+    return BarAggregator(bars)
+
+
+def open_bar(bars: Bars, start: float, exchange_rate: float, epoch: float, size: float) -> None:
+    if bars.count > 0:
+        bars.bars[bars.head] = bars.current
+        bars.published = None
+    bars.head = (bars.head + 1) % bars.capacity
+    bars.count = min(bars.count + 1, bars.capacity)
+    bars.current = [
+        start,
+        epoch,
+        exchange_rate,
+        exchange_rate,
+        exchange_rate,
+        exchange_rate,
+        size,
+        exchange_rate * size,
+        1.0
+    ]
+
+
+def extend_bar(bars: Bars, exchange_rate: float, epoch: float, size: float) -> None:
+    bar = bars.current
+    if epoch > bar[END]:
+        bar[END] = epoch
+    if exchange_rate > bar[HIGH]:
+        bar[HIGH] = exchange_rate
+    if exchange_rate < bar[LOW]:
+        bar[LOW] = exchange_rate
+    bar[CLOSE] = exchange_rate
+    bar[VOLUME] += size
+    bar[NOTIONAL] += exchange_rate * size
+    bar[TRADES] += 1.0
+
+
+def add(bars: Bars, exchange_rate: float, epoch: float, size: float) -> None:
+    if bars.resolution > 0.0:
+        start = epoch - epoch % bars.resolution
+        # Late matches are added to the newest bar instead of reopening an old one
+        if bars.count == 0 or start > bars.current[START]:
+            open_bar(bars, start, exchange_rate, epoch, size)
+        else:
+            extend_bar(bars, exchange_rate, epoch, size)
+        return
+
+    if bars.closed:
+        open_bar(bars, epoch, exchange_rate, epoch, size)
+    else:
+        extend_bar(bars, exchange_rate, epoch, size)
+    bars.closed = bars.current[bars.threshold_column] >= bars.threshold
+
+
+def update(
+    price_info: Tuple[float, float],
+    aggregator: BarAggregator,
+    size: float = 0.0
+) -> None:
+    exchange_rate, epoch = price_info
+    for bars in aggregator.bars.values():
+        add(bars, exchange_rate, epoch, size)
+
+
+def history(bars: Bars, count: Optional[int] = None) -> np.ndarray:
+    ''' Returns a copy of the newest (count) bars, oldest first, shaped (bars, COLUMNS)
+
+    Must be called from the thread that updates the bars.
+    '''
+    count = bars.count if count is None else min(count, bars.count)
+    if bars.count > 0:
+        bars.bars[bars.head] = bars.current
+    indices = (bars.head - count + 1 + np.arange(count)) % bars.capacity
+    return bars.bars[indices]
+
+
+def closed_bars(bars: Bars) -> np.ndarray:
+    ''' Returns a read-only copy of the closed bars, oldest first, that is
+    shared until the next bar closes
+
+    Must be called from the thread that updates the bars.
+    '''
+    if bars.published is None:
+        count = max(bars.count - 1, 0)
+        indices = (bars.head - count + np.arange(count)) % bars.capacity
+        bars.published = bars.bars[indices]
+        bars.published.flags.writeable = False
+    return bars.published
+
+
+def publish(aggregator: BarAggregator) -> Dict[str, PublishedBars]:
+    ''' Returns the bars of every resolution for other threads to read
+
+    Must be called from the thread that updates the bars.
+    '''
+    return {
+        name: (closed_bars(bars), tuple(bars.current) if bars.count > 0 else None)
+        for name, bars in aggregator.bars.items()
+    }
+
+
+def published_history(published: PublishedBars, count: Optional[int] = None) -> np.ndarray:
+    ''' history of published bars, safe to call from any thread '''
+    closed, current = published
+    bars = closed if current is None else np.vstack([closed, current])
+    count = len(bars) if count is None else min(count, len(bars))
+    return bars[len(bars) - count:]
+
+
+def serialize(history: np.ndarray) -> Dict[str, List[float]]:
+    return {column: history[:, index].tolist() for index, column in enumerate(COLUMNS)}
@@ -0,0 +1,144 @@
+'''
+Benchmarks checkpoint size, write time, warm restart time and the pause that
+background checkpoints impose on the trading thread.
+
+Run from the server directory: python src/benchmark_checkpoint.py
+'''
+import math
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import algorithmic_model
+import checkpoint
+import numpy as np
+import q_memory
+import registry_snapshot
+import result
+import trading_record
+from input_normalizer import InputNormalizer
+from pyrsistent import PRecord, field
+from q_memory import QMemory, QMemorySample
+from q_records import QModelInput
+from registry_snapshot import SnapshotPublisher
+from trading_record import TradingAction
+
+
+class ReplayOnlyModel(PRecord):
+    ''' Stands in for QLearningModel without constructing a tensorflow session '''
+    memory = field(type=QMemory)
+    normalizer = field(type=(InputNormalizer, type(None)), initial=None)
+
+
+def random_action() -> TradingAction:
+    return TradingAction(order=random.choice(['buy', 'sell', 'hold']), amount=0.01)
+
+
+def tick(record, index):
+    price_info = (10000.0 + 100.0 * math.sin(index / 50.0), 1552103321.0 + index)
+    record = trading_record.update_exchange_rate(price_info, record)
+    return result.with_default(record, trading_record.place_order(random_action(), record))
+
+
+def construct_registries(ticks):
+    records = {}
+    for name in ['q-learning', 'algorithmic', 'random']:
+        record = trading_record.construct(name, '', 100000.0)
+        for index in range(ticks):
+            record = tick(record, index)
+        records[name] = record
+
+    memory = q_memory.construct(1000)
+    for index in range(1000):
+        memory = q_memory.add(QMemorySample(
+            neural_network_input=QModelInput(
+                exchange_rate=10000.0 + index,
+                rate_of_change=0.001,
+                moving_average=10000.0
+            ),
+            neural_network_prediction=random_action(),
+            reward=random.uniform(-10.0, 10.0)
+        ), memory)
+
+    models = {
+        'algorithmic': algorithmic_model.construct().set('pending_trades', [
+            algorithmic_model.PendingTrade(buyers_price=10000.0 + index) for index in range(200)
+        ]),
+        'q-learning': ReplayOnlyModel(memory=memory),
+    }
+    return records, models
+
+
+def network_weights():
+    shapes = [(3, 50), (50,), (50, 50), (50,), (50, 3), (3,)]
+    return [np.random.standard_normal(shape) for shape in shapes]
+
+
+def measure(callback, repeat=5):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        callback()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def tick_latencies(records, models, publisher, ticks):
+    latencies = []
+    record = records['random']
+    for index in range(ticks):
+        start = time.perf_counter()
+        record = tick(record, index)
+        records['random'] = record
+        publisher.publish(registry_snapshot.construct(
+            records,
+            models,
+            index,
+            captured=publisher.capture() if publisher.capture_requested() else None
+        ))
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)  # sells append to transaction_history.csv
+        path = os.path.join(directory, 'checkpoint.npz')
+        records, models = construct_registries(1000)
+        weights = network_weights()
+        snapshot = registry_snapshot.construct(
+            records,
+            models,
+            1000,
+            1000,
+            captured={'q-learning/weights': weights}
+        )
+
+        save_time = measure(lambda: checkpoint.save(path, snapshot))
+        size = os.path.getsize(path)
+
+        def warm_restart():
+            saved = checkpoint.load(path)
+            checkpoint.restore(saved, dict(records), dict(models))
+        restore_time = measure(warm_restart)
+
+        publisher = SnapshotPublisher(snapshot, lambda: {'q-learning/weights': weights})
+        p50, p99 = tick_latencies(records, models, publisher, 500)
+        checkpointer = checkpoint.Checkpointer(publisher, path, 0.05)
+        checkpointer.start()
+        checkpointed_p50, checkpointed_p99 = tick_latencies(records, models, publisher, 500)
+
+        print(f'checkpoint size          : {size / 1024:.1f} KiB')
+        print(f'checkpoint write         : {save_time * 1000:.2f} ms (background thread)')
+        print(f'load + restore           : {restore_time * 1000:.2f} ms')
+        print(f'tick p50 / p99           : {p50 * 1e6:.1f} / {p99 * 1e6:.1f} us')
+        print(f'tick p50 / p99 (20 ckpt/s): '
+              f'{checkpointed_p50 * 1e6:.1f} / {checkpointed_p99 * 1e6:.1f} us')
+
+
+if __name__ == '__main__':
+    main()
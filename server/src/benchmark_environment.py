@@ -0,0 +1,44 @@
+'''
+Measures how many transitions per minute the vectorized q-learning environment
+simulates over a month of synthetic one second exchange rates.
+
+Run from the server directory: python src/benchmark_environment.py
+'''
+import time
+
+import numpy as np
+import q_learning_environment
+from q_learning_population import ORDERS
+
+SAMPLES = 30 * 24 * 60 * 60
+STEPS = 2000
+
+
+def main():
+    random = np.random.RandomState(0)
+    epochs = 1554000000.0 + np.arange(SAMPLES, dtype=np.float64)
+    exchange_rates = 5000.0 * np.exp(np.cumsum(random.normal(0.0, 0.0002, SAMPLES)))
+
+    start = time.perf_counter()
+    states = q_learning_environment.compute_states(exchange_rates, epochs)
+    print(f'computed {len(states)} states in {time.perf_counter() - start:.1f} s')
+
+    for episodes in [1, 64, 1024]:
+        environment = q_learning_environment.construct(
+            exchange_rates,
+            epochs,
+            episodes=episodes,
+            episode_length=10000,
+            states=states
+        )
+        actions = random.randint(0, len(ORDERS), (STEPS, episodes))
+        start = time.perf_counter()
+        for step_actions in actions:
+            q_learning_environment.step(environment, step_actions)
+        elapsed = time.perf_counter() - start
+        print(f'{episodes:>5} episodes: {elapsed / STEPS * 1e6:8.1f} us/step   '
+              f'{STEPS * episodes / elapsed * 60:14,.0f} transitions/minute')
+
+
+if __name__ == '__main__':
+    main()
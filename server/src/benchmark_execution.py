@@ -0,0 +1,44 @@
+'''
+Measures how many events per minute the execution simulator processes while a
+market making strategy quotes around every tenth trade of a synthetic stream.
+
+Run from the server directory: python src/benchmark_execution.py
+'''
+import time
+
+import execution_simulator
+import market_data_generator
+from market_data_generator import MarketModel
+
+MESSAGES = 300000
+
+
+def quote(simulator, epoch, message):
+    ''' Replaces a bid and an ask a dollar either side of every tenth trade '''
+    if message['trade_id'] % 10 != 0:
+        return
+    for order_id in list(simulator.orders):
+        execution_simulator.cancel(simulator, epoch, order_id)
+    price = float(message['price'])
+    execution_simulator.submit(simulator, epoch, 'benchmark', 'buy', 0.01, price - 1.0)
+    execution_simulator.submit(simulator, epoch, 'benchmark', 'sell', 0.01, price + 1.0)
+
+
+def main():
+    model = MarketModel(rate=100.0)
+    start = time.perf_counter()
+    messages = market_data_generator.take(market_data_generator.generate(model, 0.0), MESSAGES)
+    print(f'generated {len(messages)} messages in {time.perf_counter() - start:.1f} s')
+
+    for name, on_trade in [('market data only', lambda *arguments: None), ('quoting', quote)]:
+        fills = []
+        simulator = execution_simulator.construct(on_fill=fills.append)
+        start = time.perf_counter()
+        execution_simulator.replay(simulator, messages, on_trade)
+        elapsed = time.perf_counter() - start
+        print(f'{name:<17} {simulator.processed:>9} events  {len(fills):>7} fills  '
+              f'{simulator.processed / elapsed * 60:14,.0f} events/minute')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+'''
+Compares per-tick q-learning prediction latency of the tensorflow and numpy
+inference backends and checks that both produce the same outputs.
+
+Run from the server directory: python src/benchmark_inference.py
+'''
+import timeit
+
+import fully_connected_neural_network
+import numpy as np
+import tensorflow as tf
+from fully_connected_neural_network import FullyConnectedNeuralNetwork
+
+
+def main():
+    session = tf.Session()
+    neural_network = FullyConnectedNeuralNetwork(
+        session,
+        input_size=3,
+        output_size=3,
+        batch_size=10,
+        inference_backend='numpy'
+    )
+    inputs = np.random.standard_normal((1000, 3))
+    x_train = np.random.standard_normal((10, 3))
+    y_train = np.random.standard_normal((10, 3))
+    fully_connected_neural_network.train_batch(session, neural_network, x_train, y_train)
+
+    def predict(backend, input):
+        neural_network.inference_backend = backend
+        return fully_connected_neural_network.predict_one(session, neural_network, input)
+
+    numpy_outputs = np.concatenate([predict('numpy', input) for input in inputs])
+    tensorflow_outputs = np.concatenate([predict('tensorflow', input) for input in inputs])
+    maximum_difference = np.max(np.abs(numpy_outputs - tensorflow_outputs))
+
+    input = inputs[0]
+    for backend in ['tensorflow', 'numpy']:
+        neural_network.inference_backend = backend
+        number = 1000 if backend == 'tensorflow' else 100000
+        seconds = min(timeit.repeat(
+            lambda: fully_connected_neural_network.predict_one(session, neural_network, input),
+            number=number,
+            repeat=5
+        )) / number
+        print(f'{backend:<10} predict_one: {seconds * 1e6:8.2f} us')
+
+    print(f'maximum difference between backends: {maximum_difference:.3e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+'''
+Compares the per-tick cost of evaluating and training a q-learning population
+in batched operations against running the same number of agents one by one.
+
+Run from the server directory: python src/benchmark_population.py
+'''
+import time
+
+import numpy as np
+import q_learning_population
+
+TICKS = 1500
+
+
+def run(populations, states, rewards):
+    start = time.perf_counter()
+    for tick, state in enumerate(states):
+        for population in populations:
+            actions = q_learning_population.choose_actions(population, state)
+            q_learning_population.add_training_samples(
+                population, state, actions, rewards[tick, :population.size]
+            )
+            if (population.time_delta + 1) % 15 == 0:
+                q_learning_population.train(population)
+            population.time_delta += 1
+    return (time.perf_counter() - start) / len(states)
+
+
+def main():
+    random = np.random.RandomState(0)
+    states = random.standard_normal((TICKS, 3))
+    rewards = random.standard_normal((TICKS, 64))
+    for size in [1, 8, 64]:
+        hyperparameters = q_learning_population.sample_hyperparameters(size)
+        batched = run(
+            [q_learning_population.construct(hyperparameters)],
+            states,
+            rewards
+        )
+        individual = run(
+            [q_learning_population.construct([h]) for h in hyperparameters],
+            states,
+            rewards
+        )
+        print(f'{size:>3} agents   batched: {batched * 1e6:8.1f} us/tick   '
+              f'one by one: {individual * 1e6:8.1f} us/tick')
+
+
+if __name__ == '__main__':
+    main()
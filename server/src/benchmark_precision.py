@@ -0,0 +1,110 @@
+'''
+Compares a q-learning population in float32 against float64: the per-tick cost
+of trading and training, the throughput of batched predictions, the memory of
+the weights, Adam moments and replay memory, and how accurately float32
+predictions respond to the rate of change with and without input
+normalization.
+
+States are a random walk around the exchange rates the networks see in
+production: exchange rates and moving averages around 10^4 and rates of
+change around 10^-3.
+
+Run from the server directory: python src/benchmark_precision.py
+'''
+import time
+
+import input_normalizer
+import numpy as np
+import q_learning_population
+
+TICKS = 1500
+AGENTS = 64
+PREDICTION_BATCH = 1000
+
+
+def states(ticks: int, random: np.random.RandomState) -> np.ndarray:
+    exchange_rates = 10000.0 + np.cumsum(random.standard_normal(ticks))
+    moving_averages = np.convolve(exchange_rates, np.ones(100) / 100, mode='full')[:ticks]
+    moving_averages[:100] = exchange_rates[:100]
+    rates_of_change = np.gradient(exchange_rates) / exchange_rates
+    return np.stack([exchange_rates, rates_of_change, moving_averages], axis=1)
+
+
+def run(population, states, rewards):
+    start = time.perf_counter()
+    for tick, state in enumerate(states):
+        actions = q_learning_population.choose_actions(population, state)
+        q_learning_population.add_training_samples(population, state, actions, rewards[tick])
+        if (population.time_delta + 1) % 15 == 0:
+            q_learning_population.train(population)
+        population.time_delta += 1
+    return (time.perf_counter() - start) / len(states)
+
+
+def predictions_per_second(population, states):
+    inputs = q_learning_population.network_inputs(population, states)
+    repeat = 20
+    start = time.perf_counter()
+    for _ in range(repeat):
+        q_learning_population.forward(population.weights, inputs)
+    return repeat * len(states) * population.size / (time.perf_counter() - start)
+
+
+def memory_bytes(population):
+    return sum(array.nbytes for array in (
+        population.weights + population.first_moments + population.second_moments +
+        [population.memory_states, population.memory_actions, population.memory_rewards]
+    ))
+
+
+def rate_of_change_error(weights, states, normalizer=None):
+    ''' Error of float32 in the part of the predictions that's due to the rate
+    of change, relative to that part in float64
+    '''
+    without_rate_of_change = states.copy()
+    without_rate_of_change[:, 1] = 0.0 if normalizer is None else normalizer.mean[1]
+    effects = []
+    for dtype in [np.float64, np.float32]:
+        precision_weights = [w.astype(dtype) for w in weights]
+        predictions = [
+            q_learning_population.forward(
+                precision_weights,
+                input_normalizer.normalize(normalizer, inputs, dtype)
+                if normalizer is not None else inputs.astype(dtype)
+            )[-1].astype(np.float64)
+            for inputs in [states, without_rate_of_change]
+        ]
+        effects.append(predictions[0] - predictions[1])
+    expected, actual = effects
+    return np.max(np.abs(actual - expected)) / np.max(np.abs(expected))
+
+
+def main():
+    random = np.random.RandomState(0)
+    tick_states = states(TICKS, random)
+    rewards = random.standard_normal((TICKS, AGENTS))
+    hyperparameters = q_learning_population.sample_hyperparameters(AGENTS)
+    for precision in ['float64', 'float32']:
+        population = q_learning_population.construct(
+            hyperparameters,
+            precision=precision,
+            normalize_inputs=True
+        )
+        per_tick = run(population, tick_states, rewards)
+        throughput = predictions_per_second(population, tick_states[:PREDICTION_BATCH])
+        print(f'{precision}   {per_tick * 1e6:8.1f} us/tick   '
+              f'{throughput / 1e6:6.2f} M predictions/s   '
+              f'{memory_bytes(population) / 1024:8.1f} KiB')
+
+    normalizer = input_normalizer.construct(3)
+    for state in tick_states:
+        normalizer = input_normalizer.update(normalizer, state)
+    weights = q_learning_population.construct(hyperparameters).weights
+    raw = rate_of_change_error(weights, tick_states)
+    normalized = rate_of_change_error(weights, tick_states, normalizer)
+    print(f'float32 error in the effect of the rate of change   raw inputs: {raw:.2e}   '
+          f'normalized inputs: {normalized:.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+'''
+Benchmarks the trading records' SlotRecords against the PRecords they replaced.
+
+The same ticks, an exchange rate update and an order per tick, are run with
+the SlotRecords and again with PRecords declared with the same fields.  The
+PRecord path swaps the record classes in the trading modules for the duration
+of its run.  Reports the time per tick, the peak memory allocated while a
+tick runs and the memory a record with full windows keeps.
+
+Run from the server directory, with and without the invariant checks:
+    python src/benchmark_records.py
+    python -O src/benchmark_records.py
+'''
+import contextlib
+import math
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Tuple
+
+import performance_analytics
+import result
+import sliding_window
+import trading_record
+import transaction
+import transaction_window
+from performance_analytics import PerformanceAnalytics
+from pyrsistent import PRecord, field, pvector_field
+from q_records import QModelInput
+from sliding_window import SlidingWindow, SlidingWindowSample
+from trading_record import TradingAction, TradingRecord
+from transaction import PairedTransactions, Transaction
+from transaction_window import HoldRun, TransactionWindow
+
+TICKS = 1000
+# Never sells more than it bought
+ORDERS = ['buy', 'buy', 'sell', 'hold']
+
+
+def precord(record_class: Any, **fields: Any) -> type:
+    ''' A PRecord with (record_class)'s fields, with some replaced by (fields) '''
+    return type(record_class.__name__, (PRecord,), dict(record_class._precord_fields, **fields))
+
+
+def precord_classes() -> Dict[Tuple[Any, str], type]:
+    ''' The PRecord in place of each record class, by (module, name) '''
+    p_transaction = precord(Transaction)
+    p_sample = precord(SlidingWindowSample)
+    p_window = precord(SlidingWindow, samples=pvector_field(p_sample))
+    p_pair = precord(
+        PairedTransactions,
+        buy=field(type=p_transaction, mandatory=True),
+        sell=field(type=p_transaction, mandatory=True)
+    )
+    p_hold_run = precord(HoldRun)
+    p_transactions = precord(
+        TransactionWindow,
+        entries=pvector_field((p_transaction, p_hold_run))
+    )
+    p_analytics = precord(PerformanceAnalytics, returns=pvector_field(float))
+    p_record = precord(
+        TradingRecord,
+        exchange_rates=field(type=p_window, mandatory=True),
+        pending_sales=pvector_field(p_transaction),
+        transaction_window=field(type=p_transactions, mandatory=True),
+        analytics=field(type=p_analytics, mandatory=True)
+    )
+    return {
+        (transaction, 'Transaction'): p_transaction,
+        (transaction, 'PairedTransactions'): p_pair,
+        (trading_record, 'Transaction'): p_transaction,
+        (trading_record, 'TradingRecord'): p_record,
+        (trading_record, 'TradingAction'): precord(TradingAction),
+        (sliding_window, 'SlidingWindow'): p_window,
+        (sliding_window, 'SlidingWindowSample'): p_sample,
+        (transaction_window, 'HoldRun'): p_hold_run,
+        (transaction_window, 'TransactionWindow'): p_transactions,
+        (performance_analytics, 'PerformanceAnalytics'): p_analytics,
+    }
+
+
+@contextlib.contextmanager
+def precord_path() -> Iterator[Dict[Tuple[Any, str], type]]:
+    classes = precord_classes()
+    originals = {key: getattr(*key) for key in classes}
+    for (module, name), replacement in classes.items():
+        setattr(module, name, replacement)
+    try:
+        yield classes
+    finally:
+        for (module, name), original in originals.items():
+            setattr(module, name, original)
+
+
+def construct_record() -> Any:
+    # Goes through the module so the PRecord path gets its own classes
+    return trading_record.TradingRecord(
+        name='benchmark',
+        description='',
+        initial_usd=100000.0,
+        usd=100000.0,
+        crypto=0.0,
+        buys=0,
+        sells=0,
+        holds=0,
+        fees_paid=0.0,
+        exchange_rates=sliding_window.SlidingWindow(
+            samples=[],
+            maximum_size=1000,
+            first_order_filter_time_constant=1.0,
+            second_order_filter_time_constant=0.1,
+            filter_order_ratio=0.33
+        ),
+        transaction_window=transaction_window.construct(),
+        analytics=performance_analytics.construct()
+    )
+
+
+def tick(record: Any, index: int, order: str) -> Any:
+    price_info = (10000.0 + 100.0 * math.sin(index / 50.0), 1552103321.0 + index)
+    record = trading_record.update_exchange_rate(price_info, record)
+    action = trading_record.TradingAction(order=order, amount=0.001)
+    return result.with_default(record, trading_record.place_order(action, record))
+
+
+def run_ticks(orders: List[str]) -> Tuple[List[float], List[int], int]:
+    ''' Tick durations and peak allocations, and the memory kept by the record '''
+    record = construct_record()
+    for index in range(TICKS):
+        record = tick(record, index, orders[index])
+    durations = []
+    for index in range(TICKS):
+        start = time.perf_counter()
+        record = tick(record, index, orders[index])
+        durations.append(time.perf_counter() - start)
+
+    peaks = []
+    tracemalloc.start()
+    record = None
+    kept_start, _ = tracemalloc.get_traced_memory()
+    record = construct_record()
+    for index in range(TICKS):
+        record = tick(record, index, orders[index])
+    kept, _ = tracemalloc.get_traced_memory()
+    for index in range(200):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        record = tick(record, index, orders[index])
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    return durations, peaks, kept - kept_start
+
+
+def time_operations(q_model_input: type) -> Dict[str, float]:
+    ''' Median seconds of the records' own operations '''
+    sample = q_model_input(exchange_rate=10000.0, rate_of_change=0.1, moving_average=9990.0)
+    entry = transaction.Transaction(
+        label='1', quantity=1.0, exchange_rate=10000.0, epoch=1552103321.0, fees=25.0,
+        order='buy'
+    )
+    record = construct_record()
+    operations = {
+        'construct Transaction': lambda: transaction.Transaction(
+            label='1', quantity=1.0, exchange_rate=10000.0, epoch=1552103321.0, fees=25.0,
+            order='buy'
+        ),
+        'Transaction.set': lambda: entry.set('quantity', 0.5),
+        'TradingRecord.update (6 fields)': lambda: record.update({
+            'usd': 90000.0, 'crypto': 1.0, 'buys': 1, 'fees_paid': 25.0,
+            'pending_sales': record.pending_sales, 'transaction_window': record.transaction_window
+        }),
+        'read 3 fields': lambda: entry.quantity * entry.exchange_rate + entry.fees,
+        'construct QModelInput': lambda: q_model_input(
+            exchange_rate=10000.0, rate_of_change=0.1, moving_average=9990.0
+        ),
+        'QModelInput.serialize': sample.serialize,
+    }
+    timings = {}
+    for name, operation in operations.items():
+        durations = []
+        for _ in range(7):
+            start = time.perf_counter()
+            for _ in range(2000):
+                operation()
+            durations.append((time.perf_counter() - start) / 2000)
+        timings[name] = statistics.median(durations)
+    return timings
+
+
+def median(values: List[Any]) -> Any:
+    return sorted(values)[len(values) // 2]
+
+
+def main() -> None:
+    orders = [ORDERS[index % len(ORDERS)] for index in range(TICKS)]
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)  # sells append to transaction_history.csv
+        slot_durations, slot_peaks, slot_kept = run_ticks(orders)
+        slot_operations = time_operations(QModelInput)
+        with precord_path():
+            p_durations, p_peaks, p_kept = run_ticks(orders)
+            p_operations = time_operations(precord(QModelInput))
+
+    print(f'invariant checks: {"on" if __debug__ else "off (python -O)"}')
+    print(f'{"":34}{"PRecord":>12}{"SlotRecord":>12}')
+    for label, precord_value, slot_value, unit, scale in [
+        ('tick p50', median(p_durations), median(slot_durations), 'us', 1e6),
+        ('tick p99', sorted(p_durations)[int(TICKS * 0.99)],
+         sorted(slot_durations)[int(TICKS * 0.99)], 'us', 1e6),
+        ('peak allocated in a tick', median(p_peaks), median(slot_peaks), 'KiB', 1 / 1024),
+        (f'kept after {TICKS} ticks', p_kept, slot_kept, 'KiB', 1 / 1024),
+    ]:
+        print(f'{label:34}{precord_value * scale:9.1f} {unit:3}'
+              f'{slot_value * scale:9.1f} {unit:3}')
+    for name in slot_operations:
+        print(f'{name:34}{p_operations[name] * 1e6:9.2f} us '
+              f'{slot_operations[name] * 1e6:9.2f} us')
+
+
+if __name__ == '__main__':
+    main()
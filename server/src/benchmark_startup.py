@@ -0,0 +1,72 @@
+'''
+Measures time-to-first-tick and baseline memory of a fresh trading process
+with and without the q-learning strategy enabled.
+
+Each configuration runs in its own interpreter so that import costs are
+measured from a cold start.
+
+Run from the server directory: python src/benchmark_startup.py
+'''
+import json
+import resource
+import subprocess
+import sys
+import time
+
+CONFIGURATIONS = [
+    ['algorithmic', 'random'],
+    ['algorithmic', 'random', 'q-learning'],
+]
+
+FIRST_TICK = {
+    'type': 'match',
+    'price': '10000.00',
+    'time': '2019-03-08T19:48:41.951000Z',
+}
+
+
+def first_tick(enabled_strategies, started_at):
+    ''' Runs in the child interpreter '''
+    import strategies
+    from coinbase_websocket_client import CoinbaseWebsocketClient
+
+    client = CoinbaseWebsocketClient(
+        strategies.construct_trading_records(enabled_strategies),
+        strategies.construct_trading_models(enabled_strategies)
+    )
+    client.on_message(FIRST_TICK)
+    time_to_first_tick = time.time() - started_at
+    print(json.dumps({
+        'time_to_first_tick': time_to_first_tick,
+        # kilobytes on linux
+        'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'tensorflow_loaded': 'tensorflow' in sys.modules,
+    }))
+
+
+def measure(enabled_strategies):
+    started_at = time.time()
+    child = subprocess.run(
+        [sys.executable, __file__, ','.join(enabled_strategies), str(started_at)],
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True
+    )
+    # The result is the last line; trading statistics are logged before it
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def main():
+    for enabled_strategies in CONFIGURATIONS:
+        results = measure(enabled_strategies)
+        print(f'{", ".join(enabled_strategies):<36} '
+              f'time to first tick: {results["time_to_first_tick"] * 1000:8.1f} ms   '
+              f'max rss: {results["max_rss"] / 1024:7.1f} MiB   '
+              f'tensorflow loaded: {results["tensorflow_loaded"]}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        first_tick(sys.argv[1].split(','), float(sys.argv[2]))
+    else:
+        main()
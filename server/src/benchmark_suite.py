@@ -0,0 +1,438 @@
+'''
+Benchmarks the tick-to-trade hot path and compares the results against a
+stored baseline.
+
+Every benchmark reports the best per-call time of several timeit repeats in
+microseconds.  Results are written as JSON, and the suite exits with status 1
+when any benchmark is slower than its baseline by more than the threshold.
+
+Run from the server directory:
+    python src/benchmark_suite.py                      (compare to the baseline)
+    python src/benchmark_suite.py --save-baseline      (record a new baseline)
+    python src/benchmark_suite.py --filter sliding_window
+
+Baselines are machine specific, so record a new one before comparing on a
+different machine.  Saving only updates the baseline entries of the benchmarks
+that ran, and a benchmark that has a baseline entry but can't run (e.g. for a
+missing dependency) fails the comparison.
+'''
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+from typing import Any, Callable, Dict, List, Tuple
+
+import algorithmic_model
+import numpy as np
+import order_manager
+import sliding_window
+import trading_record
+import transaction
+import transaction_window
+import zulu_time
+from algorithmic_model import PendingTrade
+from pyrsistent import pvector
+from trading_record import TradingAction, TradingRecord
+from transaction import Transaction
+
+DEFAULT_BASELINE = 'benchmarks/baseline.json'
+DEFAULT_THRESHOLD = 0.25
+# Times a possible regression is measured again before it's reported
+CONFIRMATIONS = 2
+WINDOW_SIZES = [10, 100, 1000]
+LOT_COUNTS = [10, 100, 1000]
+PENDING_TRADE_COUNTS = [10, 100, 1000]
+
+Setup = Callable[[], Callable[[], Any]]
+BENCHMARKS: Dict[str, Setup] = {}
+
+
+def benchmark(name: str) -> Callable[[Setup], Setup]:
+    ''' Registers a setup function that returns the zero argument call to time '''
+    def register(setup: Setup) -> Setup:
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def match_message(index: int) -> Dict[str, str]:
+    return {
+        'type': 'match',
+        'product_id': 'BTC-USD',
+        'price': f'{5000.0 + (index % 50) * 0.25:.2f}',
+        'size': '0.01',
+        'time': f'2019-04-01T12:{(index // 60) % 60:02d}:{index % 60:02d}.{index % 1000:03d}000Z',
+    }
+
+
+def filled_window(size: int) -> sliding_window.SlidingWindow:
+    window = sliding_window.construct(size)
+    for index in range(size):
+        window = sliding_window.add(sliding_window.SlidingWindowSample(
+            exchange_rate=5000.0 + (index % 50) * 0.25,
+            epoch=1554120000.0 + index * 0.5
+        ), window)
+    return window
+
+
+def filled_record(size: int = 1000) -> TradingRecord:
+    return trading_record.construct('benchmark', '', 100000.0).set(
+        'exchange_rates',
+        filled_window(size)
+    )
+
+
+def pending_lots(count: int) -> List[Transaction]:
+    return [
+        Transaction(
+            label='BTC-USD',
+            quantity=1.0,
+            exchange_rate=5000.0 + index,
+            epoch=1554120000.0 + index,
+            fees=12.5,
+            order='buy'
+        )
+        for index in range(count)
+    ]
+
+
+def register_window_benchmarks(size: int) -> None:
+    sample = sliding_window.SlidingWindowSample(exchange_rate=5010.0, epoch=1554130000.0)
+
+    @benchmark(f'sliding_window.add[{size}]')
+    def add():
+        window = filled_window(size)
+        return lambda: sliding_window.add(sample, window)
+
+    @benchmark(f'sliding_window.average[{size}]')
+    def average():
+        window = filled_window(size)
+        return lambda: sliding_window.average(size, window)
+
+    @benchmark(f'sliding_window.derivative[{size}]')
+    def derivative():
+        window = filled_window(size)
+        return lambda: sliding_window.derivative(size, window)
+
+
+for window_size in WINDOW_SIZES:
+    register_window_benchmarks(window_size)
+
+
+@benchmark('sliding_window.series[10000]')
+def window_series():
+    indices = np.arange(10000)
+    exchange_rates = 5000.0 + (indices % 50) * 0.25
+    epochs = 1554120000.0 + indices * 0.5
+    return lambda: sliding_window.series(exchange_rates, epochs)
+
+
+@benchmark('trading_client.parse_message')
+def parse_message():
+    from trading_client import parse_message
+    message = match_message(1)
+    return lambda: parse_message(message)
+
+
+@benchmark('zulu_time.get_epoch')
+def get_epoch():
+    return lambda: zulu_time.get_epoch('2019-04-01T12:30:15.123000Z')
+
+
+def register_order_benchmarks(order: str) -> None:
+    @benchmark(f'trading_record.place_order[{order}]')
+    def place_order():
+        record = filled_record().update({
+            'crypto': 1.0,
+            'pending_sales': pending_lots(1),
+        })
+        action = TradingAction(order=order, amount=1)
+        return lambda: trading_record.place_order(action, record)
+
+
+for order_type in ['buy', 'sell', 'hold']:
+    register_order_benchmarks(order_type)
+
+
+def register_pairing_benchmark(lots: int) -> None:
+    @benchmark(f'transaction.pair_transaction[{lots}]')
+    def pair_transaction():
+        pending = pvector(pending_lots(lots))
+        sell = Transaction(
+            label='BTC-USD',
+            quantity=1.0,
+            exchange_rate=5100.0,
+            epoch=1554130000.0,
+            fees=12.75,
+            order='sell'
+        )
+        return lambda: transaction.pair_transaction(sell, pending)
+
+
+for lot_count in LOT_COUNTS:
+    register_pairing_benchmark(lot_count)
+
+
+def register_transaction_window_benchmark(order: str) -> None:
+    @benchmark(f'transaction_window.add[{order}]')
+    def add():
+        entry = pending_lots(1)[0].set('order', order)
+        window = transaction_window.construct(pending_lots(transaction_window.MAXIMUM_SIZE))
+        # Holds extend the run at the newest entry
+        window = transaction_window.add(entry, window)
+        return lambda: transaction_window.add(entry, window)
+
+
+for order_type in ['buy', 'hold']:
+    register_transaction_window_benchmark(order_type)
+
+
+def register_algorithmic_benchmark(count: int) -> None:
+    @benchmark(f'algorithmic_model.predict[{count}]')
+    def predict():
+        record = filled_record()
+        # Pending trades that are neither sold nor cut at the current exchange rate
+        model = algorithmic_model.construct().set('pending_trades', [
+            PendingTrade(buyers_price=5000.0 + index % 50) for index in range(count)
+        ])
+        features = {
+            'exchange_rate': 5010.0,
+            'rate_of_change_100': -0.5,
+            'moving_average_100': 5012.0,
+        }
+        return lambda: algorithmic_model.predict(record, features, model)
+
+
+for pending_trade_count in PENDING_TRADE_COUNTS:
+    register_algorithmic_benchmark(pending_trade_count)
+
+
+def full_channel_messages(count: int) -> List[Dict[str, Any]]:
+    ''' Lifecycles of other traders' orders as they appear on the full channel '''
+    messages: List[Dict[str, Any]] = []
+    for index in range(count // 4):
+        order_id = f'order-{index}'
+        price = f'{5000.0 + (index % 50) * 0.25:.2f}'
+        messages += [
+            {'type': 'received', 'order_id': order_id, 'client_oid': f'client-{index}',
+             'side': 'buy', 'size': '0.01', 'price': price},
+            {'type': 'open', 'order_id': order_id, 'remaining_size': '0.01',
+             'price': price, 'side': 'buy'},
+            dict(match_message(index), maker_order_id=order_id, taker_order_id='taker'),
+            {'type': 'done', 'order_id': order_id, 'reason': 'filled', 'side': 'buy'},
+        ]
+    return messages
+
+
+def tracked_manager(count: int) -> order_manager.OrderManager:
+    ''' An order manager with (count) resting orders of its own '''
+    manager = order_manager.construct({'benchmark': filled_record()})
+    for index in range(count):
+        order_manager.track(manager, f'resting-{index}', 'benchmark', 'BTC-USD', 'sell',
+                            0.01, 6000.0 + index)
+        order_manager.apply(manager, {'type': 'received', 'order_id': f'resting-{index}',
+                                      'client_oid': f'resting-{index}'})
+        order_manager.apply(manager, {'type': 'open', 'order_id': f'resting-{index}',
+                                      'remaining_size': '0.01', 'price': f'{6000 + index}'})
+    return manager
+
+
+@benchmark('order_manager.apply[other traders]')
+def apply_other_traders():
+    ''' One full channel event for an order that isn't tracked '''
+    manager = tracked_manager(1000)
+    messages = full_channel_messages(1000)
+    position = [0]
+
+    def apply():
+        order_manager.apply(manager, messages[position[0] % len(messages)])
+        position[0] += 1
+    return apply
+
+
+@benchmark('order_manager.apply[own order]')
+def apply_lifecycle():
+    ''' Tracking, receiving, opening, filling and finishing an order '''
+    manager = tracked_manager(1000)
+    messages = full_channel_messages(4)
+    position = [0]
+
+    def lifecycle():
+        client_oid = f'client-{position[0]}'
+        position[0] += 1
+        order_manager.track(manager, client_oid, 'benchmark', 'BTC-USD', 'buy', 0.01, 5000.0)
+        for message in messages:
+            order_manager.apply(manager, dict(message, client_oid=client_oid))
+    return lifecycle
+
+
+def register_tick_benchmark(enabled_strategies: List[str]) -> None:
+    @benchmark(f'trading_client.on_message[{"+".join(enabled_strategies)}]')
+    def on_message():
+        ''' A full tick for (enabled_strategies) '''
+        import strategies
+        from trading_client import TradingClient
+
+        client = TradingClient(
+            strategies.construct_trading_records(enabled_strategies),
+            strategies.construct_trading_models(enabled_strategies)
+        )
+        # Fill the sliding windows so every tick does a steady state amount of work
+        for index in range(1000):
+            client.on_message(match_message(index))
+        messages = [match_message(index) for index in range(1000, 2000)]
+        position = [0]
+
+        def tick():
+            client.on_message(messages[position[0] % len(messages)])
+            position[0] += 1
+        return tick
+
+
+# q-learning needs tensorflow, the other strategies can be measured without it
+for tick_strategies in [['q-learning', 'algorithmic', 'random'], ['algorithmic', 'random']]:
+    register_tick_benchmark(tick_strategies)
+
+
+def measure(setup: Setup, repeat: int = 5) -> float:
+    ''' Returns the best time per call in microseconds '''
+    timer = timeit.Timer(setup())
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def run(names: List[str]) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    # Trading functions log every tick and record paired transactions in the
+    # working directory, so both are redirected while benchmarking
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory, \
+            open(os.devnull, 'w') as devnull:
+        os.chdir(directory)
+        try:
+            for name in names:
+                try:
+                    with contextlib.redirect_stdout(devnull):
+                        microseconds = measure(BENCHMARKS[name])
+                except ImportError as error:
+                    print(f'{name:<45} skipped ({error})')
+                    results[name] = {'skipped': str(error)}
+                    continue
+                print(f'{name:<45} {microseconds:12.2f} us')
+                results[name] = {'microseconds': microseconds}
+        finally:
+            os.chdir(working_directory)
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'benchmarks': results,
+    }
+
+
+def compare(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    threshold: float
+) -> List[Tuple[str, float, float]]:
+    ''' Returns (name, baseline, result) of benchmarks slower than the baseline
+    by more than (threshold), e.g. 0.25 for 25%
+    '''
+    regressions = []
+    for name, measured in results['benchmarks'].items():
+        expected = baseline['benchmarks'].get(name, {})
+        if 'microseconds' not in measured or 'microseconds' not in expected:
+            continue
+        if measured['microseconds'] > expected['microseconds'] * (1 + threshold):
+            regressions.append((name, expected['microseconds'], measured['microseconds']))
+    return regressions
+
+
+def skipped_with_baseline(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any]
+) -> List[Tuple[str, str]]:
+    ''' Returns (name, reason) of skipped benchmarks that have a baseline '''
+    return [
+        (name, measured['skipped'])
+        for name, measured in results['benchmarks'].items()
+        if 'skipped' in measured and 'microseconds' in baseline['benchmarks'].get(name, {})
+    ]
+
+
+def merge(baseline: Dict[str, Any], results: Dict[str, Any]) -> Dict[str, Any]:
+    ''' Updates (baseline) with the measured benchmarks of (results) '''
+    benchmarks = dict(baseline['benchmarks'])
+    benchmarks.update({
+        name: measured
+        for name, measured in results['benchmarks'].items()
+        if 'microseconds' in measured
+    })
+    return dict(results, benchmarks=benchmarks)
+
+
+def load(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {'benchmarks': {}}
+    with open(path) as reader:
+        return json.load(reader)
+
+
+def save(path: str, results: Dict[str, Any]) -> None:
+    with open(path, 'w') as writer:
+        json.dump(results, writer, indent=2)
+
+
+def main(arguments: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks the tick-to-trade hot path')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--output', help='writes the results as JSON to this path')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown before failing, 0.25 is 25%%')
+    parser.add_argument('--filter', default='', help='only runs benchmarks containing this')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='writes the results to the baseline instead of comparing')
+    options = parser.parse_args(arguments)
+
+    names = [name for name in BENCHMARKS if options.filter in name]
+    results = run(names)
+    if options.save_baseline:
+        os.makedirs(os.path.dirname(options.baseline) or '.', exist_ok=True)
+        save(options.baseline, merge(load(options.baseline), results))
+        if options.output:
+            save(options.output, results)
+        print(f'saved baseline to {options.baseline}')
+        return 0
+
+    if not os.path.exists(options.baseline):
+        print(f'no baseline at {options.baseline}, run with --save-baseline to record one')
+    baseline = load(options.baseline)
+    regressions = compare(results, baseline, options.threshold)
+    # Shared machines are noisy, so regressions are only reported when they
+    # persist after measuring those benchmarks again
+    for _ in range(CONFIRMATIONS):
+        if len(regressions) == 0:
+            break
+        print(f'measuring {len(regressions)} possible regressions again')
+        remeasured = run([name for name, _, _ in regressions])
+        for name, measured in remeasured['benchmarks'].items():
+            best = results['benchmarks'][name]
+            best['microseconds'] = min(best['microseconds'], measured['microseconds'])
+        regressions = compare(results, baseline, options.threshold)
+    if options.output:
+        save(options.output, results)
+
+    for name, expected, measured in regressions:
+        print(f'REGRESSION {name}: {expected:.2f} us -> {measured:.2f} us '
+              f'({measured / expected - 1:+.0%})')
+    skipped = skipped_with_baseline(results, baseline)
+    for name, reason in skipped:
+        print(f'SKIPPED {name}: has a baseline but could not run ({reason})')
+    return 1 if len(regressions) > 0 or len(skipped) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,235 @@
+'''
+Downsampled history of the exchange rate and every trading record's net worth
+for the dashboard charts.
+
+Every series keeps min/max/last buckets at several zoom levels (1 second up to
+1 hour buckets), each level in a fixed size numpy ring.  A value only updates
+the finest level's open bucket; closed buckets are merged into the next level,
+so an update is O(1) amortized however many levels there are.  A query picks
+the finest level that covers the requested time range in about the requested
+number of points and merges neighbouring buckets down to that count, so any
+range is answered in time bounded by the ring capacity.
+
+The trading thread updates the history and request threads query it.  Updates
+are guarded by a sequence number like shared_state, so queries copy what they
+need and retry if the trading thread updated the history meanwhile.  As in
+shared_state, retries are bounded: after READ_TIMEOUT seconds a query answers
+from what it copied, which may mix two ticks.
+'''
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from logger import logger
+from maybe import Maybe
+from shared_state import READ_TIMEOUT, RETRY_INTERVAL, SPIN_RETRIES
+
+# Seconds per bucket of each zoom level, finest first
+LEVEL_WIDTHS = (1.0, 10.0, 60.0, 600.0, 3600.0)
+START, MINIMUM, MAXIMUM, LAST = range(4)
+
+Bucket = List[float]
+SeriesHistory = Dict[str, List[float]]
+
+
+class Level:
+    def __init__(self, width: float, capacity: int):
+        self.width = width
+        self.capacity = capacity
+        # Closed buckets, (capacity, [START, MINIMUM, MAXIMUM, LAST])
+        self.buckets = np.zeros((capacity, 4))
+        self.head = -1
+        self.count = 0
+        # Open bucket.  It holds the closed buckets of the finer level; values
+        # still in a finer level's open bucket are merged in when queried.
+        self.current: Optional[Bucket] = None
+
+
+class ChartHistory:
+    def __init__(self, level_widths: Tuple[float, ...], capacity: int):
+        self.level_widths = level_widths
+        self.capacity = capacity
+        self.series: Dict[str, List[Level]] = {}
+        # Odd while the trading thread is updating
+        self.sequence = 0
+
+
+def construct(
+    level_widths: Tuple[float, ...] = LEVEL_WIDTHS,
+    capacity: int = 2048
+) -> ChartHistory:
+    return ChartHistory(level_widths, capacity)
+
+
+def merge(bucket: Bucket, other: Bucket) -> None:
+    if other[MINIMUM] < bucket[MINIMUM]:
+        bucket[MINIMUM] = other[MINIMUM]
+    if other[MAXIMUM] > bucket[MAXIMUM]:
+        bucket[MAXIMUM] = other[MAXIMUM]
+    bucket[LAST] = other[LAST]
+
+
+def add_bucket(levels: List[Level], index: int, bucket: Bucket) -> None:
+    ''' Adds a bucket of the finer level (or a single value) to level (index) '''
+    level = levels[index]
+    start = bucket[START] - bucket[START] % level.width
+    if level.current is None:
+        level.current = [start, bucket[MINIMUM], bucket[MAXIMUM], bucket[LAST]]
+    elif start > level.current[START]:
+        closed = level.current
+        level.head = (level.head + 1) % level.capacity
+        level.count = min(level.count + 1, level.capacity)
+        level.buckets[level.head] = closed
+        if index + 1 < len(levels):
+            add_bucket(levels, index + 1, closed)
+        level.current = [start, bucket[MINIMUM], bucket[MAXIMUM], bucket[LAST]]
+    else:
+        # Late values are merged into the open bucket
+        merge(level.current, bucket)
+
+
+def update(history: ChartHistory, epoch: float, values: Dict[str, float]) -> None:
+    ''' Adds the (values) of every series at (epoch) '''
+    history.sequence += 1
+    try:
+        for name, value in values.items():
+            levels = history.series.get(name)
+            if levels is None:
+                levels = [Level(width, history.capacity) for width in history.level_widths]
+                history.series[name] = levels
+            add_bucket(levels, 0, [epoch, value, value, value])
+    finally:
+        history.sequence += 1
+
+
+def oldest_start(level: Level) -> float:
+    if level.count < level.capacity:
+        return -math.inf
+    return level.buckets[(level.head + 1) % level.capacity, START]
+
+
+def held_range(levels: List[Level]) -> Tuple[float, float]:
+    ''' Start of the oldest and end of the newest bucket held of a series
+
+    The finest level that hasn't evicted a bucket yet holds everything since
+    the first value, otherwise the coarsest level holds the oldest buckets.
+    '''
+    newest = levels[0]
+    assert newest.current is not None
+    end = newest.current[START] + newest.width
+    for level in levels:
+        if level.count < level.capacity:
+            if level.count > 0:
+                return level.buckets[(level.head + 1 - level.count) % level.capacity, START], end
+            if level.current is not None:
+                return level.current[START], end
+            break
+    return oldest_start(levels[-1]), end
+
+
+def choose_level(levels: List[Level], start: float, end: float, points: int) -> int:
+    ''' Finest level that still holds (start) and spans (start, end) in (points) buckets '''
+    covering = [
+        index for index, level in enumerate(levels)
+        if oldest_start(level) <= start
+    ]
+    if len(covering) == 0:
+        return len(levels) - 1
+    span = end - start
+    for index in covering:
+        if span / levels[index].width <= points:
+            return index
+    return covering[-1]
+
+
+def copy_level(levels: List[Level], index: int) -> np.ndarray:
+    ''' Returns the buckets of level (index), oldest first, including its open bucket
+
+    The open buckets of finer levels are merged in, so the newest values are
+    part of every level.
+    '''
+    level = levels[index]
+    indices = (level.head - level.count + 1 + np.arange(level.count)) % level.capacity
+    pending: List[Bucket] = []
+    for finer_index in range(index, -1, -1):
+        bucket = levels[finer_index].current
+        if bucket is None:
+            continue
+        start = bucket[START] - bucket[START] % level.width
+        if len(pending) == 0 or start > pending[-1][START]:
+            pending.append([start, bucket[MINIMUM], bucket[MAXIMUM], bucket[LAST]])
+        else:
+            merge(pending[-1], bucket)
+    return np.concatenate([level.buckets[indices], np.array(pending).reshape(-1, 4)])
+
+
+def downsample(
+    buckets: np.ndarray,
+    start: float,
+    end: float,
+    points: int
+) -> SeriesHistory:
+    ''' Returns the buckets between (start) and (end) merged down to at most (points) '''
+    # The first bucket is the one that contains (start)
+    first = max(np.searchsorted(buckets[:, START], start, side='right') - 1, 0)
+    last = np.searchsorted(buckets[:, START], end, side='right')
+    buckets = buckets[first:last]
+    if len(buckets) > points > 0:
+        group_size = math.ceil(len(buckets) / points)
+        group_starts = np.arange(0, len(buckets), group_size)
+        group_ends = np.minimum(group_starts + group_size, len(buckets)) - 1
+        buckets = np.stack([
+            buckets[group_starts, START],
+            np.minimum.reduceat(buckets[:, MINIMUM], group_starts),
+            np.maximum.reduceat(buckets[:, MAXIMUM], group_starts),
+            buckets[group_ends, LAST],
+        ], axis=1)
+    return {
+        'epoch': buckets[:, START].tolist(),
+        'min': buckets[:, MINIMUM].tolist(),
+        'max': buckets[:, MAXIMUM].tolist(),
+        'last': buckets[:, LAST].tolist(),
+    }
+
+
+def query(
+    history: ChartHistory,
+    name: str,
+    start: float = -math.inf,
+    end: float = math.inf,
+    points: int = 500
+) -> Maybe[SeriesHistory]:
+    ''' Returns at most (points) buckets of series (name) between (start) and (end) '''
+    deadline = None
+    retries = 0
+    while True:
+        sequence = history.sequence
+        levels = history.series.get(name)
+        # A series whose first update failed has no values
+        if levels is None or levels[0].current is None:
+            return None
+        if sequence % 2 == 0 or deadline is not None and time.perf_counter() >= deadline:
+            # Open ranges span only the values held, so that the level is
+            # chosen for the range that has values
+            oldest, newest = held_range(levels)
+            index = choose_level(levels, max(start, oldest), min(end, newest), points)
+            buckets = copy_level(levels, index)
+            if history.sequence == sequence:
+                return downsample(buckets, start, end, points)
+            if deadline is not None and time.perf_counter() >= deadline:
+                logger.warn(f'chart history has been updated for over {READ_TIMEOUT}s, '
+                            f'answering {name} from a copy that may mix two ticks')
+                return downsample(buckets, start, end, points)
+        # Let the trading thread finish its update
+        retries += 1
+        if retries <= SPIN_RETRIES:
+            time.sleep(0)
+            continue
+        if deadline is None:
+            deadline = time.perf_counter() + READ_TIMEOUT
+        time.sleep(RETRY_INTERVAL)
+
+
+def series_names(history: ChartHistory) -> List[str]:
+    return list(history.series.keys())
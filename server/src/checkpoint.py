@@ -0,0 +1,606 @@
+'''
+Periodic checkpoints and warm restarts of the full trading state.
+
+A checkpoint is a single uncompressed numpy .npz archive.  Sliding windows,
+transaction lists and replay memory are stored column-wise as arrays, and the
+neural network weights are stored as one array per dense layer variable.
+Records that share an exchange rate window refer to one stored copy of it by
+its index, and share one window again when restored.
+
+Checkpoints are taken from published registry snapshots.  Records and most
+models are immutable, so the background thread can serialize a snapshot while
+the trading thread keeps producing new ones without ever pausing it.  The
+network weights are copied by the trading thread between ticks when the
+checkpointer requests a capture (see registry_snapshot.SnapshotPublisher).
+'''
+import os
+import threading
+import time
+from typing import Any, Dict, List, cast
+
+import input_normalizer
+import numpy as np
+import performance_analytics
+import q_learning_population
+import sliding_window
+import transaction_window
+from algorithmic_model import AlgorithmicModel, PendingTrade
+from input_normalizer import InputNormalizer
+from logger import logger
+from maybe import Maybe
+from performance_analytics import PerformanceAnalytics
+from pyrsistent import PRecord, PVector, field, pmap_field
+from q_learning_population import AgentHyperparameters, QLearningPopulation
+from q_memory import QMemory, QMemorySample
+from q_records import QModelInput
+from registries import TradingModelRegistry, TradingRecordRegistry
+from registry_snapshot import RegistrySnapshot, SnapshotPublisher
+from sliding_window import SlidingWindow, SlidingWindowSample
+from trading_record import TradingAction, TradingRecord
+from transaction import Transaction
+from transaction_window import HoldRun, TransactionWindow
+
+Arrays = Dict[str, np.ndarray]
+
+ORDERS = ['buy', 'sell', 'hold']
+
+# Missing optional record fields are stored as NaN and omitted again when decoded
+SAMPLE_FIELDS = [
+    'exchange_rate',
+    'exchange_rate_filtered',
+    'exchange_rate_rate_of_change_filtered',
+    'exchange_rate_moving_average_10',
+    'exchange_rate_moving_average_100',
+    'epoch',
+]
+
+TRANSACTION_FIELDS = ['quantity', 'exchange_rate', 'epoch', 'fees']
+HOLD_RUN_FIELDS = ['first_exchange_rate', 'first_epoch']
+
+ANALYTICS_COUNTS = ['marks', 'returns_start', 'maximum_returns', 'wins', 'losses']
+ANALYTICS_METRICS = [
+    'equity',
+    'peak_equity',
+    'equity_sum',
+    'drawdown',
+    'max_drawdown',
+    'returns_sum',
+    'returns_sum_of_squares',
+    'volatility',
+    'sharpe_ratio',
+    'realized_gains',
+    'win_rate',
+    'win_loss_ratio',
+    'traded_volume',
+    'turnover',
+]
+
+
+HYPERPARAMETER_FIELDS = ['gamma', 'min_epsilon', 'max_epsilon', 'epsilon_decay', 'learning_rate']
+POPULATION_COUNTS = ['training_steps', 'memory_length', 'memory_start', 'time_delta']
+
+
+class Checkpoint(PRecord):
+    trading_records = pmap_field(str, TradingRecord)
+    algorithmic_model = field(type=(AlgorithmicModel, type(None)), initial=None)
+    q_memory = field(type=(QMemory, type(None)), initial=None)
+    input_normalizer = field(type=(InputNormalizer, type(None)), initial=None)
+    q_learning_population = field(type=(QLearningPopulation, type(None)), initial=None)
+    network_weights = field(type=list, initial=[])
+    tick = field(type=int, mandatory=True)
+    time_delta = field(type=int, mandatory=True)
+
+
+def prefixed(prefix: str, arrays: Arrays) -> Arrays:
+    return {f'{prefix}/{key}': value for key, value in arrays.items()}
+
+
+def unprefixed(prefix: str, arrays: Arrays) -> Arrays:
+    start = len(prefix) + 1
+    return {key[start:]: value for key, value in arrays.items() if key.startswith(f'{prefix}/')}
+
+
+def encode_sliding_window(window: SlidingWindow) -> Arrays:
+    arrays = {
+        sample_field: np.array(
+            [sample.get(sample_field, np.nan) for sample in window.samples],
+            dtype=np.float64
+        )
+        for sample_field in SAMPLE_FIELDS
+    }
+    arrays['maximum_size'] = np.array(window.maximum_size)
+    arrays['filters'] = np.array([
+        window.first_order_filter_time_constant,
+        window.second_order_filter_time_constant,
+        window.filter_order_ratio,
+    ])
+    return arrays
+
+
+def decode_sliding_window(arrays: Arrays) -> SlidingWindow:
+    columns = [arrays[sample_field].tolist() for sample_field in SAMPLE_FIELDS]
+    samples = [
+        SlidingWindowSample(**{
+            sample_field: value
+            for sample_field, value in zip(SAMPLE_FIELDS, row)
+            if value == value  # NaN marks a missing optional field
+        })
+        for row in zip(*columns)
+    ]
+    first_order, second_order, ratio = arrays['filters'].tolist()
+    return sliding_window.construct(
+        maximum_size=int(arrays['maximum_size']),
+        first_order_filter_time_constant=first_order,
+        second_order_filter_time_constant=second_order,
+        filter_order_ratio=ratio
+    ).set('samples', samples)
+
+
+def encode_transactions(transactions: PVector) -> Arrays:
+    arrays = {
+        transaction_field: np.array(
+            [t.get(transaction_field, np.nan) for t in transactions],
+            dtype=np.float64
+        )
+        for transaction_field in TRANSACTION_FIELDS
+    }
+    arrays['order'] = np.array([ORDERS.index(t.order) for t in transactions], dtype=np.int8)
+    arrays['label'] = np.array([t.label for t in transactions], dtype=np.str_)
+    return arrays
+
+
+def decode_transactions(arrays: Arrays) -> List[Transaction]:
+    columns = [arrays[transaction_field].tolist() for transaction_field in TRANSACTION_FIELDS]
+    orders = arrays['order'].tolist()
+    labels = arrays['label'].tolist()
+    return [
+        Transaction(
+            label=label,
+            order=ORDERS[order],
+            **{
+                transaction_field: value
+                for transaction_field, value in zip(TRANSACTION_FIELDS, row)
+                if value == value  # NaN marks a missing optional field
+            }
+        )
+        for label, order, row in zip(labels, orders, zip(*columns))
+    ]
+
+
+def encode_transaction_window(window: TransactionWindow) -> Arrays:
+    ''' Stores the ring as it is, runs have a count and trades a count of 0 '''
+    arrays = encode_transactions(window.entries)
+    arrays['count'] = np.array(
+        [entry.count if isinstance(entry, HoldRun) else 0 for entry in window.entries],
+        dtype=np.int64
+    )
+    for run_field in HOLD_RUN_FIELDS:
+        arrays[run_field] = np.array(
+            [entry.get(run_field, np.nan) for entry in window.entries],
+            dtype=np.float64
+        )
+    arrays['start'] = np.array(window.start)
+    arrays['maximum_size'] = np.array(window.maximum_size)
+    return arrays
+
+
+def decode_transaction_window(arrays: Arrays) -> TransactionWindow:
+    transactions = decode_transactions(arrays)
+    if 'count' not in arrays:
+        # Checkpoints from before hold runs kept a list of transactions
+        return transaction_window.construct(transactions)
+    first_columns = zip(*[arrays[run_field].tolist() for run_field in HOLD_RUN_FIELDS])
+    entries = [
+        HoldRun(
+            label=entry.label,
+            exchange_rate=entry.exchange_rate,
+            epoch=entry.epoch,
+            count=count,
+            first_exchange_rate=first_exchange_rate,
+            first_epoch=first_epoch
+        ) if count > 0 else entry
+        for entry, count, (first_exchange_rate, first_epoch) in zip(
+            transactions, arrays['count'].tolist(), first_columns
+        )
+    ]
+    return TransactionWindow(
+        entries=entries,
+        start=int(arrays['start']),
+        maximum_size=int(arrays['maximum_size'])
+    )
+
+
+def encode_analytics(analytics: PerformanceAnalytics) -> Arrays:
+    return {
+        'counts': np.array([analytics[name] for name in ANALYTICS_COUNTS], dtype=np.int64),
+        'metrics': np.array([analytics[name] for name in ANALYTICS_METRICS], dtype=np.float64),
+        'returns': np.array(analytics.returns, dtype=np.float64),
+    }
+
+
+def decode_analytics(arrays: Arrays) -> PerformanceAnalytics:
+    if 'counts' not in arrays:
+        # Checkpoints from before the analytics start them over
+        return performance_analytics.construct()
+    return PerformanceAnalytics(
+        returns=arrays['returns'].tolist(),
+        **dict(zip(ANALYTICS_COUNTS, arrays['counts'].tolist())),
+        **dict(zip(ANALYTICS_METRICS, arrays['metrics'].tolist()))
+    )
+
+
+def encode_trading_record(record: TradingRecord, window: int) -> Arrays:
+    ''' Encodes (record) without its exchange rate window, stored at index (window) '''
+    arrays = {
+        'name': np.array(record.name),
+        'description': np.array(record.description),
+        'balances': np.array([
+            record.initial_usd,
+            record.usd,
+            record.crypto,
+            record.fees_paid,
+        ]),
+        'counts': np.array([record.buys, record.sells, record.holds], dtype=np.int64),
+        'exchange_rates': np.array(window),
+    }
+    arrays.update(prefixed('pending_sales', encode_transactions(record.pending_sales)))
+    arrays.update(prefixed(
+        'transaction_window',
+        encode_transaction_window(record.transaction_window)
+    ))
+    arrays.update(prefixed('analytics', encode_analytics(record.analytics)))
+    return arrays
+
+
+def decode_trading_record(arrays: Arrays, windows: Dict[int, SlidingWindow]) -> TradingRecord:
+    initial_usd, usd, crypto, fees_paid = arrays['balances'].tolist()
+    buys, sells, holds = arrays['counts'].tolist()
+    return TradingRecord(
+        name=str(arrays['name']),
+        description=str(arrays['description']),
+        initial_usd=initial_usd,
+        usd=usd,
+        crypto=crypto,
+        buys=buys,
+        sells=sells,
+        holds=holds,
+        fees_paid=fees_paid,
+        exchange_rates=(
+            windows[int(arrays['exchange_rates'])] if 'exchange_rates' in arrays
+            # Checkpoints from before shared windows stored a copy in every record
+            else decode_sliding_window(unprefixed('exchange_rates', arrays))
+        ),
+        pending_sales=decode_transactions(unprefixed('pending_sales', arrays)),
+        transaction_window=decode_transaction_window(unprefixed('transaction_window', arrays)),
+        analytics=decode_analytics(unprefixed('analytics', arrays)),
+    )
+
+
+def encode_algorithmic_model(model: AlgorithmicModel) -> Arrays:
+    return {
+        'buyers_price': np.array(
+            [trade.buyers_price for trade in model.pending_trades],
+            dtype=np.float64
+        ),
+        'thresholds': np.array([model.selling_threshold, model.cut_losses_threshold]),
+    }
+
+
+def decode_algorithmic_model(arrays: Arrays) -> AlgorithmicModel:
+    selling_threshold, cut_losses_threshold = arrays['thresholds'].tolist()
+    return AlgorithmicModel(
+        pending_trades=[
+            PendingTrade(buyers_price=price) for price in arrays['buyers_price'].tolist()
+        ],
+        selling_threshold=selling_threshold,
+        cut_losses_threshold=cut_losses_threshold
+    )
+
+
+def encode_q_memory(memory: QMemory) -> Arrays:
+    return {
+        'inputs': np.array([
+            [
+                sample.neural_network_input.exchange_rate,
+                sample.neural_network_input.rate_of_change,
+                sample.neural_network_input.moving_average,
+            ]
+            for sample in memory.samples
+        ], dtype=np.float64).reshape(-1, 3),
+        'order': np.array(
+            [ORDERS.index(sample.neural_network_prediction.order) for sample in memory.samples],
+            dtype=np.int8
+        ),
+        'amount': np.array(
+            [sample.neural_network_prediction.amount for sample in memory.samples],
+            dtype=np.float64
+        ),
+        'reward': np.array([sample.reward for sample in memory.samples], dtype=np.float64),
+        'maximum_size': np.array(memory.maximum_size),
+    }
+
+
+def decode_q_memory(arrays: Arrays) -> QMemory:
+    samples = [
+        QMemorySample(
+            neural_network_input=QModelInput(
+                exchange_rate=exchange_rate,
+                rate_of_change=rate_of_change,
+                moving_average=moving_average
+            ),
+            neural_network_prediction=TradingAction(order=ORDERS[order], amount=amount),
+            reward=reward
+        )
+        for (exchange_rate, rate_of_change, moving_average), order, amount, reward in zip(
+            arrays['inputs'].tolist(),
+            arrays['order'].tolist(),
+            arrays['amount'].tolist(),
+            arrays['reward'].tolist()
+        )
+    ]
+    return QMemory(samples=samples, maximum_size=int(arrays['maximum_size']))
+
+
+def encode_input_normalizer(normalizer: InputNormalizer) -> Arrays:
+    return {
+        'count': np.array(normalizer.count),
+        'mean': normalizer.mean.copy(),
+        'm2': normalizer.m2.copy(),
+    }
+
+
+def decode_input_normalizer(arrays: Arrays) -> InputNormalizer:
+    return input_normalizer.construct(
+        len(arrays['mean']),
+        int(arrays['count']),
+        arrays['mean'],
+        arrays['m2']
+    )
+
+
+def encode_population(population: QLearningPopulation) -> Arrays:
+    arrays = {
+        'hyperparameters': np.array([
+            [hyperparameters[name] for name in HYPERPARAMETER_FIELDS]
+            for hyperparameters in population.hyperparameters
+        ]),
+        'counts': np.array(
+            [getattr(population, name) for name in POPULATION_COUNTS],
+            dtype=np.int64
+        ),
+        'memory_states': population.memory_states,
+        'memory_actions': population.memory_actions,
+        'memory_rewards': population.memory_rewards,
+    }
+    for index in range(len(population.weights)):
+        arrays[f'weights/{index}'] = population.weights[index]
+        arrays[f'first_moments/{index}'] = population.first_moments[index]
+        arrays[f'second_moments/{index}'] = population.second_moments[index]
+    if population.normalizer is not None:
+        arrays.update(prefixed('normalizer', encode_input_normalizer(population.normalizer)))
+    return arrays
+
+
+def decode_population(arrays: Arrays) -> QLearningPopulation:
+    population = q_learning_population.construct(
+        [
+            AgentHyperparameters(**dict(zip(HYPERPARAMETER_FIELDS, row)))
+            for row in arrays['hyperparameters'].tolist()
+        ],
+        memory_size=len(arrays['memory_states']),
+        precision=str(arrays['memory_states'].dtype),
+        normalize_inputs=False
+    )
+    layers = range(len(population.weights))
+    population.weights = [arrays[f'weights/{index}'] for index in layers]
+    population.first_moments = [arrays[f'first_moments/{index}'] for index in layers]
+    population.second_moments = [arrays[f'second_moments/{index}'] for index in layers]
+    population.memory_states = arrays['memory_states']
+    population.memory_actions = arrays['memory_actions']
+    population.memory_rewards = arrays['memory_rewards']
+    for name, count in zip(POPULATION_COUNTS, arrays['counts'].tolist()):
+        setattr(population, name, count)
+    normalizer_arrays = unprefixed('normalizer', arrays)
+    if normalizer_arrays:
+        population.normalizer = decode_input_normalizer(normalizer_arrays)
+    return population
+
+
+def encode_snapshot(snapshot: RegistrySnapshot) -> Arrays:
+    ''' Encodes the records and models of (snapshot), and the network weights
+    and population captured with it
+    '''
+    captured = snapshot.captured if snapshot.captured is not None else {}
+    arrays = {
+        'tick': np.array(snapshot.tick),
+        'time_delta': np.array(snapshot.time_delta),
+    }
+    windows: Dict[int, int] = {}
+    for name, record in snapshot.trading_records.items():
+        window = id(record.exchange_rates)
+        if window not in windows:
+            windows[window] = len(windows)
+            arrays.update(prefixed(
+                f'exchange_rates/{windows[window]}',
+                encode_sliding_window(record.exchange_rates)
+            ))
+        arrays.update(prefixed(
+            f'records/{name}',
+            encode_trading_record(record, windows[window])
+        ))
+
+    models = snapshot.trading_models
+    if 'algorithmic' in models:
+        arrays.update(prefixed(
+            'models/algorithmic',
+            encode_algorithmic_model(models['algorithmic'])
+        ))
+    if 'q-learning' in models:
+        arrays.update(prefixed(
+            'models/q-learning/memory',
+            encode_q_memory(models['q-learning'].memory)
+        ))
+        if models['q-learning'].normalizer is not None:
+            arrays.update(prefixed(
+                'models/q-learning/normalizer',
+                encode_input_normalizer(models['q-learning'].normalizer)
+            ))
+    for index, weights in enumerate(captured.get('q-learning/weights', [])):
+        arrays[f'models/q-learning/weights/{index}'] = weights
+    if 'q-learning-population' in captured:
+        arrays.update(prefixed(
+            'models/q-learning-population',
+            encode_population(captured['q-learning-population'])
+        ))
+    return arrays
+
+
+def decode_checkpoint(arrays: Arrays) -> Checkpoint:
+    # Record names can't contain '/'
+    record_names = {key.split('/')[1] for key in arrays if key.startswith('records/')}
+    windows = {
+        int(index): decode_sliding_window(unprefixed(f'exchange_rates/{index}', arrays))
+        for index in {key.split('/')[1] for key in arrays if key.startswith('exchange_rates/')}
+    }
+    algorithmic_arrays = unprefixed('models/algorithmic', arrays)
+    q_memory_arrays = unprefixed('models/q-learning/memory', arrays)
+    normalizer_arrays = unprefixed('models/q-learning/normalizer', arrays)
+    weight_arrays = unprefixed('models/q-learning/weights', arrays)
+    population_arrays = unprefixed('models/q-learning-population', arrays)
+    return Checkpoint(
+        trading_records={
+            name: decode_trading_record(unprefixed(f'records/{name}', arrays), windows)
+            for name in record_names
+        },
+        algorithmic_model=(
+            decode_algorithmic_model(algorithmic_arrays) if algorithmic_arrays else None
+        ),
+        q_memory=decode_q_memory(q_memory_arrays) if q_memory_arrays else None,
+        input_normalizer=(
+            decode_input_normalizer(normalizer_arrays) if normalizer_arrays else None
+        ),
+        q_learning_population=(
+            decode_population(population_arrays) if population_arrays else None
+        ),
+        network_weights=[weight_arrays[str(index)] for index in range(len(weight_arrays))],
+        tick=int(arrays['tick']),
+        time_delta=int(arrays['time_delta'])
+    )
+
+
+def save(path: str, snapshot: RegistrySnapshot) -> None:
+    ''' Writes a checkpoint next to (path) and atomically renames it into place
+    so that a crash mid-write never corrupts the last good checkpoint
+    '''
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as writer:
+        # Every keyword is an array name, none of them savez's own arguments
+        np.savez(writer, **cast(Dict[str, Any], encode_snapshot(snapshot)))
+    os.replace(temporary_path, path)
+
+
+def load(path: str) -> Maybe[Checkpoint]:
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as archive:
+        return decode_checkpoint({key: archive[key] for key in archive.files})
+
+
+def restore(
+    checkpoint: Checkpoint,
+    trading_record_registry: TradingRecordRegistry,
+    trading_model_registry: TradingModelRegistry
+) -> None:
+    ''' Copies checkpointed state into the registries of enabled strategies
+
+    Network weights are not restored here because loading them requires the
+    tensorflow session (see fully_connected_neural_network.set_weights).
+    '''
+    for name, record in checkpoint.trading_records.items():
+        if name in trading_record_registry:
+            trading_record_registry[name] = record
+    if checkpoint.algorithmic_model is not None and 'algorithmic' in trading_model_registry:
+        trading_model_registry['algorithmic'] = checkpoint.algorithmic_model
+    if checkpoint.q_memory is not None and 'q-learning' in trading_model_registry:
+        trading_model_registry['q-learning'] = trading_model_registry['q-learning'].set(
+            'memory',
+            checkpoint.q_memory
+        )
+    # Restored weights were trained on inputs normalized with these statistics.
+    # Models that don't normalize their inputs keep not normalizing them.
+    if (
+        checkpoint.input_normalizer is not None and
+        'q-learning' in trading_model_registry and
+        trading_model_registry['q-learning'].normalizer is not None
+    ):
+        trading_model_registry['q-learning'] = trading_model_registry['q-learning'].set(
+            'normalizer',
+            checkpoint.input_normalizer
+        )
+    if (
+        checkpoint.q_learning_population is not None and
+        'q-learning-population' in trading_model_registry
+    ):
+        saved = checkpoint.q_learning_population
+        population = trading_model_registry['q-learning-population']
+        # Agents are matched to their records by index, and the arrays keep
+        # the precision they were saved in
+        if (
+            (saved.size, saved.memory_size, saved.dtype, saved.normalizer is None) ==
+            (population.size, population.memory_size, population.dtype,
+             population.normalizer is None)
+        ):
+            trading_model_registry['q-learning-population'] = saved
+        else:
+            logger.warn('q-learning population not restored: its size, memory size, precision '
+                        'or input normalization differ from the checkpoint')
+
+
+class Checkpointer(threading.Thread):
+    ''' Writes a checkpoint of the latest published snapshot every (interval) seconds
+
+    The checkpointer waits up to (capture_timeout) seconds for the trading
+    thread to capture the snapshot's network weights, and otherwise writes
+    the last snapshot that was captured.
+    '''
+    def __init__(
+        self,
+        registry_publisher: SnapshotPublisher,
+        path: str,
+        interval: float = 60.0,
+        capture_timeout: float = 1.0
+    ):
+        super().__init__(name='checkpointer', daemon=True)
+        self.registry_publisher = registry_publisher
+        self.path = path
+        self.interval = interval
+        self.capture_timeout = capture_timeout
+        self._snapshot: Maybe[RegistrySnapshot] = None
+        # Serializes the periodic checkpoint with the final one taken on shutdown
+        self._lock = threading.Lock()
+
+    def checkpoint(self, final: bool = False) -> None:
+        ''' (final) captures the snapshot on the calling thread, once the
+        trading thread has stopped
+        '''
+        with self._lock:
+            snapshot = (
+                self.registry_publisher.capture_current() if final
+                else self.registry_publisher.request_capture(self.capture_timeout)
+            )
+            if snapshot is None or snapshot is self._snapshot:
+                return
+            start = time.perf_counter()
+            save(self.path, snapshot)
+            self._snapshot = snapshot
+            logger.log(f'checkpoint of tick {snapshot.tick} written to {self.path} '
+                       f'in {time.perf_counter() - start:.3f}s')
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            # A failed checkpoint, e.g. on a full disk, is retried next interval
+            try:
+                self.checkpoint()
+            except Exception as error:
+                logger.error(f'checkpoint to {self.path} failed: {error!r}')
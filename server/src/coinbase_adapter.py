@@ -1,9 +1,11 @@
+import concurrent.futures
 import json
+from typing import Any, Dict
 
-import cbpro
-import result
-from logger import logger
+import order_gateway
+from order_gateway import OrderGateway
 from pyrsistent import PRecord, field
+from result import Result
 
 
 class CoinbaseKeys(PRecord):
@@ -38,55 +40,35 @@ def get_authentication_keys(environment: str) -> CoinbaseKeys:
         # )
 
 
-keys = get_authentication_keys('production')
+API_URL = 'https://api.pro.coinbase.com'
+# The sandbox API requires a different set of API access credentials
+SANDBOX_API_URL = 'https://api-public.sandbox.pro.coinbase.com'
 
-# auth_client = cbpro.AuthenticatedClient(key, b64secret, passphrase)
-# Use the sandbox API (requires a different set of API access credentials)
-auth_client = cbpro.AuthenticatedClient(
-    keys.key,
-    keys.b64secret,
-    keys.passphrase,
-    api_url="https://api.pro.coinbase.com"
-)
 
-# fills_gen = auth_client.get_fills()
-# all_fills = list(fills_gen)
-# print(all_fills)
-
-# response = auth_client.buy(price='100.00',  # USD
-#                            size='0.001',  # BTC
-#                            order_type='limit',
-#                            product_id='BTC-USD')
-
-# print(response)
-# order_id = response['id']
-
-
-def limit_sell(product, price, size, client):
-    response = client.sell(price=price,  # USD
-                           size=size,  # BTC
-                           order_type='limit',
-                           product_id=product)
-    if 'message' in response:
-        return result.Error(response['message'])
-    return response
-
-
-response = limit_sell(product='BTC-USD', price='15000.0', size='.001', client=auth_client)
-logger.log(f'response: {response}')
-
-# cancel_response = auth_client.cancel_order(order_id)
-# print(cancel_response)
-
-# get_orders = auth_client.get_orders()
-# print(get_orders)
-
-# all_orders = list(get_orders)
-# print(all_orders)
-# print(f'\n\n')
-
-# accounts = auth_client.get_accounts()
-# print(accounts)
-
-# order_book = cbpro.OrderBook(product_id='BTC-USD')
-# order_book.start()
+def construct_gateway(environment: str = 'production') -> OrderGateway:
+    ''' Starts an order gateway authenticated with the environment's keys.
+    Nothing is sent to the exchange until an order is submitted.
+    '''
+    keys = get_authentication_keys(environment)
+    return order_gateway.start(order_gateway.construct(
+        SANDBOX_API_URL if environment == 'sandbox' else API_URL,
+        keys.key,
+        keys.b64secret,
+        keys.passphrase
+    ))
+
+
+def limit_sell(
+    product: str,
+    price: str,
+    size: str,
+    gateway: OrderGateway
+) -> 'concurrent.futures.Future[Result[Dict[str, Any]]]':
+    ''' Submits a limit sell without waiting for the exchange to respond '''
+    return order_gateway.submit(gateway, order_gateway.place_order(
+        gateway,
+        'sell',
+        product,
+        size,
+        price
+    ))
@@ -0,0 +1,435 @@
+'''
+Event driven execution simulator for backtests.
+
+Orders don't fill instantly at the last trade price.  Submissions and cancels
+reach the exchange after a latency, and fills are reported back after another,
+all scheduled on a priority queue of events keyed by epoch.  Market data is
+applied in epoch order between the scheduled events.
+
+Market orders, and limit orders that cross the spread, walk the book and pay
+taker fees.  Resting limit orders join the back of their price level's queue:
+trades at that price first fill the size displayed ahead of them, then fill
+them partially or completely, and trades through their price fill them
+completely.  Resting fills pay maker fees.  Fee rates come from the trailing
+30 day volume of the fills (see transaction.FEE_TIERS).
+
+Without level2 data the book is assumed from a DepthModel around the last
+trade.  Walking that book doesn't deplete it.
+'''
+import bisect
+import heapq
+import math
+import random
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+import transaction
+from invariants import cannot_be_negative, must_be_positive
+from market_data_generator import Message, TimedMessage
+from pyrsistent import PRecord, field
+
+ARRIVAL, CANCEL, REPORT = range(3)
+THIRTY_DAYS = 30.0 * 24.0 * 60.0 * 60.0
+
+
+class LatencyModel(PRecord):
+    # Seconds for an order or cancel to reach the exchange, a fixed part plus
+    # exponentially distributed jitter with this mean
+    submission = field(type=float, initial=0.05, invariant=cannot_be_negative)
+    submission_jitter = field(type=float, initial=0.02, invariant=cannot_be_negative)
+    # Seconds for a fill to be reported back
+    report = field(type=float, initial=0.01, invariant=cannot_be_negative)
+
+
+class DepthModel(PRecord):
+    ''' Book assumed around the last trade when there's no level2 data '''
+    half_spread = field(type=float, initial=0.005, invariant=cannot_be_negative)
+    level_spacing = field(type=float, initial=0.01, invariant=must_be_positive)
+    level_size = field(type=float, initial=1.0, invariant=must_be_positive)
+    levels = field(type=int, initial=100, invariant=must_be_positive)
+
+
+class Fill(PRecord):
+    order_id = field(type=int, mandatory=True)
+    strategy = field(type=str, mandatory=True)
+    side = field(type=str, mandatory=True)
+    quantity = field(type=float, mandatory=True)
+    price = field(type=float, mandatory=True)
+    fee = field(type=float, mandatory=True)
+    # 'maker' or 'taker'
+    liquidity = field(type=str, mandatory=True)
+    # Epoch the exchange filled the order at
+    epoch = field(type=float, mandatory=True)
+
+
+class Order:
+    def __init__(
+        self,
+        order_id: int,
+        strategy: str,
+        side: str,
+        size: float,
+        price: Optional[float],
+        submitted: float
+    ):
+        self.id = order_id
+        self.strategy = strategy
+        self.side = side
+        self.size = size
+        self.remaining = size
+        # None for market orders
+        self.price = price
+        self.submitted = submitted
+        # 'pending' until it reaches the exchange, 'open' while resting, then 'done'
+        self.status = 'pending'
+        # Size displayed at the order's price level ahead of it
+        self.queue_ahead = 0.0
+
+
+class RollingVolume:
+    ''' USD volume of the fills in a trailing window '''
+    def __init__(self, window: float):
+        self.window = window
+        self.fills: Deque[Tuple[float, float]] = deque()
+        self.total = 0.0
+
+
+def add_volume(volume: RollingVolume, epoch: float, notional: float) -> None:
+    volume.fills.append((epoch, notional))
+    volume.total += notional
+
+
+def trailing_volume(volume: RollingVolume, epoch: float) -> float:
+    while len(volume.fills) > 0 and volume.fills[0][0] <= epoch - volume.window:
+        _, notional = volume.fills.popleft()
+        volume.total -= notional
+    if len(volume.fills) == 0:
+        # Resets the float error of the running total
+        volume.total = 0.0
+    return volume.total
+
+
+class Book:
+    ''' Level2 sizes by price with each side's prices sorted ascending '''
+    def __init__(self) -> None:
+        self.sizes: Dict[str, Dict[float, float]] = {'buy': {}, 'sell': {}}
+        self.prices: Dict[str, List[float]] = {'buy': [], 'sell': []}
+
+
+class ExecutionSimulator:
+    def __init__(
+        self,
+        latency: LatencyModel,
+        depth: DepthModel,
+        on_fill: Callable[[Fill], Any],
+        seed: int
+    ):
+        self.latency = latency
+        self.depth = depth
+        self.on_fill = on_fill
+        self.rng = random.Random(seed)
+        # (epoch, sequence, kind, payload), the sequence keeps events of an epoch in order
+        self.events: List[Tuple[float, int, int, Any]] = []
+        self.sequence = 0
+        self.now = -math.inf
+        self.processed = 0
+        # Orders that aren't done yet
+        self.orders: Dict[int, Order] = {}
+        self.next_order_id = 1
+        self.book = Book()
+        self.has_book = False
+        self.last_price: Optional[float] = None
+        # Resting orders by side and price, oldest first, and their sorted prices
+        self.resting_orders: Dict[str, Dict[float, List[Order]]] = {'buy': {}, 'sell': {}}
+        self.resting_prices: Dict[str, List[float]] = {'buy': [], 'sell': []}
+        self.volume = RollingVolume(THIRTY_DAYS)
+
+    @property
+    def latency(self) -> LatencyModel:
+        return self._latency
+
+    @latency.setter
+    def latency(self, latency: LatencyModel) -> None:
+        # Record fields are slow to read, so the hot path reads these copies
+        self._latency = latency
+        self.submission = latency.submission
+        self.submission_jitter = latency.submission_jitter
+        self.report = latency.report
+
+    @property
+    def depth(self) -> DepthModel:
+        return self._depth
+
+    @depth.setter
+    def depth(self, depth: DepthModel) -> None:
+        self._depth = depth
+        self.half_spread = depth.half_spread
+        self.level_spacing = depth.level_spacing
+        self.level_size = depth.level_size
+        self.levels = depth.levels
+
+
+def construct(
+    latency: LatencyModel = LatencyModel(),
+    depth: DepthModel = DepthModel(),
+    on_fill: Callable[[Fill], Any] = lambda fill: None,
+    seed: int = 0
+) -> ExecutionSimulator:
+    return ExecutionSimulator(latency, depth, on_fill, seed)
+
+
+def schedule(simulator: ExecutionSimulator, epoch: float, kind: int, payload: Any) -> None:
+    simulator.sequence += 1
+    heapq.heappush(simulator.events, (epoch, simulator.sequence, kind, payload))
+
+
+def submission_latency(simulator: ExecutionSimulator) -> float:
+    if simulator.submission_jitter == 0.0:
+        return simulator.submission
+    return simulator.submission + simulator.rng.expovariate(1.0 / simulator.submission_jitter)
+
+
+def submit(
+    simulator: ExecutionSimulator,
+    epoch: float,
+    strategy: str,
+    side: str,
+    size: float,
+    price: Optional[float] = None
+) -> int:
+    ''' Sends a limit order at (price), or a market order without one, at (epoch).
+    Returns the order id.
+    '''
+    if side not in ('buy', 'sell'):
+        raise ValueError(f'order side must be buy or sell, not {side}')
+    order = Order(simulator.next_order_id, strategy, side, size, price, epoch)
+    simulator.next_order_id += 1
+    simulator.orders[order.id] = order
+    schedule(simulator, epoch + submission_latency(simulator), ARRIVAL, order)
+    return order.id
+
+
+def cancel(simulator: ExecutionSimulator, epoch: float, order_id: int) -> None:
+    schedule(simulator, epoch + submission_latency(simulator), CANCEL, order_id)
+
+
+def run_until(simulator: ExecutionSimulator, epoch: float) -> None:
+    ''' Processes the scheduled events up to and including (epoch) '''
+    events = simulator.events
+    while len(events) > 0 and events[0][0] <= epoch:
+        event_epoch, _, kind, payload = heapq.heappop(events)
+        simulator.now = event_epoch
+        simulator.processed += 1
+        if kind == ARRIVAL:
+            arrive(simulator, payload)
+        elif kind == CANCEL:
+            cancel_arrived(simulator, payload)
+        else:
+            simulator.on_fill(payload)
+    simulator.now = max(simulator.now, epoch)
+
+
+def add_market_data(simulator: ExecutionSimulator, epoch: float, message: Message) -> None:
+    ''' Applies a match, l2update or snapshot message received at (epoch) '''
+    run_until(simulator, epoch)
+    simulator.processed += 1
+    kind = message['type']
+    if kind == 'match':
+        trade(simulator, float(message['price']), float(message['size']), message['side'])
+    elif kind == 'l2update':
+        for side, price, size in message['changes']:
+            set_level(simulator, side, float(price), float(size))
+    elif kind == 'snapshot':
+        for book_side, side in [('bids', 'buy'), ('asks', 'sell')]:
+            simulator.book.sizes[side] = {}
+            simulator.book.prices[side] = []
+            for level in message[book_side]:
+                set_level(simulator, side, float(level[0]), float(level[1]))
+
+
+def replay(
+    simulator: ExecutionSimulator,
+    messages: Iterable[TimedMessage],
+    on_trade: Callable[[ExecutionSimulator, float, Message], Any] = lambda *arguments: None
+) -> None:
+    ''' Applies every message, calling (on_trade) after every match so strategies can trade '''
+    for epoch, message in messages:
+        add_market_data(simulator, epoch, message)
+        if message['type'] == 'match':
+            on_trade(simulator, epoch, message)
+
+
+def set_level(simulator: ExecutionSimulator, side: str, price: float, size: float) -> None:
+    simulator.has_book = True
+    sizes = simulator.book.sizes[side]
+    prices = simulator.book.prices[side]
+    if size == 0.0:
+        if price in sizes:
+            del sizes[price]
+            del prices[bisect.bisect_left(prices, price)]
+    else:
+        if price not in sizes:
+            bisect.insort(prices, price)
+        sizes[price] = size
+    # Cancels ahead of a resting order move it forward in the queue
+    for order in simulator.resting_orders[side].get(price, []):
+        order.queue_ahead = min(order.queue_ahead, size)
+
+
+def opposite(side: str) -> str:
+    return 'sell' if side == 'buy' else 'buy'
+
+
+def crosses(side: str, price: float, limit: float) -> bool:
+    return price <= limit if side == 'buy' else price >= limit
+
+
+def book_levels(simulator: ExecutionSimulator, side: str) -> Iterable[Tuple[float, float]]:
+    ''' Yields the (price, size) of the levels a (side) order takes, best first '''
+    if simulator.has_book:
+        book_side = opposite(side)
+        prices = simulator.book.prices[book_side]
+        sizes = simulator.book.sizes[book_side]
+        for price in (list(prices) if side == 'buy' else reversed(list(prices))):
+            yield price, sizes[price]
+    elif simulator.last_price is not None:
+        direction = 1.0 if side == 'buy' else -1.0
+        for level in range(simulator.levels):
+            offset = simulator.half_spread + level * simulator.level_spacing
+            yield simulator.last_price + direction * offset, simulator.level_size
+
+
+def take(simulator: ExecutionSimulator, order: Order) -> None:
+    ''' Fills (order) against the book up to its price '''
+    limit = order.price if order.price is not None else (
+        math.inf if order.side == 'buy' else -math.inf
+    )
+    taken = []
+    for price, size in book_levels(simulator, order.side):
+        if order.remaining <= 0.0 or not crosses(order.side, price, limit):
+            break
+        quantity = min(size, order.remaining)
+        taken.append((price, size - quantity))
+        fill(simulator, order, quantity, price, 'taker')
+    if simulator.has_book:
+        for price, remaining in taken:
+            set_level(simulator, opposite(order.side), price, remaining)
+
+
+def queue_ahead(simulator: ExecutionSimulator, side: str, price: float) -> float:
+    if simulator.has_book:
+        return simulator.book.sizes[side].get(price, 0.0)
+    if simulator.last_price is None:
+        return 0.0
+    best = simulator.last_price - simulator.half_spread if side == 'buy' else (
+        simulator.last_price + simulator.half_spread
+    )
+    # Orders inside the assumed spread are first in line
+    return simulator.level_size if crosses(side, price, best) else 0.0
+
+
+def arrive(simulator: ExecutionSimulator, order: Order) -> None:
+    if order.status != 'pending':
+        # Cancelled before it reached the exchange
+        return
+    take(simulator, order)
+    if order.price is None or order.remaining <= 0.0:
+        finish(simulator, order)
+        return
+    order.status = 'open'
+    order.queue_ahead = queue_ahead(simulator, order.side, order.price)
+    resting = simulator.resting_orders[order.side]
+    if order.price not in resting:
+        resting[order.price] = []
+        bisect.insort(simulator.resting_prices[order.side], order.price)
+    resting[order.price].append(order)
+
+
+def remove_resting(simulator: ExecutionSimulator, order: Order) -> None:
+    price = order.price
+    if price is None:
+        # Market orders never rest
+        return
+    resting = simulator.resting_orders[order.side]
+    orders = resting[price]
+    orders.remove(order)
+    if len(orders) == 0:
+        del resting[price]
+        prices = simulator.resting_prices[order.side]
+        del prices[bisect.bisect_left(prices, price)]
+
+
+def finish(simulator: ExecutionSimulator, order: Order) -> None:
+    order.status = 'done'
+    del simulator.orders[order.id]
+
+
+def cancel_arrived(simulator: ExecutionSimulator, order_id: int) -> None:
+    order = simulator.orders.get(order_id)
+    if order is None:
+        return
+    if order.status == 'open':
+        remove_resting(simulator, order)
+    finish(simulator, order)
+
+
+def trade(simulator: ExecutionSimulator, price: float, size: float, maker_side: str) -> None:
+    ''' Fills the resting orders of (maker_side) a trade of (size) at (price) reached '''
+    simulator.last_price = price
+    prices = simulator.resting_prices[maker_side]
+    if len(prices) == 0:
+        return
+    if maker_side == 'buy':
+        # Bids at or above the price, best first
+        reached = list(reversed(prices[bisect.bisect_left(prices, price):]))
+    else:
+        reached = prices[:bisect.bisect_right(prices, price)]
+    for level in reached:
+        for order in list(simulator.resting_orders[maker_side][level]):
+            if level != price:
+                # The trade went through the order's price, so it was taken first
+                quantity = order.remaining
+            else:
+                consumed = min(order.queue_ahead, size)
+                order.queue_ahead -= consumed
+                size -= consumed
+                quantity = min(size, order.remaining)
+                size -= quantity
+            if quantity > 0.0:
+                fill(simulator, order, quantity, level, 'maker')
+            if order.remaining <= 0.0:
+                remove_resting(simulator, order)
+                finish(simulator, order)
+
+
+def fill(
+    simulator: ExecutionSimulator,
+    order: Order,
+    quantity: float,
+    price: float,
+    liquidity: str
+) -> None:
+    volume = trailing_volume(simulator.volume, simulator.now)
+    if liquidity == 'maker':
+        fee = transaction.calculate_maker_fee(quantity, price, volume)
+    else:
+        fee = transaction.calculate_taker_fee(quantity, price, volume)
+    add_volume(simulator.volume, simulator.now, quantity * price)
+    order.remaining -= quantity
+    schedule(simulator, simulator.now + simulator.report, REPORT, Fill(
+        order_id=order.id,
+        strategy=order.strategy,
+        side=order.side,
+        quantity=quantity,
+        price=price,
+        fee=fee,
+        liquidity=liquidity,
+        epoch=simulator.now
+    ))
+
+
+def open_orders(simulator: ExecutionSimulator, strategy: str) -> List[Order]:
+    return [
+        order for order in simulator.orders.values()
+        if order.strategy == strategy
+    ]
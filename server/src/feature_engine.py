@@ -0,0 +1,380 @@
+'''
+Incremental feature engine shared by every trading strategy.
+
+Features are registered as nodes with the names of the features they depend on.
+An engine is constructed for each product with the features the enabled
+strategies ask for (plus their dependencies), orders the nodes so dependencies
+are always computed first, and updates every node once per tick in O(1).
+Strategies read the resulting Features instead of recomputing aggregates from
+their own trading record, so adding a feature or a strategy never adds
+per-strategy recomputation.
+
+Every tick starts with the input features exchange_rate, epoch and size (the
+size of the matched trade).  Features that need more samples than have been seen
+return the same defaults as the sliding_window functions they replace.
+'''
+import math
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from pyrsistent import PRecord, field, pvector_field
+from sliding_window import SlidingWindowSample
+
+Features = Dict[str, float]
+INPUTS = ('exchange_rate', 'epoch', 'size')
+
+
+class Feature(ABC):
+    ''' A node of the feature graph
+
+    update is called once per tick with the features computed so far, which
+    always include the node's dependencies, and returns the node's value.
+    '''
+    @abstractmethod
+    def update(self, features: Features) -> float:
+        pass
+
+
+class FeatureDefinition(PRecord):
+    dependencies = pvector_field(str)
+    # Returns a new Feature node, called once per engine
+    construct: Callable[[], Feature] = field(mandatory=True)
+
+
+DEFINITIONS: Dict[str, FeatureDefinition] = {}
+
+
+def register(
+    name: str,
+    construct: Callable[[], Feature],
+    dependencies: Iterable[str] = ()
+) -> None:
+    DEFINITIONS[name] = FeatureDefinition(
+        dependencies=list(dependencies),
+        construct=construct
+    )
+
+
+class RollingSum:
+    ''' Sum of the last (n) values
+
+    The sum is recomputed from the window every (n) additions so floating point
+    error from adding and subtracting can't accumulate; that stays O(1)
+    amortized.
+    '''
+    def __init__(self, n: int):
+        self.n = n
+        self.values: Deque[float] = deque(maxlen=n)
+        self.sum = 0.0
+        self.additions = 0
+
+    def add(self, value: float) -> float:
+        if len(self.values) == self.n:
+            self.sum -= self.values[0]
+        self.values.append(value)
+        self.additions += 1
+        if self.additions % self.n == 0:
+            self.sum = math.fsum(self.values)
+        else:
+            self.sum += value
+        return self.sum
+
+
+class MovingAverage(Feature):
+    ''' sliding_window.average(n) '''
+    def __init__(self, n: int, source: str = 'exchange_rate'):
+        self.source = source
+        self.window = RollingSum(n)
+
+    def update(self, features: Features) -> float:
+        total = self.window.add(features[self.source])
+        return total / len(self.window.values)
+
+
+class RateOfChange(Feature):
+    ''' sliding_window.derivative(n), the least squares slope of the last (n) samples
+
+    Running sums of raw epochs and exchange rates lose all precision, so sums
+    are kept relative to an origin sample.  The origin is moved to the oldest
+    sample and the sums recomputed every (n) ticks, which keeps the relative
+    values small and the update O(1) amortized.
+    '''
+    def __init__(self, n: int):
+        self.n = n
+        self.samples: Deque[Tuple[float, float]] = deque(maxlen=n)
+        self.origin = (0.0, 0.0)
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.sum_xx = 0.0
+        self.sum_xy = 0.0
+        self.ticks = 0
+
+    def add(self, sample: Tuple[float, float], sign: float) -> None:
+        x = sample[0] - self.origin[0]
+        y = sample[1] - self.origin[1]
+        self.sum_x += sign * x
+        self.sum_y += sign * y
+        self.sum_xx += sign * x * x
+        self.sum_xy += sign * x * y
+
+    def rebase(self) -> None:
+        self.origin = self.samples[0]
+        self.sum_x = self.sum_y = self.sum_xx = self.sum_xy = 0.0
+        for sample in self.samples:
+            self.add(sample, 1.0)
+
+    def update(self, features: Features) -> float:
+        sample = (features['epoch'], features['exchange_rate'])
+        if len(self.samples) == self.n:
+            self.add(self.samples[0], -1.0)
+        self.samples.append(sample)
+        self.ticks += 1
+        if self.ticks % self.n == 1 or self.n == 1:
+            self.rebase()
+        else:
+            self.add(sample, 1.0)
+
+        if self.n < 2 or len(self.samples) < self.n:
+            return 0.0
+        denominator = self.sum_xx - self.sum_x * self.sum_x / self.n
+        # Epochs that are all equal only cancel to rounding error
+        if denominator <= 1e-12 * self.sum_xx:
+            return 0.0
+        return (self.sum_xy - self.sum_x * self.sum_y / self.n) / denominator
+
+
+class RateOfChangeFiltered(Feature):
+    ''' exchange_rate_rate_of_change_filtered of sliding_window.filter_sample '''
+    def __init__(self, time_constant: float = 0.1):
+        self.time_constant = time_constant
+        self.samples = 0
+        self.previous_exchange_rate = 0.0
+        self.previous_epoch = 0.0
+        self.value = 0.0
+
+    def update(self, features: Features) -> float:
+        exchange_rate = features['exchange_rate']
+        epoch = features['epoch']
+        t = epoch - self.previous_epoch
+        if self.samples == 1:
+            self.value = (exchange_rate - self.previous_exchange_rate) / t if t > 0 else 0.0
+        elif self.samples > 1 and t > 0:
+            rate_of_change = (exchange_rate - self.previous_exchange_rate) / t
+            self.value += (rate_of_change - self.value) * min(1, t * self.time_constant)
+        self.samples += 1
+        self.previous_exchange_rate = exchange_rate
+        self.previous_epoch = epoch
+        return self.value
+
+
+class ExchangeRateFiltered(Feature):
+    ''' exchange_rate_filtered of sliding_window.filter_sample '''
+    def __init__(self, time_constant: float = 1.0, filter_order_ratio: float = 0.33):
+        self.time_constant = time_constant
+        self.filter_order_ratio = filter_order_ratio
+        self.samples = 0
+        self.previous_epoch = 0.0
+        self.previous_rate_of_change = 0.0
+        self.value = 0.0
+
+    def update(self, features: Features) -> float:
+        exchange_rate = features['exchange_rate']
+        epoch = features['epoch']
+        if self.samples < 2:
+            self.value = exchange_rate
+        else:
+            t = epoch - self.previous_epoch
+            self.value = (
+                self.value +
+                self.filter_order_ratio * (exchange_rate - self.value) *
+                min(1, t * self.time_constant) +
+                (1 - self.filter_order_ratio) * self.previous_rate_of_change * t
+            )
+        self.samples += 1
+        self.previous_epoch = epoch
+        self.previous_rate_of_change = features['rate_of_change_filtered']
+        return self.value
+
+
+class ExponentialMovingAverage(Feature):
+    def __init__(self, span: int, source: str = 'exchange_rate'):
+        self.source = source
+        self.alpha = 2.0 / (span + 1)
+        self.value: Optional[float] = None
+
+    def update(self, features: Features) -> float:
+        value = features[self.source]
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class Change(Feature):
+    ''' Difference between the current and previous exchange rate '''
+    def __init__(self, logarithmic: bool = False):
+        self.logarithmic = logarithmic
+        self.previous: Optional[float] = None
+
+    def update(self, features: Features) -> float:
+        exchange_rate = features['exchange_rate']
+        previous, self.previous = self.previous, exchange_rate
+        if previous is None:
+            return 0.0
+        if self.logarithmic:
+            return math.log(exchange_rate / previous)
+        return exchange_rate - previous
+
+
+class RelativeStrengthIndex(Feature):
+    ''' Wilder's relative strength index, 50 until (n) price changes are seen '''
+    def __init__(self, n: int):
+        self.n = n
+        self.changes = 0
+        self.average_gain = 0.0
+        self.average_loss = 0.0
+
+    def update(self, features: Features) -> float:
+        change = features['price_change']
+        gain = max(change, 0.0)
+        loss = max(-change, 0.0)
+        self.changes += 1
+        if self.changes <= self.n:
+            # Seed the averages with the simple average of the first n changes
+            self.average_gain += (gain - self.average_gain) / self.changes
+            self.average_loss += (loss - self.average_loss) / self.changes
+            if self.changes < self.n:
+                return 50.0
+        else:
+            self.average_gain += (gain - self.average_gain) / self.n
+            self.average_loss += (loss - self.average_loss) / self.n
+
+        if self.average_loss == 0.0:
+            return 100.0 if self.average_gain > 0.0 else 50.0
+        return 100.0 - 100.0 / (1.0 + self.average_gain / self.average_loss)
+
+
+class VolumeWeightedAveragePrice(Feature):
+    ''' Volume weighted average price of the last (n) trades '''
+    def __init__(self, n: int):
+        self.notional = RollingSum(n)
+        self.volume = RollingSum(n)
+
+    def update(self, features: Features) -> float:
+        notional = self.notional.add(features['exchange_rate'] * features['size'])
+        volume = self.volume.add(features['size'])
+        if volume <= 0.0:
+            return features['exchange_rate']
+        return notional / volume
+
+
+class RealizedVolatility(Feature):
+    ''' Square root of the sum of the last (n) squared log returns '''
+    def __init__(self, n: int):
+        self.window = RollingSum(n)
+
+    def update(self, features: Features) -> float:
+        log_return = features['log_return']
+        return math.sqrt(max(self.window.add(log_return * log_return), 0.0))
+
+
+register('moving_average_10', lambda: MovingAverage(10))
+register('moving_average_100', lambda: MovingAverage(100))
+# sliding_window.next_moving_average(n) averages the previous n samples with
+# the new one
+register('window_moving_average_10', lambda: MovingAverage(11))
+register('window_moving_average_100', lambda: MovingAverage(101))
+register('rate_of_change_100', lambda: RateOfChange(100))
+register('rate_of_change_filtered', RateOfChangeFiltered)
+register('exchange_rate_filtered', ExchangeRateFiltered, ['rate_of_change_filtered'])
+register('ema_12', lambda: ExponentialMovingAverage(12))
+register('ema_26', lambda: ExponentialMovingAverage(26))
+register('price_change', Change)
+register('log_return', lambda: Change(logarithmic=True))
+register('rsi_14', lambda: RelativeStrengthIndex(14), ['price_change'])
+register('vwap_100', lambda: VolumeWeightedAveragePrice(100))
+register('realized_volatility_100', lambda: RealizedVolatility(100), ['log_return'])
+
+
+# Features that give a sliding window sample the fields sliding_window.add
+# computes for it
+WINDOW_FEATURES = {
+    'exchange_rate_filtered': 'exchange_rate_filtered',
+    'exchange_rate_rate_of_change_filtered': 'rate_of_change_filtered',
+    'exchange_rate_moving_average_10': 'window_moving_average_10',
+    'exchange_rate_moving_average_100': 'window_moving_average_100',
+}
+
+
+def resolve(
+    features: Iterable[str],
+    definitions: Dict[str, FeatureDefinition]
+) -> List[str]:
+    ''' Returns (features) and all of their dependencies, dependencies first '''
+    order: List[str] = []
+    visiting: List[str] = []
+
+    def visit(name: str) -> None:
+        if name in INPUTS or name in order:
+            return
+        if name in visiting:
+            cycle = ' -> '.join(visiting[visiting.index(name):] + [name])
+            raise ValueError(f'feature dependency cycle: {cycle}')
+        if name not in definitions:
+            raise ValueError(f'unknown feature: {name}')
+        visiting.append(name)
+        for dependency in definitions[name].dependencies:
+            visit(dependency)
+        visiting.pop()
+        order.append(name)
+
+    for name in features:
+        visit(name)
+    return order
+
+
+class FeatureEngine:
+    def __init__(
+        self,
+        features: Iterable[str],
+        definitions: Dict[str, FeatureDefinition]
+    ):
+        self.nodes = [
+            (name, definitions[name].construct())
+            for name in resolve(features, definitions)
+        ]
+        self.features: Features = {}
+
+
+def construct(
+    features: Iterable[str],
+    definitions: Dict[str, FeatureDefinition] = DEFINITIONS
+) -> FeatureEngine:
+    return FeatureEngine(features, definitions)
+
+
+def update(
+    price_info: Tuple[float, float],
+    engine: FeatureEngine,
+    size: float = 0.0
+) -> Features:
+    ''' Adds a tick and returns the features of every node '''
+    exchange_rate, epoch = price_info
+    features = {'exchange_rate': exchange_rate, 'epoch': epoch, 'size': size}
+    for name, node in engine.nodes:
+        features[name] = node.update(features)
+    engine.features = features
+    return features
+
+
+def window_sample(features: Features) -> SlidingWindowSample:
+    ''' The sample sliding_window.add would add for the tick of (features),
+    from an engine constructed with WINDOW_FEATURES
+    '''
+    return SlidingWindowSample(
+        exchange_rate=features['exchange_rate'],
+        epoch=features['epoch'],
+        **{field: features[feature] for field, feature in WINDOW_FEATURES.items()}
+    )
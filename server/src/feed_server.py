@@ -0,0 +1,464 @@
+'''
+Local stand-in for the Coinbase websocket feed.
+
+Speaks the subset of the feed protocol the trading client uses: a client
+connects, sends a `subscribe` message with its product ids and channels, gets a
+`subscriptions` reply, and then receives the `match` (matches and full
+channels), `ticker` and `l2update` (level2 channel) messages of its products.
+Ticker messages are derived from matches, and every message keeps the sequence
+number of the stream it's replayed from.
+
+Streams are recorded newline delimited JSON (see write_recording) or synthetic
+streams from market_data_generator, replayed to every connection at 1x, Nx or
+as fast as possible (math.inf).  The websocket protocol (RFC 6455) is
+implemented with the standard library, so the server runs wherever the trading
+client does.
+
+Run from the server directory and point the client's feed_url at it:
+    python src/feed_server.py --port 9000 --speed 10 --recording matches.jsonl
+    python src/feed_server.py --port 9000 --rate 5000
+'''
+import argparse
+import base64
+import hashlib
+import json
+import math
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+import market_data_generator
+import numpy as np
+from logger import logger
+from market_data_generator import MarketModel, Message, OnMessage, TimedMessage
+from pyrsistent import PRecord, field, pset, pset_field
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+CONTINUATION, TEXT, BINARY, CLOSE, PING, PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+# Channels that carry each message type
+CHANNELS = {
+    'match': {'matches', 'full'},
+    'ticker': {'ticker'},
+    'l2update': {'level2'},
+}
+
+MessageFactory = Callable[[], Iterable[TimedMessage]]
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class Subscription(PRecord):
+    product_ids = pset_field(str)
+    channels = pset_field(str)
+
+
+class LatencyStatistics(PRecord):
+    messages = field(type=int, initial=0)
+    seconds = field(type=float, initial=0.0)
+    # Messages decided on per second
+    rate = field(type=float, initial=0.0)
+    # Seconds from a message being written to the socket until on_message returned
+    median_latency = field(type=float, initial=0.0)
+    p99_latency = field(type=float, initial=0.0)
+    maximum_latency = field(type=float, initial=0.0)
+
+
+def accept_key(key: str) -> str:
+    digest = hashlib.sha1((key + GUID).encode('ascii')).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def encode_frame(payload: bytes, opcode: int = TEXT) -> bytes:
+    ''' Server frames are final and unmasked '''
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def read_exactly(reader: BinaryIO, count: int) -> bytes:
+    data = reader.read(count)
+    if data is None or len(data) < count:
+        raise ConnectionClosed()
+    return data
+
+
+def read_frame(reader: BinaryIO) -> Tuple[int, bool, bytes]:
+    ''' Returns the opcode, final flag and unmasked payload of the next frame '''
+    first, second = read_exactly(reader, 2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack('!H', read_exactly(reader, 2))
+    elif length == 127:
+        length, = struct.unpack('!Q', read_exactly(reader, 8))
+    mask = read_exactly(reader, 4) if second & 0x80 else b''
+    data = read_exactly(reader, length)
+    if mask:
+        data = (
+            np.frombuffer(data, dtype=np.uint8) ^
+            np.resize(np.frombuffer(mask, dtype=np.uint8), length)
+        ).tobytes()
+    return first & 0x0F, bool(first & 0x80), data
+
+
+class MessageReader:
+    ''' Joins fragmented messages.  Control frames can arrive between the
+    fragments of a message, so they're returned as soon as they're read and the
+    fragments are kept for the next read.
+    '''
+    def __init__(self, reader: BinaryIO):
+        self.reader = reader
+        self.opcode = TEXT
+        self.fragments: List[bytes] = []
+
+    def read(self) -> Tuple[int, bytes]:
+        while True:
+            opcode, final, data = read_frame(self.reader)
+            if opcode >= CLOSE:
+                return opcode, data
+            if opcode != CONTINUATION:
+                self.opcode = opcode
+            self.fragments.append(data)
+            if final:
+                payload = b''.join(self.fragments)
+                self.fragments = []
+                return self.opcode, payload
+
+
+def handshake(reader: BinaryIO, connection: socket.socket) -> None:
+    ''' Upgrades an HTTP request to a websocket connection '''
+    request_line = reader.readline()
+    headers: Dict[str, str] = {}
+    while True:
+        line = reader.readline()
+        if line in (b'', b'\r\n', b'\n'):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if not request_line.startswith(b'GET') or 'sec-websocket-key' not in headers:
+        connection.sendall(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+        raise ConnectionClosed()
+    connection.sendall((
+        'HTTP/1.1 101 Switching Protocols\r\n'
+        'Upgrade: websocket\r\n'
+        'Connection: Upgrade\r\n'
+        f'Sec-WebSocket-Accept: {accept_key(headers["sec-websocket-key"])}\r\n'
+        '\r\n'
+    ).encode('ascii'))
+
+
+def parse_subscription(message: Message) -> Subscription:
+    ''' Channels are names, or objects with their own product ids like Coinbase allows '''
+    product_ids = set(message.get('product_ids', []))
+    channels = set()
+    for channel in message.get('channels', ['full']):
+        if isinstance(channel, dict):
+            channels.add(channel['name'])
+            product_ids.update(channel.get('product_ids', []))
+        else:
+            channels.add(channel)
+    return Subscription(product_ids=pset(product_ids), channels=pset(channels))
+
+
+def subscriptions_message(subscription: Subscription) -> Message:
+    return {
+        'type': 'subscriptions',
+        'channels': [
+            {'name': channel, 'product_ids': sorted(subscription.product_ids)}
+            for channel in sorted(subscription.channels)
+        ],
+    }
+
+
+def ticker_message(match: Message) -> Message:
+    return {
+        'type': 'ticker',
+        'sequence': match['sequence'],
+        'product_id': match['product_id'],
+        'price': match['price'],
+        # Matches have the maker's side, tickers the taker's
+        'side': 'buy' if match['side'] == 'sell' else 'sell',
+        'time': match['time'],
+        'trade_id': match['trade_id'],
+        'last_size': match['size'],
+    }
+
+
+def select(message: Message, subscription: Subscription) -> List[Message]:
+    ''' Messages a subscription receives for a message of the stream '''
+    if message.get('product_id') not in subscription.product_ids:
+        return []
+    selected = []
+    if not CHANNELS.get(message['type'], set()).isdisjoint(subscription.channels):
+        selected.append(message)
+    if message['type'] == 'match' and 'ticker' in subscription.channels:
+        selected.append(ticker_message(message))
+    return selected
+
+
+def write_recording(messages: Iterable[Message], path: str) -> None:
+    with open(path, 'w') as writer:
+        for message in messages:
+            writer.write(json.dumps(message))
+            writer.write('\n')
+
+
+def read_recording(path: str) -> Iterator[TimedMessage]:
+    with open(path) as reader:
+        yield from market_data_generator.timed(
+            json.loads(line) for line in reader if line.strip() != ''
+        )
+
+
+class FeedServer:
+    def __init__(
+        self,
+        messages: MessageFactory,
+        speed: float = 1.0,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        on_sent: Callable[[Message, float], Any] = lambda message, sent: None
+    ):
+        ''' Replays (messages()) to every connection at (speed) times their pace.
+        (on_sent) is called with every message and the perf_counter it's written at.
+        '''
+        self.messages = messages
+        self.speed = speed
+        self.on_sent = on_sent
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(8)
+        self.server.settimeout(0.1)
+        self.stopped = threading.Event()
+        self.connections: List[socket.socket] = []
+        self.thread = threading.Thread(target=self.accept, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.getsockname()[:2]
+        return f'ws://{host}:{port}'
+
+    def start(self) -> 'FeedServer':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+        self.server.close()
+
+    def accept(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                connection, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            connection.settimeout(None)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connections.append(connection)
+            threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    def serve(self, connection: socket.socket) -> None:
+        reader = connection.makefile('rb')
+        lock = threading.Lock()
+        closed = threading.Event()
+
+        def send(payload: bytes, opcode: int = TEXT) -> None:
+            if closed.is_set() or self.stopped.is_set():
+                raise ConnectionClosed()
+            with lock:
+                connection.sendall(encode_frame(payload, opcode))
+
+        try:
+            handshake(reader, connection)
+            messages = MessageReader(reader)
+            opcode, payload = messages.read()
+            request = json.loads(payload) if opcode == TEXT else {}
+            if request.get('type') != 'subscribe':
+                send(json.dumps({
+                    'type': 'error',
+                    'message': 'Failed to subscribe',
+                    'reason': 'Type has to be subscribe',
+                }).encode('utf-8'))
+                return
+            subscription = parse_subscription(request)
+            send(json.dumps(subscriptions_message(subscription)).encode('utf-8'))
+            threading.Thread(
+                target=self.listen,
+                args=(messages, send, closed),
+                daemon=True
+            ).start()
+
+            def publish(message: Message) -> None:
+                for selected in select(message, subscription):
+                    payload = json.dumps(selected).encode('utf-8')
+                    # Called before writing, so the client can't decide on it first
+                    self.on_sent(selected, time.perf_counter())
+                    send(payload)
+            market_data_generator.feed(publish, self.messages(), speed=self.speed)
+            # Like the exchange, the connection stays open when the stream ends
+            while not closed.wait(0.1):
+                if self.stopped.is_set():
+                    break
+        except (ConnectionClosed, OSError, ValueError):
+            pass
+        finally:
+            closed.set()
+            try:
+                with lock:
+                    connection.sendall(encode_frame(struct.pack('!H', 1000), CLOSE))
+            except OSError:
+                pass
+
+    def listen(
+        self,
+        messages: MessageReader,
+        send: Callable[[bytes, int], None],
+        closed: threading.Event
+    ) -> None:
+        ''' Answers the client's keepalive pings until it closes the connection '''
+        try:
+            while not closed.is_set():
+                opcode, payload = messages.read()
+                if opcode == PING:
+                    send(payload, PONG)
+                elif opcode == CLOSE:
+                    break
+        except (ConnectionClosed, OSError):
+            pass
+        closed.set()
+
+
+def consume(
+    url: str,
+    on_message: OnMessage,
+    product_ids: Sequence[str],
+    channels: Sequence[str],
+    count: int
+) -> None:
+    ''' Subscribes like cbpro.WebsocketClient and calls (on_message) with (count) messages '''
+    # websocket-client is installed with cbpro
+    from websocket import create_connection
+    connection = create_connection(url)
+    try:
+        connection.send(json.dumps({
+            'type': 'subscribe',
+            'product_ids': list(product_ids),
+            'channels': list(channels),
+        }))
+        subscriptions = json.loads(connection.recv())
+        if subscriptions['type'] != 'subscriptions':
+            raise ValueError(subscriptions)
+        for _ in range(count):
+            on_message(json.loads(connection.recv()))
+    finally:
+        connection.close()
+
+
+def measure_latency(
+    on_message: OnMessage,
+    messages: MessageFactory,
+    count: int,
+    speed: float = math.inf,
+    product_ids: Sequence[str] = ('BTC-USD',),
+    channels: Sequence[str] = ('matches',)
+) -> LatencyStatistics:
+    ''' Replays (count) messages through a local feed into (on_message) and measures
+    the latency from the server writing each message until (on_message) returned.
+    '''
+    sent: Dict[Tuple[str, int], float] = {}
+    latencies = np.zeros(count)
+    received = [0]
+
+    def on_sent(message: Message, sent_at: float) -> None:
+        sent[(message['type'], message['sequence'])] = sent_at
+
+    def decide(message: Message) -> None:
+        on_message(message)
+        decided = time.perf_counter()
+        sent_at = sent.pop((message['type'], message['sequence']), decided)
+        latencies[received[0]] = decided - sent_at
+        received[0] += 1
+
+    server = FeedServer(messages, speed, on_sent=on_sent).start()
+    try:
+        started = time.perf_counter()
+        consume(server.url, decide, product_ids, channels, count)
+        elapsed = time.perf_counter() - started
+    finally:
+        server.stop()
+    return LatencyStatistics(
+        messages=count,
+        seconds=elapsed,
+        rate=count / elapsed,
+        median_latency=float(np.median(latencies)),
+        p99_latency=float(np.percentile(latencies, 99)),
+        maximum_latency=float(np.max(latencies))
+    )
+
+
+def construct_message_factory(options: argparse.Namespace) -> MessageFactory:
+    if options.recording is not None:
+        return lambda: read_recording(options.recording)
+    model = MarketModel(rate=options.rate, level2_ratio=options.level2_ratio)
+    return lambda: market_data_generator.generate(model)
+
+
+def main(arguments: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Serves a local Coinbase websocket feed')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed, inf replays as fast as possible')
+    parser.add_argument('--recording', help='newline delimited JSON messages to replay')
+    parser.add_argument('--rate', type=float, default=1000.0,
+                        help='trades per second of the synthetic stream')
+    parser.add_argument('--level2-ratio', type=float, default=0.5)
+    parser.add_argument('--latency', type=int, metavar='COUNT',
+                        help='measures the latency of COUNT messages into a trading client')
+    parser.add_argument('--strategy', default='algorithmic')
+    options = parser.parse_args(arguments)
+    messages = construct_message_factory(options)
+
+    if options.latency is not None:
+        client = market_data_generator.construct_client(options.strategy)
+        statistics = measure_latency(
+            market_data_generator.silenced(client.on_message),
+            messages,
+            options.latency,
+            options.speed
+        )
+        print(f'{statistics.rate:.0f} messages/s, latency median '
+              f'{statistics.median_latency * 1e6:.0f} us, p99 '
+              f'{statistics.p99_latency * 1e6:.0f} us, max '
+              f'{statistics.maximum_latency * 1e6:.0f} us')
+        return 0
+
+    server = FeedServer(messages, options.speed, options.host, options.port).start()
+    logger.log(f'serving a {options.speed}x feed on {server.url}')
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,12 +1,44 @@
-import tensorflow as tf
+from typing import List, Tuple
+
+import numpy as np
+
+
+def valid_inference_backends(backend: str) -> Tuple[bool, str]:
+    return backend in ('tensorflow', 'numpy'), 'inference backend must be tensorflow or numpy'
+
+
+def valid_precisions(precision: str) -> Tuple[bool, str]:
+    return precision in ('float32', 'float64'), 'network precision must be float32 or float64'
 
 
 # TODO: refactor to use tensorflow estimator API instead
 class FullyConnectedNeuralNetwork:
-    def __init__(self, session, input_size, output_size, batch_size):
+    def __init__(
+        self,
+        session,
+        input_size,
+        output_size,
+        batch_size,
+        inference_backend='numpy',
+        precision='float64'
+    ):
+        # Imported here so that only deployments that construct a network pay
+        # for loading tensorflow
+        import tensorflow as tf
+
         self.input_size = input_size
         self.output_size = output_size
         self.batch_size = batch_size
+        # 'numpy' evaluates predictions with a copy of the dense layer weights
+        # instead of a session.run, which is dominated by tensorflow's dispatch
+        # overhead for a network this small.  Training always uses tensorflow.
+        self.inference_backend = inference_backend
+        self.numpy_weights: List[np.ndarray] = []
+        # Inputs, outputs, weights and the optimizer's moments are all kept in
+        # (precision).  float32 halves their memory and doubles the values a
+        # SIMD instruction operates on.
+        self.precision = precision
+        self.dtype = np.dtype(precision)
 
         self.input = None
         self.output = None
@@ -16,21 +48,79 @@ class FullyConnectedNeuralNetwork:
         self.optimizer = None
         self.variable_initializer = None
 
-        self.input = tf.placeholder(shape=[None, self.input_size], dtype=tf.float64)
-        self.output = tf.placeholder(shape=[None, self.output_size], dtype=tf.float64)
+        self.input = tf.placeholder(shape=[None, self.input_size], dtype=getattr(tf, precision))
+        self.output = tf.placeholder(shape=[None, self.output_size], dtype=getattr(tf, precision))
 
-        layer_one = tf.layers.dense(self.input, 50, activation=tf.nn.relu)
-        layer_two = tf.layers.dense(layer_one, 50, activation=tf.nn.relu)
+        self.layers = [
+            tf.layers.Dense(50, activation=tf.nn.relu),
+            tf.layers.Dense(50, activation=tf.nn.relu),
+            tf.layers.Dense(self.output_size),
+        ]
+        layer_output = self.input
+        for layer in self.layers:
+            layer_output = layer(layer_output)
 
-        self.output_operation = tf.layers.dense(layer_two, self.output_size)
+        self.output_operation = layer_output
         loss = tf.losses.mean_squared_error(self.output, self.output_operation)
         self.optimizer = tf.train.AdamOptimizer().minimize(loss)
 
         variable_initializer = tf.global_variables_initializer()
         session.run(variable_initializer)
+        sync_numpy_weights(session, self)
+
+
+def get_variables(neural_network):
+    ''' Returns the dense layer variables ordered [kernel, bias, kernel, bias, ...] '''
+    variables = []
+    for layer in neural_network.layers:
+        variables.extend([layer.kernel, layer.bias])
+    return variables
+
+
+def get_weights(session, neural_network) -> List[np.ndarray]:
+    return session.run(get_variables(neural_network))
+
+
+def set_weights(session, neural_network, weights: List[np.ndarray]) -> None:
+    ''' Loads weights exported by get_weights
+
+    Optimizer state (Adam moments) is not restored and restarts from zero.
+    '''
+    for variable, value in zip(get_variables(neural_network), weights):
+        variable.load(value, session)
+    sync_numpy_weights(session, neural_network)
+
+
+def sync_numpy_weights(session, neural_network) -> None:
+    ''' Copies the current tensorflow weights for the numpy inference backend
+
+    The weights list is replaced rather than mutated, so a prediction running
+    concurrently always sees a consistent set of layers.
+    '''
+    if neural_network.inference_backend == 'numpy':
+        neural_network.numpy_weights = get_weights(session, neural_network)
+
+
+def forward(weights: List[np.ndarray], input: np.ndarray) -> np.ndarray:
+    ''' Evaluates the network with numpy on a single input vector or a batch of inputs
+
+    (weights) are ordered [kernel, bias, kernel, bias, ...] as returned by
+    get_weights.  Every layer but the last uses a relu activation.
+    '''
+    output = input
+    last_layer = len(weights) - 2
+    for index in range(0, len(weights), 2):
+        output = np.dot(output, weights[index])
+        output += weights[index + 1]
+        if index != last_layer:
+            np.maximum(output, 0.0, out=output)
+    return output
 
 
 def predict_one(session, neural_network, input):
+    if neural_network.inference_backend == 'numpy':
+        # Evaluating a single vector avoids numpy's matrix-matrix overhead
+        return forward(neural_network.numpy_weights, input.ravel())[np.newaxis]
     feed_dict = {
         neural_network.input: input.reshape(1, neural_network.input_size)
     }
@@ -38,6 +128,8 @@ def predict_one(session, neural_network, input):
 
 
 def predict_batch(session, neural_network, input):
+    if neural_network.inference_backend == 'numpy':
+        return forward(neural_network.numpy_weights, input)
     feed_dict = {
         neural_network.input: input
     }
@@ -50,6 +142,7 @@ def train_batch(session, neural_network, x_batch, y_batch):
         neural_network.output: y_batch
     }
     session.run(neural_network.optimizer, feed_dict=feed_dict)
+    sync_numpy_weights(session, neural_network)
     # Because this server is not using asynchronous event
     # loop, the server is unable to do anything else when
     # training occurs.
@@ -0,0 +1,81 @@
+'''
+Running normalization of neural network inputs.
+
+The network inputs mix exchange rates around 10^4 with rates of change around
+10^-3.  In float32 the small inputs' contributions are lost next to the large
+ones, so inputs are standardized with the running mean and standard deviation
+of every input seen so far before they are converted to the network's
+precision.  The statistics are kept in float64 with Welford's algorithm, which
+stays accurate over long sessions where a running sum of squares would not.
+
+Normalizers are immutable values with read-only arrays, and update returns a
+new one, so published snapshots of a model can share its normalizer.
+'''
+from typing import Union
+
+import numpy as np
+from invariants import cannot_be_negative
+from maybe import Maybe
+from pyrsistent import PRecord, field
+
+
+class InputNormalizer(PRecord):
+    count = field(type=int, invariant=cannot_be_negative, initial=0)
+    mean = field(type=np.ndarray, mandatory=True)
+    # Sum of squared differences from the mean
+    m2 = field(type=np.ndarray, mandatory=True)
+
+
+def read_only(array: np.ndarray) -> np.ndarray:
+    ''' A float64 copy of (array) that can't be written to '''
+    array = np.array(array, dtype=np.float64)
+    array.flags.writeable = False
+    return array
+
+
+def construct(
+    size: int,
+    count: int = 0,
+    mean: Maybe[np.ndarray] = None,
+    m2: Maybe[np.ndarray] = None
+) -> InputNormalizer:
+    ''' An empty normalizer of (size) inputs, or one with the given statistics '''
+    return InputNormalizer(
+        count=count,
+        mean=read_only(np.zeros(size) if mean is None else mean),
+        m2=read_only(np.zeros(size) if m2 is None else m2)
+    )
+
+
+def update(normalizer: InputNormalizer, input: np.ndarray) -> InputNormalizer:
+    ''' Returns (normalizer) with a single input vector added to the statistics '''
+    count = normalizer.count + 1
+    delta = input - normalizer.mean
+    mean = normalizer.mean + delta / count
+    return InputNormalizer(
+        count=count,
+        mean=read_only(mean),
+        m2=read_only(normalizer.m2 + delta * (input - mean))
+    )
+
+
+def standard_deviation(normalizer: InputNormalizer) -> np.ndarray:
+    ''' 1 for inputs that haven't varied yet, so they're only centered '''
+    if normalizer.count < 2:
+        return np.ones_like(normalizer.m2)
+    deviation = np.sqrt(normalizer.m2 / (normalizer.count - 1))
+    deviation[deviation == 0.0] = 1.0
+    return deviation
+
+
+def normalize(
+    normalizer: InputNormalizer,
+    inputs: np.ndarray,
+    dtype: Union[type, np.dtype] = np.float64
+) -> np.ndarray:
+    ''' Standardizes an input vector or a batch of input vectors in float64 and
+    converts the result to (dtype)
+    '''
+    standardized = (np.asarray(inputs, dtype=np.float64) - normalizer.mean) / \
+        standard_deviation(normalizer)
+    return standardized.astype(dtype, copy=False)
@@ -1,72 +1,91 @@
-import algorithmic_model
-import q_learning_model
-import tensorflow as tf
-import trading_record
+import checkpoint
+import fully_connected_neural_network
+import memory_accounting
+import redundant_feed
+import sampling_profiler
+import strategies
 import web_application
-from coinbase_websocket_client import (CoinbaseWebsocketClient,  # noqa: F401
-                                       TradingModelRegistry,
-                                       TradingRecordRegistry)
+from coinbase_websocket_client import CoinbaseWebsocketClient
 from logger import logger
+from shared_state import SharedStateWriter
 import signal
 import sys
 
 
 def close_hf_trader(sig, frame):
     logger.info('closing high-frequency trader')
-    coinbase_websocket_client.close()
+    if feed is not None:
+        redundant_feed.stop(feed)
+        redundant_feed.log_statistics(feed)
+    else:
+        coinbase_websocket_client.close()
+    checkpointer.checkpoint(final=True)
     sys.exit(0)
 
 
-trading_record_registry: TradingRecordRegistry = {}
+defaults = web_application.get_defaults('production')
+# Traced from the start so that reports attribute the registries' allocations
+memory_accounting.start_tracing(defaults.memory_tracing_frames)
+if defaults.serving_mode == 'multiprocess':
+    # Workers are forked before any threads or tensorflow sessions exist
+    shared_state_writer = SharedStateWriter(defaults.shared_state_path)
+    web_workers = web_application.start_workers(
+        defaults.shared_state_path,
+        defaults.workers,
+        defaults.host,
+        defaults.port
+    )
 
-q_learning_description = (
-    'Uses reinforcement learning to make trading decisions.  Neural network is used \n'
-    'predict future rewards for buying, selling, or holding assets.  Once a trading \n'
-    'decision is made, the real reward is calculated and used to train the neural \n'
-    'network.  Uses epsilon greedy algorithm to explore many different trading \n'
-    'strategies by initially making random predictions and then gradually using \n'
-    'the neural network more and more over time.'
+trading_record_registry = strategies.construct_trading_records(
+    defaults.strategies,
+    defaults.population_size
 )
-trading_record_registry['q-learning'] = trading_record.construct(
-    'Q Learning Trading Record',
-    q_learning_description,
-    100000.0
+trading_model_registry = strategies.construct_trading_models(
+    defaults.strategies,
+    defaults.inference_backend,
+    defaults.population_size,
+    defaults.network_precision,
+    defaults.normalize_inputs
 )
+logger.info(f'trading strategies: {", ".join(defaults.strategies)}')
 
-# TODO: Rename "Algorithmic" to something else
-algorithmic_description = (
-    'Uses an algorithmic approach that looks at moving average and rate of change to \n'
-    'make trading decisions.  Once an asset is purchased it is put into a queue of \n'
-    'pending sales.  Pending sales are sold when current exchange rate rises \n'
-    'or when current exchange rate drops to cut losses.'
-)
-trading_record_registry['algorithmic'] = trading_record.construct(
-    'Algorithmic Trading Record',
-    algorithmic_description,
-    100000.0
-)
+saved_checkpoint = checkpoint.load(defaults.checkpoint_path)
+time_delta = 0
+if saved_checkpoint is not None:
+    checkpoint.restore(saved_checkpoint, trading_record_registry, trading_model_registry)
+    if 'q-learning' in trading_model_registry and len(saved_checkpoint.network_weights) > 0:
+        fully_connected_neural_network.set_weights(
+            trading_model_registry['q-learning'].session,
+            trading_model_registry['q-learning'].neural_network,
+            saved_checkpoint.network_weights
+        )
+    time_delta = saved_checkpoint.time_delta
+    logger.info(f'restored checkpoint of tick {saved_checkpoint.tick} '
+                f'from {defaults.checkpoint_path}')
 
-random_description = (
-    'Makes trading decisions randomly.  Used as baseline to judge the \n'
-    'effectiveness of other trading strategies.'
-)
-trading_record_registry['random'] = trading_record.construct(
-    'Random Trading Record',
-    random_description,
-    100000.0
+coinbase_websocket_client = CoinbaseWebsocketClient(
+    trading_record_registry,
+    trading_model_registry,
+    time_delta,
+    defaults.feed_url,
+    defaults.api_url
 )
 
-session = tf.Session()
-trading_model_registry: TradingModelRegistry = {
-    'q-learning': q_learning_model.construct(session),
-    'algorithmic': algorithmic_model.construct(
-        selling_threshold=0.02,
-        cut_losses_threshold=-0.05
-    )
-}
+checkpointer = checkpoint.Checkpointer(
+    coinbase_websocket_client.registry_publisher,
+    defaults.checkpoint_path,
+    defaults.checkpoint_interval
+)
+checkpointer.start()
 
-coinbase_websocket_client = CoinbaseWebsocketClient(trading_record_registry, trading_model_registry)
+memory_monitor = memory_accounting.MemoryMonitor(
+    coinbase_websocket_client.registry_publisher,
+    defaults.memory_report_interval
+)
+memory_monitor.start()
 
+# Assigned once the feed starts, after ctrl-c can already close the trader
+feed = None
 if hasattr(signal, 'SIGINT'):
     logger.log('listening for ctrl-c on signal.SIGINT')
     signal.signal(signal.SIGINT, close_hf_trader)
@@ -76,9 +95,34 @@ elif hasattr(signal, 'SIGBREAK'):
 else:
     logger.error('unable to set up ctrl-c listeners')
 
-
-coinbase_websocket_client.start()
+if defaults.feed_connections > 1:
+    # Redundant connections replace the client's own, which is never opened
+    coinbase_websocket_client.on_open()
+    feed = redundant_feed.start(redundant_feed.construct(
+        [coinbase_websocket_client.url] * defaults.feed_connections,
+        coinbase_websocket_client.on_message,
+        coinbase_websocket_client.products,
+        coinbase_websocket_client.channels
+    ))
+else:
+    coinbase_websocket_client.start()
 
 logger.log(f'{coinbase_websocket_client.url} {coinbase_websocket_client.products}')
 
-web_application.start(trading_record_registry, trading_model_registry)
+if defaults.serving_mode == 'multiprocess':
+    web_application.SharedStatePublisher(
+        coinbase_websocket_client.registry_publisher,
+        shared_state_writer,
+        defaults.shared_state_interval,
+        coinbase_websocket_client.chart_history
+    ).start()
+    web_application.wait(web_workers)
+else:
+    web_application.start(
+        coinbase_websocket_client.registry_publisher,
+        coinbase_websocket_client.chart_history,
+        # Profiles are cut at the ticks of the trading thread
+        sampling_profiler.construct(coinbase_websocket_client.on_message)
+        if defaults.debug_endpoints else None,
+        memory_monitor if defaults.debug_endpoints else None
+    )
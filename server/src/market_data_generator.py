@@ -0,0 +1,365 @@
+'''
+Synthetic Coinbase market data for load and soak testing.
+
+Exchange rates follow geometric brownian motion with normally distributed
+jumps, and trades arrive as a Hawkes process, so bursts of trades excite more
+trades like a real order book does (a branching ratio of 0 gives a Poisson
+process).  Every trade is a Coinbase shaped `match` message, optionally followed
+by an `l2update` of the level it traded at.
+
+Messages can be fed to `TradingClient.on_message` directly, or
+streamed as newline delimited JSON over a TCP socket.  Feeds are paced to the
+simulated time of the messages, so a model's rate is the rate the consumer
+sees, and record how far the consumer falls behind that pace.
+
+Run from the server directory to find the rate where each strategy falls behind:
+    python src/market_data_generator.py --strategies algorithmic random
+    python src/market_data_generator.py --rates 1000 10000 100000 --seconds 10
+    python src/market_data_generator.py --serve 9000 --rate 5000
+'''
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import socket
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import zulu_time
+from invariants import cannot_be_negative, must_be_positive, must_be_zero_to_one
+from pyrsistent import PRecord, field
+
+SECONDS_PER_YEAR = 365.0 * 24.0 * 60.0 * 60.0
+TICK_SIZE = 0.01
+# A consumer that lags its feed by more than this has fallen behind
+MAXIMUM_LAG = 0.5
+DEFAULT_RATES = [1, 10, 100, 1000, 10000, 100000]
+
+Message = Dict[str, Any]
+OnMessage = Callable[[Message], Any]
+# Messages paired with their epoch, so feeds don't parse their times
+TimedMessage = Tuple[float, Message]
+
+
+class MarketModel(PRecord):
+    product_id = field(type=str, initial='BTC-USD')
+    initial_price = field(type=float, initial=5000.0, invariant=must_be_positive)
+    # Annualized drift and volatility of the geometric brownian motion
+    drift = field(type=float, initial=0.0)
+    volatility = field(type=float, initial=0.8, invariant=cannot_be_negative)
+    # Expected jumps per second and the mean and standard deviation of their log returns
+    jump_intensity = field(type=float, initial=1.0 / 3600.0, invariant=cannot_be_negative)
+    jump_mean = field(type=float, initial=0.0)
+    jump_deviation = field(type=float, initial=0.01, invariant=cannot_be_negative)
+    # Mean trades per second, including the trades excited by other trades
+    rate = field(type=float, initial=10.0, invariant=must_be_positive)
+    # Expected trades excited by every trade, must be below 1 for a stationary process
+    branching_ratio = field(type=float, initial=0.5, invariant=lambda ratio: (
+        0.0 <= ratio < 1.0, 'must be between 0 inclusively and 1'
+    ))
+    # Decay rate per second of the excitation of every trade
+    decay = field(type=float, initial=10.0, invariant=must_be_positive)
+    # Trade sizes are log normal
+    mean_size = field(type=float, initial=0.05, invariant=must_be_positive)
+    size_deviation = field(type=float, initial=1.0, invariant=cannot_be_negative)
+    # Fraction of trades followed by an l2update
+    level2_ratio = field(type=float, initial=0.0, invariant=must_be_zero_to_one)
+
+
+class FeedStatistics(PRecord):
+    messages = field(type=int, initial=0)
+    seconds = field(type=float, initial=0.0)
+    # Messages delivered per second
+    rate = field(type=float, initial=0.0)
+    # Seconds the consumer finished after the message was due
+    maximum_lag = field(type=float, initial=0.0)
+    final_lag = field(type=float, initial=0.0)
+    # Mean seconds the consumer took per message
+    processing_time = field(type=float, initial=0.0)
+
+
+def arrival_epochs(model: MarketModel, start: float, rng: random.Random) -> Iterator[float]:
+    ''' Yields the epochs of Hawkes process arrivals with an exponential kernel
+
+    Uses Ogata's thinning.  The intensity only decays between arrivals, so the
+    intensity now bounds it until the next arrival.
+    '''
+    baseline = model.rate * (1.0 - model.branching_ratio)
+    decay = model.decay
+    excitation = model.branching_ratio * decay
+    epoch = start
+    excited = 0.0
+    while True:
+        bound = baseline + excited
+        wait = rng.expovariate(bound)
+        epoch += wait
+        excited *= math.exp(-decay * wait)
+        if rng.random() * bound <= baseline + excited:
+            excited += excitation
+            yield epoch
+
+
+def order_id(number: int) -> str:
+    ''' Uuid shaped order id, cheaper than generating random uuids '''
+    return f'00000000-0000-4000-8000-{number:012x}'
+
+
+class Timestamps:
+    ''' Formats epochs like zulu_time.get_timestamp, formatting each second only once '''
+    def __init__(self):
+        self.second = -1
+        self.prefix = ''
+
+    def format(self, epoch: float) -> str:
+        second = math.floor(epoch)
+        microsecond = int((epoch - second) * 1e6)
+        if second != self.second:
+            self.second = second
+            self.prefix = datetime.fromtimestamp(second).strftime('%Y-%m-%dT%H:%M:%S')
+        return f'{self.prefix}.{microsecond:06d}Z'
+
+
+def generate(
+    model: MarketModel,
+    start: Optional[float] = None,
+    seed: int = 0
+) -> Iterator[TimedMessage]:
+    ''' Yields an endless stream of (epoch, message) starting at epoch (start), now by default '''
+    rng = random.Random(seed)
+    gauss = rng.gauss
+    uniform = rng.random
+    start = time.time() if start is None else start
+    timestamps = Timestamps()
+    product_id = model.product_id
+    volatility = model.volatility / math.sqrt(SECONDS_PER_YEAR)
+    drift = model.drift / SECONDS_PER_YEAR - volatility * volatility / 2.0
+    jump_intensity = model.jump_intensity
+    jump_mean = model.jump_mean
+    jump_deviation = model.jump_deviation
+    size_deviation = model.size_deviation
+    size_location = math.log(model.mean_size) - size_deviation ** 2 / 2.0
+    level2_ratio = model.level2_ratio
+    log_price = math.log(model.initial_price)
+    previous_epoch = start
+    previous_price = round(model.initial_price, 2)
+    sequence = 0
+    for trade_id, epoch in enumerate(arrival_epochs(model, start, rng), 1):
+        elapsed = epoch - previous_epoch
+        previous_epoch = epoch
+        log_price += drift * elapsed + volatility * math.sqrt(elapsed) * gauss(0.0, 1.0)
+        if uniform() < -math.expm1(-jump_intensity * elapsed):
+            log_price += gauss(jump_mean, jump_deviation)
+        price = max(round(math.exp(log_price) / TICK_SIZE) * TICK_SIZE, TICK_SIZE)
+        size = math.exp(gauss(size_location, size_deviation))
+        # Side is the maker's side, so an uptick was a buyer taking a sell order
+        side = 'sell' if price > previous_price or (
+            price == previous_price and uniform() < 0.5
+        ) else 'buy'
+        previous_price = price
+        timestamp = timestamps.format(epoch)
+        sequence += 1
+        yield epoch, {
+            'type': 'match',
+            'trade_id': trade_id,
+            'sequence': sequence,
+            'maker_order_id': order_id(2 * trade_id),
+            'taker_order_id': order_id(2 * trade_id + 1),
+            'time': timestamp,
+            'product_id': product_id,
+            'size': f'{size:.8f}',
+            'price': f'{price:.2f}',
+            'side': side,
+        }
+        if level2_ratio > 0.0 and uniform() < level2_ratio:
+            sequence += 1
+            yield epoch, {
+                'type': 'l2update',
+                'product_id': product_id,
+                'time': timestamp,
+                'changes': [[side, f'{price:.2f}', f'{rng.expovariate(1.0):.8f}']],
+            }
+
+
+def take(messages: Iterable[TimedMessage], count: int) -> List[TimedMessage]:
+    return [message for _, message in zip(range(count), messages)]
+
+
+def timed(messages: Iterable[Message]) -> Iterator[TimedMessage]:
+    ''' Pairs recorded messages with the epoch of their time '''
+    for message in messages:
+        yield zulu_time.get_epoch(message['time']), message
+
+
+def feed(
+    on_message: OnMessage,
+    messages: Iterable[TimedMessage],
+    seconds: float = math.inf,
+    speed: float = 1.0
+) -> FeedStatistics:
+    ''' Calls (on_message) with every message at (speed) times its simulated pace,
+    for at most (seconds) of wall time.  A speed of math.inf feeds as fast as possible.
+    '''
+    delivered = 0
+    maximum_lag = 0.0
+    lag = 0.0
+    processing = 0.0
+    started = time.perf_counter()
+    first_epoch: Optional[float] = None
+    for epoch, message in messages:
+        now = time.perf_counter()
+        if now - started >= seconds:
+            break
+        due = now
+        if speed != math.inf:
+            if first_epoch is None:
+                first_epoch = epoch
+            due = started + (epoch - first_epoch) / speed
+            # Sleeping for less than a millisecond overshoots, so those are delivered late
+            if due - now > 0.001:
+                time.sleep(due - now)
+                now = time.perf_counter()
+        on_message(message)
+        finished = time.perf_counter()
+        processing += finished - now
+        delivered += 1
+        lag = max(finished - due, 0.0)
+        maximum_lag = max(maximum_lag, lag)
+    elapsed = time.perf_counter() - started
+    return FeedStatistics(
+        messages=delivered,
+        seconds=elapsed,
+        rate=delivered / elapsed if elapsed > 0.0 else 0.0,
+        maximum_lag=maximum_lag,
+        final_lag=lag,
+        processing_time=processing / delivered if delivered > 0 else 0.0
+    )
+
+
+def has_fallen_behind(statistics: FeedStatistics) -> bool:
+    return statistics.final_lag > MAXIMUM_LAG
+
+
+def serve(
+    messages: Iterable[TimedMessage],
+    host: str = '127.0.0.1',
+    port: int = 0,
+    seconds: float = math.inf,
+    speed: float = 1.0,
+    on_listening: Callable[[Tuple[str, int]], Any] = lambda address: None
+) -> FeedStatistics:
+    ''' Streams the messages as newline delimited JSON to the first connection '''
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, port))
+        server.listen(1)
+        on_listening(server.getsockname())
+        connection, _ = server.accept()
+        with connection, connection.makefile('w', encoding='utf-8') as writer:
+            def send(message: Message) -> None:
+                writer.write(json.dumps(message))
+                writer.write('\n')
+                # Flushing every message would cap the rate at the syscall rate,
+                # so writes are buffered unless the feed is paced slowly
+                if speed != math.inf:
+                    writer.flush()
+            try:
+                return feed(send, messages, seconds, speed)
+            except (BrokenPipeError, ConnectionResetError):
+                return FeedStatistics()
+
+
+def receive(host: str, port: int) -> Iterator[Message]:
+    ''' Yields the messages streamed by serve until the connection closes '''
+    with socket.create_connection((host, port)) as connection, \
+            connection.makefile('r', encoding='utf-8') as reader:
+        for line in reader:
+            yield json.loads(line)
+
+
+def find_saturation(
+    on_message: OnMessage,
+    model: MarketModel,
+    rates: List[float],
+    seconds: float
+) -> List[Tuple[float, FeedStatistics]]:
+    ''' Feeds (on_message) at increasing rates until it falls behind '''
+    results = []
+    for rate in rates:
+        statistics = feed(on_message, generate(model.set(rate=float(rate))), seconds)
+        results.append((rate, statistics))
+        if has_fallen_behind(statistics):
+            break
+    return results
+
+
+def construct_client(strategy: str) -> Any:
+    # Imported here so generating and serving doesn't need tensorflow
+    import strategies
+    from trading_client import TradingClient
+    return TradingClient(
+        strategies.construct_trading_records([strategy]),
+        strategies.construct_trading_models([strategy])
+    )
+
+
+def silenced(on_message: OnMessage) -> OnMessage:
+    devnull = open(os.devnull, 'w')
+
+    def quiet(message: Message) -> Any:
+        with contextlib.redirect_stdout(devnull):
+            return on_message(message)
+    return quiet
+
+
+def main(arguments: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Generates synthetic Coinbase market data')
+    parser.add_argument('--strategies', nargs='+', default=['algorithmic', 'random'])
+    parser.add_argument('--rates', nargs='+', type=float, default=DEFAULT_RATES,
+                        help='trades per second to try, in increasing order')
+    parser.add_argument('--seconds', type=float, default=5.0, help='seconds per rate')
+    parser.add_argument('--branching-ratio', type=float, default=0.5)
+    parser.add_argument('--level2-ratio', type=float, default=0.0)
+    parser.add_argument('--serve', type=int, help='streams messages on this port instead')
+    parser.add_argument('--rate', type=float, default=1000.0, help='trades per second to serve')
+    options = parser.parse_args(arguments)
+
+    model = MarketModel(
+        branching_ratio=options.branching_ratio,
+        level2_ratio=options.level2_ratio
+    )
+    if options.serve is not None:
+        statistics = serve(
+            generate(model.set(rate=options.rate)),
+            '0.0.0.0',
+            options.serve,
+            options.seconds,
+            on_listening=lambda address: print(f'serving on port {address[1]}')
+        )
+        print(f'sent {statistics.messages} messages at {statistics.rate:.0f}/s')
+        return 0
+
+    generated = feed(lambda message: None, generate(model.set(rate=1e6)), 1.0, math.inf)
+    print(f'generator: {generated.rate:.0f} messages/s')
+    for strategy in options.strategies:
+        try:
+            client = construct_client(strategy)
+        except ImportError as error:
+            print(f'{strategy:<24} skipped ({error})')
+            continue
+        # Strategies log every trade, which would dominate the measurement
+        for rate, statistics in find_saturation(
+            silenced(client.on_message), model, options.rates, options.seconds
+        ):
+            state = 'BEHIND' if has_fallen_behind(statistics) else 'ok'
+            print(f'{strategy:<24} {rate:>10.0f}/s  delivered {statistics.rate:10.0f}/s  '
+                  f'{statistics.processing_time * 1e6:8.1f} us/message  '
+                  f'lag {statistics.final_lag:6.3f}s  {state}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
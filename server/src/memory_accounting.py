@@ -0,0 +1,287 @@
+'''
+Sizes of the trading state's long lived structures, to attribute memory growth.
+
+A report measures, from a published registry snapshot, the number of elements
+and the deep size in bytes of every record's sliding window, transaction
+window and pending sales, the algorithmic model's pending trades, the
+q-learning replay memory and network, and the population's replay memory and
+weights.  Each report is compared with the previous ones: a structure without
+a maximum size whose element count grew in each of the last GROWTH_REPORTS
+reports is reported as growing, before it grows large enough to slow ticks.
+
+When tracemalloc is tracing, reports also list the source lines that
+allocated the most memory and those that allocated the most since the
+previous report.  Tracing has an overhead on every allocation, so it is only
+started when configured (see memory_tracing_frames in config/default.json).
+
+Deep sizes are estimates from sys.getsizeof: the internal nodes of pyrsistent
+vectors and maps are not visible to it, and memory that tensorflow allocates
+for the network is estimated from its weights.  Structures shared between
+records, like the population agents' sliding window, are walked once and
+counted in the first record's size only.
+'''
+import collections
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from fully_connected_neural_network import get_variables
+from invariants import cannot_be_negative
+from logger import logger
+from maybe import Maybe
+from pyrsistent import PMap, PRecord, PSet, PVector, field, pmap_field, pvector_field
+from registry_snapshot import RegistrySnapshot, SnapshotPublisher
+from slot_record import SlotRecord
+
+# Reports in a row an uncapped structure has to grow in to be reported as growing
+GROWTH_REPORTS = 5
+# Allocators listed per report
+TOP_ALLOCATORS = 10
+# Floats per network weight held by tensorflow: the variable and Adam's 2 moments
+TENSORFLOW_COPIES = 3
+
+
+class StructureSize(PRecord):
+    count = field(type=int, mandatory=True, invariant=cannot_be_negative)
+    bytes = field(type=int, mandatory=True, invariant=cannot_be_negative)
+    # Elements the structure is capped at, None when it can grow without bound
+    maximum_size = field(type=(int, type(None)), initial=None)
+    # The structure this one is shared with, which its bytes are counted in
+    shared_with = field(type=(str, type(None)), initial=None)
+
+
+class Allocation(PRecord):
+    location = field(type=str, mandatory=True)
+    bytes = field(type=int, mandatory=True)
+    count = field(type=int, mandatory=True)
+
+
+class MemoryReport(PRecord):
+    tick = field(type=int, mandatory=True)
+    structures = pmap_field(str, StructureSize)
+    # Bytes of all the structures, shared ones counted once
+    total_bytes = field(type=int, initial=0)
+    # Structures that grew in each of the last GROWTH_REPORTS reports
+    growing = pvector_field(str)
+    # Empty unless tracemalloc is tracing
+    traced_bytes = field(type=int, initial=0)
+    allocators = pvector_field(Allocation)
+    # Differences from the previous report's allocators
+    allocator_growth = pvector_field(Allocation)
+
+
+def deep_size(value: Any, seen: Set[int]) -> int:
+    ''' Bytes of (value) and the records and collections it holds that aren't in (seen) '''
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, np.ndarray):
+        # Views don't own, and getsizeof doesn't count, their data
+        return size if value.flags.owndata else size + value.nbytes
+    if isinstance(value, SlotRecord):
+        return size + sum(deep_size(item, seen) for item in value.values())
+    if isinstance(value, (PMap, dict)):
+        return size + sum(
+            deep_size(key, seen) + deep_size(item, seen) for key, item in value.items()
+        )
+    if isinstance(value, (PVector, PSet, list, tuple, set)):
+        return size + sum(deep_size(item, seen) for item in value)
+    # Other objects, such as tensorflow sessions, are not walked
+    return size
+
+
+def measure(
+    name: str,
+    value: Any,
+    count: int,
+    maximum_size: Maybe[int],
+    measured: Dict[int, Tuple[str, StructureSize]]
+) -> StructureSize:
+    ''' The size of a structure, or the size it was already (measured) at '''
+    if id(value) in measured:
+        first, size = measured[id(value)]
+        return size.set('shared_with', first)
+    size = StructureSize(count=count, bytes=deep_size(value, set()), maximum_size=maximum_size)
+    measured[id(value)] = name, size
+    return size
+
+
+def arrays_size(arrays: List[np.ndarray]) -> StructureSize:
+    return StructureSize(
+        count=sum(array.size for array in arrays),
+        bytes=sum(array.nbytes for array in arrays)
+    )
+
+
+def network_size(neural_network: Any) -> StructureSize:
+    ''' The network's weights, counted once for each copy of them that is held '''
+    if neural_network.inference_backend == 'numpy':
+        weights = arrays_size(neural_network.numpy_weights)
+        # The numpy copy of the weights, plus tensorflow's variables and moments
+        return weights.set('bytes', weights.bytes * (1 + TENSORFLOW_COPIES))
+    # Only tensorflow holds the weights, so they are sized from the variables'
+    # shapes rather than read with a session.run from the monitor thread
+    count = sum(variable.shape.num_elements() for variable in get_variables(neural_network))
+    return StructureSize(
+        count=count,
+        bytes=count * neural_network.dtype.itemsize * TENSORFLOW_COPIES
+    )
+
+
+def measure_structures(snapshot: RegistrySnapshot) -> Dict[str, StructureSize]:
+    measured: Dict[int, Tuple[str, StructureSize]] = {}
+    structures = {}
+    for name, record in sorted(snapshot.trading_records.items()):
+        for structure, value, count, maximum_size in [
+            (
+                'exchange_rates',
+                record.exchange_rates,
+                len(record.exchange_rates.samples),
+                record.exchange_rates.maximum_size
+            ),
+            (
+                'transaction_window',
+                record.transaction_window,
+                len(record.transaction_window.entries),
+                record.transaction_window.maximum_size
+            ),
+            ('pending_sales', record.pending_sales, len(record.pending_sales), None),
+        ]:
+            structures[f'{name}/{structure}'] = measure(
+                f'{name}/{structure}', value, count, maximum_size, measured
+            )
+
+    models = snapshot.trading_models
+    if 'algorithmic' in models:
+        pending_trades = models['algorithmic'].pending_trades
+        structures['algorithmic/pending_trades'] = measure(
+            'algorithmic/pending_trades', pending_trades, len(pending_trades), None, measured
+        )
+    if 'q-learning' in models:
+        memory = models['q-learning'].memory
+        structures['q-learning/memory'] = measure(
+            'q-learning/memory', memory, len(memory.samples), memory.maximum_size, measured
+        )
+        structures['q-learning/network'] = network_size(models['q-learning'].neural_network)
+    if 'q-learning-population' in models:
+        population = models['q-learning-population']
+        structures['q-learning-population/memory'] = arrays_size([
+            population.memory_states,
+            population.memory_actions,
+            population.memory_rewards,
+        ]).set('count', population.memory_length).set('maximum_size', population.memory_size)
+        structures['q-learning-population/weights'] = arrays_size(
+            population.weights + population.first_moments + population.second_moments
+        )
+    return structures
+
+
+def allocations(statistics: List[Any]) -> List[Allocation]:
+    return [
+        Allocation(
+            location=f'{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}',
+            bytes=getattr(statistic, 'size_diff', statistic.size),
+            count=getattr(statistic, 'count_diff', statistic.count)
+        )
+        for statistic in statistics[:TOP_ALLOCATORS]
+    ]
+
+
+class MemoryMonitor(threading.Thread):
+    ''' Logs a memory report of the latest published snapshot every (interval) seconds '''
+    def __init__(self, registry_publisher: SnapshotPublisher, interval: float = 300.0):
+        super().__init__(name='memory-monitor', daemon=True)
+        self.registry_publisher = registry_publisher
+        self.interval = interval
+        # Element counts of every structure in the last GROWTH_REPORTS + 1 reports
+        self.counts: Deque[Dict[str, int]] = collections.deque(maxlen=GROWTH_REPORTS + 1)
+        self.traces: Optional[tracemalloc.Snapshot] = None
+        # Serializes periodic reports with the snapshots requested from the api
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> MemoryReport:
+        ''' A report of the latest published snapshot that later reports aren't compared with '''
+        with self._lock:
+            return self._measure(record=False)
+
+    def report(self) -> MemoryReport:
+        ''' A report whose counts and traces later reports are compared with '''
+        with self._lock:
+            return self._measure(record=True)
+
+    def _measure(self, record: bool) -> MemoryReport:
+        snapshot = self.registry_publisher.current()
+        structures = measure_structures(snapshot)
+        counts = [*self.counts, {name: size.count for name, size in structures.items()}]
+        report = MemoryReport(
+            tick=snapshot.tick,
+            structures=structures,
+            total_bytes=sum(
+                size.bytes for size in structures.values() if size.shared_with is None
+            ),
+            growing=growing(counts[-(GROWTH_REPORTS + 1):], structures)
+        )
+        if tracemalloc.is_tracing():
+            traces = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ])
+            report = report.update({
+                'traced_bytes': tracemalloc.get_traced_memory()[0],
+                'allocators': allocations(traces.statistics('lineno')),
+                'allocator_growth': allocations(
+                    traces.compare_to(self.traces, 'lineno')
+                ) if self.traces is not None else [],
+            })
+            if record:
+                self.traces = traces
+        if record:
+            self.counts.append(counts[-1])
+        return report
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            # A failed report, e.g. of a model without the expected fields, is
+            # retried next interval
+            try:
+                log(self.report())
+            except Exception as error:
+                logger.error(f'memory report failed: {error!r}')
+
+
+def growing(counts: Sequence[Dict[str, int]], structures: Dict[str, StructureSize]) -> List[str]:
+    if len(counts) <= GROWTH_REPORTS:
+        return []
+    return sorted(
+        name for name, size in structures.items()
+        if size.maximum_size is None and all(
+            name in earlier and name in later and later[name] > earlier[name]
+            for earlier, later in zip(counts[:-1], counts[1:])
+        )
+    )
+
+
+def log(report: MemoryReport, largest: int = 5) -> None:
+    sizes = sorted(
+        ((name, size) for name, size in report.structures.items() if size.shared_with is None),
+        key=lambda item: -item[1].bytes
+    )
+    summary = ', '.join(
+        f'{name} {size.count} ({size.bytes / 1024:.0f} KiB)' for name, size in sizes[:largest]
+    )
+    traced = f', traced {report.traced_bytes / 2 ** 20:.1f} MiB' if report.traced_bytes else ''
+    logger.info(f'memory at tick {report.tick}: structures {report.total_bytes / 2 ** 20:.1f} '
+                f'MiB{traced}, largest {summary}')
+    for name in report.growing:
+        logger.warn(f'memory: {name} grew in each of the last {GROWTH_REPORTS} reports '
+                    f'to {report.structures[name].count} elements')
+
+
+def start_tracing(frames: int) -> None:
+    ''' Starts tracemalloc with (frames) frames per traceback, 0 doesn't trace '''
+    if frames > 0:
+        tracemalloc.start(frames)
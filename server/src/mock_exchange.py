@@ -0,0 +1,266 @@
+'''
+Local mock of the Coinbase Pro order endpoints for testing the order gateway.
+
+Serves POST /orders, GET /orders/<id>, GET /orders/client:<client_oid> and
+DELETE /orders/<id> over persistent HTTP/1.1 connections, and the public
+GET /products/<product_id>/book and /trades snapshots of (books) and (trades).  It rejects requests
+above its rate limit with 429 like the exchange, verifies request signatures
+when it has a secret, and can add latency, fail requests with 503, or drop
+connections after handling an order to exercise the gateway's retries.
+
+Run from the server directory: python src/mock_exchange.py --port 8000
+'''
+import argparse
+import asyncio
+import hmac
+import json
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import order_gateway
+import zulu_time
+
+
+class MockExchange:
+    def __init__(
+        self,
+        rate: float = order_gateway.RATE_LIMIT,
+        burst: int = order_gateway.BURST_LIMIT,
+        latency: float = 0.0,
+        b64secret: str = '',
+        base_path: str = ''
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.latency = latency
+        self.b64secret = b64secret
+        # Path the api is served under, e.g. '/api', part of its url and signatures
+        self.base_path = base_path
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.orders: Dict[str, Dict[str, Any]] = {}
+        self.client_oids: Dict[str, str] = {}
+        # Level2 books ({'sequence', 'bids', 'asks'}) and recent trades of each product
+        self.books: Dict[str, Dict[str, Any]] = {}
+        self.trades: Dict[str, List[Dict[str, Any]]] = {}
+        # Status codes of the next responses, e.g. [503, 503] fails the next two
+        self.failures: List[int] = []
+        # Order placements handled but not answered before closing the connection
+        self.drops = 0
+        self.requests = 0
+        self.rejected = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.maximum_in_flight = 0
+        self.server: Optional['asyncio.base_events.Server'] = None
+        # Open connections and the tasks serving them
+        self.writers: Set[asyncio.StreamWriter] = set()
+        self.handlers: Set['asyncio.Future[None]'] = set()
+
+    @property
+    def url(self) -> str:
+        if self.server is None:
+            raise RuntimeError('mock exchange is not started')
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f'http://{host}:{port}{self.base_path}'
+
+
+async def start(exchange: MockExchange, host: str = '127.0.0.1', port: int = 0) -> MockExchange:
+    async def on_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        handler = asyncio.ensure_future(serve(exchange, reader, writer))
+        exchange.handlers.add(handler)
+        try:
+            await handler
+        finally:
+            exchange.handlers.discard(handler)
+    exchange.server = await asyncio.start_server(on_connection, host, port)
+    return exchange
+
+
+async def stop(exchange: MockExchange) -> None:
+    if exchange.server is not None:
+        exchange.server.close()
+        await exchange.server.wait_closed()
+        exchange.server = None
+    for writer in list(exchange.writers):
+        writer.close()
+    await asyncio.gather(*exchange.handlers, return_exceptions=True)
+
+
+def allow(exchange: MockExchange) -> bool:
+    now = time.monotonic()
+    exchange.tokens = min(
+        float(exchange.burst),
+        exchange.tokens + (now - exchange.updated) * exchange.rate
+    )
+    exchange.updated = now
+    if exchange.tokens < 1.0:
+        return False
+    exchange.tokens -= 1.0
+    return True
+
+
+def is_signed(exchange: MockExchange, method: str, path: str, body: str,
+              headers: Dict[str, str]) -> bool:
+    if exchange.b64secret == '':
+        return True
+    expected = order_gateway.sign(
+        exchange.b64secret,
+        headers.get('cb-access-timestamp', ''),
+        method,
+        path,
+        body
+    )
+    return hmac.compare_digest(expected, headers.get('cb-access-sign', ''))
+
+
+def place(exchange: MockExchange, request: Dict[str, Any]) -> Tuple[int, Any]:
+    if request.get('side') not in ('buy', 'sell'):
+        return 400, {'message': 'Invalid side'}
+    if request.get('type', 'limit') == 'limit' and 'price' not in request:
+        return 400, {'message': 'price is required'}
+    client_oid = request.get('client_oid')
+    if client_oid in exchange.client_oids:
+        return 400, {'message': 'duplicate client_oid'}
+    order = {
+        'id': str(uuid.uuid4()),
+        'price': request.get('price'),
+        'size': request.get('size'),
+        'product_id': request.get('product_id'),
+        'side': request['side'],
+        'type': request.get('type', 'limit'),
+        'time_in_force': 'GTC',
+        'post_only': False,
+        'created_at': zulu_time.get_timestamp(time.time()),
+        'fill_fees': '0.0000000000000000',
+        'filled_size': '0.00000000',
+        'executed_value': '0.0000000000000000',
+        'status': 'pending',
+        'settled': False,
+    }
+    exchange.orders[order['id']] = order
+    if client_oid is not None:
+        exchange.client_oids[client_oid] = order['id']
+    return 200, order
+
+
+def product(exchange: MockExchange, path: str) -> Tuple[int, Any]:
+    _, _, product_id, resource = path.split('?')[0].split('/', 3)
+    if resource == 'book' and product_id in exchange.books:
+        return 200, exchange.books[product_id]
+    if resource == 'trades' and product_id in exchange.trades:
+        return 200, exchange.trades[product_id]
+    return 404, {'message': 'NotFound'}
+
+
+def route(exchange: MockExchange, method: str, path: str, body: str) -> Tuple[int, Any]:
+    if method == 'GET' and path.count('/') == 3 and path.startswith('/products/'):
+        return product(exchange, path)
+    if method == 'POST' and path == '/orders':
+        try:
+            return place(exchange, json.loads(body))
+        except ValueError:
+            return 400, {'message': 'Invalid JSON'}
+    if path.startswith('/orders/client:'):
+        order_id = exchange.client_oids.get(path[len('/orders/client:'):], '')
+    elif path.startswith('/orders/'):
+        order_id = path[len('/orders/'):]
+    else:
+        return 404, {'message': 'NotFound'}
+    order = exchange.orders.get(order_id)
+    if order is None or (method == 'DELETE' and order['status'] == 'done'):
+        return 404, {'message': 'order not found'}
+    if method == 'GET':
+        return 200, order
+    if method == 'DELETE':
+        order['status'] = 'done'
+        order['done_reason'] = 'canceled'
+        return 200, [order_id]
+    return 405, {'message': 'method not allowed'}
+
+
+async def serve(
+    exchange: MockExchange,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter
+) -> None:
+    exchange.connections += 1
+    exchange.writers.add(writer)
+    try:
+        while True:
+            request_line = await reader.readline()
+            if request_line == b'':
+                break
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = await order_gateway.read_headers(reader)
+            data = await reader.readexactly(int(headers.get('content-length', '0')))
+            body = data.decode('utf-8')
+            exchange.requests += 1
+            exchange.in_flight += 1
+            exchange.maximum_in_flight = max(exchange.maximum_in_flight, exchange.in_flight)
+            try:
+                if exchange.latency > 0.0:
+                    await asyncio.sleep(exchange.latency)
+                if not allow(exchange):
+                    exchange.rejected += 1
+                    status, response = 429, {'message': 'Rate limit exceeded'}
+                elif len(exchange.failures) > 0:
+                    status, response = exchange.failures.pop(0), {'message': 'Service Unavailable'}
+                elif not path.startswith(exchange.base_path + '/'):
+                    status, response = 404, {'message': 'NotFound'}
+                elif not path.startswith(exchange.base_path + '/products/') and (
+                    not is_signed(exchange, method, path, body, headers)
+                ):
+                    status, response = 401, {'message': 'invalid signature'}
+                else:
+                    status, response = route(
+                        exchange,
+                        method,
+                        path[len(exchange.base_path):],
+                        body
+                    )
+                    if exchange.drops > 0 and method == 'POST':
+                        exchange.drops -= 1
+                        break
+            finally:
+                exchange.in_flight -= 1
+            payload = json.dumps(response).encode('utf-8')
+            writer.write((
+                f'HTTP/1.1 {status} Mock\r\n'
+                'Content-Type: application/json\r\n'
+                f'Content-Length: {len(payload)}\r\n'
+                'Connection: keep-alive\r\n'
+                '\r\n'
+            ).encode('latin-1') + payload)
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        exchange.writers.discard(writer)
+        writer.close()
+
+
+def main(arguments: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Serves mock Coinbase Pro order endpoints')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    options = parser.parse_args(arguments)
+
+    async def run() -> None:
+        exchange = await start(MockExchange(latency=options.latency), options.host, options.port)
+        print(f'mock exchange on {exchange.url}')
+        while True:
+            await asyncio.sleep(3600)
+
+    try:
+        asyncio.get_event_loop().run_until_complete(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
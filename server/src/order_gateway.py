@@ -0,0 +1,365 @@
+'''
+Asynchronous order gateway for the Coinbase Pro REST API.
+
+Orders are sent from an asyncio event loop over a pool of persistent HTTP/1.1
+connections, so concurrent orders go out in parallel without reconnecting for
+each one.  A token bucket keeps requests within the exchange's rate limit,
+delaying bursts rather than getting them rejected.  Requests time out and are
+retried with exponential backoff when the exchange is overloaded (429 and 5xx)
+or the connection fails.  An order that may have reached the exchange is
+looked up by its client_oid before it's sent again, so retries don't place it
+twice.
+
+The trading thread never waits on the network: start() runs the gateway's
+event loop in a background thread and submit() returns a
+concurrent.futures.Future of the result.
+
+    gateway = order_gateway.construct(API_URL, key, b64secret, passphrase)
+    order_gateway.start(gateway)
+    future = order_gateway.submit(gateway, order_gateway.place_order(
+        gateway, 'sell', 'BTC-USD', '0.001', '15000.00'
+    ))
+'''
+import asyncio
+import base64
+import concurrent.futures
+import hashlib
+import hmac
+import json
+import ssl
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import result
+from invariants import cannot_be_negative, must_be_positive
+from pyrsistent import PRecord, field
+from result import Result
+
+# Coinbase pro allows 5 private requests per second in bursts of up to 10
+RATE_LIMIT = 5.0
+BURST_LIMIT = 10
+
+
+class RetryPolicy(PRecord):
+    attempts = field(type=int, initial=3, invariant=must_be_positive)
+    # Seconds to wait for a response
+    timeout = field(type=float, initial=5.0, invariant=must_be_positive)
+    # Seconds before the first retry, multiplied by (backoff_multiplier) after each
+    backoff = field(type=float, initial=0.25, invariant=cannot_be_negative)
+    backoff_multiplier = field(type=float, initial=2.0, invariant=must_be_positive)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated: Optional[float] = None
+
+
+async def take_token(bucket: TokenBucket) -> None:
+    ''' Waits until a request is allowed.  Tokens are reserved in call order, so
+    the token count goes negative while requests are waiting their turn.
+    '''
+    now = asyncio.get_event_loop().time()
+    if bucket.updated is not None:
+        bucket.tokens = min(
+            float(bucket.burst),
+            bucket.tokens + (now - bucket.updated) * bucket.rate
+        )
+    bucket.updated = now
+    bucket.tokens -= 1.0
+    if bucket.tokens < 0.0:
+        await asyncio.sleep(-bucket.tokens / bucket.rate)
+
+
+class Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+
+class ConnectionPool:
+    def __init__(self, host: str, port: int, ssl_context: Optional[ssl.SSLContext], size: int):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.size = size
+        self.idle: List[Connection] = []
+        # Created on the gateway's event loop when first used
+        self.available: Optional[asyncio.Semaphore] = None
+        # Connections opened over the pool's lifetime
+        self.opened = 0
+
+
+async def acquire(pool: ConnectionPool) -> Connection:
+    if pool.available is None:
+        pool.available = asyncio.Semaphore(pool.size)
+    await pool.available.acquire()
+    try:
+        while len(pool.idle) > 0:
+            connection = pool.idle.pop()
+            if not connection.reader.at_eof():
+                return connection
+            connection.writer.close()
+        reader, writer = await asyncio.open_connection(
+            pool.host,
+            pool.port,
+            ssl=pool.ssl_context
+        )
+        pool.opened += 1
+        return Connection(reader, writer)
+    except BaseException:
+        pool.available.release()
+        raise
+
+
+def release(pool: ConnectionPool, connection: Connection, reusable: bool) -> None:
+    if reusable:
+        pool.idle.append(connection)
+    else:
+        connection.writer.close()
+    if pool.available is not None:
+        pool.available.release()
+
+
+class OrderGateway:
+    def __init__(
+        self,
+        api_url: str,
+        key: str,
+        b64secret: str,
+        passphrase: str,
+        pool_size: int,
+        rate: float,
+        burst: int,
+        retry: RetryPolicy
+    ):
+        url = urlsplit(api_url)
+        secure = url.scheme == 'https'
+        self.host = url.hostname or 'localhost'
+        self.base_path = url.path.rstrip('/')
+        self.key = key
+        self.b64secret = b64secret
+        self.passphrase = passphrase
+        self.retry = retry
+        self.bucket = TokenBucket(rate, burst)
+        self.pool = ConnectionPool(
+            self.host,
+            url.port or (443 if secure else 80),
+            ssl.create_default_context() if secure else None,
+            pool_size
+        )
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+
+
+def construct(
+    api_url: str,
+    key: str = '',
+    b64secret: str = '',
+    passphrase: str = '',
+    pool_size: int = 4,
+    rate: float = RATE_LIMIT,
+    burst: int = BURST_LIMIT,
+    retry: RetryPolicy = RetryPolicy()
+) -> OrderGateway:
+    return OrderGateway(api_url, key, b64secret, passphrase, pool_size, rate, burst, retry)
+
+
+def sign(b64secret: str, timestamp: str, method: str, path: str, body: str) -> str:
+    ''' Coinbase pro's CB-ACCESS-SIGN of a request '''
+    message = (timestamp + method + path + body).encode('utf-8')
+    digest = hmac.new(base64.b64decode(b64secret), message, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def encode_request(gateway: OrderGateway, method: str, path: str, body: str) -> bytes:
+    # The exchange signs the path as it's requested, base path included
+    target = gateway.base_path + path
+    headers = [
+        f'{method} {target} HTTP/1.1',
+        f'Host: {gateway.host}',
+        'Connection: keep-alive',
+        'Accept: application/json',
+        'Content-Type: application/json',
+        f'Content-Length: {len(body.encode("utf-8"))}',
+        'User-Agent: hf-trader',
+    ]
+    if gateway.key != '':
+        timestamp = str(time.time())
+        headers += [
+            f'CB-ACCESS-KEY: {gateway.key}',
+            f'CB-ACCESS-SIGN: {sign(gateway.b64secret, timestamp, method, target, body)}',
+            f'CB-ACCESS-TIMESTAMP: {timestamp}',
+            f'CB-ACCESS-PASSPHRASE: {gateway.passphrase}',
+        ]
+    return ('\r\n'.join(headers) + '\r\n\r\n' + body).encode('utf-8')
+
+
+async def read_headers(reader: asyncio.StreamReader) -> Dict[str, str]:
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'', b'\r\n', b'\n'):
+            return headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+async def read_response(reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str], bytes]:
+    status_line = await reader.readline()
+    if status_line == b'':
+        raise ConnectionError('connection closed before the response')
+    status = int(status_line.split()[1])
+    headers = await read_headers(reader)
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # Trailers end with an empty line like headers
+                await read_headers(reader)
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        return status, headers, b''.join(chunks)
+    return status, headers, await reader.readexactly(int(headers.get('content-length', '0')))
+
+
+async def send(
+    gateway: OrderGateway,
+    method: str,
+    path: str,
+    body: str
+) -> Tuple[int, Any]:
+    ''' Sends a single request on a pooled connection, returns the status and JSON response '''
+    await take_token(gateway.bucket)
+    connection = await acquire(gateway.pool)
+    reusable = False
+    try:
+        async def exchange() -> Tuple[int, Dict[str, str], bytes]:
+            connection.writer.write(encode_request(gateway, method, path, body))
+            await connection.writer.drain()
+            return await read_response(connection.reader)
+        status, headers, data = await asyncio.wait_for(exchange(), gateway.retry.timeout)
+        reusable = headers.get('connection', '').lower() != 'close'
+        return status, json.loads(data) if len(data) > 0 else None
+    finally:
+        release(gateway.pool, connection, reusable)
+
+
+def error_message(status: int, response: Any) -> str:
+    if isinstance(response, dict) and 'message' in response:
+        return f'{status} {response["message"]}'
+    return str(status)
+
+
+async def request(
+    gateway: OrderGateway,
+    method: str,
+    path: str,
+    body: Optional[Dict[str, Any]] = None
+) -> Result[Any]:
+    ''' Sends a request, retrying it when the exchange is overloaded or unreachable '''
+    encoded_body = json.dumps(body) if body is not None else ''
+    client_oid = body.get('client_oid') if body is not None else None
+    policy = gateway.retry
+    delay = policy.backoff
+    # Whether the exchange may have handled the last attempt
+    uncertain = False
+    last_error = ''
+    for attempt in range(policy.attempts):
+        if attempt > 0:
+            await asyncio.sleep(delay)
+            delay *= policy.backoff_multiplier
+        if uncertain and client_oid is not None:
+            try:
+                status, response = await send(gateway, 'GET', f'/orders/client:{client_oid}', '')
+            except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError) as error:
+                last_error = f'looking up client_oid {client_oid}: {error!r}'
+                continue
+            if status == 200:
+                return response
+        try:
+            status, response = await send(gateway, method, path, encoded_body)
+        except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError) as error:
+            uncertain = True
+            last_error = repr(error)
+            continue
+        if status == 429 or status >= 500:
+            # Rejected requests weren't handled, but failed ones might have been
+            uncertain = status != 429
+            last_error = error_message(status, response)
+            continue
+        if status >= 400:
+            return result.Error(f'{method} {path} failed: {error_message(status, response)}')
+        return response
+    return result.Error(f'{method} {path} failed after {policy.attempts} attempts: {last_error}')
+
+
+async def place_order(
+    gateway: OrderGateway,
+    side: str,
+    product_id: str,
+    size: str,
+    price: Optional[str] = None,
+    client_oid: Optional[str] = None
+) -> Result[Dict[str, Any]]:
+    ''' Places a limit order at (price), or a market order without one.  Prices
+    and sizes are strings so they're sent exactly as given.
+    '''
+    order = {
+        'side': side,
+        'product_id': product_id,
+        'size': size,
+        'client_oid': client_oid if client_oid is not None else str(uuid.uuid4()),
+    }
+    if price is None:
+        order['type'] = 'market'
+    else:
+        order.update({'type': 'limit', 'price': price})
+    return await request(gateway, 'POST', '/orders', order)
+
+
+async def cancel_order(gateway: OrderGateway, order_id: str) -> Result[Any]:
+    return await request(gateway, 'DELETE', f'/orders/{order_id}')
+
+
+async def get_order(gateway: OrderGateway, order_id: str) -> Result[Dict[str, Any]]:
+    return await request(gateway, 'GET', f'/orders/{order_id}')
+
+
+async def close(gateway: OrderGateway) -> None:
+    for connection in gateway.pool.idle:
+        connection.writer.close()
+    gateway.pool.idle = []
+
+
+def start(gateway: OrderGateway) -> OrderGateway:
+    ''' Runs the gateway's event loop in a background thread '''
+    gateway.loop = asyncio.new_event_loop()
+    gateway.thread = threading.Thread(target=gateway.loop.run_forever, daemon=True)
+    gateway.thread.start()
+    return gateway
+
+
+def submit(gateway: OrderGateway, coroutine: Awaitable[Any]) -> concurrent.futures.Future:
+    ''' Schedules (coroutine) on the gateway's event loop without waiting for it '''
+    if gateway.loop is None:
+        raise RuntimeError('order gateway is not started')
+    return asyncio.run_coroutine_threadsafe(coroutine, gateway.loop)  # type: ignore
+
+
+def stop(gateway: OrderGateway) -> None:
+    if gateway.loop is None or gateway.thread is None:
+        return
+    submit(gateway, close(gateway)).result()
+    gateway.loop.call_soon_threadsafe(gateway.loop.stop)
+    gateway.thread.join()
+    gateway.loop.close()
+    gateway.loop = None
+    gateway.thread = None
@@ -0,0 +1,263 @@
+'''
+Tracks each strategy's exchange orders from the user and full channels.
+
+Orders are tracked with the strategy and client_oid they're placed with before
+they're sent (see order_gateway.place_order), then follow the exchange's events:
+
+    received  the exchange accepted the order and gave it an order id
+    open      the rest of the order is resting on the book at its price
+    match     (part of) the order filled, the fill is recorded in the
+              strategy's trading record
+    change    the order's size was reduced
+    done      the order was filled or cancelled and is forgotten
+
+Applying an event is a few dictionary lookups, and events for other traders'
+orders on the full channel are dropped after the first one.  Open orders are
+indexed by order id, client_oid, strategy and price level, and each strategy's
+open exposure is kept as running totals, so queries don't scan the orders.
+'''
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+import result
+import trading_record
+import transaction
+import zulu_time
+from registries import TradingRecordRegistry
+
+Message = Mapping[str, Any]
+
+
+class ManagedOrder:
+    def __init__(
+        self,
+        client_oid: str,
+        strategy: str,
+        product_id: str,
+        side: str,
+        size: float,
+        price: Optional[float]
+    ):
+        # Assigned by the exchange when it receives the order
+        self.id: Optional[str] = None
+        self.client_oid = client_oid
+        self.strategy = strategy
+        self.product_id = product_id
+        self.side = side
+        self.size = size
+        self.remaining = size
+        # None for market orders
+        self.price = price
+        self.filled = 0.0
+        # 'pending' until the exchange receives it, 'received', 'open' while
+        # resting on the book, then 'done'
+        self.status = 'pending'
+        # 'filled' or 'canceled' once done
+        self.done_reason = ''
+
+
+class Exposure:
+    ''' Size and USD value of the unfilled part of a strategy's orders '''
+    def __init__(self) -> None:
+        self.size = {'buy': 0.0, 'sell': 0.0}
+        # Market orders don't have a price, so they only count towards size
+        self.notional = {'buy': 0.0, 'sell': 0.0}
+
+
+class OrderManager:
+    def __init__(self, records: TradingRecordRegistry):
+        self.records = records
+        self.orders: Dict[str, ManagedOrder] = {}
+        self.client_oids: Dict[str, ManagedOrder] = {}
+        # Orders of each strategy by client_oid
+        self.strategies: Dict[str, Dict[str, ManagedOrder]] = {}
+        # Resting orders by side and price, in the order they opened
+        self.levels: Dict[str, Dict[float, Dict[str, ManagedOrder]]] = {'buy': {}, 'sell': {}}
+        self.exposures: Dict[str, Exposure] = {}
+        self.fills = 0
+
+
+def construct(records: Optional[TradingRecordRegistry] = None) -> OrderManager:
+    return OrderManager(records if records is not None else {})
+
+
+def track(
+    manager: OrderManager,
+    client_oid: str,
+    strategy: str,
+    product_id: str,
+    side: str,
+    size: float,
+    price: Optional[float] = None
+) -> ManagedOrder:
+    ''' Starts tracking an order before it's placed with (client_oid) '''
+    if side not in ('buy', 'sell'):
+        raise ValueError(f'side must be buy or sell, not {side}')
+    order = ManagedOrder(client_oid, strategy, product_id, side, size, price)
+    manager.client_oids[client_oid] = order
+    manager.strategies.setdefault(strategy, {})[client_oid] = order
+    if strategy not in manager.exposures:
+        manager.exposures[strategy] = Exposure()
+    expose(manager, order, size)
+    return order
+
+
+def expose(manager: OrderManager, order: ManagedOrder, size: float) -> None:
+    exposure = manager.exposures[order.strategy]
+    exposure.size[order.side] += size
+    if order.price is not None:
+        exposure.notional[order.side] += size * order.price
+
+
+def set_remaining(manager: OrderManager, order: ManagedOrder, remaining: float) -> None:
+    expose(manager, order, remaining - order.remaining)
+    order.remaining = remaining
+
+
+def received(manager: OrderManager, message: Message) -> Optional[ManagedOrder]:
+    order = manager.client_oids.get(message.get('client_oid', ''))
+    if order is None:
+        return None
+    order.id = message['order_id']
+    order.status = 'received'
+    manager.orders[order.id] = order
+    return order
+
+
+def opened(manager: OrderManager, message: Message) -> Optional[ManagedOrder]:
+    order = manager.orders.get(message['order_id'])
+    if order is None:
+        return None
+    order.status = 'open'
+    set_remaining(manager, order, float(message['remaining_size']))
+    if order.price is not None:
+        manager.levels[order.side].setdefault(order.price, {})[message['order_id']] = order
+    return order
+
+
+def changed(manager: OrderManager, message: Message) -> Optional[ManagedOrder]:
+    order = manager.orders.get(message['order_id'])
+    if order is None or 'new_size' not in message:
+        return None
+    set_remaining(manager, order, float(message['new_size']))
+    return order
+
+
+def done(manager: OrderManager, message: Message) -> Optional[ManagedOrder]:
+    order = manager.orders.get(message['order_id'])
+    if order is None:
+        return None
+    remove(manager, order)
+    order.status = 'done'
+    order.done_reason = message.get('reason', '')
+    return order
+
+
+def untrack(manager: OrderManager, client_oid: str) -> Optional[ManagedOrder]:
+    ''' Stops tracking an order, e.g. one the exchange rejected '''
+    order = manager.client_oids.get(client_oid)
+    if order is not None:
+        remove(manager, order)
+    return order
+
+
+def remove(manager: OrderManager, order: ManagedOrder) -> None:
+    if order.id is not None:
+        del manager.orders[order.id]
+        if order.status == 'open' and order.price is not None:
+            level = manager.levels[order.side][order.price]
+            del level[order.id]
+            if len(level) == 0:
+                del manager.levels[order.side][order.price]
+    del manager.client_oids[order.client_oid]
+    strategy_orders = manager.strategies[order.strategy]
+    del strategy_orders[order.client_oid]
+    if len(strategy_orders) == 0:
+        # Resets the float error of the running totals
+        manager.exposures[order.strategy] = Exposure()
+    else:
+        set_remaining(manager, order, 0.0)
+    order.remaining = 0.0
+
+
+def matched(manager: OrderManager, message: Message) -> Optional[ManagedOrder]:
+    maker = manager.orders.get(message.get('maker_order_id', ''))
+    taker = manager.orders.get(message.get('taker_order_id', ''))
+    if maker is None and taker is None:
+        return None
+    quantity = float(message['size'])
+    price = float(message['price'])
+    epoch = zulu_time.get_epoch(message['time'])
+    if maker is not None:
+        rate = message.get('maker_fee_rate')
+        fee = (
+            float(rate) * quantity * price if rate is not None
+            else transaction.calculate_maker_fee(quantity, price)
+        )
+        fill(manager, maker, quantity, price, epoch, fee)
+    if taker is not None:
+        rate = message.get('taker_fee_rate')
+        fee = (
+            float(rate) * quantity * price if rate is not None
+            else transaction.calculate_taker_fee(quantity, price)
+        )
+        fill(manager, taker, quantity, price, epoch, fee)
+    return taker if taker is not None else maker
+
+
+def fill(
+    manager: OrderManager,
+    order: ManagedOrder,
+    quantity: float,
+    price: float,
+    epoch: float,
+    fee: float
+) -> None:
+    ''' Reduces the order's remaining size and records the fill in its strategy's record '''
+    order.filled += quantity
+    set_remaining(manager, order, max(order.remaining - quantity, 0.0))
+    manager.fills += 1
+    record = manager.records.get(order.strategy)
+    if record is not None:
+        manager.records[order.strategy] = result.with_default(
+            record,
+            trading_record.record_fill(order.side, quantity, price, epoch, fee, record)
+        )
+
+
+HANDLERS: Dict[str, Callable[[OrderManager, Message], Optional[ManagedOrder]]] = {
+    'received': received,
+    'open': opened,
+    'match': matched,
+    'change': changed,
+    'done': done,
+}
+
+
+def apply(manager: OrderManager, message: Message) -> Optional[ManagedOrder]:
+    ''' Applies an order event, returns the tracked order it changed if any '''
+    handler = HANDLERS.get(message.get('type', ''))
+    if handler is None:
+        return None
+    return handler(manager, message)
+
+
+def find(manager: OrderManager, order_id: str) -> Optional[ManagedOrder]:
+    return manager.orders.get(order_id)
+
+
+def find_client_oid(manager: OrderManager, client_oid: str) -> Optional[ManagedOrder]:
+    return manager.client_oids.get(client_oid)
+
+
+def open_orders(manager: OrderManager, strategy: str) -> List[ManagedOrder]:
+    ''' Orders of (strategy) that aren't done, including ones not yet received '''
+    return list(manager.strategies.get(strategy, {}).values())
+
+
+def orders_at(manager: OrderManager, side: str, price: float) -> List[ManagedOrder]:
+    ''' Resting orders at a price level in the order they opened '''
+    return list(manager.levels[side].get(price, {}).values())
+
+
+def exposure(manager: OrderManager, strategy: str) -> Exposure:
+    return manager.exposures.get(strategy, Exposure())
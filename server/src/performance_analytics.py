@@ -0,0 +1,156 @@
+'''
+Risk and performance analytics of a trading record, updated as it trades.
+
+Every metric is kept up to date with O(1) work per mark and per fill, so the
+analytics of every record can be published with each snapshot and served
+without looking back over the record's history:
+
+  - equity is marked to market at each exchange rate update, and the peak
+    equity and the largest drawdown from a peak are kept with it
+  - the returns between marks are kept in a fixed size ring with their running
+    sum and sum of squares, for the rolling volatility and Sharpe ratio
+  - the capital gains of the paired buys and sells count as wins or losses
+  - the notional value of every fill adds to the traded volume, and turnover
+    is the traded volume over the average marked equity
+
+Volatility and Sharpe ratio are per mark and not annualized, marks happen at
+each matched trade of the feed rather than at a fixed interval.
+'''
+import math
+from typing import Any, Dict, Iterable, List
+
+from invariants import cannot_be_negative, must_be_positive
+from pyrsistent import field
+from slot_record import SlotRecord, pvector_field
+
+# Returns in the rolling volatility and Sharpe ratio
+RETURNS_WINDOW = 100
+
+# Ring internals that serialize() leaves out
+RING_FIELDS = ('returns', 'returns_start')
+
+
+class PerformanceAnalytics(SlotRecord):
+    marks = field(type=int, initial=0, invariant=cannot_be_negative)
+    equity = field(type=float, initial=0.0)
+    peak_equity = field(type=float, initial=0.0)
+    equity_sum = field(type=float, initial=0.0)
+    # Fractions of the peak equity
+    drawdown = field(type=float, initial=0.0, invariant=cannot_be_negative)
+    max_drawdown = field(type=float, initial=0.0, invariant=cannot_be_negative)
+    # Returns between consecutive marks.  Once the ring is full each return
+    # replaces the oldest one at (returns_start).
+    returns = pvector_field(float)
+    returns_start = field(type=int, initial=0)
+    returns_sum = field(type=float, initial=0.0)
+    returns_sum_of_squares = field(type=float, initial=0.0)
+    maximum_returns = field(type=int, initial=RETURNS_WINDOW, invariant=must_be_positive)
+    volatility = field(type=float, initial=0.0, invariant=cannot_be_negative)
+    sharpe_ratio = field(type=float, initial=0.0)
+    wins = field(type=int, initial=0, invariant=cannot_be_negative)
+    losses = field(type=int, initial=0, invariant=cannot_be_negative)
+    realized_gains = field(type=float, initial=0.0)
+    win_rate = field(type=float, initial=0.0)
+    # Wins per loss, or the number of wins before the first loss
+    win_loss_ratio = field(type=float, initial=0.0)
+    traded_volume = field(type=float, initial=0.0, invariant=cannot_be_negative)
+    turnover = field(type=float, initial=0.0)
+
+    def serialize(self, format: Any = None) -> Dict[str, Any]:
+        ''' The metrics, without the ring of returns '''
+        return {
+            name: value for name, value in super().serialize(format).items()
+            if name not in RING_FIELDS
+        }
+
+
+def construct(maximum_returns: int = RETURNS_WINDOW) -> PerformanceAnalytics:
+    return PerformanceAnalytics(returns=[], maximum_returns=maximum_returns)
+
+
+def turnover(traded_volume: float, equity_sum: float, marks: int) -> float:
+    if marks == 0 or equity_sum <= 0:
+        return 0.0
+    return traded_volume / (equity_sum / marks)
+
+
+def add_return(value: float, analytics: PerformanceAnalytics) -> Dict[str, Any]:
+    ''' The updated ring fields and rolling statistics with (value) added '''
+    returns = analytics.returns
+    returns_start = analytics.returns_start
+    returns_sum = analytics.returns_sum + value
+    returns_sum_of_squares = analytics.returns_sum_of_squares + value * value
+    if len(returns) < analytics.maximum_returns:
+        returns = returns.append(value)
+    else:
+        oldest = returns[returns_start]
+        returns_sum -= oldest
+        returns_sum_of_squares -= oldest * oldest
+        returns = returns.set(returns_start, value)
+        returns_start = (returns_start + 1) % analytics.maximum_returns
+
+    count = len(returns)
+    mean = returns_sum / count
+    # Sample variance, clamped at 0 where the running sums lost precision
+    variance = max(returns_sum_of_squares - count * mean * mean, 0.0) / max(count - 1, 1)
+    volatility = math.sqrt(variance)
+    return {
+        'returns': returns,
+        'returns_start': returns_start,
+        'returns_sum': returns_sum,
+        'returns_sum_of_squares': returns_sum_of_squares,
+        'volatility': volatility,
+        'sharpe_ratio': mean / volatility if count > 1 and volatility > 0 else 0.0,
+    }
+
+
+def mark(equity: float, analytics: PerformanceAnalytics) -> PerformanceAnalytics:
+    ''' Marks the record's (equity) to market at the latest exchange rate '''
+    marks = analytics.marks + 1
+    equity_sum = analytics.equity_sum + equity
+    peak_equity = max(analytics.peak_equity, equity) if analytics.marks > 0 else equity
+    drawdown = (peak_equity - equity) / peak_equity if peak_equity > 0 else 0.0
+    updates: Dict[str, Any] = {
+        'marks': marks,
+        'equity': equity,
+        'peak_equity': peak_equity,
+        'equity_sum': equity_sum,
+        'drawdown': drawdown,
+        'max_drawdown': max(analytics.max_drawdown, drawdown),
+        'turnover': turnover(analytics.traded_volume, equity_sum, marks),
+    }
+    if analytics.marks > 0 and analytics.equity > 0:
+        updates.update(add_return(equity / analytics.equity - 1.0, analytics))
+    return analytics.update(updates)
+
+
+def record_fill(
+    quantity: float,
+    exchange_rate: float,
+    capital_gains: Iterable[float],
+    analytics: PerformanceAnalytics
+) -> PerformanceAnalytics:
+    ''' Records a fill of (quantity) at (exchange_rate)
+
+    (capital_gains) are those of the buys a sale was paired with, empty for a
+    purchase.
+    '''
+    gains: List[float] = list(capital_gains)
+    wins = analytics.wins + sum(1 for gain in gains if gain > 0)
+    losses = analytics.losses + sum(1 for gain in gains if gain <= 0)
+    traded_volume = analytics.traded_volume + quantity * exchange_rate
+    return analytics.update({
+        'wins': wins,
+        'losses': losses,
+        'realized_gains': analytics.realized_gains + sum(gains),
+        'win_rate': wins / (wins + losses) if wins + losses > 0 else 0.0,
+        'win_loss_ratio': wins / losses if losses > 0 else float(wins),
+        'traded_volume': traded_volume,
+        'turnover': turnover(traded_volume, analytics.equity_sum, analytics.marks),
+    })
+
+
+def returns(analytics: PerformanceAnalytics) -> List[float]:
+    ''' The returns in the ring from oldest to newest '''
+    start = analytics.returns_start
+    return list(analytics.returns[start:]) + list(analytics.returns[:start])
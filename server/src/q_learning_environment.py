@@ -0,0 +1,205 @@
+'''
+Vectorized offline training environment for the q-learning agents.
+
+Steps many independent simulated episodes in lockstep over recorded exchange
+rates.  Every episode has its own wallet that follows the same rules as
+trading_record.buy_crypto, sell_crypto and hold_crypto, but balances, positions
+and fees are stored as numpy arrays so one step for all episodes is a handful of
+array operations instead of a TradingRecord update per episode.
+
+States are the same (exchange_rate, rate_of_change, moving_average) inputs that
+trading_client.q_learning_trade builds from a live trading record, and
+rewards are the change in usd caused by the action, as in
+q_learning_model.calculate_reward.
+'''
+from typing import Optional, Tuple
+
+import numpy as np
+from q_learning_population import ORDERS
+
+BUY = ORDERS.index('buy')
+SELL = ORDERS.index('sell')
+HOLD = ORDERS.index('hold')
+
+# Same constants as trading_record.construct and transaction.calculate_taker_fee
+INITIAL_USD = 100000.0
+TAKER_FEE_RATE = 0.0025
+# Number of samples used by trading_record.get_rate_of_change and get_moving_average
+WINDOW_SIZE = 100
+
+
+def moving_averages(exchange_rates: np.ndarray, n: int = WINDOW_SIZE) -> np.ndarray:
+    ''' sliding_window.average(n) after each sample has been added '''
+    sums = np.cumsum(exchange_rates)
+    averages = np.empty(len(exchange_rates))
+    head = min(n, len(exchange_rates))
+    averages[:head] = sums[:head] / np.arange(1, head + 1)
+    averages[head:] = (sums[head:] - sums[:-head]) / n
+    return averages
+
+
+def rates_of_change(
+    exchange_rates: np.ndarray,
+    epochs: np.ndarray,
+    n: int = WINDOW_SIZE,
+    chunk_size: int = 65536
+) -> np.ndarray:
+    ''' sliding_window.derivative(n) after each sample has been added
+
+    The least squares slope is computed on each window after subtracting its
+    means, like sliding_window.derivative, because running sums of raw epochs
+    lose all precision over long histories.  Windows are strided views, built a
+    chunk at a time to bound memory.
+    '''
+    slopes = np.zeros(len(exchange_rates))
+    if n < 2 or len(exchange_rates) < n:
+        return slopes
+    for start in range(n - 1, len(exchange_rates), chunk_size):
+        stop = min(start + chunk_size, len(exchange_rates))
+        windows = stop - start
+        epoch_windows = np.lib.stride_tricks.as_strided(
+            epochs[start - n + 1:],
+            shape=(windows, n),
+            strides=(epochs.strides[0], epochs.strides[0])
+        )
+        rate_windows = np.lib.stride_tricks.as_strided(
+            exchange_rates[start - n + 1:],
+            shape=(windows, n),
+            strides=(exchange_rates.strides[0], exchange_rates.strides[0])
+        )
+        epoch_errors = epoch_windows - epoch_windows.mean(axis=1, keepdims=True)
+        rate_errors = rate_windows - rate_windows.mean(axis=1, keepdims=True)
+        numerator = (epoch_errors * rate_errors).sum(axis=1)
+        denominator = (epoch_errors * epoch_errors).sum(axis=1)
+        nonzero = denominator != 0
+        slopes[start:stop][nonzero] = numerator[nonzero] / denominator[nonzero]
+    return slopes
+
+
+def compute_states(exchange_rates: np.ndarray, epochs: np.ndarray) -> np.ndarray:
+    ''' Returns the (samples, 3) q-learning inputs seen after each recorded sample '''
+    exchange_rates = np.ascontiguousarray(exchange_rates, dtype=np.float64)
+    epochs = np.ascontiguousarray(epochs, dtype=np.float64)
+    return np.stack([
+        exchange_rates,
+        rates_of_change(exchange_rates, epochs),
+        moving_averages(exchange_rates),
+    ], axis=1)
+
+
+class QLearningEnvironment:
+    def __init__(
+        self,
+        exchange_rates: np.ndarray,
+        epochs: np.ndarray,
+        episodes: int,
+        episode_length: int,
+        quantity: float = 1.0,
+        seed: int = 0,
+        states: Optional[np.ndarray] = None
+    ):
+        if episode_length + 1 > len(exchange_rates):
+            raise ValueError(f'episode_length of {episode_length} needs more than '
+                             f'{len(exchange_rates)} recorded exchange rates')
+        self.exchange_rates = np.ascontiguousarray(exchange_rates, dtype=np.float64)
+        # States can be computed once with compute_states and shared between environments
+        self.states = compute_states(self.exchange_rates, epochs) if states is None else states
+        self.episodes = episodes
+        self.episode_length = episode_length
+        self.quantity = quantity
+        self.random_state = np.random.RandomState(seed)
+
+        # Index of each episode's current sample in the recorded exchange rates
+        self.positions = np.zeros(episodes, dtype=np.int64)
+        self.steps = np.zeros(episodes, dtype=np.int64)
+        self.usd = np.zeros(episodes)
+        self.crypto = np.zeros(episodes)
+        self.fees_paid = np.zeros(episodes)
+        self.buys = np.zeros(episodes, dtype=np.int64)
+        self.sells = np.zeros(episodes, dtype=np.int64)
+        self.holds = np.zeros(episodes, dtype=np.int64)
+        reset(self, np.ones(episodes, dtype=bool))
+
+
+def construct(
+    exchange_rates: np.ndarray,
+    epochs: np.ndarray,
+    episodes: int = 64,
+    episode_length: int = 1000,
+    quantity: float = 1.0,
+    seed: int = 0,
+    states: Optional[np.ndarray] = None
+) -> QLearningEnvironment:
+    return QLearningEnvironment(
+        exchange_rates,
+        epochs,
+        episodes,
+        episode_length,
+        quantity,
+        seed,
+        states
+    )
+
+
+def reset(environment: QLearningEnvironment, episodes: np.ndarray) -> None:
+    ''' Starts new episodes at random offsets for every episode in the (episodes) mask '''
+    count = int(episodes.sum())
+    last_start = len(environment.exchange_rates) - environment.episode_length
+    environment.positions[episodes] = environment.random_state.randint(0, last_start, count)
+    environment.steps[episodes] = 0
+    environment.usd[episodes] = INITIAL_USD
+    environment.crypto[episodes] = 0.0
+    environment.fees_paid[episodes] = 0.0
+    environment.buys[episodes] = 0
+    environment.sells[episodes] = 0
+    environment.holds[episodes] = 0
+
+
+def observe(environment: QLearningEnvironment) -> np.ndarray:
+    ''' Returns the current (episodes, 3) states '''
+    return environment.states[environment.positions]
+
+
+def step(
+    environment: QLearningEnvironment,
+    actions: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    ''' Places one order per episode and advances every episode by one sample
+
+    (actions) are indices into q_learning_population.ORDERS.  Returns the
+    (next_states, rewards, done) of every episode.  Finished episodes are
+    reset, so their next state is the first state of a new episode.
+    '''
+    exchange_rates = environment.exchange_rates[environment.positions]
+    price = exchange_rates * environment.quantity
+    fee = TAKER_FEE_RATE * price
+
+    # Like buy_crypto and sell_crypto, orders the wallet can't afford are not
+    # placed and leave the record unchanged.  buy_crypto checks the balance
+    # before adding the fee, so the same check is used here.
+    buys = (actions == BUY) & (environment.usd - price >= 0)
+    sells = (actions == SELL) & (environment.crypto - environment.quantity >= 0)
+    holds = actions == HOLD
+
+    rewards = np.where(buys, -price - fee, 0.0) + np.where(sells, price - fee, 0.0)
+    environment.usd += rewards
+    environment.crypto += (buys.astype(np.float64) - sells) * environment.quantity
+    environment.fees_paid += np.where(buys | sells, fee, 0.0)
+    environment.buys += buys
+    environment.sells += sells
+    environment.holds += holds
+
+    environment.positions += 1
+    environment.steps += 1
+    done = environment.steps >= environment.episode_length
+    if done.any():
+        reset(environment, done)
+    return observe(environment), rewards, done
+
+
+def net_worth(environment: QLearningEnvironment) -> np.ndarray:
+    ''' Returns the usd value of every episode's wallet at the current exchange rate '''
+    return (
+        environment.usd +
+        environment.crypto * environment.exchange_rates[environment.positions]
+    )
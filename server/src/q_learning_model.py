@@ -9,14 +9,17 @@ Train Network
 
 import math
 import random
-from typing import Any, List
+from typing import Any, List, Union
 
 import fully_connected_neural_network
+import input_normalizer
 import numpy as np
 import q_memory
-import tensorflow as tf
+from feature_engine import Features
 from fully_connected_neural_network import FullyConnectedNeuralNetwork
+from input_normalizer import InputNormalizer
 from logger import logger
+from maybe import Maybe
 from pyrsistent import PRecord, field
 from q_memory import QMemory, QMemorySample
 from q_records import QModelInput, QModelOutput
@@ -30,28 +33,61 @@ Model = Any
 TensorFlowSession = Any
 
 
+# Features of the feature engine used as the neural network input
+FEATURES = ['exchange_rate', 'rate_of_change_100', 'moving_average_100']
+
+
 class QLearningModel(PRecord):
     memory = field(type=QMemory)
     neural_network = field(type=FullyConnectedNeuralNetwork)
-    session = field(type=tf.Session)
+    session: TensorFlowSession = field()  # tensorflow.Session
+    # Running statistics of the inputs added to memory, None when inputs are
+    # fed to the network as they are
+    normalizer = field(type=(InputNormalizer, type(None)), initial=None)
 
 
-def construct(session: TensorFlowSession) -> QLearningModel:
+def construct(
+    session: TensorFlowSession,
+    inference_backend: str = 'numpy',
+    precision: str = 'float64',
+    normalize_inputs: Maybe[bool] = None
+) -> QLearningModel:
+    ''' (normalize_inputs) defaults to normalizing in float32 only, where
+    exchange rates around 10^4 would otherwise swamp rates of change around
+    10^-3
+    '''
     neural_network = FullyConnectedNeuralNetwork(
         session,
         input_size=3,
         output_size=3,
-        batch_size=10
+        batch_size=10,
+        inference_backend=inference_backend,
+        precision=precision
     )
+    if normalize_inputs is None:
+        normalize_inputs = precision != 'float64'
     return QLearningModel(
         memory=q_memory.construct(1000),
         neural_network=neural_network,
-        session=session
+        session=session,
+        normalizer=input_normalizer.construct(3) if normalize_inputs else None
+    )
+
+
+def construct_input(features: Features) -> QModelInput:
+    return QModelInput(
+        exchange_rate=features['exchange_rate'],
+        rate_of_change=features['rate_of_change_100'],
+        moving_average=features['moving_average_100']
     )
 
 
 def predict(q_model_input: QModelInput, model: QLearningModel) -> QModelOutput:
-    input_tensor = translate_input_tensor(q_model_input)
+    input_tensor = translate_input_tensor(
+        q_model_input,
+        model.normalizer,
+        model.neural_network.dtype
+    )
     rewards_tensor = fully_connected_neural_network.predict_one(
         model.session,
         model.neural_network,
@@ -84,11 +120,18 @@ def predict_greedy_epsilon(
         return choose_best_action(rewards)
 
 
-def translate_input_tensor(q_model_input: QModelInput) -> List[float]:
+def translate_input_tensor(
+    q_model_input: QModelInput,
+    normalizer: Maybe[InputNormalizer] = None,
+    dtype: Union[type, np.dtype] = np.float64
+) -> np.ndarray:
     exchange_rate = np.float64(q_model_input.exchange_rate)
     rate_of_change = np.float64(q_model_input.rate_of_change)
     moving_average = np.float64(q_model_input.moving_average)
-    return np.array([exchange_rate, rate_of_change, moving_average])
+    input_tensor = np.array([exchange_rate, rate_of_change, moving_average])
+    if normalizer is None:
+        return input_tensor.astype(dtype, copy=False)
+    return input_normalizer.normalize(normalizer, input_tensor, dtype)
 
 
 def translate_output_tensor(rewards_tensor: List[List[float]]) -> QModelOutput:
@@ -98,7 +141,7 @@ def translate_output_tensor(rewards_tensor: List[List[float]]) -> QModelOutput:
     return QModelOutput(buy=buy, sell=sell, hold=hold)
 
 
-def create_output_tensor(rewards: QModelOutput) -> List[float]:
+def create_output_tensor(rewards: QModelOutput) -> np.ndarray:
     buy = np.float64(rewards['buy'])
     sell = np.float64(rewards['sell'])
     hold = np.float64(rewards['hold'])
@@ -116,8 +159,9 @@ def choose_best_action(rewards: QModelOutput) -> TradingAction:
 
 def train(model: QLearningModel) -> None:
     samples = q_memory.get_random_samples(10, model.memory)
-    x_train = np.zeros((len(samples), 3))
-    y_train = np.zeros((len(samples), 3))
+    dtype = model.neural_network.dtype
+    x_train = np.zeros((len(samples), 3), dtype=dtype)
+    y_train = np.zeros((len(samples), 3), dtype=dtype)
 
     for index, sample in enumerate(samples):
         state: QModelInput = sample['neural_network_input']
@@ -141,7 +185,7 @@ def train(model: QLearningModel) -> None:
             future_reward = reward + GAMMA * q_delta_reward
             predicted_actions = predicted_actions.set(action.order, np.float64(future_reward))
 
-        x_train[index] = translate_input_tensor(state)
+        x_train[index] = translate_input_tensor(state, model.normalizer, dtype)
         y_train[index] = create_output_tensor(predicted_actions)
 
     fully_connected_neural_network.train_batch(
@@ -164,4 +208,12 @@ def add_training_sample(
         reward=reward
     )
     updatedMemory = q_memory.add(q_memory_sample, model.memory)
+    if model.normalizer is not None:
+        return model.update({
+            'memory': updatedMemory,
+            'normalizer': input_normalizer.update(
+                model.normalizer,
+                translate_input_tensor(neural_network_input)
+            ),
+        })
     return model.set('memory', updatedMemory)
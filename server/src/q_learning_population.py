@@ -0,0 +1,311 @@
+'''
+A population of q-learning agents that trade the same tick stream with
+different hyperparameters.
+
+Every agent has the same 3 -> 50 -> 50 -> 3 network as q_learning_model, but the
+weights of all agents are stacked along a leading population axis.  Inference,
+the Q target calculation and the Adam update for the whole population each run
+as a handful of batched numpy matrix multiplications instead of one small
+matrix multiplication per agent (see benchmark_population.py).
+
+Agents share the replay memory states (they all see the same ticks) and only
+store their own actions and rewards.
+
+A population constructed with precision='float32' keeps its weights, Adam
+moments, replay memory and training batches in float32, and by default
+normalizes its inputs with their running mean and standard deviation (see
+input_normalizer.py and benchmark_precision.py).
+'''
+import copy
+import math
+import random
+from typing import List, Optional, Tuple
+
+import input_normalizer
+import numpy as np
+from input_normalizer import InputNormalizer
+from invariants import cannot_be_negative, must_be_positive, must_be_zero_to_one
+from maybe import Maybe
+from pyrsistent import PRecord, field
+
+ORDERS = ['buy', 'sell', 'hold']
+LAYER_SIZES = [3, 50, 50, 3]
+
+# Adam parameters matching tf.train.AdamOptimizer defaults
+BETA_1 = 0.9
+BETA_2 = 0.999
+ADAM_EPSILON = 1e-8
+
+
+class AgentHyperparameters(PRecord):
+    # Discount applied to the predicted reward of the next state
+    gamma = field(type=float, initial=0.15, invariant=must_be_zero_to_one)
+    min_epsilon = field(type=float, initial=0.1, invariant=must_be_zero_to_one)
+    max_epsilon = field(type=float, initial=0.75, invariant=must_be_zero_to_one)
+    # Rate at which epsilon decays from max_epsilon to min_epsilon (LAMBDA)
+    epsilon_decay = field(type=float, initial=0.0001, invariant=cannot_be_negative)
+    learning_rate = field(type=float, initial=0.001, invariant=must_be_positive)
+
+
+class QLearningPopulation:
+    def __init__(
+        self,
+        hyperparameters: List[AgentHyperparameters],
+        memory_size: int = 1000,
+        seed: int = 0,
+        precision: str = 'float64',
+        normalize_inputs: Maybe[bool] = None
+    ):
+        self.size = len(hyperparameters)
+        self.hyperparameters = hyperparameters
+        self.random_state = np.random.RandomState(seed)
+        self.dtype = np.dtype(precision)
+        # Running statistics of the states added to memory, None when states
+        # are fed to the networks as they are.  Normalized by default in
+        # float32 only.
+        if normalize_inputs is None:
+            normalize_inputs = precision != 'float64'
+        self.normalizer: Optional[InputNormalizer] = (
+            input_normalizer.construct(LAYER_SIZES[0]) if normalize_inputs else None
+        )
+
+        self.gamma = np.array([h.gamma for h in hyperparameters], dtype=self.dtype)
+        self.min_epsilon = np.array([h.min_epsilon for h in hyperparameters], dtype=self.dtype)
+        self.max_epsilon = np.array([h.max_epsilon for h in hyperparameters], dtype=self.dtype)
+        self.epsilon_decay = np.array([h.epsilon_decay for h in hyperparameters], dtype=self.dtype)
+        self.learning_rate = np.array([h.learning_rate for h in hyperparameters], dtype=self.dtype)
+
+        # [kernel, bias, kernel, bias, ...] with kernels shaped (agents, inputs, outputs)
+        # and biases shaped (agents, 1, outputs).  Kernels use glorot uniform
+        # initialization like tf.layers.Dense.
+        self.weights: List[np.ndarray] = []
+        for inputs, outputs in zip(LAYER_SIZES[:-1], LAYER_SIZES[1:]):
+            limit = math.sqrt(6.0 / (inputs + outputs))
+            self.weights.append(
+                self.random_state.uniform(-limit, limit, (self.size, inputs, outputs))
+                .astype(self.dtype)
+            )
+            self.weights.append(np.zeros((self.size, 1, outputs), dtype=self.dtype))
+        self.first_moments = [np.zeros_like(weights) for weights in self.weights]
+        self.second_moments = [np.zeros_like(weights) for weights in self.weights]
+        self.training_steps = 0
+
+        # Ring buffer replay memory.  States are stored before normalization so
+        # that batches are normalized with the latest statistics.
+        self.memory_size = memory_size
+        self.memory_states = np.zeros((memory_size, LAYER_SIZES[0]), dtype=self.dtype)
+        self.memory_actions = np.zeros((memory_size, self.size), dtype=np.int64)
+        self.memory_rewards = np.zeros((memory_size, self.size), dtype=self.dtype)
+        self.memory_length = 0
+        self.memory_start = 0
+
+        self.time_delta = 0
+
+
+def record_name(agent: int) -> str:
+    ''' Name of an agent's trading record in the trading record registry
+
+    Checkpoints prefix a record's arrays with its name, so it can't contain '/'.
+    '''
+    return f'q-learning-population-{agent}'
+
+
+def construct(
+    hyperparameters: List[AgentHyperparameters],
+    memory_size: int = 1000,
+    seed: int = 0,
+    precision: str = 'float64',
+    normalize_inputs: Maybe[bool] = None
+) -> QLearningPopulation:
+    return QLearningPopulation(hyperparameters, memory_size, seed, precision, normalize_inputs)
+
+
+def clone(population: QLearningPopulation) -> QLearningPopulation:
+    ''' A copy that trading and training (population) leave unchanged '''
+    return copy.deepcopy(population)
+
+
+def sample_hyperparameters(size: int, seed: int = 0) -> List[AgentHyperparameters]:
+    ''' Samples (size) agents around q_learning_model's hand-picked constants
+
+    The first agent always uses the same constants as q_learning_model.
+    '''
+    generator = random.Random(seed)
+    hyperparameters = [AgentHyperparameters()]
+    for _ in range(size - 1):
+        min_epsilon = generator.uniform(0.01, 0.2)
+        hyperparameters.append(AgentHyperparameters(
+            gamma=generator.uniform(0.0, 0.99),
+            min_epsilon=min_epsilon,
+            max_epsilon=generator.uniform(min_epsilon, 1.0),
+            epsilon_decay=10 ** generator.uniform(-5.0, -3.0),
+            learning_rate=10 ** generator.uniform(-4.0, -2.0)
+        ))
+    return hyperparameters[:size]
+
+
+def forward(weights: List[np.ndarray], inputs: np.ndarray) -> List[np.ndarray]:
+    ''' Evaluates every agent's network on the same (batch, 3) inputs
+
+    Returns the pre-activation output of each layer, each shaped
+    (agents, batch, outputs).  The last entry is the predicted rewards.
+    '''
+    layer_outputs = []
+    activations = inputs
+    last_layer = len(weights) - 2
+    for index in range(0, len(weights), 2):
+        # (batch, inputs) @ (agents, inputs, outputs) broadcasts over agents
+        layer_output = np.matmul(activations, weights[index]) + weights[index + 1]
+        layer_outputs.append(layer_output)
+        if index != last_layer:
+            activations = np.maximum(layer_output, 0.0)
+    return layer_outputs
+
+
+def network_inputs(population: QLearningPopulation, states: np.ndarray) -> np.ndarray:
+    ''' (states) as they are fed to the networks, in the population's precision '''
+    if population.normalizer is None:
+        return states.astype(population.dtype, copy=False)
+    return input_normalizer.normalize(population.normalizer, states, population.dtype)
+
+
+def predict(population: QLearningPopulation, state: np.ndarray) -> np.ndarray:
+    ''' Returns the predicted (buy, sell, hold) rewards of every agent, shaped (agents, 3) '''
+    inputs = network_inputs(population, state.reshape(1, -1))
+    return forward(population.weights, inputs)[-1][:, 0, :]
+
+
+def epsilon(population: QLearningPopulation) -> np.ndarray:
+    return (
+        population.min_epsilon +
+        (population.max_epsilon - population.min_epsilon) *
+        np.exp(-population.epsilon_decay * population.time_delta)
+    )
+
+
+def choose_actions(population: QLearningPopulation, state: np.ndarray) -> np.ndarray:
+    ''' Chooses an action index into ORDERS for every agent with epsilon greedy '''
+    greedy_actions = np.argmax(predict(population, state), axis=1)
+    random_actions = population.random_state.randint(0, len(ORDERS), population.size)
+    explore = population.random_state.random_sample(population.size) < epsilon(population)
+    return np.where(explore, random_actions, greedy_actions)
+
+
+def add_training_samples(
+    population: QLearningPopulation,
+    state: np.ndarray,
+    actions: np.ndarray,
+    rewards: np.ndarray
+) -> None:
+    if population.normalizer is not None:
+        population.normalizer = input_normalizer.update(population.normalizer, state)
+    # Overwrite the oldest sample once the memory is full
+    index = (population.memory_start + population.memory_length) % population.memory_size
+    population.memory_states[index] = state
+    population.memory_actions[index] = actions
+    population.memory_rewards[index] = rewards
+    if population.memory_length < population.memory_size:
+        population.memory_length += 1
+    else:
+        population.memory_start = (population.memory_start + 1) % population.memory_size
+
+
+def get_random_samples(
+    population: QLearningPopulation,
+    sample_size: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    ''' Returns a random run of consecutive (states, actions, rewards) like q_memory '''
+    length = population.memory_length
+    offset = 0
+    if length > sample_size:
+        offset = population.random_state.randint(0, length - sample_size + 1)
+    indices = (population.memory_start + offset + np.arange(min(sample_size, length))) \
+        % population.memory_size
+    return (
+        population.memory_states[indices],
+        population.memory_actions[indices].T,
+        population.memory_rewards[indices].T,
+    )
+
+
+def calculate_targets(
+    population: QLearningPopulation,
+    predicted_rewards: np.ndarray,
+    actions: np.ndarray,
+    rewards: np.ndarray
+) -> np.ndarray:
+    ''' Q(s, a) = r + GAMMA * max Q(s', a') for every agent and sample
+
+    Like q_learning_model.train, the next state of a sample is the following
+    sample and the last sample only receives its reward.
+    '''
+    future_rewards = rewards.copy()
+    future_rewards[:, :-1] += population.gamma[:, np.newaxis] * predicted_rewards[:, 1:].max(axis=2)
+    targets = predicted_rewards.copy()
+    agents, samples = np.indices(actions.shape)
+    targets[agents, samples, actions] = future_rewards
+    return targets
+
+
+def gradients(
+    weights: List[np.ndarray],
+    inputs: np.ndarray,
+    layer_outputs: List[np.ndarray],
+    targets: np.ndarray
+) -> List[np.ndarray]:
+    ''' Gradients of each agent's mean squared error, as tf.losses.mean_squared_error
+
+    (layer_outputs) are the outputs of forward(weights, inputs).
+    '''
+    batch_size = inputs.shape[0]
+    layer_gradient = 2.0 * (layer_outputs[-1] - targets) / targets[0].size
+    weight_gradients: List[np.ndarray] = []
+    for layer in range(len(layer_outputs) - 1, -1, -1):
+        if layer == 0:
+            activations = np.broadcast_to(inputs, (len(weights[0]), batch_size, inputs.shape[1]))
+        else:
+            activations = np.maximum(layer_outputs[layer - 1], 0.0)
+        weight_gradients.insert(0, layer_gradient.sum(axis=1, keepdims=True))
+        weight_gradients.insert(0, np.matmul(activations.transpose(0, 2, 1), layer_gradient))
+        if layer > 0:
+            layer_gradient = np.matmul(layer_gradient, weights[layer * 2].transpose(0, 2, 1))
+            layer_gradient *= layer_outputs[layer - 1] > 0
+    return weight_gradients
+
+
+def train(population: QLearningPopulation, sample_size: int = 10) -> None:
+    ''' Runs one Adam step for every agent on the same run of replay memory '''
+    if population.memory_length == 0:
+        return
+    states, actions, rewards = get_random_samples(population, sample_size)
+    states = network_inputs(population, states)
+    layer_outputs = forward(population.weights, states)
+    targets = calculate_targets(population, layer_outputs[-1], actions, rewards)
+
+    population.training_steps += 1
+    step = population.training_steps
+    learning_rate = (
+        population.learning_rate *
+        math.sqrt(1 - BETA_2 ** step) / (1 - BETA_1 ** step)
+    )[:, np.newaxis, np.newaxis]
+    # Updates are done in place, reusing the gradient as scratch space, because
+    # allocating temporaries dominates the arithmetic for a population this size
+    weight_gradients = gradients(population.weights, states, layer_outputs, targets)
+    for index, gradient in enumerate(weight_gradients):
+        # m = BETA_1 * m + (1 - BETA_1) * g  ==  BETA_1 * (m - g) + g
+        first_moment = population.first_moments[index]
+        first_moment -= gradient
+        first_moment *= BETA_1
+        first_moment += gradient
+        # v = BETA_2 * v + (1 - BETA_2) * g^2  ==  BETA_2 * (v - g^2) + g^2
+        second_moment = population.second_moments[index]
+        gradient *= gradient
+        second_moment -= gradient
+        second_moment *= BETA_2
+        second_moment += gradient
+        # w -= learning_rate * m / (sqrt(v) + epsilon)
+        np.sqrt(second_moment, out=gradient)
+        gradient += ADAM_EPSILON
+        np.divide(first_moment, gradient, out=gradient)
+        gradient *= learning_rate
+        population.weights[index] -= gradient
@@ -1,10 +1,11 @@
 
 from pyrsistent import PRecord, field
+from slot_record import SlotRecord
 
 # TODO: rename to NeuralNetworkInput and NeuralNetworkOutput
 
 
-class QModelInput(PRecord):
+class QModelInput(SlotRecord):
     exchange_rate = field(type=float)
     rate_of_change = field(type=float)
     moving_average = field(type=float)
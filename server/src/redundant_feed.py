@@ -0,0 +1,324 @@
+'''
+Redundant feed ingest.  The same products are subscribed on several websocket
+connections at once and their messages are merged, so a slow or dropped
+connection doesn't delay or lose messages that another connection has.
+
+Each message is passed on when it first arrives on any connection.  Later
+arrivals of the same message are recognised by a DedupWindow, a ring of bits
+indexed by sequence number that's kept for each product and message type (a
+ticker shares its match's sequence number).  Messages without a sequence
+number, like level2 updates, are only taken from the primary connection: the
+longest connected one that's still open.
+
+Every connection counts the messages it delivered first and how far behind
+the first arrival its duplicates were, which shows the faster connection.  A
+sequence number that a connection carries on several channels is counted once.
+Dropped connections reconnect in the background while the others carry on.
+
+Run from the server directory to compare connections to a feed:
+    python src/redundant_feed.py wss://ws-feed.pro.coinbase.com/ --connections 2
+'''
+import argparse
+import json
+import sys
+import threading
+import time
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from logger import logger
+from pyrsistent import PRecord, field
+
+Message = Dict[str, Any]
+# Feed messages are passed on as they're decoded, the callback gives them a type
+OnMessage = Callable[[Any], Any]
+# Sequence numbers remembered by each window, a power of two
+DEDUP_WINDOW = 1 << 16
+
+
+class DedupWindow:
+    ''' Which of the last (size) sequence numbers have arrived, as a ring of bits '''
+    def __init__(self, size: int = DEDUP_WINDOW):
+        if size <= 0 or size & (size - 1) != 0:
+            raise ValueError(f'window size must be a power of two, not {size}')
+        self.mask = size - 1
+        self.bits = bytearray(size // 8 or 1)
+        # Perf counter of each sequence number's first arrival
+        self.arrivals = array('d', bytes(8 * size))
+        self.highest: Optional[int] = None
+
+
+def mark(window: DedupWindow, sequence: int, now: float) -> bool:
+    ''' Marks (sequence) as arrived at (now), returns whether it's the first arrival.
+    Sequence numbers older than the window are assumed to have arrived.
+    '''
+    highest = window.highest
+    if highest is None:
+        highest = sequence - 1
+    if sequence > highest:
+        if sequence - highest > window.mask:
+            window.bits = bytearray(len(window.bits))
+        else:
+            # Frees the ring's slots for the new sequence numbers
+            for skipped in range(highest + 1, sequence + 1):
+                index = skipped & window.mask
+                window.bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+        window.highest = sequence
+    elif sequence < highest - window.mask:
+        return False
+    index = sequence & window.mask
+    bit = 1 << (index & 7)
+    if window.bits[index >> 3] & bit:
+        return False
+    window.bits[index >> 3] |= bit
+    window.arrivals[index] = now
+    return True
+
+
+def seconds_behind(window: DedupWindow, sequence: int, now: float) -> Optional[float]:
+    ''' Seconds since (sequence) first arrived, None when it's older than the window '''
+    if window.highest is None or sequence < window.highest - window.mask:
+        return None
+    return now - window.arrivals[sequence & window.mask]
+
+
+class Connection:
+    def __init__(self, url: str, index: int):
+        self.url = url
+        self.index = index
+        self.socket: Any = None
+        self.connected = False
+        # Perf counter of the current connection
+        self.connected_at = 0.0
+        self.disconnects = 0
+        # Sequence numbers this connection carried, for each product
+        self.windows: Dict[str, DedupWindow] = {}
+        self.received = 0
+        self.first_arrivals = 0
+        self.duplicates = 0
+        # Seconds the duplicates arrived after the first arrival
+        self.total_lag = 0.0
+        self.maximum_lag = 0.0
+
+
+class ConnectionStatistics(PRecord):
+    url = field(type=str, mandatory=True)
+    connected = field(type=bool, initial=False)
+    disconnects = field(type=int, initial=0)
+    received = field(type=int, initial=0)
+    # Messages this connection delivered before any other
+    first_arrivals = field(type=int, initial=0)
+    duplicates = field(type=int, initial=0)
+    mean_lag = field(type=float, initial=0.0)
+    maximum_lag = field(type=float, initial=0.0)
+
+
+class RedundantFeed:
+    def __init__(
+        self,
+        urls: Sequence[str],
+        on_message: OnMessage,
+        product_ids: Sequence[str],
+        channels: Sequence[str],
+        window_size: int,
+        reconnect_delay: float
+    ):
+        self.connections = [Connection(url, index) for index, url in enumerate(urls)]
+        self.on_message = on_message
+        self.product_ids = list(product_ids)
+        self.channels = list(channels)
+        self.window_size = window_size
+        self.reconnect_delay = reconnect_delay
+        self.windows: Dict[Tuple[str, str], DedupWindow] = {}
+        self.primary: Optional[Connection] = None
+        self.delivered = 0
+        # Messages are merged and passed on one at a time
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.threads: List[threading.Thread] = []
+
+
+def construct(
+    urls: Sequence[str],
+    on_message: OnMessage,
+    product_ids: Sequence[str] = ('BTC-USD',),
+    channels: Sequence[str] = ('matches',),
+    window_size: int = DEDUP_WINDOW,
+    reconnect_delay: float = 1.0
+) -> RedundantFeed:
+    if len(urls) == 0:
+        raise ValueError('a redundant feed needs at least one url')
+    return RedundantFeed(urls, on_message, product_ids, channels, window_size, reconnect_delay)
+
+
+def receive(feed: RedundantFeed, connection: Connection, message: Message, now: float) -> bool:
+    ''' Passes (message) on unless it already arrived on another connection '''
+    with feed.lock:
+        sequence = message.get('sequence')
+        if sequence is None:
+            connection.received += 1
+            if connection is not feed.primary:
+                return False
+        else:
+            product_id = message.get('product_id', '')
+            key = (product_id, message.get('type', ''))
+            window = feed.windows.get(key)
+            if window is None:
+                window = feed.windows[key] = DedupWindow(feed.window_size)
+            carried = connection.windows.get(product_id)
+            if carried is None:
+                carried = connection.windows[product_id] = DedupWindow(feed.window_size)
+            # Only the first channel to carry a sequence number on this
+            # connection counts, a ticker after its match is no new arrival
+            counted = mark(carried, sequence, now)
+            if counted:
+                connection.received += 1
+            if not mark(window, sequence, now):
+                if counted:
+                    connection.duplicates += 1
+                    lag = seconds_behind(window, sequence, now)
+                    if lag is not None:
+                        connection.total_lag += lag
+                        connection.maximum_lag = max(connection.maximum_lag, lag)
+                return False
+            if counted:
+                connection.first_arrivals += 1
+        feed.delivered += 1
+        try:
+            feed.on_message(message)
+        except Exception as error:
+            logger.error(f'Unable to process a feed message: {error!r}')
+        return True
+
+
+def elect_primary(feed: RedundantFeed) -> None:
+    connected = [connection for connection in feed.connections if connection.connected]
+    feed.primary = min(
+        connected,
+        key=lambda connection: connection.connected_at
+    ) if len(connected) > 0 else None
+
+
+def listen(feed: RedundantFeed, connection: Connection) -> None:
+    ''' Reads (connection) until the feed stops, reconnecting when it drops '''
+    # websocket-client is installed with cbpro
+    from websocket import create_connection
+    while not feed.stopped.is_set():
+        try:
+            connection.socket = create_connection(connection.url, timeout=5.0)
+            connection.socket.settimeout(None)
+            connection.socket.send(json.dumps({
+                'type': 'subscribe',
+                'product_ids': feed.product_ids,
+                'channels': feed.channels,
+            }))
+            with feed.lock:
+                connection.connected = True
+                connection.connected_at = time.perf_counter()
+                elect_primary(feed)
+            while True:
+                data = connection.socket.recv()
+                now = time.perf_counter()
+                if data == '':
+                    raise ConnectionError('feed closed the connection')
+                message = json.loads(data)
+                if message.get('type') != 'subscriptions':
+                    receive(feed, connection, message, now)
+        except Exception as error:
+            if not feed.stopped.is_set():
+                logger.warn(f'feed connection {connection.index} to {connection.url} '
+                            f'dropped: {error!r}')
+        finally:
+            with feed.lock:
+                if connection.connected:
+                    connection.disconnects += 1
+                connection.connected = False
+                elect_primary(feed)
+            if connection.socket is not None:
+                connection.socket.close()
+                connection.socket = None
+        feed.stopped.wait(feed.reconnect_delay)
+
+
+def start(feed: RedundantFeed) -> RedundantFeed:
+    feed.threads = [
+        threading.Thread(target=listen, args=(feed, connection), daemon=True)
+        for connection in feed.connections
+    ]
+    for thread in feed.threads:
+        thread.start()
+    return feed
+
+
+def stop(feed: RedundantFeed) -> None:
+    feed.stopped.set()
+    for connection in feed.connections:
+        socket = connection.socket
+        if socket is not None:
+            # Interrupts the connection's blocking read
+            socket.shutdown()
+    for thread in feed.threads:
+        thread.join()
+
+
+def statistics(feed: RedundantFeed) -> List[ConnectionStatistics]:
+    with feed.lock:
+        return [
+            ConnectionStatistics(
+                url=connection.url,
+                connected=connection.connected,
+                disconnects=connection.disconnects,
+                received=connection.received,
+                first_arrivals=connection.first_arrivals,
+                duplicates=connection.duplicates,
+                mean_lag=connection.total_lag / max(connection.duplicates, 1),
+                maximum_lag=connection.maximum_lag,
+            )
+            for connection in feed.connections
+        ]
+
+
+def log_statistics(feed: RedundantFeed) -> None:
+    for index, stats in enumerate(statistics(feed)):
+        logger.log(
+            f'feed connection {index} {stats.url}: '
+            f'{"connected" if stats.connected else "disconnected"}, '
+            f'{stats.first_arrivals}/{stats.received} first, '
+            f'duplicates {stats.mean_lag * 1000:.2f} ms behind on average '
+            f'({stats.maximum_lag * 1000:.2f} ms at most), {stats.disconnects} disconnects'
+        )
+
+
+def main(arguments: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Compares redundant connections to a feed')
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('--connections', type=int, default=1,
+                        help='connections to each url')
+    parser.add_argument('--products', default='BTC-USD')
+    parser.add_argument('--channels', default='matches')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    options = parser.parse_args(arguments)
+
+    try:
+        import websocket  # noqa: F401
+    except ImportError as error:
+        print(f'skipped ({error})')
+        return 0
+    feed = start(construct(
+        [url for url in options.urls for _ in range(options.connections)],
+        lambda message: None,
+        options.products.split(','),
+        options.channels.split(',')
+    ))
+    try:
+        time.sleep(options.seconds)
+    except KeyboardInterrupt:
+        pass
+    stop(feed)
+    print(f'{feed.delivered} messages delivered')
+    log_statistics(feed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
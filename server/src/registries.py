@@ -1,14 +1,25 @@
-from typing import Dict
+from typing import Dict, Iterable, Tuple
 
 from algorithmic_model import AlgorithmicModel
 from mypy_extensions import TypedDict
 from q_learning_model import QLearningModel
+from q_learning_population import QLearningPopulation
 from trading_record import TradingRecord
 
+STRATEGIES = ('q-learning', 'q-learning-population', 'algorithmic', 'random')
+
+
+def valid_strategies(strategies: Iterable[str]) -> Tuple[bool, str]:
+    valid = all(strategy in STRATEGIES for strategy in strategies)
+    return valid, f'strategies must be one of {", ".join(STRATEGIES)}'
+
+
+# Only strategies enabled in config/default.json have an entry
 TradingModelRegistry = TypedDict('TradingModelRegistry', {
     'q-learning': QLearningModel,
+    'q-learning-population': QLearningPopulation,
     'algorithmic': AlgorithmicModel
-})
+}, total=False)
 
 # TODO: convert to typed dictionary
 TradingRecordRegistry = Dict[str, TradingRecord]
@@ -0,0 +1,127 @@
+'''
+Publishes immutable per-tick snapshots of the trading registries.
+
+The websocket thread owns the mutable registries and bar aggregators and
+publishes a snapshot of them after every message that changed them.  Flask request threads only ever
+read from a published snapshot, so a request never sees records from different
+ticks mixed together.
+'''
+import threading
+from typing import Any, Callable, Mapping
+
+from bar_aggregator import PublishedBars
+from maybe import Maybe
+from pyrsistent import PMap, PRecord, field, pmap, pmap_field
+from trading_record import TradingRecord
+
+
+class RegistrySnapshot(PRecord):
+    trading_records = pmap_field(str, TradingRecord)
+    trading_models = field(type=PMap, mandatory=True)
+    tick = field(type=int, mandatory=True)
+    # Drives the q-learning epsilon decay
+    time_delta = field(type=int, initial=0)
+    # Copies of the state that models update in place, taken between ticks
+    # when a reader requested them (see SnapshotPublisher.request_capture)
+    captured = field(type=(PMap, type(None)), initial=None)
+    # bar_aggregator.PublishedBars of every product and resolution
+    bars = field(type=PMap, initial=pmap())
+
+
+def construct(
+    trading_record_registry: Mapping[str, TradingRecord],
+    trading_model_registry: Mapping[str, Any],
+    tick: int = 0,
+    time_delta: int = 0,
+    captured: Maybe[Mapping[str, Any]] = None,
+    bars: Maybe[Mapping[str, Mapping[str, PublishedBars]]] = None
+) -> RegistrySnapshot:
+    return RegistrySnapshot(
+        trading_records=pmap(trading_record_registry),
+        trading_models=pmap(trading_model_registry),
+        tick=tick,
+        time_delta=time_delta,
+        captured=pmap(captured) if captured is not None else None,
+        bars=pmap({
+            product: pmap(published) for product, published in bars.items()
+        }) if bars is not None else pmap()
+    )
+
+
+class SnapshotPublisher:
+    ''' Holds a reference to the most recently published RegistrySnapshot
+
+    Records, and models other than the ones below, are immutable, so
+    publishing is a single reference assignment (atomic under the GIL).  The
+    trading thread only takes a lock to publish a requested capture, and
+    readers take the reference once per request and read everything from
+    that one snapshot.
+
+    The q-learning network's weights live in its tensorflow session and the
+    q-learning population trains its numpy arrays in place, so a snapshot
+    only refers to their latest state, which may be halfway through a tick.
+    Readers that need them consistent with the snapshot's records request a
+    capture: the trading thread copies them with (capture) into the next
+    snapshot it publishes.
+    '''
+    def __init__(
+        self,
+        snapshot: RegistrySnapshot,
+        capture: Callable[[], Mapping[str, Any]] = dict
+    ):
+        self._snapshot = snapshot
+        self.capture = capture
+        # The latest published snapshot with captured state
+        self._captured: Maybe[RegistrySnapshot] = None
+        # Captures are counted in generations: each request asks for a new
+        # one, and a published capture answers the requests made before the
+        # trading thread decided to take it
+        self._capture_changed = threading.Condition()
+        self._requested_generation = 0
+        self._capturing_generation = 0
+        self._published_generation = 0
+
+    def publish(self, snapshot: RegistrySnapshot) -> None:
+        self._snapshot = snapshot
+        if snapshot.captured is not None:
+            with self._capture_changed:
+                self._captured = snapshot
+                self._published_generation = max(
+                    self._published_generation,
+                    self._capturing_generation
+                )
+                self._capture_changed.notify_all()
+
+    def current(self) -> RegistrySnapshot:
+        return self._snapshot
+
+    def capture_requested(self) -> bool:
+        ''' Called by the trading thread before it publishes, a capture it
+        publishes next answers the requests made up to this call
+        '''
+        self._capturing_generation = self._requested_generation
+        return self._capturing_generation > self._published_generation
+
+    def request_capture(self, timeout: float) -> Maybe[RegistrySnapshot]:
+        ''' Waits up to (timeout) seconds for the trading thread to publish a
+        snapshot with captured state.  Returns the latest snapshot with
+        captured state, which is an older one when the trading thread doesn't
+        publish in time and None when it never has.
+        '''
+        with self._capture_changed:
+            self._requested_generation += 1
+            generation = self._requested_generation
+            self._capture_changed.wait_for(
+                lambda: self._published_generation >= generation,
+                timeout
+            )
+            return self._captured
+
+    def capture_current(self) -> RegistrySnapshot:
+        ''' Captures state on the calling thread, for once the trading thread
+        has stopped publishing
+        '''
+        self._capturing_generation = self._requested_generation
+        snapshot = self._snapshot.set('captured', pmap(self.capture()))
+        self.publish(snapshot)
+        return snapshot
@@ -0,0 +1,131 @@
+'''
+On demand stack sampling of the trading thread.
+
+While a profile is taken the requesting thread reads the stacks of the other
+threads from sys._current_frames() every (interval) seconds and counts each
+distinct stack.  Nothing is installed in the trading thread: no trace or
+profile hooks, and no sampling thread exists between profiles, so there is no
+overhead unless a profile is being taken.
+
+A thread that holds the GIL only hands it to a waiting thread every switch
+interval (5ms by default), so a sampler waking up mostly finds the trading
+thread at the points where it released the GIL rather than in the middle of
+a tick.  The switch interval is shortened for the duration of a profile, to
+sample pure Python code evenly at the cost of more frequent GIL handoffs.
+
+A profile can be focused on a function, e.g. the websocket client's
+on_message.  Stacks are then cut at the outermost call of the function and
+stacks without it, such as threads waiting on their sockets, are only
+counted as samples.  Stacks are returned in the collapsed format of
+flamegraph.pl and speedscope:
+
+    trading_client:on_message;...;trading_record:place_order 42
+'''
+import collections
+import os
+import sys
+import threading
+import time
+from types import CodeType, FrameType
+from typing import Any, Callable, Dict, List, Optional
+
+from invariants import cannot_be_negative, must_be_positive
+from maybe import Maybe
+from pyrsistent import PRecord, field, pmap_field
+from result import Result, Warning
+
+DEFAULT_SECONDS = 5.0
+MAXIMUM_SECONDS = 60.0
+DEFAULT_INTERVAL = 0.005
+MINIMUM_INTERVAL = 0.001
+# Seconds between GIL handoffs while a profile is taken
+SWITCH_INTERVAL = 0.0001
+
+
+class Profile(PRecord):
+    seconds = field(type=float, mandatory=True, invariant=cannot_be_negative)
+    interval = field(type=float, mandatory=True, invariant=must_be_positive)
+    # Times the threads' stacks were read
+    samples = field(type=int, mandatory=True, invariant=cannot_be_negative)
+    # Collapsed stacks and the number of samples they were seen in
+    stacks = pmap_field(str, int)
+
+
+class SamplingProfiler:
+    def __init__(self, focus: Maybe[Callable[..., Any]] = None):
+        # Code of the function that stacks are cut at, bound methods included
+        self.focus: Optional[CodeType] = (
+            getattr(focus, '__func__', focus).__code__ if focus is not None else None
+        )
+        # Only one profile is taken at a time
+        self.lock = threading.Lock()
+
+
+def construct(focus: Maybe[Callable[..., Any]] = None) -> SamplingProfiler:
+    return SamplingProfiler(focus)
+
+
+def frame_name(frame: FrameType) -> str:
+    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f'{module}:{frame.f_code.co_name}'
+
+
+def collapse(frame: FrameType, focus: Optional[CodeType]) -> Maybe[str]:
+    ''' The stack of (frame) from its outermost frame, or from the outermost
+    call of (focus) when it's given
+    '''
+    names: List[str] = []
+    focused = 0
+    current: Optional[FrameType] = frame
+    while current is not None:
+        names.append(frame_name(current))
+        if current.f_code is focus:
+            focused = len(names)
+        current = current.f_back
+    if focus is not None:
+        if focused == 0:
+            return None
+        names = names[:focused]
+    return ';'.join(reversed(names))
+
+
+def sample(
+    profiler: SamplingProfiler,
+    seconds: float = DEFAULT_SECONDS,
+    interval: float = DEFAULT_INTERVAL
+) -> Result[Profile]:
+    ''' Samples the stacks of every other thread for (seconds) '''
+    if not profiler.lock.acquire(blocking=False):
+        return Warning('a profile is already being taken')
+    try:
+        seconds = min(max(seconds, 0.0), MAXIMUM_SECONDS)
+        interval = max(interval, MINIMUM_INTERVAL)
+        sampler = threading.get_ident()
+        stacks: Dict[str, int] = collections.Counter()
+        samples = 0
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, SWITCH_INTERVAL))
+        try:
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                for thread, frame in sys._current_frames().items():
+                    if thread == sampler:
+                        continue
+                    stack = collapse(frame, profiler.focus)
+                    if stack is not None:
+                        stacks[stack] += 1
+                samples += 1
+                time.sleep(interval)
+        finally:
+            sys.setswitchinterval(switch_interval)
+        return Profile(seconds=seconds, interval=interval, samples=samples, stacks=stacks)
+    finally:
+        profiler.lock.release()
+
+
+def collapsed(profile: Profile) -> str:
+    ''' The stacks in the collapsed format, most sampled first '''
+    return ''.join(
+        f'{stack} {count}\n'
+        for stack, count in sorted(profile.stacks.items(), key=lambda item: -item[1])
+    )
@@ -0,0 +1,295 @@
+'''
+Detects dropped feed messages from their sequence numbers and resyncs from a
+REST snapshot without reconnecting.
+
+Every product's messages on the full channel carry consecutive sequence
+numbers.  A message that skips ahead means messages were dropped, so the
+product's messages are buffered while its level2 book and recent trades are
+fetched in the background.  Once the snapshot arrives the tracker passes on,
+in order:
+
+    a 'snapshot' message with the book at the snapshot's sequence number
+    the trades that were missed, as 'match' messages
+    the buffered messages newer than the snapshot
+
+Messages at or before the last sequence number are duplicates and dropped,
+except for other message types at the same sequence number, e.g. the ticker
+of a match.  Matches at or before the last trade are dropped too, so trades
+that were replayed from the snapshot aren't applied again when the feed
+delivers them.  Messages without a sequence number, like level2 updates, are
+passed on as they are.
+
+The snapshot is fetched on another thread, so the websocket keeps reading
+while it's fetched.  The buffer is replayed with the first message after the
+snapshot arrives, or by poll(), which replays every product's buffer and is
+called for every message so a quiet product doesn't wait for its own.  Failed
+fetches are retried with exponential backoff, and the buffer only keeps the
+newest (maximum_buffer_size) messages while they fail.
+
+    tracker = sequence_tracker.construct(sequence_tracker.rest_snapshot(API_URL))
+    for message in sequence_tracker.receive(tracker, message):
+        ...
+'''
+import collections
+import concurrent.futures
+import json
+import time
+import urllib.request
+from typing import Any, Callable, Deque, Dict, List, Mapping, Optional, Set
+
+from logger import logger
+from pyrsistent import PRecord, field
+
+Message = Mapping[str, Any]
+
+# Seconds before the first retry of a failed snapshot fetch, doubled after
+# every further failure up to MAXIMUM_RETRY_DELAY
+RETRY_DELAY = 0.5
+MAXIMUM_RETRY_DELAY = 30.0
+# Messages buffered per product while resyncing
+MAXIMUM_BUFFER_SIZE = 100000
+
+
+class Snapshot(PRecord):
+    product_id = field(type=str, mandatory=True)
+    sequence = field(type=int, mandatory=True)
+    # [price, size, order count] levels as strings, best first
+    bids = field(type=list, initial=[])
+    asks = field(type=list, initial=[])
+    # Recent trades as match messages, newest first
+    trades = field(type=list, initial=[])
+
+
+FetchSnapshot = Callable[[str], Snapshot]
+
+
+class ProductState:
+    def __init__(self, maximum_buffer_size: int, retry_delay: float) -> None:
+        self.sequence: Optional[int] = None
+        # Message types seen at (sequence)
+        self.types: Set[str] = set()
+        self.trade_id: Optional[int] = None
+        # Messages received while a snapshot is fetched, oldest dropped first
+        self.buffer: Deque[Message] = collections.deque(maxlen=maximum_buffer_size)
+        self.snapshot: Optional[concurrent.futures.Future] = None
+        self.gap_detected = 0.0
+        # Whether the buffer dropped messages since the gap
+        self.overflowed = False
+        # When a failed snapshot is fetched again, None until the failure is seen
+        self.retry_at: Optional[float] = None
+        self.retry_delay = retry_delay
+
+
+class SequenceTracker:
+    def __init__(
+        self,
+        fetch_snapshot: Optional[FetchSnapshot],
+        maximum_buffer_size: int,
+        retry_delay: float
+    ):
+        self.fetch_snapshot = fetch_snapshot
+        self.maximum_buffer_size = maximum_buffer_size
+        self.retry_delay = retry_delay
+        self.products: Dict[str, ProductState] = {}
+        self.executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.gaps = 0
+        self.duplicates = 0
+        # Buffered messages dropped because the buffer was full
+        self.overflows = 0
+        # Seconds from detecting each gap to replaying its buffer
+        self.recovery_times: List[float] = []
+
+
+def construct(
+    fetch_snapshot: Optional[FetchSnapshot] = None,
+    maximum_buffer_size: int = MAXIMUM_BUFFER_SIZE,
+    retry_delay: float = RETRY_DELAY
+) -> SequenceTracker:
+    ''' Gaps are only logged when there's no way to (fetch_snapshot) '''
+    return SequenceTracker(fetch_snapshot, maximum_buffer_size, retry_delay)
+
+
+def fetch_json(url: str, timeout: float) -> Any:
+    request = urllib.request.Request(url, headers={'User-Agent': 'hf-trader'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def rest_snapshot(api_url: str, timeout: float = 2.0) -> FetchSnapshot:
+    ''' Fetches snapshots from the Coinbase Pro REST API or a stand-in at (api_url) '''
+    def fetch(product_id: str) -> Snapshot:
+        book = fetch_json(f'{api_url}/products/{product_id}/book?level=2', timeout)
+        trades = fetch_json(f'{api_url}/products/{product_id}/trades', timeout)
+        return Snapshot(
+            product_id=product_id,
+            sequence=int(book['sequence']),
+            bids=book['bids'],
+            asks=book['asks'],
+            trades=[dict(trade, type='match', product_id=product_id) for trade in trades]
+        )
+    return fetch
+
+
+def receive(tracker: SequenceTracker, message: Message) -> List[Message]:
+    ''' Returns the messages to process in order, none while resyncing '''
+    product_id = message.get('product_id')
+    if product_id is None:
+        return [message]
+    state = tracker.products.get(product_id)
+    if state is None:
+        state = tracker.products[product_id] = ProductState(
+            tracker.maximum_buffer_size,
+            tracker.retry_delay
+        )
+    if state.snapshot is not None:
+        buffer(tracker, product_id, state, message)
+        if state.snapshot.done():
+            return resync(tracker, product_id, state)
+        return []
+    sequence = message.get('sequence')
+    if sequence is None:
+        return [message]
+    if state.sequence is not None and sequence <= state.sequence:
+        if sequence < state.sequence or message['type'] in state.types:
+            tracker.duplicates += 1
+            return []
+        state.types.add(message['type'])
+    elif state.sequence is not None and sequence > state.sequence + 1 and (
+        tracker.fetch_snapshot is not None
+    ):
+        logger.warn(f'{product_id} messages {state.sequence + 1} to {sequence - 1} '
+                    'were dropped, resyncing from a snapshot')
+        tracker.gaps += 1
+        state.gap_detected = time.perf_counter()
+        state.overflowed = False
+        state.buffer.clear()
+        state.buffer.append(message)
+        request_snapshot(tracker, product_id, state)
+        return []
+    else:
+        if state.sequence is not None and sequence > state.sequence + 1:
+            logger.warn(f'{product_id} messages {state.sequence + 1} to {sequence - 1} '
+                        'were dropped')
+            tracker.gaps += 1
+        state.sequence = sequence
+        state.types = {message['type']}
+    if message['type'] == 'match' and message.get('trade_id') is not None:
+        if state.trade_id is not None and message['trade_id'] <= state.trade_id:
+            tracker.duplicates += 1
+            return []
+        state.trade_id = message['trade_id']
+    return [message]
+
+
+def buffer(
+    tracker: SequenceTracker,
+    product_id: str,
+    state: ProductState,
+    message: Message
+) -> None:
+    if len(state.buffer) == state.buffer.maxlen:
+        if not state.overflowed:
+            logger.warn(f'{product_id} resync buffer is full, dropping the oldest messages')
+            state.overflowed = True
+        tracker.overflows += 1
+    state.buffer.append(message)
+
+
+def request_snapshot(tracker: SequenceTracker, product_id: str, state: ProductState) -> None:
+    if tracker.executor is None:
+        tracker.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    assert tracker.fetch_snapshot is not None
+    state.snapshot = tracker.executor.submit(tracker.fetch_snapshot, product_id)
+
+
+def resync(tracker: SequenceTracker, product_id: str, state: ProductState) -> List[Message]:
+    ''' Replays the buffered messages over the fetched snapshot '''
+    assert state.snapshot is not None
+    error = state.snapshot.exception()
+    if error is not None:
+        now = time.perf_counter()
+        if state.retry_at is None:
+            logger.error(f'Unable to fetch a {product_id} snapshot, trying again in '
+                         f'{state.retry_delay:.1f}s: {error!r}')
+            state.retry_at = now + state.retry_delay
+            state.retry_delay = min(state.retry_delay * 2, MAXIMUM_RETRY_DELAY)
+        elif now >= state.retry_at:
+            state.retry_at = None
+            request_snapshot(tracker, product_id, state)
+        return []
+    snapshot = state.snapshot.result()
+    buffered = list(state.buffer)
+    state.buffer.clear()
+    state.snapshot = None
+    state.retry_delay = tracker.retry_delay
+    state.sequence = snapshot.sequence
+    state.types = set()
+    messages: List[Message] = [{
+        'type': 'snapshot',
+        'product_id': product_id,
+        'sequence': snapshot.sequence,
+        'bids': snapshot.bids,
+        'asks': snapshot.asks,
+    }]
+
+    # Buffered messages older than the snapshot are part of it, and trades that
+    # are still to come from the buffer aren't replayed ahead of it.  Replayed
+    # trades newer than the buffer are dropped when the feed delivers them.
+    buffered = [
+        message for message in buffered
+        if message.get('sequence', snapshot.sequence + 1) > snapshot.sequence
+    ]
+    buffered_trades = [
+        message['trade_id'] for message in buffered
+        if message['type'] == 'match' and message.get('trade_id') is not None
+    ]
+    first_buffered_trade = min(buffered_trades) if buffered_trades else None
+    missed_trades = sorted(
+        (
+            trade for trade in snapshot.trades
+            if (state.trade_id is None or trade['trade_id'] > state.trade_id) and
+            (first_buffered_trade is None or trade['trade_id'] < first_buffered_trade)
+        ),
+        key=lambda trade: trade['trade_id']
+    )
+    if state.trade_id is not None and len(missed_trades) > 0 and (
+        missed_trades[0]['trade_id'] > state.trade_id + 1
+    ):
+        logger.warn(f'{product_id} trades {state.trade_id + 1} to '
+                    f'{missed_trades[0]["trade_id"] - 1} are older than the snapshot')
+    # Without a previous trade there's nothing to catch up on
+    if state.trade_id is not None:
+        messages += missed_trades
+    if len(missed_trades) > 0:
+        state.trade_id = missed_trades[-1]['trade_id']
+
+    for index, message in enumerate(buffered):
+        if state.snapshot is not None:
+            # Another gap in the buffer, the rest waits for the next snapshot
+            state.buffer.extend(buffered[index:])
+            return messages
+        messages += receive(tracker, message)
+    tracker.recovery_times.append(time.perf_counter() - state.gap_detected)
+    return messages
+
+
+def poll(tracker: SequenceTracker) -> List[Message]:
+    ''' Replays the buffers of fetched snapshots, and fetches failed snapshots
+    again once their retry is due, without waiting for another message
+    '''
+    messages: List[Message] = []
+    for product_id, state in tracker.products.items():
+        if state.snapshot is not None and state.snapshot.done():
+            messages += resync(tracker, product_id, state)
+    return messages
+
+
+def is_resyncing(tracker: SequenceTracker, product_id: str) -> bool:
+    state = tracker.products.get(product_id)
+    return state is not None and state.snapshot is not None
+
+
+def close(tracker: SequenceTracker) -> None:
+    if tracker.executor is not None:
+        tracker.executor.shutdown(wait=False)
+        tracker.executor = None
@@ -0,0 +1,107 @@
+'''
+Single-writer shared memory channel between the trading process and the web
+workers.
+
+The trading process writes serialized trading state into a memory mapped file
+and any number of worker processes map the same file read-only.  Writes are
+guarded by a sequence lock: the sequence number is odd while a write is in
+progress, so readers retry instead of blocking the writer.  A writer that
+died mid-write leaves the sequence number odd, so readers give up retrying
+after READ_TIMEOUT seconds and return the last payload they read in full.
+
+The writer never truncates an existing file, which would pull the pages out
+from under readers that already mapped it.  It only grows the file to its
+capacity and carries on from the sequence number in the file.
+'''
+import mmap
+import os
+import struct
+import time
+from typing import Tuple
+
+from logger import logger
+from result import Error, Result
+
+# (sequence, payload length)
+HEADER = struct.Struct('<QQ')
+DEFAULT_CAPACITY = 8 * 1024 * 1024  # 8 MB
+# Retries without sleeping, which covers writes that are about to finish
+SPIN_RETRIES = 100
+# Seconds slept between later retries
+RETRY_INTERVAL = 0.0005
+# Seconds a read retries for before returning the last payload read in full
+READ_TIMEOUT = 0.1
+
+
+class SharedStateWriter:
+    def __init__(self, path: str, capacity: int = DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        self._file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b')
+        if os.fstat(self._file.fileno()).st_size < HEADER.size + capacity:
+            os.ftruncate(self._file.fileno(), HEADER.size + capacity)
+        self._memory = mmap.mmap(self._file.fileno(), HEADER.size + capacity)
+        # A writer that died mid-write left an odd sequence number behind
+        sequence = HEADER.unpack_from(self._memory, 0)[0]
+        self._sequence = sequence + sequence % 2
+
+    def write(self, payload: bytes) -> Result[int]:
+        length = len(payload)
+        if length > self.capacity:
+            return Error(f'shared state payload of {length} bytes exceeds '
+                         f'capacity of {self.capacity} bytes')
+
+        self._sequence += 1
+        struct.pack_into('<Q', self._memory, 0, self._sequence)
+        self._memory[HEADER.size:HEADER.size + length] = payload
+        self._sequence += 1
+        HEADER.pack_into(self._memory, 0, self._sequence, length)
+        return self._sequence
+
+    def close(self) -> None:
+        self._memory.close()
+        self._file.close()
+
+
+class SharedStateReader:
+    def __init__(self, path: str, timeout: float = READ_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._file = open(path, 'rb')
+        self._memory = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # The last (sequence, payload) read in full
+        self._last: Tuple[int, bytes] = (0, b'')
+        self._timed_out = False
+
+    def read(self) -> Tuple[int, bytes]:
+        ''' Returns the latest (sequence, payload) published by the writer
+
+        Sequence 0 means nothing has been published yet.  When a write doesn't
+        finish within (timeout) seconds, returns the last payload read in full.
+        '''
+        deadline = None
+        retries = 0
+        while True:
+            sequence, length = HEADER.unpack_from(self._memory, 0)
+            if sequence % 2 == 0:
+                payload = self._memory[HEADER.size:HEADER.size + length]
+                if HEADER.unpack_from(self._memory, 0)[0] == sequence:
+                    self._last = sequence, payload
+                    self._timed_out = False
+                    return self._last
+            retries += 1
+            if retries <= SPIN_RETRIES:
+                continue
+            if deadline is None:
+                deadline = time.perf_counter() + self.timeout
+            elif time.perf_counter() >= deadline:
+                if not self._timed_out:
+                    logger.warn(f'shared state {self.path} has been written to for over '
+                                f'{self.timeout}s, serving sequence {self._last[0]}')
+                    self._timed_out = True
+                return self._last
+            time.sleep(RETRY_INTERVAL)
+
+    def close(self) -> None:
+        self._memory.close()
+        self._file.close()
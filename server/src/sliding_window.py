@@ -1,13 +1,15 @@
 import operator
 from functools import reduce
-from typing import Union
+from typing import Dict, Iterable, Tuple, Union
 
+import numpy as np
 from invariants import must_be_positive, must_be_zero_to_one
 from pipetools import X, pipe
-from pyrsistent import PRecord, PVector, field, pvector_field
+from pyrsistent import PRecord, PVector, field
+from slot_record import SlotRecord, pvector_field
 
 
-class SlidingWindowSample(PRecord):
+class SlidingWindowSample(SlotRecord):
     exchange_rate = field(type=float, mandatory=True)
     exchange_rate_filtered = field(type=float, mandatory=False)
     exchange_rate_rate_of_change_filtered = field(type=float, mandatory=False)
@@ -65,11 +67,17 @@ def add(sample: SlidingWindowSample, window: SlidingWindow) -> SlidingWindow:
         'exchange_rate_moving_average_10': next_moving_average(10, window, sample),
         'exchange_rate_moving_average_100': next_moving_average(100, window, sample),
     })
+    return append(updated_sample, window)
 
+
+def append(sample: SlidingWindowSample, window: SlidingWindow) -> SlidingWindow:
+    ''' Adds a (sample) whose filtered and averaged fields are already set,
+    e.g. by feature_engine.window_sample
+    '''
     # Pop oldest sample to keep length of samples less than maximum size
     if len(window.samples) >= window.maximum_size:
-        return window.update({'samples': window.samples.append(updated_sample)[1:]})
-    return window.update({'samples': window.samples.append(updated_sample)})
+        return window.update({'samples': window.samples.append(sample)[1:]})
+    return window.update({'samples': window.samples.append(sample)})
 
 
 def filter_sample(sample: SlidingWindowSample, window: SlidingWindow) -> SlidingWindowSample:
@@ -171,3 +179,167 @@ def current_epoch(window: SlidingWindow) -> Union[float, None]:
     if len(window.samples) == 0:
         return None
     return window.samples[-1].epoch
+
+
+# Batch versions of add(), for analysis of recorded exchange rates.  They
+# compute the fields add() gives every sample of a window, and derivative()
+# after every sample, for a whole array of samples added to an empty window.
+
+# Rows of regression windows computed at a time, bounds the temporary arrays
+DERIVATIVE_CHUNK_SIZE = 2 ** 20
+
+
+def affine_scan(a: np.ndarray, b: np.ndarray, initial: float) -> np.ndarray:
+    ''' Solves x[i] = a[i] * x[i - 1] + b[i] with x[-1] = (initial) for every i
+
+    Composes the affine steps pairwise in log2(len) passes (a parallel prefix
+    scan) instead of iterating over them.  Only multiplies and adds, so
+    steps that reset the recurrence (a[i] == 0) need no special case.
+    '''
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    shift = 1
+    while shift < len(a):
+        # Step i absorbs the steps before it, up to 2 * shift of them
+        b[shift:] = a[shift:] * b[:-shift] + b[shift:]
+        a[shift:] = a[shift:] * a[:-shift]
+        shift *= 2
+    return a * initial + b
+
+
+def filter_series(
+    exchange_rates: np.ndarray,
+    epochs: np.ndarray,
+    window: SlidingWindow
+) -> Tuple[np.ndarray, np.ndarray]:
+    ''' The filtered exchange rates and rates of change that filter_sample gives
+    the samples when they're added to an empty window with (window)'s parameters
+    '''
+    length = len(exchange_rates)
+    filtered = np.array(exchange_rates, dtype=np.float64)
+    rate_of_change = np.zeros(length)
+    if length < 2:
+        return filtered, rate_of_change
+
+    times = np.diff(epochs)
+    # Rates of change between consecutive samples, 0 where time didn't pass
+    raw = np.zeros(length - 1)
+    np.divide(np.diff(exchange_rates), times, out=raw, where=times > 0)
+    if window.maximum_size == 1:
+        # Each sample is filtered against a window of only the sample before it
+        rate_of_change[1:] = raw
+        return filtered, rate_of_change
+
+    rate_of_change[1] = raw[0]
+    # Samples from the third on are filtered against the sample before them
+    times, raw = times[1:], raw[1:]
+    second_order = np.where(
+        times > 0, np.minimum(1.0, times * window.second_order_filter_time_constant), 0.0
+    )
+    rate_of_change[2:] = affine_scan(1.0 - second_order, second_order * raw, rate_of_change[1])
+
+    first_order = window.filter_order_ratio * np.minimum(
+        1.0, times * window.first_order_filter_time_constant
+    )
+    filtered[2:] = affine_scan(
+        1.0 - first_order,
+        first_order * filtered[2:] +
+        (1.0 - window.filter_order_ratio) * rate_of_change[1:-1] * times,
+        filtered[1]
+    )
+    return filtered, rate_of_change
+
+
+def moving_average_series(
+    n: int,
+    exchange_rates: np.ndarray,
+    maximum_size: int
+) -> np.ndarray:
+    ''' The moving averages next_moving_average(n) gives the samples when they're
+    added to an empty window of (maximum_size)
+
+    Each sample is averaged with up to (n) samples before it that are still in
+    the window.
+    '''
+    length = len(exchange_rates)
+    if length == 0:
+        return np.zeros(0)
+    # Offset by the first rate so that the running sums stay small
+    offset = exchange_rates[0]
+    sums = np.concatenate(([0.0], np.cumsum(exchange_rates - offset)))
+    index = np.arange(length)
+    previous = np.minimum(index, min(n, maximum_size))
+    return offset + (sums[index + 1] - sums[index - previous]) / (previous + 1)
+
+
+def derivative_series(
+    n: int,
+    exchange_rates: np.ndarray,
+    epochs: np.ndarray,
+    maximum_size: int
+) -> np.ndarray:
+    ''' The derivative(n) of a window of (maximum_size) after each sample is added
+
+    Each slope is a least squares fit to the (n) most recent samples, centered
+    on their means like derivative() rather than from running sums, which lose
+    their precision to the large epochs.
+    '''
+    length = len(exchange_rates)
+    slopes = np.zeros(length)
+    if n < 2 or length < n or maximum_size < n:
+        return slopes
+    rates = np.ascontiguousarray(exchange_rates, dtype=np.float64)
+    times = np.ascontiguousarray(epochs, dtype=np.float64)
+    # (length - n + 1, n) views of every window of (n) consecutive samples
+    rate_windows, time_windows = (
+        np.lib.stride_tricks.as_strided(
+            values,
+            shape=(length - n + 1, n),
+            strides=(values.strides[0], values.strides[0]),
+            writeable=False
+        )
+        for values in (rates, times)
+    )
+    rows = max(1, DERIVATIVE_CHUNK_SIZE // n)
+    for start in range(0, length - n + 1, rows):
+        time_errors = time_windows[start:start + rows]
+        time_errors = time_errors - time_errors.mean(axis=1, keepdims=True)
+        rate_errors = rate_windows[start:start + rows]
+        rate_errors = rate_errors - rate_errors.mean(axis=1, keepdims=True)
+        numerator = (time_errors * rate_errors).sum(axis=1)
+        denominator = (time_errors * time_errors).sum(axis=1)
+        chunk = slopes[start + n - 1:start + n - 1 + rows]
+        np.divide(numerator, denominator, out=chunk, where=denominator != 0)
+    return slopes
+
+
+def series(
+    exchange_rates: np.ndarray,
+    epochs: np.ndarray,
+    window: SlidingWindow = construct(maximum_size=1000),
+    derivatives: Iterable[int] = (100,)
+) -> Dict[str, np.ndarray]:
+    ''' Every field add() gives the samples of (exchange_rates) and (epochs) when
+    they're added to an empty window with (window)'s parameters, and
+    derivative_(n), the derivative(n) of the window after each of them
+    '''
+    exchange_rates = np.asarray(exchange_rates, dtype=np.float64)
+    epochs = np.asarray(epochs, dtype=np.float64)
+    filtered, rate_of_change = filter_series(exchange_rates, epochs, window)
+    fields = {
+        'exchange_rate': exchange_rates,
+        'exchange_rate_filtered': filtered,
+        'exchange_rate_rate_of_change_filtered': rate_of_change,
+        'exchange_rate_moving_average_10': moving_average_series(
+            10, exchange_rates, window.maximum_size
+        ),
+        'exchange_rate_moving_average_100': moving_average_series(
+            100, exchange_rates, window.maximum_size
+        ),
+        'epoch': epochs,
+    }
+    for n in derivatives:
+        fields[f'derivative_{n}'] = derivative_series(
+            n, exchange_rates, epochs, window.maximum_size
+        )
+    return fields
@@ -0,0 +1,251 @@
+'''
+Compact immutable records for the types that are built many times per tick.
+
+A SlotRecord is declared like a PRecord, with pyrsistent fields, but its
+values are kept in __slots__ instead of a persistent map.  set() and update()
+copy the slots into a new record rather than rebuilding a map through an
+evolver, and reading a field is a plain attribute lookup.
+
+Field types, invariants and mandatory fields are checked like a PRecord's,
+raising PTypeError and InvariantException, but only when __debug__ is set.
+Tests and the default `python src/main.py` run with the checks, and
+production runs with `python -O src/main.py` skip them.
+
+    class Transaction(SlotRecord):
+        label = field(type=str, mandatory=True)
+        quantity = field(type=float)
+
+SlotRecords are CheckedTypes, so they can be the type of PRecord fields,
+pvector_field() and pmap_field() and are serialized with them.
+
+Vectors of records are the other per-tick cost: a PVector slice is a plain
+PVector, so setting a pyrsistent pvector_field() to a window's slice checks
+every item again.  This module's pvector_field() only does so in __debug__.
+'''
+from typing import (Any, Dict, Iterator, List, Mapping, Optional, Set, Tuple, Type,
+                    TypeVar)
+
+import pyrsistent
+from pyrsistent import CheckedType, InvariantException, PTypeError, PVector, field
+from pyrsistent._checked_types import _restore_pickle, get_type
+from pyrsistent._pvector import PythonPVector, python_pvector
+
+# pyrsistent doesn't export the type of its field specifications
+DEFAULT_FIELD: Any = field()
+PField = type(DEFAULT_FIELD)
+NO_FACTORY = DEFAULT_FIELD.factory
+NO_INITIAL = DEFAULT_FIELD.initial
+NO_INVARIANT = DEFAULT_FIELD.invariant
+NO_SERIALIZER = DEFAULT_FIELD.serializer
+
+R = TypeVar('R', bound='SlotRecord')
+T = TypeVar('T')
+
+
+class FieldSpec:
+    ''' What a record does with each field's value, worked out once per class '''
+    __slots__ = ('name', 'field', 'types', 'factory', 'invariant')
+
+    def __init__(self, name: str, spec: Any):
+        self.name = name
+        self.field = spec
+        self.types = tuple(get_type(t) for t in spec.type)
+        factory = spec.factory
+        self.factory = None if factory is NO_FACTORY else factory
+        self.invariant = None if spec.invariant is NO_INVARIANT else spec.invariant
+
+
+class SlotRecordMeta(type):
+    def __new__(mcs, name: str, bases: Tuple[type, ...], namespace: Dict[str, Any]):
+        specs: Dict[str, Any] = {}
+        for base in reversed(bases):
+            specs.update(getattr(base, '_precord_fields', {}))
+        declared = [key for key, value in namespace.items() if isinstance(value, PField)]
+        for key in declared:
+            specs[key] = namespace.pop(key)
+        # Only the newly declared fields need slots, the rest are inherited
+        namespace['__slots__'] = tuple(declared)
+        namespace['_precord_fields'] = specs
+        namespace['_field_specs'] = tuple(FieldSpec(key, spec) for key, spec in specs.items())
+        namespace['_field_names'] = frozenset(specs)
+        return super().__new__(mcs, name, bases, namespace)
+
+
+def check(cls: type, spec: FieldSpec, value: Any, error_codes: List[Any]) -> None:
+    ''' Checks (value) against the field's type and adds its failed invariants to (error_codes) '''
+    if spec.types and not isinstance(value, spec.types):
+        raise PTypeError(
+            cls, spec.name, spec.field.type, type(value),
+            f'Invalid type for field {cls.__name__}.{spec.name}, was {type(value).__name__}'
+        )
+    if spec.invariant is not None:
+        is_ok, error_code = spec.invariant(value)
+        if not is_ok:
+            error_codes.append(error_code)
+
+
+class SlotRecord(CheckedType, metaclass=SlotRecordMeta):
+    _precord_fields: Dict[str, Any] = {}
+    _field_specs: Tuple[FieldSpec, ...] = ()
+    _field_names: frozenset = frozenset()
+
+    def __init__(self, **values: Any) -> None:
+        cls = type(self)
+        unknown = values.keys() - cls._field_names
+        if unknown:
+            raise AttributeError(f"'{', '.join(sorted(unknown))}' are not fields of {cls.__name__}")
+        error_codes: List[Any] = []
+        missing: List[str] = []
+        for spec in cls._field_specs:
+            if spec.name in values:
+                value = values[spec.name]
+            elif spec.field.initial is not NO_INITIAL:
+                initial = spec.field.initial
+                value = initial() if callable(initial) else initial
+            else:
+                if __debug__ and spec.field.mandatory:
+                    missing.append(f'{cls.__name__}.{spec.name}')
+                continue
+            if spec.factory is not None:
+                value = spec.factory(value)
+            if __debug__:
+                check(cls, spec, value, error_codes)
+            object.__setattr__(self, spec.name, value)
+        if __debug__ and (error_codes or missing):
+            raise InvariantException(tuple(error_codes), tuple(missing), 'Field invariant failed')
+
+    def set(self: R, *args: Any, **kwargs: Any) -> R:
+        ''' set('field', value) or set(field=value, ...) '''
+        if args:
+            return self.update({args[0]: args[1]})
+        return self.update(kwargs)
+
+    def update(self: R, *maps: Mapping[str, Any]) -> R:
+        ''' A copy of the record with the fields in (maps) replaced '''
+        values = maps[0] if len(maps) == 1 else {
+            key: value for mapping in maps for key, value in mapping.items()
+        }
+        cls = type(self)
+        record = object.__new__(cls)
+        error_codes: List[Any] = []
+        matched = 0
+        for spec in cls._field_specs:
+            name = spec.name
+            if name in values:
+                matched += 1
+                value = values[name]
+                if spec.factory is not None:
+                    value = spec.factory(value)
+                if __debug__:
+                    check(cls, spec, value, error_codes)
+            else:
+                try:
+                    value = getattr(self, name)
+                except AttributeError:
+                    continue
+            object.__setattr__(record, name, value)
+        if matched != len(values):
+            unknown = sorted(set(values) - cls._field_names)
+            raise AttributeError(f"'{', '.join(unknown)}' are not fields of {cls.__name__}")
+        if __debug__ and error_codes:
+            raise InvariantException(tuple(error_codes), (), 'Field invariant failed')
+        return record
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f'{type(self).__name__} is immutable, use set() or update()')
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f'{type(self).__name__} is immutable, use set() or update()')
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in self._field_names else default
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            if key in self._field_names:
+                return getattr(self, key)
+        except AttributeError:
+            pass
+        raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._field_names and hasattr(self, str(key))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def keys(self) -> List[str]:
+        return [spec.name for spec in self._field_specs if hasattr(self, spec.name)]
+
+    def values(self) -> List[Any]:
+        return [value for _, value in self.items()]
+
+    def items(self) -> List[Tuple[str, Any]]:
+        missing = object()
+        items = ((spec.name, getattr(self, spec.name, missing)) for spec in self._field_specs)
+        return [(key, value) for key, value in items if value is not missing]
+
+    def __eq__(self, other: object) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.items() == other.items()  # type: ignore
+
+    def __ne__(self, other: object) -> bool:
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self) -> int:
+        return hash((type(self), tuple(self.items())))
+
+    def __repr__(self) -> str:
+        values = ', '.join(f'{key}={value!r}' for key, value in self.items())
+        return f'{type(self).__name__}({values})'
+
+    def __reduce__(self) -> Any:
+        return _restore_pickle, (type(self), dict(self.items()))
+
+    @classmethod
+    def create(
+        cls: Type[R],
+        source_data: Any,
+        _factory_fields: Optional[Set[str]] = None,
+        ignore_extra: bool = False
+    ) -> R:
+        if isinstance(source_data, cls):
+            return source_data
+        if ignore_extra:
+            source_data = {
+                key: value for key, value in source_data.items() if key in cls._field_names
+            }
+        return cls(**source_data)
+
+    def serialize(self, format: Any = None) -> Any:
+        specs = self._precord_fields
+        return {
+            key: (
+                value.serialize(format)  # type: ignore
+                if isinstance(value, CheckedType) and specs[key].serializer is NO_SERIALIZER
+                else specs[key].serializer(format, value)
+            )
+            for key, value in self.items()
+        }
+
+
+def pvector_field(item_type: Type[T]) -> PVector[T]:
+    ''' pyrsistent's pvector_field, except that without __debug__ the items aren't
+    checked again each time the field is set
+    '''
+    checked: Any = pyrsistent.pvector_field(item_type)
+    if __debug__:
+        return checked
+    vector_type = next(iter(checked.type))
+
+    def factory(items: Any) -> Any:
+        if isinstance(items, vector_type):
+            return items
+        # A CheckedPVector wraps a PythonPVector's tree as it is
+        return vector_type(items if type(items) is PythonPVector else python_pvector(items))
+    return field(type=vector_type, factory=factory, mandatory=True, initial=checked.initial)
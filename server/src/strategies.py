@@ -0,0 +1,126 @@
+'''
+Constructs the trading records and models of the strategies enabled in
+config/default.json.
+
+Heavy dependencies are only imported by strategies that need them, so an
+algorithmic-only deployment never loads tensorflow.
+'''
+from typing import Any, Dict, Iterable
+
+import algorithmic_model
+import fully_connected_neural_network
+import q_learning_model
+import q_learning_population
+import trading_record
+from maybe import Maybe
+from registries import TradingModelRegistry, TradingRecordRegistry
+
+q_learning_description = (
+    'Uses reinforcement learning to make trading decisions.  Neural network is used \n'
+    'predict future rewards for buying, selling, or holding assets.  Once a trading \n'
+    'decision is made, the real reward is calculated and used to train the neural \n'
+    'network.  Uses epsilon greedy algorithm to explore many different trading \n'
+    'strategies by initially making random predictions and then gradually using \n'
+    'the neural network more and more over time.'
+)
+
+# TODO: Rename "Algorithmic" to something else
+algorithmic_description = (
+    'Uses an algorithmic approach that looks at moving average and rate of change to \n'
+    'make trading decisions.  Once an asset is purchased it is put into a queue of \n'
+    'pending sales.  Pending sales are sold when current exchange rate rises \n'
+    'or when current exchange rate drops to cut losses.'
+)
+
+q_learning_population_description = (
+    'One agent of a population of q-learning agents that trade the same ticks with \n'
+    'different hyperparameters.  The networks of all agents are evaluated and \n'
+    'trained together in batched matrix operations.'
+)
+
+random_description = (
+    'Makes trading decisions randomly.  Used as baseline to judge the \n'
+    'effectiveness of other trading strategies.'
+)
+
+
+def construct_trading_records(
+    strategies: Iterable[str],
+    population_size: int = 64
+) -> TradingRecordRegistry:
+    trading_record_registry: TradingRecordRegistry = {}
+    if 'q-learning' in strategies:
+        trading_record_registry['q-learning'] = trading_record.construct(
+            'Q Learning Trading Record',
+            q_learning_description,
+            100000.0
+        )
+    if 'q-learning-population' in strategies:
+        for agent in range(population_size):
+            trading_record_registry[q_learning_population.record_name(agent)] = \
+                trading_record.construct(
+                    f'Q Learning Population Agent {agent} Trading Record',
+                    q_learning_population_description,
+                    100000.0
+                )
+    if 'algorithmic' in strategies:
+        trading_record_registry['algorithmic'] = trading_record.construct(
+            'Algorithmic Trading Record',
+            algorithmic_description,
+            100000.0
+        )
+    if 'random' in strategies:
+        trading_record_registry['random'] = trading_record.construct(
+            'Random Trading Record',
+            random_description,
+            100000.0
+        )
+    return trading_record_registry
+
+
+def construct_trading_models(
+    strategies: Iterable[str],
+    inference_backend: str = 'numpy',
+    population_size: int = 64,
+    precision: str = 'float64',
+    normalize_inputs: Maybe[bool] = None
+) -> TradingModelRegistry:
+    trading_model_registry: TradingModelRegistry = {}
+    if 'q-learning' in strategies:
+        import tensorflow as tf
+        trading_model_registry['q-learning'] = q_learning_model.construct(
+            tf.Session(),
+            inference_backend,
+            precision,
+            normalize_inputs
+        )
+    if 'q-learning-population' in strategies:
+        trading_model_registry['q-learning-population'] = q_learning_population.construct(
+            q_learning_population.sample_hyperparameters(population_size),
+            precision=precision,
+            normalize_inputs=normalize_inputs
+        )
+    if 'algorithmic' in strategies:
+        trading_model_registry['algorithmic'] = algorithmic_model.construct(
+            selling_threshold=0.02,
+            cut_losses_threshold=-0.05
+        )
+    return trading_model_registry
+
+
+def capture_models(trading_model_registry: TradingModelRegistry) -> Dict[str, Any]:
+    ''' Copies of the state that the models update in place, see
+    registry_snapshot.SnapshotPublisher
+    '''
+    captured: Dict[str, Any] = {}
+    if 'q-learning' in trading_model_registry:
+        model = trading_model_registry['q-learning']
+        captured['q-learning/weights'] = fully_connected_neural_network.get_weights(
+            model.session,
+            model.neural_network
+        )
+    if 'q-learning-population' in trading_model_registry:
+        captured['q-learning-population'] = q_learning_population.clone(
+            trading_model_registry['q-learning-population']
+        )
+    return captured
@@ -0,0 +1,110 @@
+import bar_aggregator
+import numpy as np
+import pytest  # noqa: F401
+from bar_aggregator import CLOSE, END, HIGH, LOW, NOTIONAL, START, TRADES, VOLUME
+
+
+def matches(count, seed=0):
+    random = np.random.RandomState(seed)
+    epochs = 1554000000.0 + np.cumsum(random.exponential(0.7, count))
+    exchange_rates = 5000.0 * np.exp(np.cumsum(random.normal(0.0, 0.0005, count)))
+    sizes = random.exponential(0.2, count)
+    return exchange_rates, epochs, sizes
+
+
+def aggregate(aggregator, exchange_rates, epochs, sizes):
+    for exchange_rate, epoch, size in zip(exchange_rates, epochs, sizes):
+        bar_aggregator.update((float(exchange_rate), float(epoch)), aggregator, float(size))
+
+
+def expected_bar(exchange_rates, epochs, sizes, start):
+    return [
+        start,
+        epochs[-1],
+        exchange_rates[0],
+        exchange_rates.max(),
+        exchange_rates.min(),
+        exchange_rates[-1],
+        sizes.sum(),
+        (exchange_rates * sizes).sum(),
+        len(exchange_rates),
+    ]
+
+
+def test_time_bars_match_grouped_matches():
+    exchange_rates, epochs, sizes = matches(3000)
+    aggregator = bar_aggregator.construct(capacity=5000)
+    aggregate(aggregator, exchange_rates, epochs, sizes)
+
+    for name, resolution in bar_aggregator.TIME_RESOLUTIONS.items():
+        bars = bar_aggregator.history(aggregator.bars[name])
+        starts = epochs - epochs % resolution
+        expected = [
+            expected_bar(exchange_rates[group], epochs[group], sizes[group], start)
+            for start in np.unique(starts)
+            for group in [starts == start]
+        ]
+        assert np.allclose(bars, expected)
+
+
+def test_threshold_bars_close_at_threshold():
+    exchange_rates, epochs, sizes = matches(2000)
+    aggregator = bar_aggregator.construct(volume_threshold=5.0, dollar_threshold=20000.0)
+    aggregate(aggregator, exchange_rates, epochs, sizes)
+
+    volume_bars = bar_aggregator.history(aggregator.bars['volume'])
+    assert (volume_bars[:-1, VOLUME] >= 5.0).all()
+    assert (volume_bars[:-1, VOLUME] - sizes.max() < 5.0).all()
+    assert np.isclose(volume_bars[:, VOLUME].sum(), sizes.sum())
+    assert volume_bars[:, TRADES].sum() == len(sizes)
+
+    dollar_bars = bar_aggregator.history(aggregator.bars['dollar'])
+    assert (dollar_bars[:-1, NOTIONAL] >= 20000.0).all()
+    assert np.isclose(dollar_bars[:, NOTIONAL].sum(), (exchange_rates * sizes).sum())
+    assert dollar_bars[:, TRADES].sum() == len(sizes)
+    assert (dollar_bars[:, HIGH] >= dollar_bars[:, LOW]).all()
+
+
+def test_ring_keeps_newest_bars():
+    aggregator = bar_aggregator.construct(capacity=4, time_resolutions={'1s': 1.0})
+    for second in range(10):
+        bar_aggregator.update((100.0 + second, 1000.0 + second + 0.5), aggregator, 1.0)
+    bars = aggregator.bars['1s']
+    assert bars.count == 4
+    history = bar_aggregator.history(bars)
+    assert list(history[:, START]) == [1006.0, 1007.0, 1008.0, 1009.0]
+    assert list(history[:, CLOSE]) == [106.0, 107.0, 108.0, 109.0]
+    assert list(bar_aggregator.history(bars, 2)[:, START]) == [1008.0, 1009.0]
+    assert len(bar_aggregator.history(bars, 10)) == 4
+
+
+def test_late_matches_extend_newest_bar():
+    aggregator = bar_aggregator.construct(time_resolutions={'1m': 60.0})
+    bar_aggregator.update((100.0, 120.5), aggregator, 1.0)
+    bar_aggregator.update((90.0, 119.0), aggregator, 1.0)
+    history = bar_aggregator.history(aggregator.bars['1m'])
+    assert len(history) == 1
+    assert history[0, LOW] == 90.0
+    assert history[0, END] == 120.5
+
+
+def test_published_bars_match_history():
+    exchange_rates, epochs, sizes = matches(500)
+    aggregator = bar_aggregator.construct(capacity=50)
+    assert len(bar_aggregator.published_history(bar_aggregator.publish(aggregator)['1m'])) == 0
+
+    aggregate(aggregator, exchange_rates, epochs, sizes)
+    published = bar_aggregator.publish(aggregator)
+    closed, _ = published['1s']
+    assert not closed.flags.writeable
+    assert closed is bar_aggregator.publish(aggregator)['1s'][0]
+    for name, bars in aggregator.bars.items():
+        assert np.array_equal(
+            bar_aggregator.published_history(published[name], 20),
+            bar_aggregator.history(bars, 20)
+        )
+
+    # Published bars don't change as the trading thread keeps updating
+    expected = bar_aggregator.published_history(published['1s'])
+    aggregate(aggregator, exchange_rates + 1.0, epochs + 100.0, sizes)
+    assert np.array_equal(bar_aggregator.published_history(published['1s']), expected)
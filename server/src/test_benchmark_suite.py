@@ -0,0 +1,55 @@
+import json
+
+import benchmark_suite
+import pytest  # noqa: F401
+
+
+def results(**microseconds):
+    return {'benchmarks': {name: {'microseconds': value} for name, value in microseconds.items()}}
+
+
+def test_compare_reports_regressions_beyond_threshold():
+    baseline = results(fast=10.0, slow=100.0, removed=5.0)
+    measured = results(fast=12.0, slow=130.0, added=1.0)
+    measured['benchmarks']['skipped'] = {'skipped': 'No module named tensorflow'}
+    assert benchmark_suite.compare(measured, baseline, 0.25) == [('slow', 100.0, 130.0)]
+    assert benchmark_suite.compare(measured, baseline, 0.1) == [
+        ('fast', 10.0, 12.0),
+        ('slow', 100.0, 130.0),
+    ]
+
+
+def test_run_writes_machine_readable_results(tmp_path):
+    baseline = str(tmp_path / 'baseline.json')
+    assert benchmark_suite.main(['--filter', 'zulu_time', '--save-baseline',
+                                 '--baseline', baseline]) == 0
+    output = str(tmp_path / 'results.json')
+    benchmark_suite.main(['--filter', 'zulu_time', '--baseline', baseline,
+                          '--output', output, '--threshold', '100'])
+    with open(output) as reader:
+        measured = json.load(reader)
+    assert list(measured['benchmarks']) == ['zulu_time.get_epoch']
+    assert measured['benchmarks']['zulu_time.get_epoch']['microseconds'] > 0
+
+
+def test_skipped_benchmarks_with_a_baseline_fail(tmp_path, monkeypatch):
+    def missing_dependency():
+        raise ImportError("No module named 'cbpro'")
+    monkeypatch.setitem(benchmark_suite.BENCHMARKS, 'zulu_time.missing', missing_dependency)
+    baseline = str(tmp_path / 'baseline.json')
+    benchmark_suite.save(baseline, results(**{'zulu_time.missing': 1.0, 'kept': 2.0}))
+
+    # Saving keeps the entries of benchmarks that didn't run
+    assert benchmark_suite.main(['--filter', 'zulu_time', '--save-baseline',
+                                 '--baseline', baseline]) == 0
+    saved = benchmark_suite.load(baseline)['benchmarks']
+    assert saved['zulu_time.missing'] == {'microseconds': 1.0}
+    assert saved['kept'] == {'microseconds': 2.0}
+    assert 'zulu_time.get_epoch' in saved
+
+    assert benchmark_suite.main(['--filter', 'zulu_time', '--baseline', baseline,
+                                 '--threshold', '100']) == 1
+    assert benchmark_suite.skipped_with_baseline(
+        {'benchmarks': {'zulu_time.missing': {'skipped': "No module named 'cbpro'"}}},
+        results(**{'zulu_time.missing': 1.0})
+    ) == [('zulu_time.missing', "No module named 'cbpro'")]
@@ -0,0 +1,132 @@
+import math
+import time
+
+import chart_history
+import numpy as np
+import pytest  # noqa: F401
+
+
+def values(count, seed=0):
+    random = np.random.RandomState(seed)
+    epochs = 1554000000.0 + np.cumsum(random.exponential(0.4, count))
+    exchange_rates = 5000.0 + np.cumsum(random.normal(0.0, 1.0, count))
+    return epochs, exchange_rates
+
+
+def record(history, epochs, exchange_rates):
+    for epoch, exchange_rate in zip(epochs, exchange_rates):
+        chart_history.update(history, float(epoch), {'exchange_rate': float(exchange_rate)})
+
+
+def expected_buckets(epochs, exchange_rates, width):
+    starts = epochs - epochs % width
+    buckets = []
+    for start in np.unique(starts):
+        group = exchange_rates[starts == start]
+        buckets.append([start, group.min(), group.max(), group[-1]])
+    return np.array(buckets)
+
+
+def as_array(history):
+    return np.array([history['epoch'], history['min'], history['max'], history['last']]).T
+
+
+def test_every_level_matches_grouped_values():
+    epochs, exchange_rates = values(5000)
+    history = chart_history.construct()
+    record(history, epochs, exchange_rates)
+    levels = history.series['exchange_rate']
+    for index, width in enumerate(chart_history.LEVEL_WIDTHS):
+        assert np.allclose(
+            chart_history.copy_level(levels, index),
+            expected_buckets(epochs, exchange_rates, width)
+        )
+
+
+def test_query_picks_a_level_and_downsamples_to_points():
+    epochs, exchange_rates = values(5000)
+    history = chart_history.construct()
+    record(history, epochs, exchange_rates)
+
+    start, end = epochs[1000], epochs[1300]
+    recent = as_array(chart_history.query(history, 'exchange_rate', start, end, 500))
+    expected = expected_buckets(epochs, exchange_rates, 1.0)
+    expected = expected[(expected[:, 0] >= math.floor(start)) & (expected[:, 0] <= end)]
+    assert np.allclose(recent, expected)
+
+    everything = as_array(chart_history.query(history, 'exchange_rate', points=7))
+    assert len(everything) <= 7
+    assert everything[:, 1].min() == exchange_rates.min()
+    assert everything[:, 2].max() == exchange_rates.max()
+    assert everything[-1, 3] == exchange_rates[-1]
+
+    assert chart_history.query(history, 'missing') is None
+
+
+def test_unbounded_queries_span_the_values_held():
+    _, exchange_rates = values(1800)
+    epochs = 1554000000.0 + np.arange(1800)
+    history = chart_history.construct()
+    record(history, epochs, exchange_rates)
+    everything = as_array(chart_history.query(history, 'exchange_rate', points=250))
+    # 10 second buckets are the finest that fit half an hour in 250 points
+    assert 100 < len(everything) <= 250
+    assert np.all(np.diff(everything[:, 0]) == 10.0)
+    assert everything[-1, 3] == exchange_rates[-1]
+
+    evicting = chart_history.construct(capacity=64)
+    record(evicting, epochs, exchange_rates)
+    assert 20 < len(chart_history.query(evicting, 'exchange_rate', points=250)['epoch']) <= 250
+
+
+def test_evicted_ranges_are_answered_from_coarser_levels():
+    epochs, exchange_rates = values(3000)
+    history = chart_history.construct(capacity=64)
+    record(history, epochs, exchange_rates)
+    oldest = as_array(chart_history.query(history, 'exchange_rate', epochs[0], epochs[50]))
+    assert oldest[0, 0] <= epochs[0]
+    assert len(oldest) > 0
+    assert np.all(np.diff(oldest[:, 0]) >= 10.0)
+
+
+def test_queries_retry_when_updated_while_copying(monkeypatch):
+    history = chart_history.construct()
+    chart_history.update(history, 1554000000.0, {'exchange_rate': 1.0})
+    copy_level = chart_history.copy_level
+    updates = []
+
+    def copy_level_then_update(levels, index):
+        buckets = copy_level(levels, index)
+        # The trading thread updates the history while the request thread copies
+        if len(updates) == 0:
+            updates.append(2.0)
+            chart_history.update(history, 1554000000.5, {'exchange_rate': 2.0})
+        return buckets
+
+    monkeypatch.setattr(chart_history, 'copy_level', copy_level_then_update)
+    result = chart_history.query(history, 'exchange_rate')
+    assert result['min'] == [1.0]
+    assert result['max'] == [2.0]
+    assert result['last'] == [2.0]
+
+
+def test_queries_answer_when_an_update_never_finishes(monkeypatch):
+    history = chart_history.construct()
+    chart_history.update(history, 1554000000.0, {'exchange_rate': 1.0})
+    add_bucket = chart_history.add_bucket
+
+    def fail(levels, index, bucket):
+        raise MemoryError()
+    monkeypatch.setattr(chart_history, 'add_bucket', fail)
+    with pytest.raises(MemoryError):
+        chart_history.update(history, 1554000001.0, {'exchange_rate': 2.0})
+    # Failed updates still finish the sequence
+    assert history.sequence % 2 == 0
+    monkeypatch.setattr(chart_history, 'add_bucket', add_bucket)
+
+    # As if the trading thread died halfway through an update
+    monkeypatch.setattr(chart_history, 'READ_TIMEOUT', 0.01)
+    history.sequence += 1
+    started = time.perf_counter()
+    assert chart_history.query(history, 'exchange_rate')['last'] == [1.0]
+    assert time.perf_counter() - started < 1.0
@@ -0,0 +1,224 @@
+import time
+
+import numpy as np
+import pytest  # noqa: F401
+import algorithmic_model
+import checkpoint
+import input_normalizer
+import q_learning_population
+import q_memory
+import registry_snapshot
+import strategies
+import trading_record
+import transaction_window
+from q_memory import QMemorySample
+from q_records import QModelInput
+from registry_snapshot import SnapshotPublisher
+from trading_record import TradingAction
+from transaction import Transaction
+
+
+def construct_record(name):
+    record = trading_record.construct(name, f'{name} description', 100000.0)
+    orders = ['buy', 'buy', 'hold', 'sell', 'buy']
+    for tick, order in enumerate(orders):
+        price_info = (10000.0 + tick * 3.5, 1552103321.0 + tick)
+        record = trading_record.update_exchange_rate(price_info, record)
+        record = trading_record.place_order(TradingAction(order=order, amount=1), record)
+    return record
+
+
+def construct_memory():
+    memory = q_memory.construct(1000)
+    for reward in [1.5, -2.0, 0.0]:
+        memory = q_memory.add(QMemorySample(
+            neural_network_input=QModelInput(
+                exchange_rate=10000.0,
+                rate_of_change=0.001,
+                moving_average=9999.5
+            ),
+            neural_network_prediction=TradingAction(order='sell', amount=1),
+            reward=reward
+        ), memory)
+    return memory
+
+
+def test_save_load(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # pair_transaction appends to transaction_history.csv
+    path = str(tmp_path / 'checkpoint.npz')
+    records = {name: construct_record(name) for name in ['algorithmic', 'random']}
+    model = algorithmic_model.construct(0.03, -0.04).set('pending_trades', [
+        algorithmic_model.PendingTrade(buyers_price=10001.0),
+        algorithmic_model.PendingTrade(buyers_price=10002.5),
+    ])
+    weights = [np.arange(150, dtype=np.float64).reshape(3, 50), np.zeros(50)]
+    snapshot = registry_snapshot.construct(
+        records,
+        {'algorithmic': model},
+        5,
+        42,
+        captured={'q-learning/weights': weights}
+    )
+
+    checkpoint.save(path, snapshot)
+    restored = checkpoint.load(path)
+
+    assert restored is not None
+    assert restored.tick == 5
+    assert restored.time_delta == 42
+    assert restored.trading_records['algorithmic'] == records['algorithmic']
+    assert restored.trading_records['random'] == records['random']
+    assert restored.algorithmic_model == model
+    assert restored.q_memory is None
+    assert len(restored.network_weights) == 2
+    assert np.array_equal(restored.network_weights[0], weights[0])
+
+
+def test_shared_exchange_rate_windows_are_stored_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shared = construct_record('random').exchange_rates
+    records = {
+        name: trading_record.set_exchange_rates(shared, construct_record(name))
+        for name in ['algorithmic', 'random']
+    }
+    records['own'] = construct_record('own')
+    arrays = checkpoint.encode_snapshot(registry_snapshot.construct(records, {}))
+    assert len([key for key in arrays if key.endswith('/exchange_rate_filtered')]) == 2
+
+    restored = checkpoint.decode_checkpoint(arrays).trading_records
+    assert restored['algorithmic'] == records['algorithmic']
+    assert restored['algorithmic'].exchange_rates is restored['random'].exchange_rates
+    assert restored['own'] == records['own']
+
+    # Older checkpoints stored a copy of the window in every record
+    record = records['own']
+    old_arrays = {
+        key: value for key, value in checkpoint.encode_trading_record(record, 0).items()
+        if key != 'exchange_rates'
+    }
+    old_arrays.update(checkpoint.prefixed(
+        'exchange_rates',
+        checkpoint.encode_sliding_window(record.exchange_rates)
+    ))
+    assert checkpoint.decode_trading_record(old_arrays, {}) == record
+
+
+def test_q_memory_round_trip():
+    memory = construct_memory()
+    assert checkpoint.decode_q_memory(checkpoint.encode_q_memory(memory)) == memory
+    empty_memory = q_memory.construct(10)
+    assert checkpoint.decode_q_memory(checkpoint.encode_q_memory(empty_memory)) == empty_memory
+
+
+def test_input_normalizer_round_trip():
+    normalizer = input_normalizer.construct(3)
+    for input in [[10000.0, 0.001, 9999.0], [10002.5, -0.002, 9999.5]]:
+        normalizer = input_normalizer.update(normalizer, np.array(input))
+    restored = checkpoint.decode_input_normalizer(checkpoint.encode_input_normalizer(normalizer))
+    assert restored.count == 2
+    assert restored.mean.tolist() == normalizer.mean.tolist()
+    assert restored.m2.tolist() == normalizer.m2.tolist()
+
+
+def test_load_missing_checkpoint(tmp_path):
+    assert checkpoint.load(str(tmp_path / 'missing.npz')) is None
+
+
+def test_restore_only_enabled_strategies(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    records = {'algorithmic': construct_record('algorithmic')}
+    saved = checkpoint.decode_checkpoint(checkpoint.encode_snapshot(
+        registry_snapshot.construct(records, {'algorithmic': algorithmic_model.construct()})
+    ))
+    trading_record_registry = {'random': trading_record.construct('random', '', 0.0)}
+    trading_model_registry = {}
+    checkpoint.restore(saved, trading_record_registry, trading_model_registry)
+    assert list(trading_record_registry) == ['random']
+    assert trading_model_registry == {}
+
+
+def test_transaction_lists_of_older_checkpoints_become_windows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    window = construct_record('random').transaction_window
+    transactions = transaction_window.expand(window.serialize())
+    arrays = checkpoint.encode_transactions([Transaction(**entry) for entry in transactions])
+    assert checkpoint.decode_transaction_window(arrays) == window
+
+
+def test_checkpointer_survives_failed_checkpoints(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    records = {'random': construct_record('random')}
+    weights = [np.ones((3, 50))]
+    publisher = SnapshotPublisher(
+        registry_snapshot.construct(records, {}, 1),
+        lambda: {'q-learning/weights': weights}
+    )
+    # A file where the checkpoint's directory should be makes every save fail
+    (tmp_path / 'file').write_text('')
+    checkpointer = checkpoint.Checkpointer(publisher, str(tmp_path / 'file' / 'checkpoint.npz'),
+                                           interval=0.01, capture_timeout=0.01)
+    checkpointer.start()
+    for tick in range(2, 10):
+        publisher.publish(registry_snapshot.construct(
+            records,
+            {},
+            tick,
+            captured=publisher.capture() if publisher.capture_requested() else None
+        ))
+        time.sleep(0.02)
+    assert checkpointer.is_alive()
+
+    checkpointer.path = str(tmp_path / 'checkpoint.npz')
+    checkpointer.checkpoint(final=True)
+    restored = checkpoint.load(checkpointer.path)
+    assert restored is not None
+    assert restored.tick == 9
+    assert np.array_equal(restored.network_weights[0], weights[0])
+
+
+def test_save_load_population(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    enabled = ['q-learning-population', 'random']
+    records = strategies.construct_trading_records(enabled, 2)
+    models = strategies.construct_trading_models(enabled, population_size=2)
+    population = models['q-learning-population']
+    for tick in range(20):
+        state = np.array([10000.0 + tick, 0.001, 10000.0])
+        actions = q_learning_population.choose_actions(population, state)
+        q_learning_population.add_training_samples(population, state, actions, np.ones(2))
+        q_learning_population.train(population)
+        population.time_delta += 1
+    for name in records:
+        records[name] = construct_record(name)
+    path = str(tmp_path / 'checkpoint.npz')
+    checkpoint.save(path, registry_snapshot.construct(
+        records,
+        models,
+        20,
+        captured=strategies.capture_models(models)
+    ))
+
+    restored_records = strategies.construct_trading_records(enabled, 2)
+    restored_models = strategies.construct_trading_models(enabled, population_size=2)
+    checkpoint.restore(checkpoint.load(path), restored_records, restored_models)
+
+    assert restored_records == records
+    restored = restored_models['q-learning-population']
+    assert restored.time_delta == 20
+    assert restored.training_steps == 20
+    assert restored.memory_length == 20
+    assert restored.hyperparameters == population.hyperparameters
+    for name in ['weights', 'first_moments', 'second_moments']:
+        for saved, original in zip(getattr(restored, name), getattr(population, name)):
+            assert np.array_equal(saved, original)
+    state = np.array([10005.0, 0.001, 10000.0])
+    assert np.array_equal(
+        q_learning_population.predict(restored, state),
+        q_learning_population.predict(population, state)
+    )
+
+    # A population of a different size starts over
+    resized_models = strategies.construct_trading_models(enabled, population_size=3)
+    resized = resized_models['q-learning-population']
+    checkpoint.restore(checkpoint.load(path), {}, resized_models)
+    assert resized_models['q-learning-population'] is resized
@@ -0,0 +1,184 @@
+import execution_simulator
+import market_data_generator
+import pytest  # noqa: F401
+import trading_record
+import transaction
+from execution_simulator import DepthModel, LatencyModel
+from market_data_generator import MarketModel
+
+START = 1554120000.0
+LATENCY = LatencyModel(submission=0.05, submission_jitter=0.0, report=0.01)
+
+
+def match(price, size, maker_side):
+    return {'type': 'match', 'price': str(price), 'size': str(size), 'side': maker_side}
+
+
+def snapshot(bids, asks):
+    return {'type': 'snapshot', 'bids': bids, 'asks': asks}
+
+
+def construct(fills, **arguments):
+    return execution_simulator.construct(latency=LATENCY, on_fill=fills.append, **arguments)
+
+
+def test_fee_rates_are_tiered_by_volume():
+    assert transaction.fee_rates(0.0) == (0.0015, 0.0025)
+    assert transaction.fee_rates(9999.0) == (0.0015, 0.0025)
+    assert transaction.fee_rates(10000.0) == (0.0010, 0.0020)
+    assert transaction.fee_rates(1e9) == (0.0, 0.0004)
+    assert transaction.calculate_taker_fee(1.0, 5000.0) == pytest.approx(12.5)
+    assert transaction.calculate_maker_fee(1.0, 5000.0, 20000.0) == pytest.approx(5.0)
+
+
+def test_market_orders_arrive_late_and_walk_the_assumed_book():
+    fills = []
+    simulator = construct(fills, depth=DepthModel(half_spread=0.5, level_spacing=1.0))
+    execution_simulator.add_market_data(simulator, START, match(5000.0, 0.1, 'sell'))
+    execution_simulator.submit(simulator, START, 'algorithmic', 'buy', 2.5)
+
+    # The price moves before the order reaches the exchange
+    execution_simulator.add_market_data(simulator, START + 0.04, match(5010.0, 0.1, 'sell'))
+    execution_simulator.run_until(simulator, START + 0.059)
+    assert fills == []
+    execution_simulator.run_until(simulator, START + 0.06)
+    assert [(fill.quantity, fill.price, fill.liquidity) for fill in fills] == [
+        (1.0, 5010.5, 'taker'), (1.0, 5011.5, 'taker'), (0.5, 5012.5, 'taker')
+    ]
+    assert fills[0].epoch == pytest.approx(START + 0.05)
+    assert fills[0].fee == pytest.approx(transaction.calculate_taker_fee(1.0, 5010.5))
+    assert simulator.orders == {}
+
+
+def test_market_orders_walk_and_deplete_the_level2_book():
+    fills = []
+    simulator = construct(fills)
+    execution_simulator.add_market_data(simulator, START, snapshot(
+        [['99.00', '1.0']],
+        [['100.00', '1.0'], ['101.00', '2.0']]
+    ))
+    execution_simulator.submit(simulator, START, 'random', 'buy', 2.0)
+    execution_simulator.run_until(simulator, START + 1.0)
+    assert [(fill.quantity, fill.price) for fill in fills] == [(1.0, 100.0), (1.0, 101.0)]
+    assert simulator.book.prices['sell'] == [101.0]
+    assert simulator.book.sizes['sell'] == {101.0: 1.0}
+
+
+def test_resting_orders_wait_for_the_queue_ahead_of_them():
+    fills = []
+    simulator = construct(fills)
+    execution_simulator.add_market_data(simulator, START, snapshot(
+        [['99.00', '3.0']],
+        [['100.00', '1.0']]
+    ))
+    order_id = execution_simulator.submit(simulator, START, 'algorithmic', 'buy', 2.0, 99.0)
+    execution_simulator.run_until(simulator, START + 1.0)
+    assert simulator.orders[order_id].queue_ahead == 3.0
+
+    execution_simulator.add_market_data(simulator, START + 2.0, match(99.0, 2.0, 'buy'))
+    assert simulator.orders[order_id].queue_ahead == 1.0
+    # Orders ahead are cancelled
+    execution_simulator.add_market_data(simulator, START + 3.0, {
+        'type': 'l2update', 'changes': [['buy', '99.00', '0.5']]
+    })
+    execution_simulator.add_market_data(simulator, START + 4.0, match(99.0, 1.5, 'buy'))
+    execution_simulator.run_until(simulator, START + 5.0)
+    assert [(fill.quantity, fill.liquidity) for fill in fills] == [(1.0, 'maker')]
+    assert simulator.orders[order_id].remaining == 1.0
+
+    # Trades through the order's price fill it completely
+    execution_simulator.add_market_data(simulator, START + 6.0, match(98.5, 0.1, 'buy'))
+    execution_simulator.run_until(simulator, START + 7.0)
+    assert [(fill.quantity, fill.price) for fill in fills] == [(1.0, 99.0), (1.0, 99.0)]
+    assert fills[1].fee == pytest.approx(transaction.calculate_maker_fee(1.0, 99.0))
+    assert simulator.orders == {}
+    assert simulator.resting_prices == {'buy': [], 'sell': []}
+
+
+def test_crossing_limit_orders_take_then_rest():
+    fills = []
+    simulator = construct(fills)
+    execution_simulator.add_market_data(simulator, START, snapshot(
+        [['99.00', '1.0']],
+        [['100.00', '1.0'], ['102.00', '1.0']]
+    ))
+    order_id = execution_simulator.submit(simulator, START, 'algorithmic', 'buy', 2.0, 101.0)
+    execution_simulator.run_until(simulator, START + 1.0)
+    assert [(fill.quantity, fill.price, fill.liquidity) for fill in fills] == [
+        (1.0, 100.0, 'taker')
+    ]
+    assert simulator.orders[order_id].status == 'open'
+    assert simulator.resting_prices['buy'] == [101.0]
+
+
+def test_cancelled_orders_are_not_filled():
+    fills = []
+    simulator = construct(fills)
+    execution_simulator.add_market_data(simulator, START, match(100.0, 1.0, 'sell'))
+    cancelled = execution_simulator.submit(simulator, START, 'algorithmic', 'sell', 1.0, 101.0)
+    late = execution_simulator.submit(simulator, START, 'algorithmic', 'sell', 1.0, 101.0)
+    execution_simulator.run_until(simulator, START + 1.0)
+    execution_simulator.cancel(simulator, START + 1.0, cancelled)
+    execution_simulator.add_market_data(simulator, START + 1.1, match(101.0, 5.0, 'sell'))
+    execution_simulator.run_until(simulator, START + 2.0)
+    assert [fill.order_id for fill in fills] == [late]
+
+    # The trade reaches the order before the cancel does
+    filled = execution_simulator.submit(simulator, START + 2.0, 'algorithmic', 'sell', 1.0, 102.0)
+    execution_simulator.run_until(simulator, START + 3.0)
+    execution_simulator.cancel(simulator, START + 3.0, filled)
+    execution_simulator.add_market_data(simulator, START + 3.01, match(102.0, 5.0, 'sell'))
+    execution_simulator.run_until(simulator, START + 4.0)
+    assert [fill.order_id for fill in fills] == [late, filled]
+
+    # The cancel reaches the exchange before the order does
+    pending = execution_simulator.submit(simulator, START + 4.0, 'algorithmic', 'buy', 1.0)
+    simulator.latency = LATENCY.set(submission=0.0)
+    execution_simulator.cancel(simulator, START + 4.0, pending)
+    execution_simulator.run_until(simulator, START + 5.0)
+    assert [fill.order_id for fill in fills] == [late, filled]
+    assert simulator.orders == {}
+
+
+def test_fee_tiers_follow_trailing_volume():
+    fills = []
+    simulator = construct(fills, depth=DepthModel(level_size=100.0))
+    execution_simulator.add_market_data(simulator, START, match(5000.0, 1.0, 'sell'))
+    for index in range(3):
+        execution_simulator.submit(simulator, START + index, 'random', 'buy', 1.0)
+    thirty_days_later = START + execution_simulator.THIRTY_DAYS + 10.0
+    execution_simulator.submit(simulator, thirty_days_later, 'random', 'buy', 1.0)
+    execution_simulator.run_until(simulator, thirty_days_later + 1.0)
+    rates = [round(fill.fee / (fill.quantity * fill.price), 6) for fill in fills]
+    # $0, $5k and $10k of trailing volume, then none once it's 30 days old
+    assert rates == [0.0025, 0.0025, 0.002, 0.0025]
+
+
+def test_fills_are_recorded_in_trading_records(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    records = {'algorithmic': trading_record.construct('algorithmic', '', 100000.0)}
+
+    def on_fill(fill):
+        records[fill.strategy] = trading_record.record_fill(
+            fill.side, fill.quantity, fill.price, fill.epoch, fill.fee, records[fill.strategy]
+        )
+
+    simulator = execution_simulator.construct(latency=LATENCY, on_fill=on_fill)
+
+    def on_trade(simulator, epoch, message):
+        # Buys on the first trade and sells everything on the hundredth
+        if message['trade_id'] == 1:
+            execution_simulator.submit(simulator, epoch, 'algorithmic', 'buy', 0.5)
+        elif message['trade_id'] == 100:
+            execution_simulator.submit(simulator, epoch, 'algorithmic', 'sell', 0.5)
+
+    messages = market_data_generator.take(
+        market_data_generator.generate(MarketModel(rate=100.0), START), 200
+    )
+    execution_simulator.replay(simulator, messages, on_trade)
+    record = records['algorithmic']
+    assert (record.buys, record.sells) == (1, 1)
+    assert record.crypto == 0.0
+    assert record.fees_paid > 0.0
+    assert record.usd != 100000.0
+    assert len(record.pending_sales) == 0
@@ -0,0 +1,133 @@
+import math
+
+import feature_engine
+import numpy as np
+import pytest  # noqa: F401
+import sliding_window
+import trading_record
+from feature_engine import Feature, FeatureDefinition
+
+
+def ticks(count):
+    # Bursts of matches share an epoch, like the coinbase feed
+    return [
+        (30000.0 + 400.0 * math.sin(i / 15.0) + (i % 7), 1554000000.0 + (i // 3) * 0.5)
+        for i in range(count)
+    ]
+
+
+def test_features_match_trading_record():
+    engine = feature_engine.construct([
+        'moving_average_100',
+        'rate_of_change_100',
+        'exchange_rate_filtered',
+    ])
+    record = trading_record.construct('test', '', 100000.0)
+    for price_info in ticks(450):
+        features = feature_engine.update(price_info, engine)
+        record = trading_record.update_exchange_rate(price_info, record)
+        sample = record.exchange_rates.samples[-1]
+        assert np.isclose(features['moving_average_100'], trading_record.get_moving_average(record))
+        assert np.isclose(features['rate_of_change_100'], trading_record.get_rate_of_change(record))
+        assert np.isclose(
+            features['rate_of_change_filtered'],
+            sample.exchange_rate_rate_of_change_filtered
+        )
+        assert np.isclose(features['exchange_rate_filtered'], sample.exchange_rate_filtered)
+
+
+def test_window_samples_match_sliding_window():
+    engine = feature_engine.construct(feature_engine.WINDOW_FEATURES.values())
+    window = sliding_window.construct(maximum_size=1000)
+    shared_window = sliding_window.construct(maximum_size=1000)
+    for price_info in ticks(450):
+        features = feature_engine.update(price_info, engine)
+        window = sliding_window.add(
+            sliding_window.SlidingWindowSample(exchange_rate=price_info[0], epoch=price_info[1]),
+            window
+        )
+        shared_window = sliding_window.append(feature_engine.window_sample(features), shared_window)
+        expected, sample = window.samples[-1], shared_window.samples[-1]
+        for field in ['exchange_rate', 'epoch', *feature_engine.WINDOW_FEATURES]:
+            assert np.isclose(sample[field], expected[field])
+
+
+def test_rate_of_change_keeps_precision_over_long_histories():
+    engine = feature_engine.construct(['rate_of_change_100'])
+    window = sliding_window.construct(100)
+    for i in range(5000):
+        price_info = (8000.0 + 0.01 * i + (i % 3) * 0.5, 1554000000.0 + i * 0.25)
+        features = feature_engine.update(price_info, engine)
+        window = sliding_window.add(
+            sliding_window.SlidingWindowSample(exchange_rate=price_info[0], epoch=price_info[1]),
+            window
+        )
+    assert np.isclose(features['rate_of_change_100'], sliding_window.derivative(100, window))
+
+
+def test_vwap_and_realized_volatility():
+    engine = feature_engine.construct(['vwap_100', 'realized_volatility_100'])
+    random = np.random.RandomState(0)
+    exchange_rates = 5000.0 * np.exp(np.cumsum(random.normal(0.0, 0.001, 300)))
+    sizes = random.uniform(0.01, 2.0, 300)
+    for i in range(300):
+        features = feature_engine.update((exchange_rates[i], float(i)), engine, sizes[i])
+    window = slice(200, 300)
+    assert np.isclose(
+        features['vwap_100'],
+        (exchange_rates[window] * sizes[window]).sum() / sizes[window].sum()
+    )
+    log_returns = np.diff(np.log(exchange_rates))[-100:]
+    assert np.isclose(features['realized_volatility_100'], np.sqrt((log_returns ** 2).sum()))
+
+
+def test_rsi_is_bounded():
+    engine = feature_engine.construct(['rsi_14'])
+    rsi = [feature_engine.update(price_info, engine)['rsi_14'] for price_info in ticks(200)]
+    assert rsi[:13] == [50.0] * 13
+    assert all(0.0 <= value <= 100.0 for value in rsi)
+    rising = feature_engine.construct(['rsi_14'])
+    for i in range(20):
+        features = feature_engine.update((100.0 + i, float(i)), rising)
+    assert features['rsi_14'] == 100.0
+
+
+def test_dependencies_are_resolved_and_computed_once():
+    constructed = []
+
+    class Counter(Feature):
+        def __init__(self, name):
+            constructed.append(name)
+            self.count = 0
+
+        def update(self, features):
+            self.count += 1
+            return self.count
+
+    class Sum(Feature):
+        def update(self, features):
+            return features['a'] + features['b']
+
+    definitions = {
+        'a': FeatureDefinition(construct=lambda: Counter('a')),
+        'b': FeatureDefinition(dependencies=['a'], construct=lambda: Counter('b')),
+        'sum': FeatureDefinition(dependencies=['b', 'a'], construct=Sum),
+    }
+    engine = feature_engine.construct(['sum', 'b', 'a'], definitions)
+    assert [name for name, _ in engine.nodes] == ['a', 'b', 'sum']
+    assert constructed == ['a', 'b']
+    feature_engine.update((1.0, 0.0), engine)
+    features = feature_engine.update((1.0, 1.0), engine)
+    assert features['sum'] == 4
+    assert engine.features is features
+
+
+def test_unknown_features_and_cycles_are_rejected():
+    with pytest.raises(ValueError, match='unknown feature: missing'):
+        feature_engine.construct(['missing'])
+    definitions = {
+        'a': FeatureDefinition(dependencies=['b'], construct=Feature),
+        'b': FeatureDefinition(dependencies=['a'], construct=Feature),
+    }
+    with pytest.raises(ValueError, match='a -> b -> a'):
+        feature_engine.construct(['a'], definitions)
@@ -0,0 +1,147 @@
+import io
+import json
+import math
+import os
+import struct
+import time
+
+import feed_server
+import market_data_generator
+import pytest  # noqa: F401
+from feed_server import FeedServer, Subscription
+from market_data_generator import MarketModel
+from pyrsistent import pset
+
+START = 1554120000.0
+
+
+def synthetic(count, rate=1000.0, level2_ratio=0.5):
+    return market_data_generator.take(
+        market_data_generator.generate(MarketModel(rate=rate, level2_ratio=level2_ratio), START),
+        count
+    )
+
+
+def client_frame(payload, opcode=feed_server.TEXT, mask=b'\x01\x02\x03\x04', final=True):
+    ''' Clients mask every frame '''
+    length = len(payload)
+    first = (0x80 if final else 0) | opcode
+    if length < 126:
+        header = struct.pack('!BB', first, 0x80 | length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', first, 0x80 | 126, length)
+    else:
+        header = struct.pack('!BBQ', first, 0x80 | 127, length)
+    masked = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+    return header + mask + masked
+
+
+def test_handshake_accepts_the_rfc_example_key():
+    assert feed_server.accept_key('dGhlIHNhbXBsZSBub25jZQ==') == 's3pPLMBiTxaQ9kYGzzhZRbK+xOo='
+
+
+def test_frames_are_read_and_encoded_at_every_length():
+    for length in [0, 10, 125, 126, 300, 70000]:
+        payload = os.urandom(length)
+        assert feed_server.read_frame(io.BytesIO(client_frame(payload))) == (
+            feed_server.TEXT, True, payload
+        )
+        encoded = feed_server.encode_frame(payload, feed_server.BINARY)
+        assert feed_server.read_frame(io.BytesIO(encoded)) == (feed_server.BINARY, True, payload)
+
+    fragmented = feed_server.MessageReader(io.BytesIO(
+        client_frame(b'hello ', final=False) +
+        client_frame(b'ping', feed_server.PING) +
+        client_frame(b'world', feed_server.CONTINUATION)
+    ))
+    assert fragmented.read() == (feed_server.PING, b'ping')
+    assert fragmented.read() == (feed_server.TEXT, b'hello world')
+    with pytest.raises(feed_server.ConnectionClosed):
+        fragmented.read()
+
+
+def test_subscriptions_select_channels_and_products():
+    subscription = feed_server.parse_subscription({
+        'type': 'subscribe',
+        'product_ids': ['BTC-USD'],
+        'channels': ['ticker', {'name': 'matches', 'product_ids': ['ETH-USD']}],
+    })
+    assert subscription == Subscription(
+        product_ids=pset(['BTC-USD', 'ETH-USD']),
+        channels=pset(['ticker', 'matches'])
+    )
+    _, match = synthetic(1)[0]
+    match_and_ticker = feed_server.select(match, subscription)
+    assert [message['type'] for message in match_and_ticker] == ['match', 'ticker']
+    assert match_and_ticker[1]['sequence'] == match['sequence']
+    assert match_and_ticker[1]['price'] == match['price']
+
+    assert feed_server.select(dict(match, product_id='LTC-USD'), subscription) == []
+    level2 = Subscription(product_ids=pset(['BTC-USD']), channels=pset(['level2']))
+    assert feed_server.select(match, level2) == []
+
+
+def test_recordings_are_replayed_to_subscribed_clients(tmp_path):
+    websocket = pytest.importorskip('websocket')
+    messages = synthetic(200)
+    path = str(tmp_path / 'recording.jsonl')
+    feed_server.write_recording([message for _, message in messages], path)
+
+    server = FeedServer(lambda: feed_server.read_recording(path), math.inf).start()
+    try:
+        connection = websocket.create_connection(server.url)
+        connection.send(json.dumps({
+            'type': 'subscribe',
+            'product_ids': ['BTC-USD'],
+            'channels': ['matches', 'level2', 'full', 'user'],
+        }))
+        assert json.loads(connection.recv())['type'] == 'subscriptions'
+        received = [json.loads(connection.recv()) for _ in range(len(messages))]
+        assert received == [message for _, message in messages]
+
+        # The client's keepalive pings are answered
+        connection.ping('keepalive')
+        frame = connection.recv_data_frame(control_frame=True)[1]
+        assert (frame.opcode, frame.data) == (feed_server.PONG, b'keepalive')
+        connection.close()
+
+        rejected = websocket.create_connection(server.url)
+        rejected.send(json.dumps({'type': 'unsubscribe'}))
+        assert json.loads(rejected.recv())['type'] == 'error'
+        rejected.close()
+    finally:
+        server.stop()
+
+
+def test_replays_are_paced_by_speed():
+    websocket = pytest.importorskip('websocket')
+    # About a second of trades replayed at 10x
+    messages = synthetic(100, rate=100.0, level2_ratio=0.0)
+    server = FeedServer(lambda: iter(messages), 10.0).start()
+    try:
+        connection = websocket.create_connection(server.url)
+        connection.send(json.dumps({'type': 'subscribe', 'product_ids': ['BTC-USD']}))
+        connection.recv()
+        started = time.perf_counter()
+        for _ in range(len(messages)):
+            connection.recv()
+        elapsed = time.perf_counter() - started
+        connection.close()
+    finally:
+        server.stop()
+    simulated = messages[-1][0] - messages[0][0]
+    assert simulated / 10.0 * 0.8 < elapsed < simulated / 10.0 + 0.5
+
+
+def test_latency_is_measured_from_socket_to_decision():
+    pytest.importorskip('websocket')
+    decisions = []
+    statistics = feed_server.measure_latency(
+        decisions.append,
+        lambda: market_data_generator.generate(MarketModel(rate=1000.0), START),
+        500
+    )
+    assert len(decisions) == statistics.messages == 500
+    assert statistics.rate > 0.0
+    assert 0.0 < statistics.median_latency <= statistics.p99_latency
+    assert statistics.p99_latency <= statistics.maximum_latency < 5.0
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest  # noqa: F401
+from fully_connected_neural_network import forward
+
+
+def test_forward():
+    weights = [
+        np.array([[1.0, -1.0], [2.0, 0.5]]), np.array([0.5, -4.0]),
+        np.array([[1.0], [3.0]]), np.array([-1.0]),
+    ]
+    # hidden = relu([1 + 4 + 0.5, -1 + 1 - 4]) = [5.5, 0.0]
+    assert forward(weights, np.array([[1.0, 2.0]])).tolist() == [[4.5]]
+
+
+def test_forward_matches_reference_implementation():
+    random = np.random.RandomState(0)
+    shapes = [(3, 50), (50,), (50, 50), (50,), (50, 3), (3,)]
+    weights = [random.standard_normal(shape) for shape in shapes]
+    inputs = random.standard_normal((10, 3))
+
+    expected = []
+    for input in inputs:
+        hidden = input
+        for index in range(0, 4, 2):
+            hidden = [
+                max(0.0, sum(h * w for h, w in zip(hidden, column)) + bias)
+                for column, bias in zip(weights[index].T, weights[index + 1])
+            ]
+        expected.append([
+            sum(h * w for h, w in zip(hidden, column)) + bias
+            for column, bias in zip(weights[4].T, weights[5])
+        ])
+
+    assert np.allclose(forward(weights, inputs), expected, rtol=1e-12, atol=1e-12)
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest  # noqa: F401
+import input_normalizer
+
+
+def test_statistics_match_numpy():
+    random = np.random.RandomState(0)
+    inputs = np.stack([
+        10000.0 + np.cumsum(random.standard_normal(500)),
+        0.001 * random.standard_normal(500),
+        np.full(500, 5.0),
+    ], axis=1)
+    normalizer = input_normalizer.construct(3)
+    for input in inputs:
+        normalizer = input_normalizer.update(normalizer, input)
+
+    assert normalizer.count == 500
+    assert np.allclose(normalizer.mean, inputs.mean(axis=0), rtol=1e-12)
+    deviation = input_normalizer.standard_deviation(normalizer)
+    assert np.allclose(deviation[:2], inputs[:, :2].std(axis=0, ddof=1), rtol=1e-9)
+    # Constant inputs are only centered
+    assert deviation[2] == 1.0
+
+    normalized = input_normalizer.normalize(normalizer, inputs, np.float32)
+    assert normalized.dtype == np.float32
+    assert np.allclose(normalized[:, :2].mean(axis=0), 0.0, atol=1e-5)
+    assert np.allclose(normalized[:, :2].std(axis=0, ddof=1), 1.0, atol=1e-5)
+    assert np.all(normalized[:, 2] == 0.0)
+
+
+def test_inputs_are_only_centered_until_they_vary():
+    normalizer = input_normalizer.construct(2)
+    assert input_normalizer.normalize(normalizer, np.array([3.0, 4.0])).tolist() == [3.0, 4.0]
+    updated = input_normalizer.update(normalizer, np.array([1.0, 2.0]))
+    assert input_normalizer.normalize(updated, np.array([3.0, 4.0])).tolist() == [2.0, 2.0]
+    # Snapshots that share the earlier normalizer don't see the update
+    assert normalizer.count == 0
+    assert input_normalizer.normalize(normalizer, np.array([3.0, 4.0])).tolist() == [3.0, 4.0]
+    assert not updated.mean.flags.writeable
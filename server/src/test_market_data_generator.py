@@ -0,0 +1,121 @@
+import math
+import threading
+import time
+
+import market_data_generator
+import numpy as np
+import pytest  # noqa: F401
+import zulu_time
+from market_data_generator import MarketModel
+
+START = 1554120000.0
+
+
+def epochs(model, count, seed=0):
+    return np.array([
+        epoch for epoch, _ in market_data_generator.take(
+            market_data_generator.generate(model, START, seed), count
+        )
+    ])
+
+
+def window_counts(arrivals, width):
+    return np.bincount(((arrivals - START) // width).astype(int))[:-1]
+
+
+def test_arrivals_match_the_target_rate_and_cluster_when_excited():
+    poisson = epochs(MarketModel(rate=100.0, branching_ratio=0.0), 20000)
+    hawkes = epochs(MarketModel(rate=100.0, branching_ratio=0.8, decay=5.0), 20000)
+    for arrivals in [poisson, hawkes]:
+        assert len(arrivals) / (arrivals[-1] - START) == pytest.approx(100.0, rel=0.1)
+
+    # Poisson counts have a variance equal to their mean, excited arrivals are burstier
+    poisson_counts = window_counts(poisson, 1.0)
+    hawkes_counts = window_counts(hawkes, 1.0)
+    assert poisson_counts.var() / poisson_counts.mean() == pytest.approx(1.0, abs=0.2)
+    assert hawkes_counts.var() / hawkes_counts.mean() > 5.0
+
+
+def test_messages_are_coinbase_shaped():
+    model = MarketModel(rate=1000.0, level2_ratio=0.5)
+    messages = market_data_generator.take(market_data_generator.generate(model, START), 1000)
+    matches = [message for _, message in messages if message['type'] == 'match']
+    updates = [message for _, message in messages if message['type'] == 'l2update']
+    assert 0.4 < len(updates) / len(matches) < 0.6
+
+    for epoch, message in messages:
+        assert zulu_time.get_epoch(message['time']) == pytest.approx(epoch, abs=1e-6)
+        assert message['product_id'] == 'BTC-USD'
+    for message in matches:
+        assert float(message['price']) > 0.0
+        assert float(message['size']) > 0.0
+        assert message['side'] in ['buy', 'sell']
+    assert [message['trade_id'] for message in matches] == list(range(1, len(matches) + 1))
+    assert [message['sequence'] for message in matches] == sorted(
+        message['sequence'] for message in matches
+    )
+    side, price, size = updates[0]['changes'][0]
+    assert side in ['buy', 'sell'] and float(price) > 0.0 and float(size) > 0.0
+
+
+def test_exchange_rates_have_the_model_volatility():
+    model = MarketModel(
+        initial_price=50000.0,
+        volatility=0.8,
+        jump_intensity=0.0,
+        rate=10.0,
+        branching_ratio=0.0
+    )
+    messages = market_data_generator.take(market_data_generator.generate(model, START), 20000)
+    prices = np.array([float(message['price']) for _, message in messages])
+    seconds = messages[-1][0] - START
+    annualized = math.sqrt(
+        np.sum(np.diff(np.log(prices)) ** 2) / seconds * market_data_generator.SECONDS_PER_YEAR
+    )
+    assert annualized == pytest.approx(0.8, rel=0.05)
+
+
+def test_feed_paces_messages_and_detects_slow_consumers():
+    received = []
+    statistics = market_data_generator.feed(
+        received.append,
+        market_data_generator.generate(MarketModel(rate=1000.0, branching_ratio=0.0)),
+        seconds=0.5
+    )
+    assert statistics.messages == len(received)
+    assert 300 < statistics.messages < 700
+    assert not market_data_generator.has_fallen_behind(statistics)
+
+    results = market_data_generator.find_saturation(
+        lambda message: time.sleep(0.002),
+        MarketModel(branching_ratio=0.0),
+        [100.0, 2000.0, 10000.0],
+        1.0
+    )
+    assert [rate for rate, _ in results] == [100.0, 2000.0]
+    assert not market_data_generator.has_fallen_behind(results[0][1])
+    assert market_data_generator.has_fallen_behind(results[1][1])
+
+
+def test_messages_are_streamed_over_a_socket():
+    messages = market_data_generator.take(
+        market_data_generator.generate(MarketModel(rate=1000.0), START), 100
+    )
+    listening = threading.Event()
+    addresses = []
+
+    def on_listening(address):
+        addresses.append(address)
+        listening.set()
+
+    server = threading.Thread(target=market_data_generator.serve, kwargs={
+        'messages': messages,
+        'speed': math.inf,
+        'on_listening': on_listening,
+    })
+    server.start()
+    assert listening.wait(5.0)
+    host, port = addresses[0]
+    received = list(market_data_generator.receive(host, port))
+    server.join()
+    assert received == [message for _, message in messages]
@@ -0,0 +1,194 @@
+import json
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import algorithmic_model
+import memory_accounting
+import numpy as np
+import pytest  # noqa: F401
+import q_learning_population
+import registry_snapshot
+import strategies
+import trading_record
+import web_application
+from registry_snapshot import SnapshotPublisher
+from trading_record import TradingAction
+
+
+def trade(records, order, tick):
+    ''' Trades every record on one exchange rate window, like the population agents '''
+    window_record = trading_record.update_exchange_rate(
+        (10000.0 + tick, 1554000000.0 + tick),
+        records['q-learning-population-0']
+    )
+    for name, record in records.items():
+        record = trading_record.set_exchange_rates(window_record.exchange_rates, record)
+        records[name] = trading_record.place_order(TradingAction(order=order, amount=1), record)
+
+
+def construct_state():
+    records = strategies.construct_trading_records(['q-learning-population'], 3)
+    models = {
+        'algorithmic': algorithmic_model.construct().set('pending_trades', [
+            algorithmic_model.PendingTrade(buyers_price=10000.0),
+        ]),
+        'q-learning-population': q_learning_population.construct(
+            q_learning_population.sample_hyperparameters(3), memory_size=50
+        ),
+    }
+    return records, models
+
+
+def test_structures_are_counted_and_sized():
+    records, models = construct_state()
+    for tick in range(4):
+        trade(records, 'buy', tick)
+    monitor = memory_accounting.MemoryMonitor(
+        SnapshotPublisher(registry_snapshot.construct(records, models, 4))
+    )
+    report = monitor.report()
+
+    assert report.tick == 4
+    pending_sales = report.structures['q-learning-population-0/pending_sales']
+    assert (pending_sales.count, pending_sales.maximum_size) == (4, None)
+    assert pending_sales.bytes > 4 * 100
+    window = report.structures['q-learning-population-1/exchange_rates']
+    assert (window.count, window.maximum_size) == (4, 1000)
+    # The agents share one window, which is walked and counted once
+    assert report.structures['q-learning-population-2/exchange_rates'] == window.set(
+        'shared_with', 'q-learning-population-0/exchange_rates'
+    )
+    assert report.total_bytes == sum(
+        size.bytes for size in report.structures.values() if size.shared_with is None
+    )
+    assert report.structures['algorithmic/pending_trades'].count == 1
+    memory = report.structures['q-learning-population/memory']
+    assert (memory.count, memory.maximum_size) == (0, 50)
+    assert memory.bytes > 0
+    assert report.structures['q-learning-population/weights'].count > 0
+    assert report.growing == []
+
+
+def test_uncapped_structures_that_keep_growing_are_reported(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # pair_transaction appends to transaction_history.csv
+    records, models = construct_state()
+    publisher = SnapshotPublisher(registry_snapshot.construct(records, models))
+    monitor = memory_accounting.MemoryMonitor(publisher)
+    for tick in range(memory_accounting.GROWTH_REPORTS + 1):
+        trade(records, 'buy', tick)
+        publisher.publish(registry_snapshot.construct(records, models, tick))
+        report = monitor.report()
+    # Transaction windows and sliding windows grow too, but are capped
+    assert report.growing == [
+        'q-learning-population-0/pending_sales',
+        'q-learning-population-1/pending_sales',
+        'q-learning-population-2/pending_sales',
+    ]
+    memory_accounting.log(report)
+
+    trade(records, 'sell', memory_accounting.GROWTH_REPORTS + 1)
+    publisher.publish(registry_snapshot.construct(records, models))
+    assert monitor.report().growing == []
+
+
+def test_snapshots_leave_the_report_history_alone(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # pair_transaction appends to transaction_history.csv
+    records, models = construct_state()
+    publisher = SnapshotPublisher(registry_snapshot.construct(records, models))
+    monitor = memory_accounting.MemoryMonitor(publisher)
+    for tick in range(memory_accounting.GROWTH_REPORTS + 1):
+        trade(records, 'buy', tick)
+        publisher.publish(registry_snapshot.construct(records, models, tick))
+        snapshot = monitor.snapshot()
+        monitor.snapshot()
+        assert len(monitor.counts) == tick
+        report = monitor.report()
+    # Growth is reported against the periodic reports only
+    assert len(report.growing) == 3
+    assert snapshot.growing == report.growing
+
+    memory_accounting.start_tracing(1)
+    try:
+        monitor.report()
+        kept = [bytearray(1024) for _ in range(1000)]
+        for _ in range(2):
+            assert any(allocation.bytes > 1024 * 1000
+                       for allocation in monitor.snapshot().allocator_growth)
+    finally:
+        tracemalloc.stop()
+    assert len(kept) == 1000
+
+
+def test_tensorflow_networks_are_sized_from_their_variables():
+    def dense(inputs, outputs):
+        return SimpleNamespace(
+            kernel=SimpleNamespace(shape=SimpleNamespace(num_elements=lambda: inputs * outputs)),
+            bias=SimpleNamespace(shape=SimpleNamespace(num_elements=lambda: outputs))
+        )
+    network = SimpleNamespace(
+        inference_backend='tensorflow',
+        dtype=np.dtype('float32'),
+        layers=[dense(4, 50), dense(50, 3)]
+    )
+    size = memory_accounting.network_size(network)
+    assert size.count == 4 * 50 + 50 + 50 * 3 + 3
+    assert size.bytes == size.count * 4 * memory_accounting.TENSORFLOW_COPIES
+
+    network.inference_backend = 'numpy'
+    network.numpy_weights = [np.zeros((4, 50), np.float32), np.zeros(50, np.float32)]
+    assert memory_accounting.network_size(network).bytes == \
+        250 * 4 * (1 + memory_accounting.TENSORFLOW_COPIES)
+
+
+def test_traced_allocators_and_their_growth():
+    records, models = construct_state()
+    publisher = SnapshotPublisher(registry_snapshot.construct(records, models))
+    monitor = memory_accounting.MemoryMonitor(publisher)
+    assert monitor.report().allocators == []
+
+    memory_accounting.start_tracing(1)
+    try:
+        monitor.report()
+        kept = [bytearray(1024) for _ in range(1000)]
+        report = monitor.report()
+    finally:
+        tracemalloc.stop()
+    assert report.traced_bytes > 1024 * 1000
+    assert any('test_memory_accounting.py' in allocation.location and
+               allocation.bytes > 1024 * 1000
+               for allocation in report.allocator_growth)
+    assert len(kept) == 1000
+
+
+def test_monitor_survives_failed_reports(monkeypatch):
+    publisher = SnapshotPublisher(registry_snapshot.construct(
+        strategies.construct_trading_records(['random']), {}
+    ))
+    monitor = memory_accounting.MemoryMonitor(publisher, interval=0.01)
+    measure = monitor.report
+    reports = []
+
+    def report():
+        reports.append(len(reports))
+        if len(reports) < 3:
+            raise ValueError('unmeasurable structure')
+        return measure()
+    monkeypatch.setattr(monitor, 'report', report)
+    monitor.start()
+    time.sleep(0.2)
+    assert monitor.is_alive()
+    assert len(reports) > 3
+    # The daemon thread outlives the test, so it's parked instead of stopped
+    monitor.interval = 3600.0
+
+
+def test_memory_endpoint():
+    records, models = construct_state()
+    publisher = SnapshotPublisher(registry_snapshot.construct(records, models))
+    client = web_application.create_app(
+        web_application.SnapshotViews(publisher),
+        memory_monitor=memory_accounting.MemoryMonitor(publisher)
+    ).test_client()
+    report = json.loads(client.get('/debug/memory').get_data())
+    assert report['structures']['q-learning-population-0/pending_sales']['count'] == 0
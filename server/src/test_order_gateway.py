@@ -0,0 +1,170 @@
+import asyncio
+import base64
+import time
+
+import coinbase_adapter
+import mock_exchange
+import order_gateway
+import pytest  # noqa: F401
+import result
+from mock_exchange import MockExchange
+from order_gateway import RetryPolicy
+
+SECRET = base64.b64encode(b'mock exchange secret').decode('ascii')
+FAST_RETRIES = RetryPolicy(attempts=3, timeout=1.0, backoff=0.01)
+
+
+def run(exchange, test, **arguments):
+    ''' Runs (test) with a gateway connected to (exchange) on a new event loop '''
+    async def main():
+        await mock_exchange.start(exchange)
+        gateway = order_gateway.construct(exchange.url, **arguments)
+        try:
+            return await test(gateway)
+        finally:
+            await order_gateway.close(gateway)
+            await mock_exchange.stop(exchange)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+def test_orders_are_signed_placed_and_cancelled():
+    exchange = MockExchange(b64secret=SECRET)
+
+    async def test(gateway):
+        placed = await order_gateway.place_order(gateway, 'buy', 'BTC-USD', '0.01', '4000.00')
+        fetched = await order_gateway.get_order(gateway, placed['id'])
+        cancelled = await order_gateway.cancel_order(gateway, placed['id'])
+        again = await order_gateway.cancel_order(gateway, placed['id'])
+        return placed, fetched, cancelled, again
+
+    placed, fetched, cancelled, again = run(
+        exchange, test, key='key', b64secret=SECRET, passphrase='passphrase'
+    )
+    assert (placed['side'], placed['price'], placed['size']) == ('buy', '4000.00', '0.01')
+    assert fetched['id'] == placed['id']
+    assert cancelled == [placed['id']]
+    assert isinstance(again, result.Error)
+
+    unsigned = run(MockExchange(b64secret=SECRET), lambda gateway: order_gateway.place_order(
+        gateway, 'buy', 'BTC-USD', '0.01', '4000.00'
+    ))
+    assert isinstance(unsigned, result.Error)
+
+
+def test_requests_under_a_base_path_are_signed_with_it():
+    exchange = MockExchange(b64secret=SECRET, base_path='/api')
+
+    async def test(gateway):
+        placed = await order_gateway.place_order(gateway, 'sell', 'BTC-USD', '0.02', '4100.00')
+        return placed, await order_gateway.get_order(gateway, placed['id'])
+
+    placed, fetched = run(exchange, test, key='key', b64secret=SECRET, passphrase='passphrase')
+    assert (placed['side'], placed['price']) == ('sell', '4100.00')
+    assert fetched['id'] == placed['id']
+
+
+def test_concurrent_orders_share_pooled_connections():
+    exchange = MockExchange(rate=1000.0, burst=1000, latency=0.05)
+
+    async def test(gateway):
+        started = time.perf_counter()
+        orders = await asyncio.gather(*[
+            order_gateway.place_order(gateway, 'sell', 'BTC-USD', '0.01', f'{6000 + index}.00')
+            for index in range(20)
+        ])
+        return orders, time.perf_counter() - started
+
+    orders, elapsed = run(exchange, test, pool_size=4, rate=1000.0, burst=1000)
+    assert len({order['id'] for order in orders}) == 20
+    assert exchange.connections == 4
+    assert exchange.maximum_in_flight == 4
+    # 5 rounds of 4 parallel requests rather than 20 sequential ones
+    assert elapsed < 20 * 0.05 * 0.6
+
+
+def test_bursts_are_delayed_to_the_rate_limit():
+    exchange = MockExchange(rate=50.0, burst=7)
+
+    async def test(gateway):
+        started = time.perf_counter()
+        orders = await asyncio.gather(*[
+            order_gateway.place_order(gateway, 'buy', 'BTC-USD', '0.01', '4000.00')
+            for _ in range(30)
+        ])
+        return orders, time.perf_counter() - started
+
+    orders, elapsed = run(exchange, test, rate=50.0, burst=5)
+    assert all(result.is_okay(order) for order in orders)
+    assert exchange.rejected == 0
+    # The first 5 go out at once and the remaining 25 at 50 per second
+    assert elapsed >= 0.45
+
+
+def test_failed_requests_are_retried_without_duplicating_orders():
+    exchange = MockExchange()
+
+    async def test(gateway):
+        exchange.failures = [503, 429]
+        retried = await order_gateway.place_order(gateway, 'buy', 'BTC-USD', '0.01', '4000.00')
+        # The exchange places the order but the response is lost
+        exchange.drops = 1
+        dropped = await order_gateway.place_order(
+            gateway, 'buy', 'BTC-USD', '0.02', '4000.00', client_oid='lost-response'
+        )
+        exchange.failures = [503, 503, 503]
+        failed = await order_gateway.get_order(gateway, retried['id'])
+        return retried, dropped, failed
+
+    retried, dropped, failed = run(exchange, test, retry=FAST_RETRIES)
+    assert retried['size'] == '0.01'
+    assert dropped['id'] == exchange.client_oids['lost-response']
+    assert isinstance(failed, result.Error)
+    assert sorted(order['size'] for order in exchange.orders.values()) == ['0.01', '0.02']
+
+
+def test_rejected_orders_are_not_retried_and_slow_requests_time_out():
+    exchange = MockExchange()
+
+    market = run(exchange, lambda gateway: order_gateway.place_order(
+        gateway, 'buy', 'BTC-USD', '0.01'
+    ), retry=FAST_RETRIES)
+    assert market['type'] == 'market'
+    invalid = run(exchange, lambda gateway: order_gateway.request(
+        gateway, 'POST', '/orders', {'side': 'short'}
+    ), retry=FAST_RETRIES)
+    assert isinstance(invalid, result.Error)
+    assert exchange.requests == 2
+
+    slow = MockExchange(latency=0.3)
+    timed_out = run(slow, lambda gateway: order_gateway.get_order(gateway, 'missing'), retry=(
+        RetryPolicy(attempts=2, timeout=0.1, backoff=0.0)
+    ))
+    assert isinstance(timed_out, result.Error)
+    assert slow.requests == 2
+
+
+def test_orders_are_submitted_without_blocking_the_trading_thread():
+    exchange = MockExchange(rate=1000.0, burst=1000, latency=0.02)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(mock_exchange.start(exchange))
+    gateway = order_gateway.start(order_gateway.construct(exchange.url, rate=1000.0, burst=1000))
+    try:
+        started = time.perf_counter()
+        futures = [
+            coinbase_adapter.limit_sell('BTC-USD', f'{6000 + index}.00', '0.001', gateway)
+            for index in range(20)
+        ]
+        submitting = time.perf_counter() - started
+        assert submitting < 0.05
+        loop.run_until_complete(asyncio.sleep(0.5))
+        orders = [future.result(timeout=5.0) for future in futures]
+    finally:
+        order_gateway.stop(gateway)
+        loop.run_until_complete(mock_exchange.stop(exchange))
+        loop.close()
+    prices = [f'{6000 + index}.00' for index in range(20)]
+    assert sorted(order['price'] for order in orders) == prices
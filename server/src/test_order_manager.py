@@ -0,0 +1,140 @@
+import order_manager
+import pytest  # noqa: F401
+import trading_record
+import transaction
+import transaction_window
+import zulu_time
+
+TIME = '2019-04-01T12:00:00.000000Z'
+
+
+def received(order_id, client_oid, side='buy', size='1.0', price='100.00'):
+    return {
+        'type': 'received', 'order_id': order_id, 'client_oid': client_oid,
+        'side': side, 'size': size, 'price': price, 'order_type': 'limit', 'time': TIME,
+    }
+
+
+def opened(order_id, remaining_size, price='100.00', side='buy'):
+    return {
+        'type': 'open', 'order_id': order_id, 'remaining_size': remaining_size,
+        'price': price, 'side': side, 'time': TIME,
+    }
+
+
+def done(order_id, reason, side='buy'):
+    return {
+        'type': 'done', 'order_id': order_id, 'reason': reason,
+        'remaining_size': '0', 'side': side, 'time': TIME,
+    }
+
+
+def match(maker_order_id, taker_order_id, size, price='100.00', **fee_rates):
+    return dict({
+        'type': 'match', 'maker_order_id': maker_order_id, 'taker_order_id': taker_order_id,
+        'size': size, 'price': price, 'side': 'buy', 'time': TIME, 'trade_id': 1,
+    }, **fee_rates)
+
+
+def test_orders_are_indexed_through_their_lifecycle():
+    manager = order_manager.construct()
+    order = order_manager.track(manager, 'oid-1', 'algorithmic', 'BTC-USD', 'buy', 1.0, 100.0)
+    assert order.status == 'pending'
+    assert order_manager.find_client_oid(manager, 'oid-1') is order
+
+    assert order_manager.apply(manager, received('id-1', 'oid-1')) is order
+    assert order_manager.find(manager, 'id-1') is order
+    order_manager.apply(manager, opened('id-1', '1.0'))
+    assert order.status == 'open'
+    assert order_manager.orders_at(manager, 'buy', 100.0) == [order]
+
+    order_manager.apply(manager, {'type': 'change', 'order_id': 'id-1', 'new_size': '0.6'})
+    assert order.remaining == 0.6
+    order_manager.apply(manager, done('id-1', 'canceled'))
+    assert (order.status, order.done_reason) == ('done', 'canceled')
+    assert order_manager.find(manager, 'id-1') is None
+    assert order_manager.find_client_oid(manager, 'oid-1') is None
+    assert order_manager.orders_at(manager, 'buy', 100.0) == []
+    assert manager.levels == {'buy': {}, 'sell': {}}
+    assert order_manager.open_orders(manager, 'algorithmic') == []
+
+
+def test_other_traders_events_are_ignored():
+    manager = order_manager.construct()
+    order_manager.track(manager, 'oid-1', 'algorithmic', 'BTC-USD', 'buy', 1.0, 100.0)
+    for message in [
+        received('other', 'someone-else'),
+        received('anonymous', None),
+        opened('other', '1.0'),
+        match('other', 'another', '0.5'),
+        done('other', 'filled'),
+        {'type': 'ticker', 'price': '100.00'},
+        {'type': 'l2update', 'changes': [['buy', '100.00', '1.0']]},
+    ]:
+        assert order_manager.apply(manager, message) is None
+    assert manager.orders == {}
+    assert manager.levels == {'buy': {}, 'sell': {}}
+
+
+def test_exposure_is_kept_per_strategy():
+    manager = order_manager.construct()
+    order_manager.track(manager, 'a', 'algorithmic', 'BTC-USD', 'buy', 1.0, 100.0)
+    order_manager.track(manager, 'b', 'algorithmic', 'BTC-USD', 'buy', 2.0, 99.0)
+    order_manager.track(manager, 'c', 'algorithmic', 'BTC-USD', 'sell', 0.5, 101.0)
+    order_manager.track(manager, 'd', 'random', 'BTC-USD', 'sell', 3.0)
+    exposure = order_manager.exposure(manager, 'algorithmic')
+    assert exposure.size == {'buy': 3.0, 'sell': 0.5}
+    assert exposure.notional == pytest.approx({'buy': 298.0, 'sell': 50.5})
+    assert order_manager.exposure(manager, 'random').size == {'buy': 0.0, 'sell': 3.0}
+    assert order_manager.exposure(manager, 'q-learning').size == {'buy': 0.0, 'sell': 0.0}
+
+    order_manager.apply(manager, received('id-a', 'a'))
+    order_manager.apply(manager, opened('id-a', '1.0'))
+    order_manager.apply(manager, match('id-a', 'other', '0.25'))
+    assert exposure.size['buy'] == pytest.approx(2.75)
+    assert exposure.notional['buy'] == pytest.approx(273.0)
+
+    # Orders the exchange rejected are no longer exposed
+    order_manager.untrack(manager, 'b')
+    assert exposure.size['buy'] == pytest.approx(0.75)
+    assert [order.client_oid for order in order_manager.open_orders(manager, 'algorithmic')] == [
+        'a', 'c'
+    ]
+    order_manager.apply(manager, done('id-a', 'canceled'))
+    order_manager.untrack(manager, 'c')
+    exposure = order_manager.exposure(manager, 'algorithmic')
+    assert (exposure.size, exposure.notional) == (
+        {'buy': 0.0, 'sell': 0.0}, {'buy': 0.0, 'sell': 0.0}
+    )
+
+
+def test_fills_are_reconciled_into_trading_records(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    records = {'algorithmic': trading_record.construct('algorithmic', '', 100000.0)}
+    manager = order_manager.construct(records)
+    maker = order_manager.track(manager, 'maker', 'algorithmic', 'BTC-USD', 'buy', 1.0, 100.0)
+    order_manager.apply(manager, received('id-maker', 'maker'))
+    order_manager.apply(manager, opened('id-maker', '1.0'))
+    order_manager.apply(manager, match('id-maker', 'other', '0.4'))
+    order_manager.apply(manager, match('id-maker', 'other', '0.6', maker_fee_rate='0.001'))
+    order_manager.apply(manager, done('id-maker', 'filled'))
+    assert (maker.filled, maker.done_reason) == (1.0, 'filled')
+
+    # A market sell that takes liquidity
+    order_manager.track(manager, 'taker', 'algorithmic', 'BTC-USD', 'sell', 1.0)
+    order_manager.apply(manager, received('id-taker', 'taker', side='sell', price=None))
+    order_manager.apply(manager, match('other', 'id-taker', '1.0', price='110.00'))
+    order_manager.apply(manager, done('id-taker', 'filled', side='sell'))
+
+    fees = [
+        transaction.calculate_maker_fee(0.4, 100.0),
+        0.001 * 0.6 * 100.0,
+        transaction.calculate_taker_fee(1.0, 110.0),
+    ]
+    record = records['algorithmic']
+    assert manager.fills == 3
+    assert (record.buys, record.sells, record.crypto) == (2, 1, 0.0)
+    assert record.fees_paid == pytest.approx(sum(fees))
+    assert record.usd == pytest.approx(100000.0 - 100.0 + 110.0 - sum(fees))
+    assert transaction_window.latest(record.transaction_window).epoch == zulu_time.get_epoch(TIME)
+    assert manager.orders == {}
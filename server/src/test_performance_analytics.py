@@ -0,0 +1,63 @@
+import numpy as np
+import pytest  # noqa: F401
+import performance_analytics
+import trading_record
+import transaction
+from trading_record import TradingAction
+
+
+def test_marks_match_the_metrics_of_the_whole_series():
+    equities = 1000.0 + 50.0 * np.sin(np.arange(300) / 7.0) + np.arange(300) * 0.1
+    analytics = performance_analytics.construct(maximum_returns=50)
+    for equity in equities:
+        analytics = performance_analytics.mark(float(equity), analytics)
+
+    peaks = np.maximum.accumulate(equities)
+    returns = equities[1:] / equities[:-1] - 1.0
+    window = returns[-50:]
+    assert analytics.marks == 300
+    assert analytics.equity == equities[-1]
+    assert analytics.peak_equity == peaks[-1]
+    assert analytics.max_drawdown == pytest.approx(np.max((peaks - equities) / peaks))
+    assert performance_analytics.returns(analytics) == pytest.approx(window.tolist())
+    assert analytics.volatility == pytest.approx(np.std(window, ddof=1))
+    assert analytics.sharpe_ratio == pytest.approx(np.mean(window) / np.std(window, ddof=1))
+    assert 'returns' not in analytics.serialize()
+
+
+def test_fills_count_paired_wins_and_losses():
+    analytics = performance_analytics.construct()
+    analytics = performance_analytics.mark(1000.0, analytics)
+    analytics = performance_analytics.mark(1000.0, analytics)
+    analytics = performance_analytics.record_fill(2.0, 100.0, [], analytics)
+    analytics = performance_analytics.record_fill(2.0, 110.0, [9.5, -0.5, 3.0], analytics)
+    assert (analytics.wins, analytics.losses) == (2, 1)
+    assert analytics.realized_gains == 12.0
+    assert analytics.win_rate == pytest.approx(2 / 3)
+    assert analytics.win_loss_ratio == 2.0
+    assert analytics.traded_volume == 420.0
+    assert analytics.turnover == pytest.approx(0.42)
+
+
+def test_trading_records_keep_their_analytics(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # pair_transaction appends to transaction_history.csv
+    record = trading_record.construct('analytics', '', 100000.0)
+    for tick, (order, exchange_rate) in enumerate([
+        ('buy', 100.0), ('buy', 110.0), ('sell', 105.0), ('sell', 120.0)
+    ]):
+        record = trading_record.update_exchange_rate((exchange_rate, 1554000000.0 + tick), record)
+        record = trading_record.place_order(TradingAction(order=order, amount=1.0), record)
+    analytics = record.analytics
+    assert analytics.marks == 4
+    # The first sale is paired with the buy at 100, the second with the buy at 110
+    assert (analytics.wins, analytics.losses) == (2, 0)
+    assert analytics.traded_volume == 435.0
+    # Equity is marked before the tick's order, the last sale only paid its fee since
+    assert analytics.equity == pytest.approx(
+        record.usd + transaction.calculate_taker_fee(1.0, 120.0)
+    )
+
+    # Fills of exchange orders are paired like the orders the record places itself
+    record = trading_record.record_fill('buy', 0.5, 100.0, 1554000009.0, 0.1, record)
+    record = trading_record.record_fill('sell', 0.5, 90.0, 1554000010.0, 0.1, record)
+    assert (record.analytics.wins, record.analytics.losses) == (2, 1)
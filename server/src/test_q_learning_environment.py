@@ -0,0 +1,93 @@
+import math
+
+import numpy as np
+import pytest  # noqa: F401
+import q_learning_environment
+import result
+import trading_record
+from q_learning_population import ORDERS
+from trading_record import TradingAction
+
+
+def recorded_exchange_rates(samples):
+    epochs = 1554000000.0 + np.arange(samples) * 0.75
+    exchange_rates = np.array([30000.0 + 500.0 * math.sin(i / 20.0) for i in range(samples)])
+    return exchange_rates, epochs
+
+
+def test_states_match_trading_record():
+    exchange_rates, epochs = recorded_exchange_rates(250)
+    states = q_learning_environment.compute_states(exchange_rates, epochs)
+    record = trading_record.construct('test', '', 100000.0)
+    for index in range(len(exchange_rates)):
+        record = trading_record.update_exchange_rate(
+            (float(exchange_rates[index]), float(epochs[index])),
+            record
+        )
+        assert states[index, 0] == trading_record.get_exchange_rate(record)
+        assert np.isclose(states[index, 1], trading_record.get_rate_of_change(record))
+        assert np.isclose(states[index, 2], trading_record.get_moving_average(record))
+
+
+def test_step_matches_trading_record(tmp_path, monkeypatch):
+    # sell_crypto records paired transactions in the working directory
+    monkeypatch.chdir(tmp_path)
+    exchange_rates, epochs = recorded_exchange_rates(200)
+    environment = q_learning_environment.construct(
+        exchange_rates,
+        epochs,
+        episodes=3,
+        episode_length=150
+    )
+    records = [trading_record.construct('test', '', 100000.0) for _ in range(3)]
+    random = np.random.RandomState(2)
+    for _ in range(100):
+        positions = environment.positions.copy()
+        actions = random.randint(0, len(ORDERS), 3)
+        _, rewards, done = q_learning_environment.step(environment, actions)
+        assert not done.any()
+        for episode, record in enumerate(records):
+            record = trading_record.update_exchange_rate(
+                (float(exchange_rates[positions[episode]]), float(epochs[positions[episode]])),
+                record
+            )
+            action = TradingAction(order=ORDERS[actions[episode]], amount=1)
+            updated_record = result.with_default(record, trading_record.place_order(action, record))
+            assert np.isclose(rewards[episode], updated_record.usd - record.usd)
+            records[episode] = updated_record
+
+    for episode, record in enumerate(records):
+        assert np.isclose(environment.usd[episode], record.usd)
+        assert environment.crypto[episode] == record.crypto
+        assert np.isclose(environment.fees_paid[episode], record.fees_paid)
+        assert environment.buys[episode] == record.buys
+        assert environment.sells[episode] == record.sells
+        assert environment.holds[episode] == record.holds
+
+
+def test_finished_episodes_are_reset():
+    exchange_rates, epochs = recorded_exchange_rates(50)
+    environment = q_learning_environment.construct(
+        exchange_rates,
+        epochs,
+        episodes=4,
+        episode_length=10
+    )
+    buy = np.full(4, q_learning_environment.BUY)
+    for _ in range(9):
+        _, _, done = q_learning_environment.step(environment, buy)
+        assert not done.any()
+    assert (environment.buys == 3).all()
+
+    states, rewards, done = q_learning_environment.step(environment, buy)
+    assert done.all()
+    assert (rewards == 0.0).all()
+    assert (environment.usd == q_learning_environment.INITIAL_USD).all()
+    assert (environment.crypto == 0.0).all()
+    assert np.array_equal(states, q_learning_environment.observe(environment))
+
+
+def test_episode_length_must_fit_recorded_exchange_rates():
+    exchange_rates, epochs = recorded_exchange_rates(10)
+    with pytest.raises(ValueError):
+        q_learning_environment.construct(exchange_rates, epochs, episode_length=10)
@@ -0,0 +1,139 @@
+import numpy as np
+import pytest  # noqa: F401
+import q_learning_population
+from fully_connected_neural_network import forward
+from q_learning_population import AgentHyperparameters
+
+
+def construct(size, **hyperparameters):
+    return q_learning_population.construct(
+        [AgentHyperparameters(**hyperparameters) for _ in range(size)],
+        memory_size=20
+    )
+
+
+def agent_weights(population, agent):
+    # Biases are stored as (agents, 1, outputs)
+    return [
+        weights[agent, 0] if index % 2 == 1 else weights[agent]
+        for index, weights in enumerate(population.weights)
+    ]
+
+
+def test_predict_matches_individual_networks():
+    population = construct(4)
+    state = np.array([10000.0, 0.002, 9999.0]) / 10000.0
+    rewards = q_learning_population.predict(population, state)
+    assert rewards.shape == (4, 3)
+    for agent in range(4):
+        assert np.allclose(rewards[agent], forward(agent_weights(population, agent), state))
+
+
+def test_gradients_match_finite_differences():
+    population = construct(2)
+    random = np.random.RandomState(1)
+    inputs = random.standard_normal((5, 3))
+    targets = random.standard_normal((2, 5, 3))
+
+    def loss(weights):
+        outputs = q_learning_population.forward(weights, inputs)[-1]
+        return ((outputs - targets) ** 2).mean(axis=(1, 2)).sum()
+
+    layer_outputs = q_learning_population.forward(population.weights, inputs)
+    analytic = q_learning_population.gradients(
+        population.weights,
+        inputs,
+        layer_outputs,
+        targets
+    )
+    for index in [0, 3, 5]:
+        position = (1,) + tuple(0 for _ in population.weights[index].shape[1:])
+        shifted = [weights.copy() for weights in population.weights]
+        shifted[index][position] += 1e-6
+        numeric = (loss(shifted) - loss(population.weights)) / 1e-6
+        assert abs(numeric - analytic[index][position]) < 1e-4
+
+
+def test_choose_actions():
+    population = construct(3, min_epsilon=0.0, max_epsilon=0.0)
+    state = np.array([1.0, 0.0, 1.0])
+    greedy = np.argmax(q_learning_population.predict(population, state), axis=1)
+    assert q_learning_population.choose_actions(population, state).tolist() == greedy.tolist()
+
+
+def test_replay_memory_ring():
+    population = construct(2)
+    for tick in range(25):
+        q_learning_population.add_training_samples(
+            population,
+            np.full(3, float(tick)),
+            np.array([0, 1]),
+            np.array([float(tick), -float(tick)])
+        )
+    assert population.memory_length == 20
+    states, actions, rewards = q_learning_population.get_random_samples(population, 20)
+    assert states[:, 0].tolist() == [float(tick) for tick in range(5, 25)]
+    assert actions.shape == (2, 20)
+    assert rewards[1].tolist() == [-float(tick) for tick in range(5, 25)]
+
+
+def test_train_reduces_loss():
+    population = construct(2, gamma=0.0, learning_rate=0.01)
+    for tick in range(10):
+        q_learning_population.add_training_samples(
+            population, np.array([0.1 * tick, 0.0, 1.0]), np.array([0, 2]), np.array([1.0, -1.0])
+        )
+
+    def loss():
+        states, actions, rewards = q_learning_population.get_random_samples(population, 10)
+        predicted = q_learning_population.forward(population.weights, states)[-1]
+        agents, samples = np.indices(actions.shape)
+        return ((predicted[agents, samples, actions] - rewards) ** 2).sum()
+
+    initial_loss = loss()
+    for _ in range(200):
+        q_learning_population.train(population)
+    assert loss() < initial_loss / 10
+
+
+def test_float32_population():
+    population = q_learning_population.construct(
+        [AgentHyperparameters(gamma=0.0, learning_rate=0.01) for _ in range(2)],
+        memory_size=20,
+        precision='float32'
+    )
+    assert population.normalizer is not None
+    for tick in range(10):
+        q_learning_population.add_training_samples(
+            population,
+            np.array([10000.0 + tick, 0.001 * (-1) ** tick, 10000.0]),
+            np.array([0, 2]),
+            np.array([1.0, -1.0])
+        )
+    for _ in range(20):
+        q_learning_population.train(population)
+
+    arrays = (
+        population.weights + population.first_moments + population.second_moments +
+        [population.memory_states, population.memory_rewards]
+    )
+    assert all(array.dtype == np.float32 for array in arrays)
+    rewards = q_learning_population.predict(population, np.array([10005.0, 0.001, 10000.0]))
+    assert rewards.dtype == np.float32
+    assert np.all(np.isfinite(rewards))
+
+
+def test_float32_weights_start_as_float64_weights():
+    hyperparameters = [AgentHyperparameters() for _ in range(3)]
+    float64 = q_learning_population.construct(hyperparameters)
+    float32 = q_learning_population.construct(
+        hyperparameters, precision='float32', normalize_inputs=False
+    )
+    assert float64.normalizer is None
+    assert float64.weights[0].dtype == np.float64
+    state = np.array([1.0, 0.002, 0.999])
+    assert np.allclose(
+        q_learning_population.predict(float32, state),
+        q_learning_population.predict(float64, state),
+        rtol=1e-5
+    )
@@ -0,0 +1,148 @@
+import threading
+import time
+
+import market_data_generator
+import pytest  # noqa: F401
+import redundant_feed
+from feed_server import FeedServer
+from market_data_generator import MarketModel
+from redundant_feed import DedupWindow
+
+START = 1554120000.0
+
+
+def synthetic():
+    return market_data_generator.generate(MarketModel(rate=200.0), START)
+
+
+def delayed(parity, seconds=0.003):
+    ''' Delays the messages of one parity, so each feed is faster for the other half '''
+    def on_sent(message, sent_at):
+        if message['sequence'] % 2 == parity:
+            time.sleep(seconds)
+    return on_sent
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_dedup_window_remembers_recent_sequences():
+    window = DedupWindow(8)
+    assert redundant_feed.mark(window, 100, 1.0)
+    assert not redundant_feed.mark(window, 100, 1.5)
+    assert redundant_feed.seconds_behind(window, 100, 1.5) == 0.5
+    # Sequence numbers that arrive out of order
+    assert redundant_feed.mark(window, 103, 2.0)
+    assert redundant_feed.mark(window, 101, 2.1)
+    assert not redundant_feed.mark(window, 103, 2.2)
+    assert redundant_feed.mark(window, 102, 2.3)
+
+    # The ring wraps around and forgets the oldest
+    assert redundant_feed.mark(window, 108, 3.0)
+    assert not redundant_feed.mark(window, 101, 3.0)
+    assert redundant_feed.mark(window, 104, 3.0)
+    assert redundant_feed.mark(window, 111, 4.0)
+    assert not redundant_feed.mark(window, 100, 4.0)
+    assert redundant_feed.seconds_behind(window, 100, 4.0) is None
+    assert redundant_feed.mark(window, 1000, 5.0)
+    assert redundant_feed.mark(window, 999, 5.0)
+    assert not redundant_feed.mark(window, 111, 5.0)
+
+    with pytest.raises(ValueError):
+        DedupWindow(10)
+
+
+def test_first_arrivals_are_delivered_once():
+    delivered = []
+    feed = redundant_feed.construct(['ws://a', 'ws://b'], delivered.append)
+    first, second = feed.connections
+    for connection, connected_at in [(first, 1.0), (second, 2.0)]:
+        connection.connected = True
+        connection.connected_at = connected_at
+    redundant_feed.elect_primary(feed)
+    assert feed.primary is first
+
+    match = {'type': 'match', 'product_id': 'BTC-USD', 'sequence': 5}
+    ticker = {'type': 'ticker', 'product_id': 'BTC-USD', 'sequence': 5}
+    other_product = {'type': 'match', 'product_id': 'ETH-USD', 'sequence': 5}
+    update = {'type': 'l2update', 'product_id': 'BTC-USD', 'changes': []}
+    assert redundant_feed.receive(feed, second, match, 10.0)
+    assert not redundant_feed.receive(feed, first, match, 10.002)
+    assert redundant_feed.receive(feed, first, ticker, 10.003)
+    assert redundant_feed.receive(feed, first, other_product, 10.003)
+    # Messages without a sequence number only come from the primary connection
+    assert not redundant_feed.receive(feed, second, update, 10.004)
+    assert redundant_feed.receive(feed, first, update, 10.005)
+    assert not redundant_feed.receive(feed, second, ticker, 10.006)
+    assert delivered == [match, ticker, other_product, update]
+
+    # The ticker shares its match's sequence number, so each connection
+    # counts the pair once: first as a duplicate, second as a first arrival
+    first_statistics, second_statistics = redundant_feed.statistics(feed)
+    assert (first_statistics.received, first_statistics.first_arrivals) == (3, 1)
+    assert first_statistics.duplicates == 1
+    assert first_statistics.mean_lag == pytest.approx(0.002)
+    assert (second_statistics.received, second_statistics.first_arrivals) == (2, 1)
+    assert second_statistics.duplicates == 0
+
+    # The other connection takes over when the primary drops
+    first.connected = False
+    redundant_feed.elect_primary(feed)
+    assert feed.primary is second
+
+
+def test_feeds_with_delays_are_merged_by_first_arrival():
+    servers = [FeedServer(synthetic, on_sent=delayed(parity)).start() for parity in [0, 1]]
+    lock = threading.Lock()
+    sequences = []
+
+    def on_message(message):
+        with lock:
+            sequences.append(message['sequence'])
+
+    feed = redundant_feed.start(redundant_feed.construct(
+        [server.url for server in servers], on_message
+    ))
+    try:
+        wait_for(lambda: len(sequences) >= 200)
+    finally:
+        redundant_feed.stop(feed)
+        for server in servers:
+            server.stop()
+    # Every message exactly once, and each connection was faster for some
+    assert sorted(sequences) == list(range(1, len(sequences) + 1))
+    for connection in redundant_feed.statistics(feed):
+        assert connection.first_arrivals > 0.2 * len(sequences)
+        assert 0.0 < connection.mean_lag < 0.1
+
+
+def test_messages_keep_arriving_when_a_connection_drops():
+    servers = [FeedServer(synthetic).start() for _ in range(2)]
+    lock = threading.Lock()
+    sequences = []
+
+    def on_message(message):
+        with lock:
+            sequences.append(message['sequence'])
+
+    feed = redundant_feed.start(redundant_feed.construct(
+        [server.url for server in servers], on_message, reconnect_delay=0.05
+    ))
+    try:
+        wait_for(lambda: len(sequences) >= 50)
+        servers[0].stop()
+        wait_for(lambda: not feed.connections[0].connected)
+        dropped_at = len(sequences)
+        wait_for(lambda: len(sequences) >= dropped_at + 50)
+        assert feed.primary is feed.connections[1]
+    finally:
+        redundant_feed.stop(feed)
+        servers[1].stop()
+    assert sorted(sequences) == list(range(1, len(sequences) + 1))
+    dropped, remaining = redundant_feed.statistics(feed)
+    assert (dropped.disconnects, dropped.connected) == (1, False)
+    assert remaining.first_arrivals >= 50
@@ -0,0 +1,157 @@
+import math
+import sys
+import threading
+import time
+
+import pytest  # noqa: F401
+import registry_snapshot
+import sliding_window
+import trading_record
+from registry_snapshot import SnapshotPublisher
+
+
+def construct_registry():
+    return {
+        name: trading_record.construct(name, '', 100000.0).set(
+            'exchange_rates', sliding_window.construct(maximum_size=10)
+        )
+        for name in ['q-learning', 'algorithmic', 'random']
+    }
+
+
+def test_publish():
+    registry = construct_registry()
+    publisher = SnapshotPublisher(registry_snapshot.construct(registry, {}))
+    snapshot = publisher.current()
+
+    registry['random'] = trading_record.update_exchange_rate((1.0, 1.0), registry['random'])
+    publisher.publish(registry_snapshot.construct(registry, {}, 1))
+
+    assert snapshot.tick == 0
+    assert len(snapshot.trading_records['random'].exchange_rates.samples) == 0
+    assert publisher.current().tick == 1
+    assert len(publisher.current().trading_records['random'].exchange_rates.samples) == 1
+
+
+def test_concurrent_reads_see_consistent_ticks():
+    ''' Stress test: many reader threads against a high-rate synthetic feed
+
+    Every record in a snapshot must have been updated by the same tick.
+    '''
+    TICKS = 500
+    READERS = 4
+    registry = construct_registry()
+    publisher = SnapshotPublisher(registry_snapshot.construct(registry, {}))
+    finished = threading.Event()
+    inconsistent_reads = []
+    reads = [0] * READERS
+
+    def synthetic_feed():
+        for tick in range(1, TICKS + 1):
+            price_info = (10000.0 + 50.0 * math.sin(tick / 10.0), float(tick))
+            for name in registry:
+                registry[name] = trading_record.update_exchange_rate(price_info, registry[name])
+            publisher.publish(registry_snapshot.construct(registry, {}, tick))
+        finished.set()
+
+    def reader(index):
+        while not finished.is_set():
+            snapshot = publisher.current()
+            epochs = {
+                sliding_window.current_epoch(record.exchange_rates)
+                for record in snapshot.trading_records.values()
+            }
+            expected_epoch = float(snapshot.tick) if snapshot.tick > 0 else None
+            if epochs != {expected_epoch}:
+                inconsistent_reads.append((snapshot.tick, epochs))
+            reads[index] += 1
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(READERS)]
+        threads.append(threading.Thread(target=synthetic_feed))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert inconsistent_reads == []
+    assert all(count > 0 for count in reads)
+    assert publisher.current().tick == TICKS
+
+
+def test_captures_are_taken_by_the_publishing_thread():
+    registry = construct_registry()
+    captures = []
+
+    def capture():
+        captures.append(threading.get_ident())
+        return {'weights': len(captures)}
+
+    publisher = SnapshotPublisher(registry_snapshot.construct(registry, {}), capture)
+    # Nothing is published, so there is nothing captured to return
+    assert publisher.request_capture(0.01) is None
+    assert publisher.capture_requested()
+
+    def trading_thread():
+        for tick in range(1, 4):
+            publisher.publish(registry_snapshot.construct(
+                registry,
+                {},
+                tick,
+                captured=publisher.capture() if publisher.capture_requested() else None
+            ))
+
+    thread = threading.Thread(target=trading_thread)
+    thread.start()
+    thread.join()
+
+    assert captures == [thread.ident]
+    assert not publisher.capture_requested()
+    assert publisher.current().tick == 3
+    assert publisher.current().captured is None
+    # Not published in time, so the last captured snapshot is returned
+    captured = publisher.request_capture(0.01)
+    assert captured is not None
+    assert captured.tick == 1
+    assert captured.captured['weights'] == 1
+
+    final = publisher.capture_current()
+    assert final.tick == 3
+    assert final.captured['weights'] == 2
+    assert publisher.current() is final
+
+
+def test_requests_made_while_capturing_wait_for_the_next_capture():
+    registry = construct_registry()
+    publisher = SnapshotPublisher(registry_snapshot.construct(registry, {}))
+    answers = {}
+
+    def request(name):
+        answers[name] = publisher.request_capture(5.0)
+
+    def start_request(name, generation):
+        thread = threading.Thread(target=request, args=(name,))
+        thread.start()
+        while publisher._requested_generation < generation:
+            time.sleep(0.001)
+        return thread
+
+    first = start_request('first', 1)
+    assert publisher.capture_requested()
+    # Requested after the trading thread decided to capture
+    second = start_request('second', 2)
+    publisher.publish(registry_snapshot.construct(registry, {}, 1, captured={}))
+    first.join(1.0)
+    assert answers['first'].tick == 1
+    second.join(0.05)
+    assert second.is_alive()
+
+    assert publisher.capture_requested()
+    publisher.publish(registry_snapshot.construct(registry, {}, 2, captured={}))
+    second.join(1.0)
+    assert answers['second'].tick == 2
+    assert not publisher.capture_requested()
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest  # noqa: F401
+import registry_snapshot
+import sampling_profiler
+import web_application
+from registry_snapshot import SnapshotPublisher
+from result import Warning
+
+
+def spin(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def tick(stop):
+    spin(0.005)
+
+
+def trade(stop):
+    while not stop.is_set():
+        tick(stop)
+        time.sleep(0.001)
+
+
+def start_trading():
+    stop = threading.Event()
+    thread = threading.Thread(target=trade, args=(stop,), daemon=True)
+    thread.start()
+    return stop, thread
+
+
+def test_stacks_are_cut_at_the_focus():
+    stop, thread = start_trading()
+    try:
+        profile = sampling_profiler.sample(sampling_profiler.construct(tick), 0.3, 0.002)
+        unfocused = sampling_profiler.sample(sampling_profiler.construct(), 0.05)
+    finally:
+        stop.set()
+        thread.join()
+    assert profile.samples > 10
+    assert profile.stacks
+    # Only stacks inside tick are kept, from tick down
+    assert all(stack.startswith('test_sampling_profiler:tick') for stack in profile.stacks)
+    assert 'test_sampling_profiler:tick;test_sampling_profiler:spin' in profile.stacks
+    lines = sampling_profiler.collapsed(profile).splitlines()
+    assert int(lines[0].rsplit(' ', 1)[1]) == max(profile.stacks.values())
+    # Without a focus whole stacks are kept, including idle ones
+    assert any(stack.startswith('threading:') for stack in unfocused.stacks)
+
+
+def test_one_profile_at_a_time():
+    profiler = sampling_profiler.construct()
+    with profiler.lock:
+        assert isinstance(sampling_profiler.sample(profiler, 0.01), Warning)
+
+
+def test_profile_endpoint_is_only_served_with_a_profiler():
+    publisher = SnapshotPublisher(registry_snapshot.construct({}, {}))
+    views = web_application.SnapshotViews(publisher)
+    assert web_application.create_app(views).test_client().get(
+        '/debug/profile?seconds=0.01'
+    ).status_code == 404
+
+    client = web_application.create_app(views, sampling_profiler.construct(tick)).test_client()
+    stop, thread = start_trading()
+    try:
+        response = client.get('/debug/profile?seconds=0.2&interval=0.002')
+    finally:
+        stop.set()
+        thread.join()
+    assert response.mimetype == 'text/plain'
+    assert response.get_data(as_text=True).startswith('test_sampling_profiler:tick')
+    assert client.get('/debug/profile?seconds=0.01&format=svg').status_code == 400
+    profile = client.get('/debug/profile?seconds=0.01&format=json').get_json()
+    assert profile['seconds'] == 0.01
@@ -0,0 +1,223 @@
+import asyncio
+import threading
+
+import market_data_generator
+import mock_exchange
+import pytest  # noqa: F401
+import sequence_tracker
+from market_data_generator import MarketModel
+from mock_exchange import MockExchange
+from sequence_tracker import Snapshot
+
+
+def message(sequence, kind='received', product_id='BTC-USD', **fields):
+    return dict({'type': kind, 'product_id': product_id, 'sequence': sequence}, **fields)
+
+
+def trade(sequence, trade_id, price='100.00'):
+    return message(sequence, 'match', trade_id=trade_id, price=price, size='0.1', side='buy')
+
+
+def sequences(messages):
+    return [(message['type'], message.get('sequence'), message.get('trade_id'))
+            for message in messages]
+
+
+def test_messages_in_sequence_pass_and_duplicates_are_dropped():
+    tracker = sequence_tracker.construct()
+    received = []
+    for incoming in [
+        {'type': 'subscriptions', 'channels': []},
+        message(1),
+        trade(2, 10),
+        message(2, 'ticker'),
+        # The same match from the matches and full channels
+        trade(2, 10),
+        message(1),
+        {'type': 'l2update', 'product_id': 'BTC-USD', 'changes': []},
+        message(1, product_id='ETH-USD'),
+        message(3),
+    ]:
+        received += sequence_tracker.receive(tracker, incoming)
+    assert [(incoming['type'], incoming.get('product_id'), incoming.get('sequence'))
+            for incoming in received] == [
+        ('subscriptions', None, None),
+        ('received', 'BTC-USD', 1),
+        ('match', 'BTC-USD', 2),
+        ('ticker', 'BTC-USD', 2),
+        ('l2update', 'BTC-USD', None),
+        ('received', 'ETH-USD', 1),
+        ('received', 'BTC-USD', 3),
+    ]
+    assert (tracker.duplicates, tracker.gaps) == (2, 0)
+
+
+def test_gaps_are_counted_when_snapshots_cant_be_fetched():
+    tracker = sequence_tracker.construct()
+    received = []
+    for sequence in [1, 2, 5, 6]:
+        received += sequence_tracker.receive(tracker, message(sequence))
+    assert [incoming['sequence'] for incoming in received] == [1, 2, 5, 6]
+    assert tracker.gaps == 1
+
+
+def test_gaps_are_resynced_from_a_snapshot_and_the_buffer_replayed():
+    fetched = threading.Event()
+    trades = [trade(sequence, sequence + 100) for sequence in [6, 4, 3]]
+
+    def fetch_snapshot(product_id):
+        fetched.wait(5.0)
+        return Snapshot(product_id=product_id, sequence=6, bids=[['99.00', '1.0', 1]],
+                        asks=[['101.00', '2.0', 1]], trades=trades)
+
+    tracker = sequence_tracker.construct(fetch_snapshot)
+    received = []
+    # 3 to 5 are dropped, 6 is part of the snapshot and 8 is a trade the
+    # snapshot's trades haven't caught up with
+    for incoming in [trade(1, 101), message(2), trade(6, 106), message(7), trade(8, 108)]:
+        received += sequence_tracker.receive(tracker, incoming)
+    assert sequence_tracker.is_resyncing(tracker, 'BTC-USD')
+    assert sequences(received) == [('match', 1, 101), ('received', 2, None)]
+
+    fetched.set()
+    tracker.products['BTC-USD'].snapshot.result()
+    received += sequence_tracker.receive(tracker, message(9))
+    assert sequences(received) == [
+        ('match', 1, 101),
+        ('received', 2, None),
+        ('snapshot', 6, None),
+        ('match', 3, 103),
+        ('match', 4, 104),
+        ('match', 6, 106),
+        ('received', 7, None),
+        ('match', 8, 108),
+        ('received', 9, None),
+    ]
+    assert received[2]['bids'] == [['99.00', '1.0', 1]]
+    assert not sequence_tracker.is_resyncing(tracker, 'BTC-USD')
+    assert len(tracker.recovery_times) == 1
+
+    # Sequence tracking carries on from the replayed messages
+    assert sequence_tracker.receive(tracker, message(9)) == []
+    assert sequences(sequence_tracker.receive(tracker, message(10))) == [('received', 10, None)]
+
+
+def test_failed_snapshots_are_fetched_again():
+    attempts = []
+
+    def fetch_snapshot(product_id):
+        attempts.append(product_id)
+        if len(attempts) == 1:
+            raise ConnectionError('snapshot unavailable')
+        return Snapshot(product_id=product_id, sequence=3)
+
+    tracker = sequence_tracker.construct(fetch_snapshot, retry_delay=0.0)
+    sequence_tracker.receive(tracker, message(1))
+    sequence_tracker.receive(tracker, message(4))
+    tracker.products['BTC-USD'].snapshot.exception()
+    # The failure is logged, and the snapshot fetched again once the retry is due
+    assert sequence_tracker.poll(tracker) == []
+    assert sequence_tracker.poll(tracker) == []
+    tracker.products['BTC-USD'].snapshot.result()
+    assert sequences(sequence_tracker.poll(tracker)) == [
+        ('snapshot', 3, None), ('received', 4, None)
+    ]
+    assert attempts == ['BTC-USD', 'BTC-USD']
+    sequence_tracker.close(tracker)
+
+
+def test_failing_snapshots_back_off_and_keep_the_newest_messages():
+    attempts = []
+
+    def fetch_snapshot(product_id):
+        attempts.append(product_id)
+        raise ConnectionError('snapshot unavailable')
+
+    tracker = sequence_tracker.construct(fetch_snapshot, maximum_buffer_size=3, retry_delay=10.0)
+    sequence_tracker.receive(tracker, message(1))
+    sequence_tracker.receive(tracker, message(4))
+    state = tracker.products['BTC-USD']
+    state.snapshot.exception()
+    for sequence in range(5, 100):
+        assert sequence_tracker.receive(tracker, message(sequence)) == []
+    assert attempts == ['BTC-USD']
+    assert state.retry_delay == 20.0
+    assert [buffered['sequence'] for buffered in state.buffer] == [97, 98, 99]
+    assert tracker.overflows == 93
+    sequence_tracker.close(tracker)
+
+
+def test_backfilled_trades_repeated_by_the_feed_are_dropped():
+    def fetch_snapshot(product_id):
+        return Snapshot(product_id=product_id, sequence=5, trades=[
+            trade(None, 12), trade(None, 11), trade(None, 10)
+        ])
+
+    tracker = sequence_tracker.construct(fetch_snapshot)
+    sequence_tracker.receive(tracker, trade(1, 9))
+    sequence_tracker.receive(tracker, message(4))
+    tracker.products['BTC-USD'].snapshot.result()
+    replayed = sequence_tracker.receive(tracker, message(6))
+    assert [message.get('trade_id') for message in replayed if message['type'] == 'match'] == [
+        10, 11, 12
+    ]
+    # The feed's own copies of the backfilled trades arrive after the snapshot
+    assert sequence_tracker.receive(tracker, trade(7, 11)) == []
+    assert sequence_tracker.receive(tracker, trade(8, 12)) == []
+    assert sequences(sequence_tracker.receive(tracker, trade(9, 13))) == [('match', 9, 13)]
+    assert sequences(sequence_tracker.receive(tracker, message(10))) == [('received', 10, None)]
+    assert tracker.duplicates == 2
+    sequence_tracker.close(tracker)
+
+
+def test_buffered_trades_are_not_replayed_from_the_snapshot():
+    def fetch_snapshot(product_id):
+        return Snapshot(product_id=product_id, sequence=5, trades=[
+            trade(None, 13), trade(None, 12), trade(None, 11), trade(None, 10)
+        ])
+
+    tracker = sequence_tracker.construct(fetch_snapshot)
+    sequence_tracker.receive(tracker, trade(1, 9))
+    sequence_tracker.receive(tracker, trade(6, 12))
+    tracker.products['BTC-USD'].snapshot.result()
+    replayed = sequence_tracker.receive(tracker, trade(7, 13))
+    assert [message.get('trade_id') for message in replayed if message['type'] == 'match'] == [
+        10, 11, 12, 13
+    ]
+    sequence_tracker.close(tracker)
+
+
+def test_dropped_trades_are_recovered_from_a_rest_stand_in():
+    messages = [match for _, match in market_data_generator.take(
+        market_data_generator.generate(MarketModel()), 200
+    )]
+    exchange = MockExchange()
+    exchange.books['BTC-USD'] = {'sequence': 150, 'bids': [], 'asks': []}
+    # The trades endpoint has the most recent trades, newest first
+    exchange.trades['BTC-USD'] = [
+        {key: match[key] for key in ['time', 'trade_id', 'price', 'size', 'side']}
+        for match in reversed(messages[50:150])
+    ]
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(mock_exchange.start(exchange), loop).result()
+    try:
+        tracker = sequence_tracker.construct(sequence_tracker.rest_snapshot(exchange.url))
+        received = []
+        # Messages 101 to 140 are dropped
+        for incoming in messages[:100] + messages[140:]:
+            received += sequence_tracker.receive(tracker, incoming)
+        tracker.products['BTC-USD'].snapshot.result()
+        received += sequence_tracker.poll(tracker)
+    finally:
+        asyncio.run_coroutine_threadsafe(mock_exchange.stop(exchange), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+        sequence_tracker.close(tracker)
+    trades = [incoming for incoming in received if incoming['type'] == 'match']
+    assert [incoming['trade_id'] for incoming in trades] == list(range(1, 201))
+    assert [incoming['price'] for incoming in trades] == [match['price'] for match in messages]
+    assert tracker.gaps == 1
+    assert tracker.recovery_times[0] < 1.0
@@ -0,0 +1,79 @@
+import struct
+import threading
+import time
+
+import pytest  # noqa: F401
+from result import Error
+from shared_state import HEADER, SharedStateReader, SharedStateWriter
+
+
+def test_write_read(tmp_path):
+    path = str(tmp_path / 'shared-state')
+    writer = SharedStateWriter(path, capacity=64)
+    reader = SharedStateReader(path)
+
+    assert reader.read() == (0, b'')
+    sequence = writer.write(b'{"stats": "{}"}')
+    assert reader.read() == (sequence, b'{"stats": "{}"}')
+    assert writer.write(b'x' * 65).__class__ == Error
+    assert reader.read() == (sequence, b'{"stats": "{}"}')
+
+
+def test_concurrent_reads_are_never_torn(tmp_path):
+    path = str(tmp_path / 'shared-state')
+    writer = SharedStateWriter(path, capacity=4096)
+    reader = SharedStateReader(path)
+    finished = threading.Event()
+    torn_reads = []
+
+    def write():
+        for index in range(5000):
+            writer.write(bytes([index % 256]) * (1024 + index % 1024))
+        finished.set()
+
+    def read():
+        while not finished.is_set():
+            _, payload = reader.read()
+            if len(payload) > 0 and payload != payload[:1] * len(payload):
+                torn_reads.append(payload)
+
+    threads = [threading.Thread(target=read) for _ in range(3)]
+    threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert torn_reads == []
+
+
+def test_read_returns_last_payload_when_writer_dies_mid_write(tmp_path):
+    path = str(tmp_path / 'shared-state')
+    writer = SharedStateWriter(path, capacity=64)
+    reader = SharedStateReader(path, timeout=0.01)
+    sequence = writer.write(b'{"stats": "{}"}')
+    assert reader.read() == (sequence, b'{"stats": "{}"}')
+
+    # A writer killed halfway through write leaves an odd sequence number behind
+    struct.pack_into('<Q', writer._memory, 0, sequence + 1)
+    writer._memory[HEADER.size:HEADER.size + 4] = b'torn'
+
+    start = time.perf_counter()
+    assert reader.read() == (sequence, b'{"stats": "{}"}')
+    assert time.perf_counter() - start < 1.0
+    # A reader that never read a payload in full returns nothing published yet
+    assert SharedStateReader(path, timeout=0.01).read() == (0, b'')
+
+
+def test_reopening_keeps_readers_mapped_file(tmp_path):
+    path = str(tmp_path / 'shared-state')
+    writer = SharedStateWriter(path, capacity=64)
+    reader = SharedStateReader(path)
+    sequence = writer.write(b'{"tick": 1}')
+    writer.close()
+
+    # A restarted writer neither truncates the file nor reuses sequence numbers
+    restarted = SharedStateWriter(path, capacity=64)
+    assert reader.read() == (sequence, b'{"tick": 1}')
+    assert restarted.write(b'{"tick": 2}') > sequence
+    assert reader.read()[1] == b'{"tick": 2}'
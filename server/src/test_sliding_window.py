@@ -1,7 +1,8 @@
+import numpy as np
 import pytest  # noqa: F401
 from pyrsistent import pvector
 from sliding_window import (SlidingWindowSample, add, average, construct,
-                            current_exchange_rate, derivative, time_slice)
+                            current_exchange_rate, derivative, series, time_slice)
 
 
 def add_sample(exchange_rate, window):
@@ -51,3 +52,43 @@ def test_current_exchange_rate():
     assert current_exchange_rate(window_size_1) == 1.0
     window_size_2 = add_sample(2.0, window_size_1)
     assert current_exchange_rate(window_size_2) == 2.0
+
+
+def incremental_series(exchange_rates, epochs, window, n):
+    samples = []
+    derivatives = []
+    for exchange_rate, epoch in zip(exchange_rates, epochs):
+        window = add(SlidingWindowSample(
+            exchange_rate=float(exchange_rate),
+            epoch=float(epoch)
+        ), window)
+        samples.append(window.samples[-1])
+        derivatives.append(derivative(n, window))
+    return samples, derivatives
+
+
+@pytest.mark.parametrize('maximum_size, n', [(1000, 100), (1, 2), (50, 20), (50, 100)])
+def test_series_match_adding_samples_one_at_a_time(maximum_size, n):
+    random = np.random.RandomState(maximum_size)
+    length = 400
+    exchange_rates = 5000.0 + np.cumsum(random.normal(0.0, 2.0, length))
+    # Bursts of trades at the same epoch and gaps long enough to reset the filters
+    times = random.choice([0.0, 0.05, 0.3, 1.0, 20.0], length)
+    epochs = 1554120000.0 + np.cumsum(times)
+    window = construct(maximum_size)
+
+    fields = series(exchange_rates, epochs, window, derivatives=[n])
+    samples, derivatives = incremental_series(exchange_rates, epochs, window, n)
+    for field in SlidingWindowSample._precord_fields:
+        assert fields[field] == pytest.approx(
+            [sample[field] for sample in samples], rel=1e-9, abs=1e-9
+        ), field
+    assert fields[f'derivative_{n}'] == pytest.approx(derivatives, rel=1e-9, abs=1e-9)
+
+
+def test_series_of_few_samples():
+    assert all(len(values) == 0 for values in series(np.zeros(0), np.zeros(0)).values())
+    fields = series(np.array([5.0]), np.array([1.0]), derivatives=[2])
+    assert fields['exchange_rate_filtered'][0] == 5.0
+    assert fields['exchange_rate_moving_average_10'][0] == 5.0
+    assert fields['derivative_2'][0] == 0.0
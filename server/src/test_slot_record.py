@@ -0,0 +1,94 @@
+import os
+import pickle
+import subprocess
+import sys
+
+import pytest  # noqa: F401
+import trading_record
+from invariants import cannot_be_negative
+from pyrsistent import InvariantException, PRecord, PTypeError, field, pmap_field
+from slot_record import SlotRecord, pvector_field
+
+
+class Fill(SlotRecord):
+    order = field(type=str, mandatory=True)
+    size = field(type=float, invariant=cannot_be_negative)
+    count = field(type=int, initial=0)
+
+
+class Fills(PRecord):
+    fills = pvector_field(Fill)
+    by_order = pmap_field(str, Fill)
+
+
+def test_records_are_read_and_copied_like_precords():
+    fill = Fill(order='buy', size=1.0)
+    assert (fill.order, fill.size, fill.count) == ('buy', 1.0, 0)
+    assert fill['size'] == 1.0
+    assert fill.get('size') == 1.0
+
+    smaller = fill.set('size', 0.5)
+    assert smaller == Fill(order='buy', size=0.5)
+    assert fill.size == 1.0
+    assert fill.set(size=0.5, count=2) == smaller.update({'count': 2})
+    assert smaller != fill
+    assert hash(smaller) == hash(Fill(order='buy', size=0.5))
+    with pytest.raises(AttributeError):
+        fill.size = 0.5  # type: ignore
+
+    # Optional fields can be left unset
+    unsized = Fill(order='hold')
+    assert 'size' not in unsized
+    assert unsized.get('size', 0.0) == 0.0
+    with pytest.raises(AttributeError):
+        unsized.size
+    with pytest.raises(KeyError):
+        unsized['size']
+    assert dict(unsized) == {'order': 'hold', 'count': 0}
+    assert repr(unsized) == "Fill(order='hold', count=0)"
+
+
+def test_field_types_and_invariants_are_checked():
+    with pytest.raises(InvariantException) as missing:
+        Fill(size=1.0)
+    assert missing.value.missing_fields == ('Fill.order',)
+    with pytest.raises(InvariantException) as negative:
+        Fill(order='buy', size=-1.0)
+    assert negative.value.invariant_errors == ('cannot be negative',)
+    with pytest.raises(InvariantException):
+        Fill(order='buy').set('size', -1.0)
+    with pytest.raises(PTypeError):
+        Fill(order='buy', size=1)
+    with pytest.raises(AttributeError):
+        Fill(order='buy').set('price', 1.0)
+    with pytest.raises(InvariantException):
+        trading_record.construct('checked', '', 0.0).set('usd', -1.0)
+
+
+def test_records_nest_in_pyrsistent_collections():
+    fills = Fills(fills=[Fill(order='buy', size=1.0), {'order': 'sell'}],
+                  by_order={'a': Fill(order='hold')})
+    assert fills.fills[1] == Fill(order='sell')
+    assert fills.serialize() == {
+        'fills': [{'order': 'buy', 'size': 1.0, 'count': 0}, {'order': 'sell', 'count': 0}],
+        'by_order': {'a': {'order': 'hold', 'count': 0}},
+    }
+    with pytest.raises(TypeError):
+        fills.set('fills', ['not a fill'])
+    assert pickle.loads(pickle.dumps(fills)) == fills
+
+
+def test_checks_are_skipped_in_optimized_mode():
+    source = os.path.dirname(os.path.abspath(__file__))
+    script = (
+        'import trading_record, transaction\n'
+        'record = trading_record.construct("unchecked", "", 0.0).set("usd", -1.0)\n'
+        'lots = record.set("pending_sales", ["not a transaction"]).pending_sales\n'
+        'print(record.usd, lots[0])\n'
+    )
+    for flags, expected in [([], 'InvariantException'), (['-O'], '-1.0 not a transaction')]:
+        completed = subprocess.run(
+            [sys.executable, *flags, '-c', script],
+            cwd=source, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+        )
+        assert expected in completed.stdout + completed.stderr
@@ -0,0 +1,29 @@
+import sys
+
+import numpy as np
+import pytest  # noqa: F401
+import strategies
+
+
+def test_construct_enabled_strategies_only():
+    enabled = ['algorithmic', 'random']
+    trading_record_registry = strategies.construct_trading_records(enabled)
+    trading_model_registry = strategies.construct_trading_models(enabled)
+
+    assert sorted(trading_record_registry) == ['algorithmic', 'random']
+    assert list(trading_model_registry) == ['algorithmic']
+    assert 'tensorflow' not in sys.modules
+
+
+def test_capture_population():
+    enabled = ['q-learning-population']
+    trading_model_registry = strategies.construct_trading_models(enabled, population_size=2)
+    population = trading_model_registry['q-learning-population']
+
+    captured = strategies.capture_models(trading_model_registry)['q-learning-population']
+    population.weights[0] += 1.0
+    population.time_delta += 1
+
+    assert captured is not population
+    assert np.array_equal(captured.weights[0] + 1.0, population.weights[0])
+    assert captured.time_delta == population.time_delta - 1
@@ -0,0 +1,56 @@
+import pytest  # noqa: F401
+import sliding_window
+import strategies
+from trading_client import TradingClient
+
+
+def match_message(index):
+    return {
+        'type': 'match',
+        'product_id': 'BTC-USD',
+        'price': f'{5000.0 + (index % 50) * 0.25:.2f}',
+        'size': '0.01',
+        'time': f'2019-04-01T12:{(index // 60) % 60:02d}:{index % 60:02d}.000000Z',
+    }
+
+
+def test_records_share_the_engine_fed_window(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    enabled_strategies = ['algorithmic', 'random']
+    client = TradingClient(
+        strategies.construct_trading_records(enabled_strategies),
+        strategies.construct_trading_models(enabled_strategies)
+    )
+    window = sliding_window.construct(maximum_size=1000)
+    for index in range(300):
+        client.on_message(match_message(index))
+        window = sliding_window.add(sliding_window.SlidingWindowSample(
+            exchange_rate=5000.0 + (index % 50) * 0.25,
+            epoch=1554120000.0 + index
+        ), window)
+
+    records = client.trading_record_registry
+    assert records['algorithmic'].exchange_rates is records['random'].exchange_rates
+    samples = records['random'].exchange_rates.samples
+    assert len(samples) == 300
+    for sample, expected in zip(samples, window.samples):
+        assert sample.exchange_rate_filtered == pytest.approx(expected.exchange_rate_filtered)
+        assert sample.exchange_rate_moving_average_100 == pytest.approx(
+            expected.exchange_rate_moving_average_100
+        )
+
+
+def test_publishes_changed_ticks_with_their_bars(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = TradingClient(
+        strategies.construct_trading_records(['random']),
+        strategies.construct_trading_models(['random'])
+    )
+    client.on_message(match_message(0))
+    snapshot = client.registry_publisher.current()
+    assert snapshot.tick == 1
+    closed, current = snapshot.bars['BTC-USD']['1s']
+    assert len(closed) == 0 and current[2] == 5000.0
+
+    client.on_message({'type': 'heartbeat', 'product_id': 'BTC-USD'})
+    assert client.registry_publisher.current() is snapshot
@@ -0,0 +1,67 @@
+import pytest  # noqa: F401
+import transaction_window
+from transaction import Transaction
+from transaction_window import HoldRun
+
+
+def trade(order, epoch, exchange_rate=100.0):
+    return Transaction(label='BTC-USD', quantity=1.0, exchange_rate=exchange_rate,
+                       epoch=epoch, fees=0.25, order=order)
+
+
+def hold(epoch, exchange_rate=100.0):
+    return Transaction(label='BTC-USD', quantity=0.0, exchange_rate=exchange_rate,
+                       epoch=epoch, fees=0.0, order='hold')
+
+
+def test_consecutive_holds_collapse_into_runs():
+    window = transaction_window.construct([
+        hold(1.0, 100.0), hold(2.0, 101.0), hold(3.0, 103.0),
+        trade('buy', 4.0),
+        hold(5.0),
+        trade('sell', 6.0),
+    ])
+    assert transaction_window.entries(window) == [
+        HoldRun(label='BTC-USD', exchange_rate=103.0, epoch=3.0, count=3,
+                first_exchange_rate=100.0, first_epoch=1.0),
+        trade('buy', 4.0),
+        HoldRun(label='BTC-USD', exchange_rate=100.0, epoch=5.0,
+                first_exchange_rate=100.0, first_epoch=5.0),
+        trade('sell', 6.0),
+    ]
+    assert transaction_window.latest(window) == trade('sell', 6.0)
+    assert transaction_window.latest(transaction_window.construct()) is None
+
+
+def test_the_ring_replaces_the_oldest_entries():
+    window = transaction_window.construct(maximum_size=3)
+    for epoch in range(5):
+        window = transaction_window.add(trade('buy', float(epoch)), window)
+    assert len(window.entries) == 3
+    assert [entry.epoch for entry in transaction_window.entries(window)] == [2.0, 3.0, 4.0]
+
+    # A run at the newest entry keeps growing in place
+    earlier = window
+    for epoch in range(5, 105):
+        window = transaction_window.add(hold(float(epoch)), window)
+    assert [entry.epoch for entry in transaction_window.entries(window)] == [3.0, 4.0, 104.0]
+    assert transaction_window.latest(window).count == 100
+    # Windows are immutable, published snapshots keep theirs
+    assert [entry.epoch for entry in transaction_window.entries(earlier)] == [2.0, 3.0, 4.0]
+
+
+def test_runs_are_serialized_compactly_and_expanded_on_request():
+    window = transaction_window.construct([
+        trade('buy', 1.0), hold(2.0, 100.0), hold(3.0, 102.0), hold(4.0, 104.0)
+    ])
+    serialized = window.serialize()
+    assert serialized == [
+        trade('buy', 1.0).serialize(),
+        {'label': 'BTC-USD', 'quantity': 0.0, 'exchange_rate': 104.0, 'epoch': 4.0,
+         'fees': 0.0, 'order': 'hold', 'count': 3, 'first_exchange_rate': 100.0,
+         'first_epoch': 2.0},
+    ]
+    assert transaction_window.expand(serialized) == [trade('buy', 1.0).serialize()] + [
+        hold(epoch, exchange_rate).serialize()
+        for epoch, exchange_rate in [(2.0, 100.0), (3.0, 102.0), (4.0, 104.0)]
+    ]
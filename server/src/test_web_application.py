@@ -0,0 +1,181 @@
+import json
+import socket
+import time
+import urllib.request
+
+import bar_aggregator
+import chart_history
+import pytest  # noqa: F401
+import registry_snapshot
+import trading_record
+import web_application
+from registry_snapshot import SnapshotPublisher
+from shared_state import SharedStateReader, SharedStateWriter
+from trading_record import TradingAction
+
+
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def get(url):
+    for _ in range(50):
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                return json.loads(response.read())
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(url)
+
+
+def test_workers_serve_shared_state(tmp_path):
+    path = str(tmp_path / 'shared-state')
+    port = get_free_port()
+    writer = SharedStateWriter(path)
+    writer.write(json.dumps({'stats': json.dumps({'tick': 1})}).encode('utf-8'))
+    workers = web_application.start_workers(path, 2, port=port)
+    try:
+        assert get(f'http://127.0.0.1:{port}/stats') == {'tick': 1}
+
+        writer.write(json.dumps({
+            'stats': json.dumps({'tick': 2}),
+            'transactions': json.dumps({'algorithmic': []}),
+        }).encode('utf-8'))
+        for _ in range(4):
+            assert get(f'http://127.0.0.1:{port}/stats') == {'tick': 2}
+        assert get(f'http://127.0.0.1:{port}/transactions') == {'algorithmic': []}
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+
+
+def test_history_endpoint():
+    history = chart_history.construct()
+    for second in range(600):
+        chart_history.update(history, 1554000000.0 + second, {
+            'exchange_rate': 5000.0 + second,
+            'net_worth/random': 100000.0 - second,
+        })
+    publisher = SnapshotPublisher(registry_snapshot.construct({}, {}))
+    client = web_application.create_app(
+        web_application.SnapshotViews(publisher, history)
+    ).test_client()
+
+    response = json.loads(client.get('/history?points=10').get_data())
+    assert list(response) == ['exchange_rate']
+    assert len(response['exchange_rate']['epoch']) <= 10
+    assert response['exchange_rate']['last'][-1] == 5599.0
+
+    response = json.loads(client.get(
+        '/history?series=net_worth/random&series=missing&start=1554000100&end=1554000109'
+    ).get_data())
+    assert list(response) == ['net_worth/random']
+    assert response['net_worth/random']['epoch'] == [1554000100.0 + i for i in range(10)]
+
+    assert client.get('/history?points=many').status_code == 400
+
+
+def test_workers_serve_published_history(tmp_path):
+    history = chart_history.construct()
+    for second in range(600):
+        chart_history.update(history, 1554000000.0 + second, {'exchange_rate': float(second)})
+    publisher = SnapshotPublisher(registry_snapshot.construct({}, {}))
+    path = str(tmp_path / 'shared-state')
+    web_application.SharedStatePublisher(
+        publisher,
+        SharedStateWriter(path),
+        history=history
+    ).publish()
+    client = web_application.create_app(
+        web_application.SharedStateViews(SharedStateReader(path))
+    ).test_client()
+
+    response = json.loads(client.get('/history?points=5').get_data())
+    assert len(response['exchange_rate']['epoch']) <= 5
+    assert min(response['exchange_rate']['min']) == 0.0
+    assert max(response['exchange_rate']['max']) == 599.0
+
+
+def test_bars_endpoint(tmp_path):
+    aggregator = bar_aggregator.construct()
+    for second in range(300):
+        bar_aggregator.update((5000.0 + second, 1554000000.0 + second), aggregator, 1.0)
+    publisher = SnapshotPublisher(registry_snapshot.construct(
+        {}, {}, bars={'BTC-USD': bar_aggregator.publish(aggregator)}
+    ))
+    path = str(tmp_path / 'shared-state')
+    web_application.SharedStatePublisher(publisher, SharedStateWriter(path)).publish()
+
+    for views in [
+        web_application.SnapshotViews(publisher),
+        web_application.SharedStateViews(SharedStateReader(path)),
+    ]:
+        client = web_application.create_app(views).test_client()
+        response = json.loads(client.get('/bars?resolution=1m&count=3').get_data())
+        assert response['start'] == [1554000120.0, 1554000180.0, 1554000240.0]
+        assert response['close'] == [5179.0, 5239.0, 5299.0]
+        assert response['trades'] == [60.0, 60.0, 60.0]
+        response = json.loads(client.get('/bars?resolution=1s&count=2').get_data())
+        assert response['open'] == [5298.0, 5299.0]
+        assert json.loads(client.get('/bars?product=ETH-USD').get_data()) == {}
+
+
+def test_failed_shared_state_writes_are_retried(tmp_path):
+    records = {'random': trading_record.construct('random', '', 100000.0)}
+    publisher = SnapshotPublisher(registry_snapshot.construct(records, {}))
+    path = str(tmp_path / 'shared-state')
+    shared_state_publisher = web_application.SharedStatePublisher(
+        publisher,
+        SharedStateWriter(path, capacity=16)
+    )
+    shared_state_publisher.publish()
+    assert SharedStateReader(path).read() == (0, b'')
+
+    shared_state_publisher.writer = SharedStateWriter(path)
+    shared_state_publisher.publish()
+    assert 'stats' in json.loads(SharedStateReader(path).read()[1])
+
+
+def test_transactions_expand_hold_runs():
+    record = trading_record.construct('algorithmic', '', 100000.0)
+    for tick, order in enumerate(['buy', 'hold', 'hold', 'hold']):
+        record = trading_record.update_exchange_rate((5000.0 + tick, 1554000000.0 + tick), record)
+        record = trading_record.place_order(TradingAction(order=order, amount=1), record)
+    publisher = SnapshotPublisher(registry_snapshot.construct({'algorithmic': record}, {}))
+    client = web_application.create_app(web_application.SnapshotViews(publisher)).test_client()
+
+    compact = json.loads(client.get('/transactions').get_data())['algorithmic']
+    assert [(entry['order'], entry.get('count')) for entry in compact] == [
+        ('buy', None), ('hold', 3)
+    ]
+    expanded = json.loads(client.get('/transactions?expand=holds').get_data())['algorithmic']
+    assert [(entry['order'], entry['epoch']) for entry in expanded] == [
+        ('buy', 1554000000.0),
+        ('hold', 1554000001.0),
+        ('hold', 1554000002.0),
+        ('hold', 1554000003.0),
+    ]
+    assert client.get('/transactions?expand=everything').status_code == 400
+
+
+def test_analytics_of_every_record(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # pair_transaction appends to transaction_history.csv
+    records = {}
+    for name in ['q-learning-population-0', 'q-learning-population-1']:
+        record = trading_record.construct(name, '', 100000.0)
+        for tick, order in enumerate(['buy', 'hold', 'sell']):
+            price_info = (5000.0 + tick * 100.0, 1554000000.0 + tick)
+            record = trading_record.update_exchange_rate(price_info, record)
+            record = trading_record.place_order(TradingAction(order=order, amount=1), record)
+        records[name] = record
+    publisher = SnapshotPublisher(registry_snapshot.construct(records, {}))
+    client = web_application.create_app(web_application.SnapshotViews(publisher)).test_client()
+
+    analytics = json.loads(client.get('/analytics').get_data())
+    assert sorted(analytics) == sorted(records)
+    assert analytics['q-learning-population-0']['marks'] == 3
+    assert analytics['q-learning-population-0']['wins'] == 1
+    assert 'returns' not in analytics['q-learning-population-0']
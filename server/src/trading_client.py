@@ -0,0 +1,330 @@
+import random
+from functools import partial
+from typing import Dict, List, Tuple, cast
+
+import algorithmic_model
+import bar_aggregator
+import chart_history
+import feature_engine
+import numpy as np
+import order_manager
+import q_learning_model
+import q_learning_population
+import registry_snapshot
+import result
+import sequence_tracker
+import sliding_window
+import strategies
+import trading_record
+import zulu_time
+from bar_aggregator import BarAggregator
+from feature_engine import FeatureEngine, Features
+from logger import logger
+from maybe import Maybe
+from pyrsistent import PRecord, field
+from registries import TradingModelRegistry, TradingRecordRegistry
+from registry_snapshot import SnapshotPublisher
+from sliding_window import SlidingWindow
+from trading_record import TradingAction
+
+
+# Logged by trading_record.statistics
+STATISTICS_FEATURES = ['moving_average_100', 'rate_of_change_100']
+
+
+class CoinbaseMessage(PRecord):
+    price = field(type=str)
+    type = field(type=str)
+    time = field(type=str)
+    size = field(type=str)
+    product_id = field(type=str)
+
+
+def predict_random() -> TradingAction:
+    ''' Returns a random trading action.
+    buy 25%, sell 25%, and hold 50% of the time
+    '''
+    prediction = random.randint(0, 3)
+    amount = random.uniform(0.0, 1.0)
+    if prediction == 0:
+        return TradingAction(order='buy', amount=amount)
+    elif prediction == 1:
+        return TradingAction(order='sell', amount=amount)
+    return TradingAction(order='hold', amount=0)
+
+
+PriceInfo = Tuple[float, float]
+
+
+def parse_message(msg: CoinbaseMessage) -> Maybe[PriceInfo]:
+    has_price_changed = (
+        'price' in msg and
+        'time' in msg and
+        msg['type'] == 'match'
+    )
+    if has_price_changed:
+        exchange_rate = float(msg['price'])
+        epoch = zulu_time.get_epoch(msg['time'])
+
+        return exchange_rate, epoch
+    return None
+
+
+def parse_size(msg: CoinbaseMessage) -> float:
+    ''' Size of the matched trade, 0.0 when the message doesn't have one '''
+    return float(msg['size']) if 'size' in msg else 0.0
+
+
+def construct_feature_engine(
+    features: List[str],
+    trading_record_registry: TradingRecordRegistry
+) -> FeatureEngine:
+    ''' Warms up the features with the exchange rates of a restored trading record '''
+    engine = feature_engine.construct(features)
+    records = list(trading_record_registry.values())
+    if len(records) > 0:
+        for sample in records[0].exchange_rates.samples:
+            feature_engine.update((sample.exchange_rate, sample.epoch), engine)
+    return engine
+
+
+def construct_exchange_rates(trading_record_registry: TradingRecordRegistry) -> SlidingWindow:
+    ''' The exchange rates of a restored trading record, or an empty window '''
+    records = list(trading_record_registry.values())
+    if len(records) > 0:
+        return records[0].exchange_rates
+    return sliding_window.construct(maximum_size=1000)
+
+
+class TradingClient:
+    ''' Trades every enabled strategy on feed messages passed to on_message
+
+    Holds the trading registries and everything computed from the feed, and
+    publishes snapshots of them for other threads.  CoinbaseWebsocketClient
+    feeds it from the Coinbase websocket feed.
+    '''
+    def __init__(
+            self,
+            trading_record_registry: TradingRecordRegistry,
+            trading_model_registry: TradingModelRegistry,
+            time_delta: int = 0,
+            api_url: str = ''
+    ):
+        self.trading_record_registry = trading_record_registry
+        self.trading_model_registry = trading_model_registry
+        # Only strategies that have a trading record or model are traded
+        enabled_strategies = [
+            (strategy, trade, features) for strategy, trade, features in [
+                ('algorithmic', self.algorithmic_trade, algorithmic_model.FEATURES),
+                ('random', self.random_trade, []),
+                ('q-learning', self.q_learning_trade, q_learning_model.FEATURES),
+                (
+                    'q-learning-population',
+                    self.q_learning_population_trade,
+                    q_learning_model.FEATURES
+                ),
+            ]
+            if strategy in trading_record_registry or strategy in trading_model_registry
+        ]
+        self.strategies = [trade for _, trade, _ in enabled_strategies]
+        # Features are computed once per product and shared by every strategy
+        self.features = sorted({
+            feature for _, _, features in enabled_strategies for feature in features
+        } | set(feature_engine.WINDOW_FEATURES.values()) | set(STATISTICS_FEATURES))
+        self.feature_engines: Dict[str, FeatureEngine] = {
+            'BTC-USD': construct_feature_engine(self.features, trading_record_registry)
+        }
+        # Every record trading a product shares the product's sliding window,
+        # whose samples are filled in from the product's features
+        self.exchange_rates: Dict[str, SlidingWindow] = {
+            'BTC-USD': construct_exchange_rates(trading_record_registry)
+        }
+        self.bar_aggregators: Dict[str, BarAggregator] = {
+            'BTC-USD': bar_aggregator.construct()
+        }
+        self.chart_history = chart_history.construct()
+        # Fills of the strategies' exchange orders are recorded in their trading records
+        self.order_manager = order_manager.construct(trading_record_registry)
+        # Dropped messages are recovered from REST snapshots of (api_url), or
+        # only logged without one
+        self.sequence_tracker = sequence_tracker.construct(
+            sequence_tracker.rest_snapshot(api_url) if api_url != '' else None
+        )
+        self.message_count = 0
+        # TODO: Turn into real time delta
+        # Currently time_delta increments on price changes
+        self.time_delta = time_delta
+        self.registry_publisher = SnapshotPublisher(
+            registry_snapshot.construct(
+                trading_record_registry,
+                trading_model_registry,
+                time_delta=time_delta
+            ),
+            partial(strategies.capture_models, trading_model_registry)
+        )
+
+    def q_learning_trade(self, exchange_rates: SlidingWindow, features: Features) -> None:
+        record = trading_record.set_exchange_rates(
+            exchange_rates,
+            self.trading_record_registry['q-learning']
+        )
+        q_model_input = q_learning_model.construct_input(features)
+
+        action = q_learning_model.predict_greedy_epsilon(
+            q_model_input,
+            self.trading_model_registry['q-learning'],
+            self.time_delta
+        )
+
+        finished_order = trading_record.place_order(action, record)
+        self.trading_record_registry['q-learning'] = result.with_default(
+            self.trading_record_registry['q-learning'],
+            finished_order
+        )
+
+        reward = q_learning_model.calculate_reward(
+            record, self.trading_record_registry['q-learning']
+        )
+
+        self.trading_model_registry['q-learning'] = q_learning_model.add_training_sample(
+            neural_network_input=q_model_input,
+            neural_network_prediction=action,
+            reward=reward,
+            model=self.trading_model_registry['q-learning']
+        )
+
+        # Train model every 15 time delta cycles
+        if ((self.time_delta + 1) % 15 == 0):
+            logger.log('training q-learning model...')
+            q_learning_model.train(self.trading_model_registry['q-learning'])
+
+        trading_record.statistics(self.trading_record_registry['q-learning'], features)
+        self.time_delta += 1
+
+    def q_learning_population_trade(
+        self,
+        exchange_rates: SlidingWindow,
+        features: Features
+    ) -> None:
+        population = self.trading_model_registry['q-learning-population']
+        state = np.array([features[feature] for feature in q_learning_model.FEATURES])
+
+        actions = q_learning_population.choose_actions(population, state)
+
+        rewards = np.zeros(population.size)
+        for agent, action in enumerate(actions):
+            name = q_learning_population.record_name(agent)
+            record = trading_record.set_exchange_rates(
+                exchange_rates,
+                self.trading_record_registry[name]
+            )
+            finished_order = trading_record.place_order(
+                TradingAction(order=q_learning_population.ORDERS[action], amount=1),
+                record
+            )
+            self.trading_record_registry[name] = result.with_default(record, finished_order)
+            rewards[agent] = q_learning_model.calculate_reward(
+                record,
+                self.trading_record_registry[name]
+            )
+
+        q_learning_population.add_training_samples(population, state, actions, rewards)
+
+        # Train population every 15 time delta cycles
+        if ((population.time_delta + 1) % 15 == 0):
+            logger.log('training q-learning population...')
+            q_learning_population.train(population)
+        population.time_delta += 1
+
+    def algorithmic_trade(self, exchange_rates: SlidingWindow, features: Features) -> None:
+        record = trading_record.set_exchange_rates(
+            exchange_rates,
+            self.trading_record_registry['algorithmic']
+        )
+        action, self.trading_model_registry['algorithmic'] = algorithmic_model.predict(
+            record,
+            features,
+            self.trading_model_registry['algorithmic']
+        )
+
+        finished_order = trading_record.place_order(action, record)
+        self.trading_record_registry['algorithmic'] = result.with_default(
+            self.trading_record_registry['algorithmic'],
+            finished_order
+        )
+
+        trading_record.statistics(self.trading_record_registry['algorithmic'], features)
+        algorithmic_model.statistics(self.trading_model_registry['algorithmic'])
+
+    def random_trade(self, exchange_rates: SlidingWindow, features: Features) -> None:
+        record = trading_record.set_exchange_rates(
+            exchange_rates,
+            self.trading_record_registry['random']
+        )
+        action = predict_random()
+
+        finished_order = trading_record.place_order(action, record)
+        self.trading_record_registry['random'] = result.with_default(
+            self.trading_record_registry['random'],
+            finished_order
+        )
+
+        trading_record.statistics(self.trading_record_registry['random'], features)
+
+    def record_chart_history(self, price_info: PriceInfo) -> None:
+        exchange_rate, epoch = price_info
+        values = {'exchange_rate': exchange_rate}
+        for name, record in self.trading_record_registry.items():
+            values[f'net_worth/{name}'] = record.usd + record.crypto * exchange_rate
+        chart_history.update(self.chart_history, epoch, values)
+
+    def on_message(self, message: CoinbaseMessage):
+        self.message_count += 1
+        changed = False
+        # Products that went quiet while resyncing are replayed on any message
+        ordered_messages = sequence_tracker.poll(self.sequence_tracker) + \
+            sequence_tracker.receive(self.sequence_tracker, message)
+        for ordered_message in ordered_messages:
+            # Snapshots and replayed trades have the same shape as feed messages
+            changed = self.process_message(cast(CoinbaseMessage, ordered_message)) or changed
+        # Publish once per tick so readers never see records from different
+        # ticks, and only when the tick changed them.  Requested captures are
+        # taken on the next message, changed or not.
+        capture = self.registry_publisher.capture_requested()
+        if changed or capture:
+            self.registry_publisher.publish(registry_snapshot.construct(
+                self.trading_record_registry,
+                self.trading_model_registry,
+                self.message_count,
+                self.time_delta,
+                self.registry_publisher.capture() if capture else None,
+                {
+                    product: bar_aggregator.publish(aggregator)
+                    for product, aggregator in self.bar_aggregators.items()
+                }
+            ))
+
+    def process_message(self, message: CoinbaseMessage) -> bool:
+        ''' Trades on (message), returns whether it changed the registries '''
+        changed_order = order_manager.apply(self.order_manager, message)
+        price_info = parse_message(message)
+        if price_info is not None:
+            product = message.get('product_id', 'BTC-USD')
+            if product not in self.feature_engines:
+                self.feature_engines[product] = feature_engine.construct(self.features)
+                self.exchange_rates[product] = sliding_window.construct(maximum_size=1000)
+                self.bar_aggregators[product] = bar_aggregator.construct()
+            size = parse_size(message)
+            bar_aggregator.update(price_info, self.bar_aggregators[product], size)
+            features = feature_engine.update(price_info, self.feature_engines[product], size)
+            self.exchange_rates[product] = sliding_window.append(
+                feature_engine.window_sample(features),
+                self.exchange_rates[product]
+            )
+            for trade in self.strategies:
+                trade(self.exchange_rates[product], features)
+            self.record_chart_history(price_info)
+        return changed_order is not None or price_info is not None
+
+    def close_feed(self) -> None:
+        sequence_tracker.close(self.sequence_tracker)
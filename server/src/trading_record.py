@@ -1,16 +1,22 @@
 from typing import Tuple
 
+import performance_analytics
 import sliding_window
 import transaction
+import transaction_window
+from feature_engine import Features
 from invariants import cannot_be_negative
 from logger import logger
 from maybe import Maybe
-from pyrsistent import PRecord, field, pvector_field
+from performance_analytics import PerformanceAnalytics
+from pyrsistent import field
 from result import Error, Result, Warning
+from slot_record import SlotRecord, pvector_field
 from transaction import Transaction
+from transaction_window import TransactionWindow
 
 
-class TradingRecord(PRecord):
+class TradingRecord(SlotRecord):
     ''' TODO: eventually divide this record into two:
         1) information pulled from trading exchange
         2) information generated by hft server (ie. transaction decisions)
@@ -26,7 +32,8 @@ class TradingRecord(PRecord):
     exchange_rates = field(type=sliding_window.SlidingWindow, mandatory=True)
     fees_paid = field(type=float, invariant=cannot_be_negative, mandatory=True)
     pending_sales = pvector_field(Transaction)  # TODO: Rename to pending_pairs
-    transaction_window = pvector_field(Transaction)
+    transaction_window = field(type=TransactionWindow, mandatory=True)
+    analytics = field(type=PerformanceAnalytics, mandatory=True)
 
 
 def construct(name: str, description: str = '', initial_usd: float = 0) -> TradingRecord:
@@ -41,7 +48,8 @@ def construct(name: str, description: str = '', initial_usd: float = 0) -> Tradi
         holds=0,
         fees_paid=0.0,
         exchange_rates=sliding_window.construct(maximum_size=1000),
-        transaction_window=[]
+        transaction_window=transaction_window.construct(),
+        analytics=performance_analytics.construct()
     )
 
 
@@ -54,7 +62,7 @@ def valid_order_types(string: str) -> Tuple[bool, str]:
     return string in order_types, 'order must be buy, sell, or hold'
 
 
-class TradingAction(PRecord):
+class TradingAction(SlotRecord):
     order = field(type=str, invariant=valid_order_types)
     amount = field(type=(float, int), invariant=cannot_be_negative)
 
@@ -89,7 +97,8 @@ def buy_crypto(quantity: float, record: TradingRecord) -> Result[TradingRecord]:
         order='buy',
     )
 
-    transaction_window = transaction.window_add(buy_transaction, record.transaction_window)
+    window = transaction_window.add(buy_transaction, record.transaction_window)
+    analytics = performance_analytics.record_fill(quantity, exchange_rate, [], record.analytics)
 
     return record.update({
         'usd': record.usd - buying_price - fee,
@@ -97,7 +106,8 @@ def buy_crypto(quantity: float, record: TradingRecord) -> Result[TradingRecord]:
         'buys': record.buys + 1,
         'fees_paid': record.fees_paid + fee,
         'pending_sales': record.pending_sales.append(buy_transaction),
-        'transaction_window': transaction_window,
+        'transaction_window': window,
+        'analytics': analytics,
     })
 
 
@@ -130,12 +140,18 @@ def sell_crypto(quantity: float, record: TradingRecord) -> Result[TradingRecord]
         order='sell',
     )
 
-    pending_sales = transaction.pair_transaction(
+    pending_sales, pairs = transaction.pair_transactions(
         sell_transaction,
         record.pending_sales
     )
 
-    transaction_window = transaction.window_add(sell_transaction, record.transaction_window)
+    window = transaction_window.add(sell_transaction, record.transaction_window)
+    analytics = performance_analytics.record_fill(
+        quantity,
+        exchange_rate,
+        [transaction.calculate_capital_gains(pair) for pair in pairs],
+        record.analytics
+    )
 
     selling_price = exchange_rate * quantity
 
@@ -145,7 +161,8 @@ def sell_crypto(quantity: float, record: TradingRecord) -> Result[TradingRecord]
         'sells': record.sells + 1,
         'fees_paid': record.fees_paid + fee,
         'pending_sales': pending_sales,
-        'transaction_window': transaction_window,
+        'transaction_window': window,
+        'analytics': analytics,
     })
 
 
@@ -171,15 +188,70 @@ def hold_crypto(record: TradingRecord) -> Result[TradingRecord]:
         order='hold',
     )
 
-    transaction_window = transaction.window_add(hold_transaction, record.transaction_window)
+    window = transaction_window.add(hold_transaction, record.transaction_window)
 
     return record.update({
         'holds': record.holds + 1,
-        'transaction_window': transaction_window,
+        'transaction_window': window,
+    })
+
+
+def record_fill(
+    order: str,
+    quantity: float,
+    exchange_rate: float,
+    epoch: float,
+    fee: float,
+    record: TradingRecord
+) -> Result[TradingRecord]:
+    ''' Records a (partial) fill of an exchange order at the price and fee it was filled at '''
+    price = exchange_rate * quantity
+    if order == 'buy' and record.usd - price - fee < 0:
+        logger.warn(f'Unable to record a ${price} purchase with ${record.usd}')
+        return Warning('cryptocurrency wallet empty')
+    if order == 'sell' and record.crypto - quantity < 0:
+        logger.warn(f'Unable to record a sale of {quantity} cryptocurrency with '
+                    f'{record.crypto} cryptocurrency in wallet')
+        return Warning('cryptocurrency wallet empty')
+
+    fill_transaction = Transaction(
+        label='BTC-USD',
+        quantity=float(quantity),
+        exchange_rate=float(exchange_rate),
+        epoch=float(epoch),
+        fees=float(fee),
+        order=order,
+    )
+    window = transaction_window.add(fill_transaction, record.transaction_window)
+    if order == 'buy':
+        return record.update({
+            'usd': record.usd - price - fee,
+            'crypto': record.crypto + quantity,
+            'buys': record.buys + 1,
+            'fees_paid': record.fees_paid + fee,
+            'pending_sales': record.pending_sales.append(fill_transaction),
+            'transaction_window': window,
+            'analytics': performance_analytics.record_fill(
+                quantity, exchange_rate, [], record.analytics
+            ),
+        })
+    pending_sales, pairs = transaction.pair_transactions(fill_transaction, record.pending_sales)
+    return record.update({
+        'usd': record.usd + price - fee,
+        'crypto': record.crypto - quantity,
+        'sells': record.sells + 1,
+        'fees_paid': record.fees_paid + fee,
+        'pending_sales': pending_sales,
+        'transaction_window': window,
+        'analytics': performance_analytics.record_fill(
+            quantity,
+            exchange_rate,
+            [transaction.calculate_capital_gains(pair) for pair in pairs],
+            record.analytics
+        ),
     })
 
 
-# TODO: Check that sequence number is incremented with each message received
 def update_exchange_rate(
     price_info: Tuple[float, float],
     record: TradingRecord
@@ -190,8 +262,23 @@ def update_exchange_rate(
         epoch=epoch
     )
     exchange_rates = sliding_window.add(sliding_window_sample, record.exchange_rates)
+    return set_exchange_rates(exchange_rates, record)
+
+
+def set_exchange_rates(
+    exchange_rates: sliding_window.SlidingWindow,
+    record: TradingRecord
+) -> TradingRecord:
+    ''' Sets the record's exchange rates and marks its equity to the latest one '''
+    exchange_rate = sliding_window.current_exchange_rate(exchange_rates)
+    if exchange_rate is None:
+        return record.set('exchange_rates', exchange_rates)
     return record.update({
         'exchange_rates': exchange_rates,
+        'analytics': performance_analytics.mark(
+            record.usd + record.crypto * exchange_rate,
+            record.analytics
+        ),
     })
 
 
@@ -203,7 +290,10 @@ def place_order(action: TradingAction, record: TradingRecord) -> Result[TradingR
     return hold_crypto(record)
 
 
-def statistics(record: TradingRecord):
+def statistics(record: TradingRecord, features: Features):
+    ''' Logs the record's statistics, with the moving average and rate of
+    change of the last 100 exchange rates from (features)
+    '''
     logger.log(f'-- {record.name} Statistics --')
     exchange_rate = sliding_window.current_exchange_rate(record.exchange_rates)
     logger.log(f'Exchange Rate: {exchange_rate}')
@@ -216,16 +306,20 @@ def statistics(record: TradingRecord):
     logger.log(f'Holds: {record.holds}')
     logger.log(f'Pending Sales: {len(record.pending_sales)}')
     logger.log(f'Fees Paid: {record.fees_paid}')
-    moving_average = sliding_window.average(100, record.exchange_rates)
-    logger.log(f'Moving Average: {moving_average}')
-    derivative = sliding_window.derivative(100, record.exchange_rates)
-    logger.log(f'Rate of Change: {derivative}')
+    logger.log(f'Moving Average: {features["moving_average_100"]}')
+    logger.log(f'Rate of Change: {features["rate_of_change_100"]}')
     exchange_rate = get_exchange_rate(record)
     if exchange_rate is not None:
         net_worth = record.usd + record.crypto * exchange_rate
         profit = net_worth - record.initial_usd
         logger.log(f'Net Worth: {net_worth}')
         logger.log(f'Profit: {profit}')
+    analytics = record.analytics
+    logger.log(f'Drawdown: {analytics.drawdown} (max {analytics.max_drawdown})')
+    logger.log(f'Volatility: {analytics.volatility}')
+    logger.log(f'Sharpe Ratio: {analytics.sharpe_ratio}')
+    logger.log(f'Wins/Losses: {analytics.wins}/{analytics.losses}')
+    logger.log(f'Turnover: {analytics.turnover}')
 
 
 def get_exchange_rate(record: TradingRecord) -> Maybe[float]:
@@ -1,8 +1,10 @@
+import bisect
 import csv
 from typing import List, Tuple  # noqa: F401
 
 import zulu_time
 from pyrsistent import PRecord, PVector, field, pvector
+from slot_record import SlotRecord
 
 
 # TODO: consolidate this function (duplicated in trading_record)
@@ -17,7 +19,7 @@ def valid_order_types(string: str) -> Tuple[bool, str]:
 
 # TODO: figure out a way to consolidate transaction state
 # between Transaction, TradingAction, and TradingRecord records
-class Transaction(PRecord):
+class Transaction(SlotRecord):
     label = field(type=str, mandatory=True)
     quantity = field(type=float, mandatory=False)
     exchange_rate = field(type=float, mandatory=False)
@@ -36,14 +38,6 @@ class PairedTransactions(PRecord):
     sell = field(type=Transaction, mandatory=True)
 
 
-# TODO: move into a transaction_window.py file
-def window_add(transaction: Transaction, transaction_window: PVector) -> PVector:
-    MAXIMUM_SIZE = 1000
-    if len(transaction_window) >= MAXIMUM_SIZE:
-        return transaction_window.append(transaction)[1:]
-    return transaction_window.append(transaction)
-
-
 def record_paired_transaction(  # TODO: Renamed to record_transaction_pair
     path: str,
     paired_transactions: PairedTransactions
@@ -98,40 +92,78 @@ def calculate_capital_gains(transactions: PairedTransactions) -> float:
     return price_delta - fees
 
 
-def calculate_taker_fee(quantity: float, exchange_rate: float) -> float:
+# Coinbase pro fee tiers by trailing 30 day USD volume:
+# (minimum volume, maker fee rate, taker fee rate)
+FEE_TIERS = [
+    (0.0, 0.0015, 0.0025),
+    (10000.0, 0.0010, 0.0020),
+    (50000.0, 0.0008, 0.0018),
+    (100000.0, 0.0005, 0.0015),
+    (1000000.0, 0.0000, 0.0010),
+    (10000000.0, 0.0000, 0.0008),
+    (50000000.0, 0.0000, 0.0005),
+    (100000000.0, 0.0000, 0.0004),
+]
+FEE_TIER_VOLUMES = [volume for volume, _, _ in FEE_TIERS]
+
+
+def fee_rates(volume: float) -> Tuple[float, float]:
+    ''' Returns the maker and taker fee rates of a trailing 30 day USD (volume) '''
+    _, maker_rate, taker_rate = FEE_TIERS[bisect.bisect_right(FEE_TIER_VOLUMES, volume) - 1]
+    return maker_rate, taker_rate
+
+
+def calculate_taker_fee(quantity: float, exchange_rate: float, volume: float = 0.0) -> float:
     ''' Calculates the fee when making a coinbase pro taker order
 
     A taker order is an order that is executed immediately and as such,
-    has a higher fee structure.
+    has a higher fee structure.  The fee rate is reduced as the trailing 30 day
+    (volume) goes up.
 
-    TODO: update this function to pull the fee rate down dynamically from
-    coinbase.pro.  Fee is reduced as transaction volume goes up.
+    TODO: pull the fee tiers down dynamically from coinbase.pro.
     '''
-    FEE_RATE = 0.0025  # 0.25%
+    _, taker_rate = fee_rates(volume)
     price = quantity * exchange_rate
-    return FEE_RATE * price
+    return taker_rate * price
+
+
+def calculate_maker_fee(quantity: float, exchange_rate: float, volume: float = 0.0) -> float:
+    ''' Calculates the fee when a resting coinbase pro order is filled '''
+    maker_rate, _ = fee_rates(volume)
+    return maker_rate * quantity * exchange_rate
 
 
 def pair_transaction(
     sell_transaction: Transaction,
     pending_transactions: PVector
 ) -> PVector:
+    ''' The pending transactions that remain once (sell_transaction) is paired '''
+    remaining_pending_transactions, _ = pair_transactions(sell_transaction, pending_transactions)
+    return remaining_pending_transactions
+
+
+def pair_transactions(
+    sell_transaction: Transaction,
+    pending_transactions: PVector
+) -> Tuple[PVector, List[PairedTransactions]]:
     ''' Match pending paired transactions using a FIFO algorithm
 
     Cryptocurrency purchases are turned into pending paired transactions.
     When cryptocurrency is sold, the oldest purchases are paired with the
     newest sales to calculate capital gains.  Transaction pairs are recorded
-    in transaction_history.csv.
+    in transaction_history.csv.  Returns the remaining pending transactions
+    and the pairs.
     '''
     remaining_quantity_sold = sell_transaction.quantity
     remaining_pending_transactions: List[Transaction] = []
+    paired_transactions: List[PairedTransactions] = []
     for buy_transaction in pending_transactions:
         is_complete_match = (
             remaining_quantity_sold >= 0 and
             remaining_quantity_sold >= buy_transaction.quantity
         )
         is_partial_match = (
-            remaining_quantity_sold >= 0 and
+            remaining_quantity_sold > 0 and
             remaining_quantity_sold < buy_transaction.quantity
         )
         if is_complete_match:
@@ -142,6 +174,7 @@ def pair_transaction(
                 sell=sell_transaction.set('quantity', quantity_paired)
             )
             record_paired_transaction('transaction_history.csv', paired_transaction)
+            paired_transactions.append(paired_transaction)
         elif is_partial_match:
             quantity_paired = remaining_quantity_sold
             remaining_quantity_sold -= buy_transaction.quantity
@@ -155,6 +188,7 @@ def pair_transaction(
                 sell=sell_transaction.set('quantity', quantity_paired)
             )
             record_paired_transaction('transaction_history.csv', paired_transaction)
+            paired_transactions.append(paired_transaction)
         else:
             remaining_pending_transactions.append(buy_transaction)
-    return pvector(remaining_pending_transactions)
+    return pvector(remaining_pending_transactions), paired_transactions
@@ -0,0 +1,136 @@
+'''
+The most recent transactions of a trading record, in a fixed size ring.
+
+Most ticks are holds, so consecutive holds are kept as a single HoldRun with
+their count and the epochs and exchange rates of the first and last hold.
+The window's entries are then mostly real trades, and its memory and
+serialized size grow with them rather than with the number of ticks.
+
+The ring is a persistent vector of at most (maximum_size) entries.  Once it's
+full each new entry replaces the oldest one in place, so adding to the window
+copies a few vector nodes instead of the whole vector, and windows in
+published snapshots never change.
+
+A HoldRun serializes like a hold transaction at its last hold, plus its
+count, first_epoch and first_exchange_rate.  expand() turns the serialized
+runs back into one hold per tick for clients that ask for them.
+'''
+from typing import Any, Dict, Iterable, List, Union
+
+from invariants import must_be_positive
+from maybe import Maybe
+from pyrsistent import field, pvector_field
+from slot_record import SlotRecord
+from transaction import Transaction
+
+MAXIMUM_SIZE = 1000
+
+
+class HoldRun(SlotRecord):
+    label = field(type=str, mandatory=True)
+    quantity = field(type=float, initial=0.0)
+    # Exchange rate and epoch of the last hold
+    exchange_rate = field(type=float, mandatory=True)
+    epoch = field(type=float, mandatory=True)
+    fees = field(type=float, initial=0.0)
+    order = field(type=str, initial='hold')
+    count = field(type=int, initial=1, invariant=must_be_positive)
+    first_exchange_rate = field(type=float, mandatory=True)
+    first_epoch = field(type=float, mandatory=True)
+
+
+Entry = Union[Transaction, HoldRun]
+
+
+class TransactionWindow(SlotRecord):
+    entries = pvector_field((Transaction, HoldRun))
+    # Index of the oldest entry once the ring is full
+    start = field(type=int, initial=0)
+    maximum_size = field(type=int, initial=MAXIMUM_SIZE, invariant=must_be_positive)
+
+    def serialize(self, format: Any = None) -> List[Dict[str, Any]]:
+        ''' The entries from oldest to newest, with holds as runs '''
+        return [entry.serialize(format) for entry in entries(self)]
+
+
+def construct(
+    transactions: Iterable[Transaction] = (),
+    maximum_size: int = MAXIMUM_SIZE
+) -> TransactionWindow:
+    window = TransactionWindow(entries=[], maximum_size=maximum_size)
+    for transaction in transactions:
+        window = add(transaction, window)
+    return window
+
+
+def add(transaction: Transaction, window: TransactionWindow) -> TransactionWindow:
+    if transaction.order == 'hold':
+        last = latest(window)
+        if isinstance(last, HoldRun) and last.label == transaction.label:
+            return window.set('entries', window.entries.set(
+                newest_index(window),
+                last.update({
+                    'exchange_rate': transaction.exchange_rate,
+                    'epoch': transaction.epoch,
+                    'count': last.count + 1,
+                })
+            ))
+        return append(HoldRun(
+            label=transaction.label,
+            exchange_rate=transaction.exchange_rate,
+            epoch=transaction.epoch,
+            first_exchange_rate=transaction.exchange_rate,
+            first_epoch=transaction.epoch
+        ), window)
+    return append(transaction, window)
+
+
+def append(entry: Entry, window: TransactionWindow) -> TransactionWindow:
+    if len(window.entries) < window.maximum_size:
+        return window.set('entries', window.entries.append(entry))
+    # Overwrites the oldest entry
+    return window.update({
+        'entries': window.entries.set(window.start, entry),
+        'start': (window.start + 1) % window.maximum_size,
+    })
+
+
+def newest_index(window: TransactionWindow) -> int:
+    return (window.start - 1) % len(window.entries)
+
+
+def latest(window: TransactionWindow) -> Maybe[Entry]:
+    if len(window.entries) == 0:
+        return None
+    return window.entries[newest_index(window)]
+
+
+def entries(window: TransactionWindow) -> List[Entry]:
+    ''' The entries from oldest to newest '''
+    return list(window.entries[window.start:]) + list(window.entries[:window.start])
+
+
+def expand(serialized: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    ''' Expands the serialized runs of a window into one hold per tick
+
+    The holds between the first and last hold of a run are spaced evenly and
+    their exchange rates interpolated, the run doesn't keep each tick's.
+    '''
+    expanded = []
+    for entry in serialized:
+        count = entry.get('count')
+        if count is None:
+            expanded.append(entry)
+            continue
+        hold = {key: value for key, value in entry.items()
+                if key not in ('count', 'first_epoch', 'first_exchange_rate')}
+        for index in range(count):
+            fraction = index / (count - 1) if count > 1 else 1.0
+            expanded.append(dict(
+                hold,
+                epoch=entry['first_epoch'] + (entry['epoch'] - entry['first_epoch']) * fraction,
+                exchange_rate=entry['first_exchange_rate'] + (
+                    entry['exchange_rate'] - entry['first_exchange_rate']
+                ) * fraction
+            ))
+    return expanded
@@ -1,15 +1,89 @@
 import json
+import math
+import multiprocessing
+import signal
+import socket
+import threading
+import time
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Dict, List, Tuple, Union
 
-from flask import Flask
+import bar_aggregator
+import chart_history
+import numpy as np
+import result
+import sampling_profiler
+import transaction_window
+from chart_history import ChartHistory
+from flask import Flask, Response
 from flask_cors import cross_origin
-from flask_restful import Api, Resource
+from flask_restful import Api, Resource, reqparse
+from fully_connected_neural_network import valid_inference_backends, valid_precisions
+from invariants import cannot_be_negative, must_be_positive
 from logger import logger
-from pyrsistent import PRecord, field
-from registries import TradingModelRegistry, TradingRecordRegistry
+from maybe import Maybe
+from memory_accounting import MemoryMonitor
+from pyrsistent import PRecord, field, pvector_field
+from registries import STRATEGIES, valid_strategies
+from registry_snapshot import RegistrySnapshot, SnapshotPublisher
+from sampling_profiler import SamplingProfiler
+from shared_state import SharedStateReader, SharedStateWriter
+from werkzeug.serving import make_server
+
+
+def valid_serving_modes(mode: str) -> Tuple[bool, str]:
+    return mode in ('threaded', 'multiprocess'), 'serving mode must be threaded or multiprocess'
+
+
+def must_have_valid_strategies(defaults) -> Tuple[bool, str]:
+    return valid_strategies(defaults.strategies)
 
 
 class Defaults(PRecord):
     web_client_uri = field(type=str, mandatory=True)
+    # Strategies to trade.  Dependencies such as tensorflow are only loaded for
+    # the strategies listed here.
+    strategies = pvector_field(str, initial=STRATEGIES)
+    # Evaluates q-learning predictions with 'numpy' or 'tensorflow'
+    inference_backend = field(type=str, initial='numpy', invariant=valid_inference_backends)
+    # Precision of the q-learning networks, their replay memory and training
+    # batches: 'float64' or 'float32'
+    network_precision = field(type=str, initial='float64', invariant=valid_precisions)
+    # Normalizes network inputs with their running mean and standard deviation,
+    # None normalizes them in float32 only
+    normalize_inputs = field(type=(bool, type(None)), initial=None)
+    # Number of agents traded by the q-learning-population strategy
+    population_size = field(type=int, initial=64, invariant=must_be_positive)
+    __invariant__ = must_have_valid_strategies
+    # 'threaded' serves the API from the trading process with flask's development
+    # server.  'multiprocess' serves it from forked worker processes that read the
+    # state the trading process publishes into shared memory.
+    serving_mode = field(type=str, initial='threaded', invariant=valid_serving_modes)
+    workers = field(type=int, initial=4, invariant=must_be_positive)
+    host = field(type=str, initial='127.0.0.1')
+    port = field(type=int, initial=5000)
+    shared_state_path = field(type=str, initial='/tmp/hf-trader-shared-state')
+    # Seconds between shared memory publications in multiprocess mode
+    shared_state_interval = field(type=float, initial=0.25, invariant=must_be_positive)
+    # Trading state is checkpointed to (checkpoint_path) every (checkpoint_interval)
+    # seconds and restored from it on startup
+    checkpoint_path = field(type=str, initial='checkpoint.npz')
+    checkpoint_interval = field(type=float, initial=60.0, invariant=must_be_positive)
+    # Websocket feed the client trades on, e.g. a local feed_server for testing
+    feed_url = field(type=str, initial='wss://ws-feed.pro.coinbase.com/')
+    # Parallel connections to (feed_url), merged by first arrival when more than 1
+    feed_connections = field(type=int, initial=1, invariant=must_be_positive)
+    # REST API that order books are resynced from when feed messages are dropped,
+    # '' only logs the dropped messages
+    api_url = field(type=str, initial='https://api.pro.coinbase.com')
+    # Serves /debug/profile, which samples the trading thread on request, and
+    # /debug/memory.  Only available in threaded serving mode.
+    debug_endpoints = field(type=bool, initial=False)
+    # Seconds between memory reports in the log
+    memory_report_interval = field(type=float, initial=300.0, invariant=must_be_positive)
+    # Frames tracemalloc keeps per allocation for the memory reports, 0 doesn't
+    # trace.  Tracing slows down every allocation.
+    memory_tracing_frames = field(type=int, initial=0, invariant=cannot_be_negative)
 
 
 def get_defaults(environment: str) -> Defaults:
@@ -27,75 +101,473 @@ def get_cross_origin_uri() -> str:
     return f'{web_client_uri}*'
 
 
-class Statistics(Resource):
+def serialize_statistics(snapshot: RegistrySnapshot) -> str:
+    '''
+    TODO: parameterize 'algorithmic' and 'q-learning' Queries
+    '''
+    return json.dumps({
+        strategy: snapshot.trading_records[strategy].serialize()
+        for strategy in ['algorithmic', 'q-learning']
+        if strategy in snapshot.trading_records
+    })
+
+
+def serialize_transactions(snapshot: RegistrySnapshot) -> str:
+    '''
+    TODO: parameterize 'algorithmic' and 'q-learning' Queries
+    '''
+    return json.dumps({
+        strategy: snapshot.trading_records[strategy].transaction_window.serialize()
+        for strategy in ['algorithmic', 'q-learning']
+        if strategy in snapshot.trading_records
+    })
+
+
+def serialize_analytics(snapshot: RegistrySnapshot) -> str:
+    ''' The analytics of every trading record, including each population agent's '''
+    return json.dumps({
+        name: record.analytics.serialize()
+        for name, record in snapshot.trading_records.items()
+    })
+
+
+VIEWS: Dict[str, Callable[[RegistrySnapshot], str]] = {
+    'stats': serialize_statistics,
+    'transactions': serialize_transactions,
+    'analytics': serialize_analytics,
+}
+
+
+# Most points a history request can ask for per series
+MAXIMUM_HISTORY_POINTS = 5000
+# Points per series of the history published to multiprocess workers
+PUBLISHED_HISTORY_POINTS = 250
+# Newest bars of every product and resolution published to multiprocess workers
+PUBLISHED_BARS = 100
+
+
+def serialize_bars(snapshot: RegistrySnapshot, count: Maybe[int] = None) -> Dict[str, Any]:
+    ''' The newest (count) bars of every product and resolution '''
+    return {
+        product: {
+            resolution: bar_aggregator.serialize(bar_aggregator.published_history(bars, count))
+            for resolution, bars in published.items()
+        }
+        for product, published in snapshot.bars.items()
+    }
+
+
+class SnapshotViews:
+    ''' Serializes views on request from the in-process snapshot publisher '''
     def __init__(
         self,
-        trading_record_registry: TradingRecordRegistry,
-        trading_model_registry: TradingModelRegistry
+        registry_publisher: SnapshotPublisher,
+        history: Maybe[ChartHistory] = None
     ):
-        self.trading_record_registry = trading_record_registry
-        self.trading_model_registry = trading_model_registry
+        self.registry_publisher = registry_publisher
+        self.history_store = history
 
-    @cross_origin(origins=get_cross_origin_uri())
-    def get(self):
-        '''
-        TODO: parameterize 'algorithmic' and 'q-learning' Queries
+    def get(self, view: str) -> str:
+        return VIEWS[view](self.registry_publisher.current())
+
+    def history(self, series: List[str], start: float, end: float, points: int) -> str:
+        if self.history_store is None:
+            return json.dumps({})
+        histories = {
+            name: chart_history.query(self.history_store, name, start, end, points)
+            for name in series
+        }
+        return json.dumps({name: history for name, history in histories.items() if history})
+
+    def bars(self, product: str, resolution: str, count: int) -> str:
+        published = self.registry_publisher.current().bars.get(product, {}).get(resolution)
+        if published is None:
+            return json.dumps({})
+        return json.dumps(
+            bar_aggregator.serialize(bar_aggregator.published_history(published, count))
+        )
+
+
+class SharedStateViews:
+    ''' Returns views the trading process already serialized into shared memory
+
+    Payloads are only parsed when the trading process has published a new one.
+    '''
+    def __init__(self, reader: SharedStateReader):
+        self.reader = reader
+        self._sequence = 0
+        self._views: Dict[str, Any] = {}
+
+    def read(self) -> Dict[str, Any]:
+        sequence, payload = self.reader.read()
+        if sequence != self._sequence:
+            self._views = json.loads(payload)
+            self._sequence = sequence
+        return self._views
+
+    def get(self, view: str) -> str:
+        return self.read().get(view, json.dumps({}))
+
+    def history(self, series: List[str], start: float, end: float, points: int) -> str:
+        ''' Answers from the coarse history the trading process published
+
+        Workers only see PUBLISHED_HISTORY_POINTS buckets of every series.
         '''
-        logger.log('/stats/GET')
-        algorithmic_record = self.trading_record_registry['algorithmic']
-        q_learning_record = self.trading_record_registry['q-learning']
-        return json.dumps({
-            'algorithmic': algorithmic_record.serialize(),
-            'q-learning': q_learning_record.serialize(),
-        })
+        published = self.read().get('history', {})
+        histories = {}
+        for name in series:
+            if name not in published:
+                continue
+            history = published[name]
+            buckets = np.array(
+                [history['epoch'], history['min'], history['max'], history['last']]
+            ).T.reshape(-1, 4)
+            histories[name] = chart_history.downsample(buckets, start, end, points)
+        return json.dumps(histories)
 
+    def bars(self, product: str, resolution: str, count: int) -> str:
+        ''' Answers from the newest PUBLISHED_BARS bars the trading process published '''
+        published = self.read().get('bars', {}).get(product, {}).get(resolution)
+        if published is None:
+            return json.dumps({})
+        return json.dumps({column: values[-count:] for column, values in published.items()})
 
-class Transactions(Resource):
+
+Views = Union[SnapshotViews, SharedStateViews]
+
+
+class SharedStatePublisher(threading.Thread):
+    ''' Periodically serializes the latest snapshot into shared memory
+
+    Serialization happens on this thread so the trading thread only pays for
+    publishing a snapshot reference.
+    '''
     def __init__(
         self,
-        trading_record_registry: TradingRecordRegistry,
-        trading_model_registry: TradingModelRegistry
+        registry_publisher: SnapshotPublisher,
+        writer: SharedStateWriter,
+        interval: float = 0.25,
+        history: Maybe[ChartHistory] = None
     ):
-        self.trading_record_registry = trading_record_registry
-        self.trading_model_registry = trading_model_registry
+        super().__init__(name='shared-state-publisher', daemon=True)
+        self.registry_publisher = registry_publisher
+        self.writer = writer
+        self.interval = interval
+        self.history = history
+        self._snapshot: Maybe[RegistrySnapshot] = None
+
+    def publish(self) -> None:
+        snapshot = self.registry_publisher.current()
+        if snapshot is self._snapshot:
+            return
+        views: Dict[str, Any] = {view: serialize(snapshot) for view, serialize in VIEWS.items()}
+        if self.history is not None:
+            views['history'] = {
+                name: chart_history.query(
+                    self.history,
+                    name,
+                    points=PUBLISHED_HISTORY_POINTS
+                )
+                for name in chart_history.series_names(self.history)
+            }
+        views['bars'] = serialize_bars(snapshot, PUBLISHED_BARS)
+        payload = json.dumps(views)
+        # A failed write, e.g. of a payload over capacity, is logged by the
+        # Error and tried again next interval
+        if not result.is_okay(self.writer.write(payload.encode('utf-8'))):
+            logger.warn(f'shared state of tick {snapshot.tick} was not published')
+            return
+        self._snapshot = snapshot
+
+    def run(self) -> None:
+        while True:
+            self.publish()
+            time.sleep(self.interval)
+
+
+class Statistics(Resource):
+    def __init__(self, views: Views):
+        self.views = views
+
+    @cross_origin(origins=get_cross_origin_uri())
+    def get(self):
+        logger.log('/stats/GET')
+        return self.views.get('stats')
+
+
+class Transactions(Resource):
+    ''' GET /transactions?expand=holds
+
+    Consecutive holds are returned as runs, or as one hold per tick when
+    (expand) is holds.
+    '''
+    def __init__(self, views: Views):
+        self.views = views
+        self.parser = reqparse.RequestParser()
+        self.parser.add_argument('expand', choices=('holds',), location='args')
 
     @cross_origin(origins=get_cross_origin_uri())
     def get(self):
-        '''
-        TODO: parameterize 'algorithmic' and 'q-learning' Queries
-        '''
         logger.log('/transactions/GET')
-        algorithmic_record = self.trading_record_registry['algorithmic']
-        q_learning_record = self.trading_record_registry['q-learning']
-        return json.dumps({
-            'algorithmic': algorithmic_record.transaction_window.serialize(),
-            'q-learning': q_learning_record.transaction_window.serialize(),
-        })
+        transactions = self.views.get('transactions')
+        if self.parser.parse_args()['expand'] == 'holds':
+            return json.dumps({
+                strategy: transaction_window.expand(window)
+                for strategy, window in json.loads(transactions).items()
+            })
+        return transactions
 
 
-def start(
-    trading_record_registry: TradingRecordRegistry,
-    trading_model_registry: TradingModelRegistry
-):
+class Analytics(Resource):
+    ''' GET /analytics
+
+    Equity, drawdown, rolling volatility and Sharpe ratio, wins and losses and
+    turnover of every trading record, as they were last updated by the trading
+    thread.
+    '''
+    def __init__(self, views: Views):
+        self.views = views
+
+    @cross_origin(origins=get_cross_origin_uri())
+    def get(self):
+        logger.log('/analytics/GET')
+        return self.views.get('analytics')
+
+
+class History(Resource):
+    ''' GET /history?series=exchange_rate&series=net_worth/q-learning&start=&end=&points=
+
+    Returns at most (points) min/max/last buckets of every requested series
+    between the (start) and (end) epochs.
+    '''
+    def __init__(self, views: Views):
+        self.views = views
+        self.parser = reqparse.RequestParser()
+        self.parser.add_argument(
+            'series',
+            action='append',
+            default=['exchange_rate'],
+            location='args'
+        )
+        self.parser.add_argument('start', type=float, default=-math.inf, location='args')
+        self.parser.add_argument('end', type=float, default=math.inf, location='args')
+        self.parser.add_argument('points', type=int, default=500, location='args')
+
+    @cross_origin(origins=get_cross_origin_uri())
+    def get(self):
+        logger.log('/history/GET')
+        arguments = self.parser.parse_args()
+        points = min(max(arguments['points'], 1), MAXIMUM_HISTORY_POINTS)
+        return self.views.history(
+            arguments['series'],
+            arguments['start'],
+            arguments['end'],
+            points
+        )
+
+
+class Bars(Resource):
+    ''' GET /bars?product=BTC-USD&resolution=1m&count=100
+
+    Returns the newest (count) OHLCV bars of a product at a time resolution
+    (1s, 1m, 5m or 1h) or of its volume or dollar bars, oldest first.  The
+    newest bar is the one still being built.
+    '''
+    def __init__(self, views: Views):
+        self.views = views
+        self.parser = reqparse.RequestParser()
+        self.parser.add_argument('product', default='BTC-USD', location='args')
+        self.parser.add_argument('resolution', default='1m', location='args')
+        self.parser.add_argument('count', type=int, default=100, location='args')
+
+    @cross_origin(origins=get_cross_origin_uri())
+    def get(self):
+        logger.log('/bars/GET')
+        arguments = self.parser.parse_args()
+        return self.views.bars(
+            arguments['product'],
+            arguments['resolution'],
+            min(max(arguments['count'], 1), MAXIMUM_HISTORY_POINTS)
+        )
+
+
+class Profiler(Resource):
+    ''' GET /debug/profile?seconds=5&interval=0.005&format=collapsed
+
+    Samples the trading thread's stacks for (seconds) and returns them
+    collapsed for flamegraph.pl or speedscope, or as JSON when (format) is
+    json.  The request takes (seconds) to answer.
+    '''
+    def __init__(self, profiler: SamplingProfiler):
+        self.profiler = profiler
+        self.parser = reqparse.RequestParser()
+        self.parser.add_argument(
+            'seconds',
+            type=float,
+            default=sampling_profiler.DEFAULT_SECONDS,
+            location='args'
+        )
+        self.parser.add_argument(
+            'interval',
+            type=float,
+            default=sampling_profiler.DEFAULT_INTERVAL,
+            location='args'
+        )
+        self.parser.add_argument(
+            'format',
+            choices=('collapsed', 'json'),
+            default='collapsed',
+            location='args'
+        )
+
+    def get(self):
+        logger.log('/debug/profile/GET')
+        arguments = self.parser.parse_args()
+        profile = sampling_profiler.sample(
+            self.profiler,
+            arguments['seconds'],
+            arguments['interval']
+        )
+        if not isinstance(profile, sampling_profiler.Profile):
+            return {'message': profile.message}, 409
+        if arguments['format'] == 'json':
+            return profile.serialize()
+        return Response(sampling_profiler.collapsed(profile), mimetype='text/plain')
+
+
+class Memory(Resource):
+    ''' GET /debug/memory
+
+    Element counts and deep sizes of the trading state's structures, the
+    structures that keep growing and, when tracemalloc is tracing, the top
+    allocators and their growth since the previous periodic report.
+    '''
+    def __init__(self, memory_monitor: MemoryMonitor):
+        self.memory_monitor = memory_monitor
+
+    def get(self):
+        logger.log('/debug/memory/GET')
+        return self.memory_monitor.snapshot().serialize()
+
+
+def create_app(
+    views: Views,
+    profiler: Maybe[SamplingProfiler] = None,
+    memory_monitor: Maybe[MemoryMonitor] = None
+) -> Flask:
     flask = Flask(__name__)
     api = Api(flask)
 
     api.add_resource(
         Statistics,
         '/stats',
-        resource_class_kwargs={
-            'trading_record_registry': trading_record_registry,
-            'trading_model_registry': trading_model_registry
-        }
+        resource_class_kwargs={'views': views}
     )
 
     api.add_resource(
         Transactions,
         '/transactions',
-        resource_class_kwargs={
-            'trading_record_registry': trading_record_registry,
-            'trading_model_registry': trading_model_registry
-        }
+        resource_class_kwargs={'views': views}
+    )
+
+    api.add_resource(
+        Analytics,
+        '/analytics',
+        resource_class_kwargs={'views': views}
+    )
+
+    api.add_resource(
+        History,
+        '/history',
+        resource_class_kwargs={'views': views}
     )
 
-    flask.run(debug=False)
+    api.add_resource(
+        Bars,
+        '/bars',
+        resource_class_kwargs={'views': views}
+    )
+
+    if profiler is not None:
+        api.add_resource(
+            Profiler,
+            '/debug/profile',
+            resource_class_kwargs={'profiler': profiler}
+        )
+
+    if memory_monitor is not None:
+        api.add_resource(
+            Memory,
+            '/debug/memory',
+            resource_class_kwargs={'memory_monitor': memory_monitor}
+        )
+
+    return flask
+
+
+def create_shared_state_app(shared_state_path: str = '') -> Flask:
+    ''' WSGI entry point for serving the API under a production server, e.g.
+
+    gunicorn --pythonpath src --workers 4 --bind 127.0.0.1:5000 \
+        'web_application:create_shared_state_app()'
+
+    The trading process must be running in multiprocess serving mode so that
+    it publishes into the shared memory file.
+    '''
+    path = shared_state_path or get_defaults('production').shared_state_path
+    return create_app(SharedStateViews(SharedStateReader(path)))
+
+
+def start(
+    registry_publisher: SnapshotPublisher,
+    history: Maybe[ChartHistory] = None,
+    profiler: Maybe[SamplingProfiler] = None,
+    memory_monitor: Maybe[MemoryMonitor] = None
+):
+    create_app(
+        SnapshotViews(registry_publisher, history),
+        profiler,
+        memory_monitor
+    ).run(debug=False)
+
+
+def serve_worker(fd: int, shared_state_path: str, host: str, port: int) -> None:
+    # ctrl-c is handled by the trading process, which terminates its workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    app = create_shared_state_app(shared_state_path)
+    make_server(host, port, app, fd=fd).serve_forever()
+
+
+def start_workers(
+    shared_state_path: str,
+    workers: int,
+    host: str = '127.0.0.1',
+    port: int = 5000
+) -> List[BaseProcess]:
+    ''' Forks (workers) API processes that accept on one shared listening socket
+
+    Must be called after the SharedStateWriter has created the shared memory
+    file and before the trading process starts any threads.
+    '''
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+
+    context = multiprocessing.get_context('fork')
+    processes: List[BaseProcess] = []
+    for _ in range(workers):
+        process = context.Process(
+            target=serve_worker,
+            args=(listener.fileno(), shared_state_path, host, port),
+            daemon=True
+        )
+        process.start()
+        processes.append(process)
+    logger.info(f'serving api from {workers} worker processes on {host}:{port}')
+    return processes
+
+
+def wait(processes: List[BaseProcess]) -> None:
+    for process in processes:
+        process.join()